@@ -1,9 +1,11 @@
 from flask import Flask
 import os
+from typing import Optional
 from .extensions import db, login_manager
+from .clock import RealClock
 
 
-def create_app() -> Flask:
+def create_app(config: Optional[dict] = None) -> Flask:
 	app = Flask(__name__, static_folder="static", template_folder="templates", instance_relative_config=True)
 
 	# Security & session config
@@ -26,20 +28,166 @@ def create_app() -> Flask:
 		app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(app.instance_path, 'tamagochi.sqlite')}"
 	app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-	# Init extensions
+	# Read replicas for read-only GET endpoints (see app/replicas.py), e.g.
+	# DATABASE_REPLICA_URLS=postgresql://replica1/tamagochi,postgresql://replica2/tamagochi
+	app.config["SQLALCHEMY_REPLICA_URLS"] = [url for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url]
+	app.config["REPLICA_READ_YOUR_WRITES_SECONDS"] = 5.0
+	app.config["REPLICA_MAX_LAG_SECONDS"] = 2.0
+	app.config["REPLICA_CHECK_SECONDS"] = 5.0
+	app.config["REPLICA_RETRY_SECONDS"] = 30.0
+
+	# Extra shards for per-user game state, shard 0 being the primary (see app/sharding.py), e.g.
+	# DATABASE_SHARD_URLS=sqlite:////srv/tamagochi/shard1.sqlite,sqlite:////srv/tamagochi/shard2.sqlite
+	app.config["SQLALCHEMY_SHARD_URLS"] = [url for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url]
+	app.config["SHARD_MOVE_GRACE_SECONDS"] = 2.0
+
+	# Source of "now" for all game logic (swap for FrozenClock/AcceleratedClock in simulations)
+	app.config["CLOCK"] = RealClock()
+
+	# Per-user state cache
+	app.config["STATE_CACHE_BACKEND"] = os.getenv("STATE_CACHE_BACKEND", "local")
+	app.config["STATE_CACHE_ADDRESS"] = ("127.0.0.1", int(os.getenv("STATE_CACHE_PORT", "50055")))
+	app.config["STATE_CACHE_MAX_BYTES"] = int(os.getenv("STATE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+	app.config["STATE_CACHE_TTL"] = 300.0
+
+	# Coalesce concurrent polls / serialize writes per user (see app/singleflight.py)
+	app.config["SINGLE_FLIGHT_ENABLED"] = True
+
+	# How long responses are kept for Idempotency-Key replays
+	app.config["IDEMPOTENCY_WINDOW_SECONDS"] = 24 * 3600
+
+	# Password hashing: KDF parameters (see `flask calibrate-password-hash`) and the
+	# bounded executor logins verify on
+	app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+	app.config["PASSWORD_VERIFY_WORKERS"] = int(os.getenv("PASSWORD_VERIFY_WORKERS", "2"))
+	app.config["PASSWORD_VERIFY_QUEUE"] = int(os.getenv("PASSWORD_VERIFY_QUEUE", "4"))
+	app.config["PASSWORD_VERIFY_TIMEOUT"] = 10.0
+
+	# Rate limiting (see app/ratelimit.py); RATE_LIMITS overrides per-endpoint policies
+	app.config["RATE_LIMIT_ENABLED"] = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+	app.config["RATE_LIMIT_BACKEND"] = os.getenv("RATE_LIMIT_BACKEND", "local")
+	app.config["RATE_LIMIT_ADDRESS"] = ("127.0.0.1", int(os.getenv("RATE_LIMIT_PORT", "50056")))
+	app.config["RATE_LIMITS"] = {}
+
+	# Coin/food ledger written with every inventory change (see app/ledger.py)
+	app.config["LEDGER_ENABLED"] = True
+
+	# Per-pet stat history ring buffers for charts (see app/stat_history.py)
+	app.config["STAT_HISTORY_ENABLED"] = True
+
+	# Deferred-work queue (see app/jobs.py); 0 threads leaves draining to `flask jobs-worker`
+	app.config["JOB_QUEUE_PATH"] = os.getenv("JOB_QUEUE_PATH")  # default instance/jobs.sqlite
+	app.config["JOB_WORKER_THREADS"] = int(os.getenv("JOB_WORKER_THREADS", "1"))
+	app.config["JOB_BATCH_SIZE"] = 50
+	app.config["JOB_MAX_ATTEMPTS"] = 5
+	app.config["JOB_LEASE_SECONDS"] = 60.0
+
+	# Render the shared part of the game page once (see app/fragments.py)
+	app.config["FRAGMENT_CACHE_ENABLED"] = True
+
+	# Response compression and opt-in MessagePack (see app/compression.py)
+	app.config["COMPRESS_ENABLED"] = True
+	app.config["COMPRESS_MIN_BYTES"] = 512
+	app.config["COMPRESS_LEVEL"] = 6
+	app.config["COMPRESS_BROTLI_QUALITY"] = 5
+	app.config["MSGPACK_ENABLED"] = True
+
+	# SQLite maintenance schedule (see app/maintenance.py; `flask db-maintenance --every 60`);
+	# intervals in seconds, 0 turns a task off. SQLITE_JOURNAL_MODE=wal lets backups run beside writers
+	app.config["SQLITE_JOURNAL_MODE"] = os.getenv("SQLITE_JOURNAL_MODE")
+	app.config["MAINTENANCE_BACKUP_DIR"] = os.getenv("BACKUP_DIR")  # default instance/backups
+	app.config["MAINTENANCE_BACKUP_SECONDS"] = 24 * 3600
+	app.config["MAINTENANCE_BACKUP_KEEP"] = 7
+	app.config["MAINTENANCE_BACKUP_STEP_PAGES"] = 1024
+	app.config["MAINTENANCE_BACKUP_MAX_RESTARTS"] = 3
+	app.config["MAINTENANCE_VACUUM_SECONDS"] = 3600
+	app.config["MAINTENANCE_VACUUM_STEP_PAGES"] = 256
+	app.config["MAINTENANCE_VACUUM_BUDGET_SECONDS"] = 10.0
+	app.config["MAINTENANCE_OPTIMIZE_SECONDS"] = 3600
+	app.config["MAINTENANCE_ANALYZE_SECONDS"] = 7 * 24 * 3600
+	app.config["MAINTENANCE_ANALYSIS_LIMIT"] = 1000
+	app.config["MAINTENANCE_STEP_PAUSE_SECONDS"] = 0.05
+
+	# Request capture for replay benchmarks (see app/capture.py and `flask replay-trace`); off when unset
+	app.config["TRAFFIC_CAPTURE_PATH"] = os.getenv("TRAFFIC_CAPTURE_PATH")
+	app.config["TRAFFIC_CAPTURE_SAMPLE"] = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0"))
+	app.config["TRAFFIC_CAPTURE_MAX_BYTES"] = 1 << 30
+	app.config["TRAFFIC_CAPTURE_MAX_BODY_BYTES"] = 64 * 1024
+	app.config["TRAFFIC_CAPTURE_FLUSH_SECONDS"] = 1.0
+
+	# Explicit overrides (simulations, benchmarks)
+	if config:
+		app.config.update(config)
+
+	# Request capture first so its timer wraps every other hook
+	from . import capture
+	capture.init_app(app)
+
+	# Init extensions (replica and shard binds must be configured before the engines are made)
+	from . import replicas, sharding
+	replicas.init_app(app)
+	sharding.init_app(app)
 	db.init_app(app)
 	login_manager.init_app(app)
 
+	# Per-user state cache (STATE_CACHE_BACKEND="shared" to use `flask cache-server`)
+	from .state_cache import state_cache
+	state_cache.init_app(app)
+
+	# Idempotency-Key replay for mutating endpoints
+	from . import idempotency
+	idempotency.init_app(app)
+
+	# Password verification executor
+	from . import passwords
+	passwords.init_app(app)
+
+	# Per-route token-bucket rate limits (RATE_LIMIT_BACKEND="shared" to use `flask ratelimit-server`)
+	from . import ratelimit
+	ratelimit.init_app(app)
+
+	# Append-only inventory ledger
+	from . import ledger
+	ledger.init_app(app)
+
+	# Stat samples for /api/pet/history
+	from . import stat_history
+	stat_history.init_app(app)
+
+	# Per-day analytics counters for the admin dashboard
+	from . import rollups
+	rollups.init_app(app)
+
+	# Durable queue for work done after the response
+	from . import jobs
+	jobs.init_app(app)
+
+	# Cached template fragments ({{ fragment(...) }} in templates)
+	from . import fragments
+	fragments.init_app(app)
+
+	# gzip/brotli and MessagePack for every blueprint's responses
+	from . import compression
+	compression.init_app(app)
+
 	# Blueprints
 	from .views import bp as main_bp
 	app.register_blueprint(main_bp)
 	from .auth import bp as auth_bp
 	app.register_blueprint(auth_bp, url_prefix="/auth")
 
+	# CLI commands (flask --app run <command>)
+	from .cli import register_commands
+	register_commands(app)
+
 	# Create tables and run lightweight migrations
 	with app.app_context():
 		from . import models  # noqa: F401
-		db.create_all()
+		# auto_vacuum for new SQLite files, SQLITE_JOURNAL_MODE
+		from .maintenance import prepare_databases
+		prepare_databases(app)
+		# Primary only: replica binds have no models of their own and may be read-only
+		db.create_all(bind_key=None)
 
 		# Lightweight migration for SQLite: add missing columns if needed
 		from sqlalchemy import inspect, text
@@ -53,36 +201,44 @@ def create_app() -> Flask:
 		if 'must_change_password' not in cols:
 			db.session.execute(text("ALTER TABLE users ADD COLUMN must_change_password BOOLEAN NOT NULL DEFAULT 0"))
 			db.session.commit()
+		# Existing users' data is all in the primary, shard 0
+		if 'shard' not in cols:
+			db.session.execute(text("ALTER TABLE users ADD COLUMN shard SMALLINT NOT NULL DEFAULT 0"))
+			db.session.execute(text("ALTER TABLE users ADD COLUMN shard_moving BOOLEAN NOT NULL DEFAULT 0"))
+			db.session.commit()
 
-		# Pets table new columns for feed/play state
+		# Timed activity state moved from sixteen pets columns into pet_activities
 		pet_cols = {c['name'] for c in insp.get_columns('pets')}
-		if 'is_feeding' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN is_feeding BOOLEAN NOT NULL DEFAULT 0"))
-			db.session.commit()
-			pet_cols.add('is_feeding')
-		if 'feed_start_time' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN feed_start_time DATETIME"))
-			db.session.commit()
-		if 'feed_type' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN feed_type VARCHAR(30)"))
-			db.session.commit()
-		if 'feed_end_time' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN feed_end_time DATETIME"))
-			db.session.commit()
-		if 'is_playing' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN is_playing BOOLEAN NOT NULL DEFAULT 0"))
-			db.session.commit()
-			pet_cols.add('is_playing')
-		if 'play_start_time' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN play_start_time DATETIME"))
-			db.session.commit()
-		if 'play_type' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN play_type VARCHAR(30)"))
+		if 'is_sleeping' in pet_cols:
+			from .activities import migrate_legacy_columns
+			migrate_legacy_columns(pet_cols)
+
+		# Ledger sequence per inventory; existing inventories open their ledger on first change
+		inventory_cols = {c['name'] for c in insp.get_columns('inventories')}
+		if 'ledger_seq' not in inventory_cols:
+			db.session.execute(text("ALTER TABLE inventories ADD COLUMN ledger_seq INTEGER NOT NULL DEFAULT 0"))
 			db.session.commit()
-		if 'play_end_time' not in pet_cols:
-			db.session.execute(text("ALTER TABLE pets ADD COLUMN play_end_time DATETIME"))
+
+		# create_all skips indexes declared after a table already existed
+		for table in db.metadata.sorted_tables:
+			for index in table.indexes:
+				index.create(bind=db.engine, checkfirst=True)
+
+		# Per-user tables in every extra shard
+		sharding.create_shard_tables(app)
+
+		# Request fingerprints for idempotency keys, in every shard
+		from .models import IdempotencyRecord
+		for _ in sharding.each_shard():
+			connection = db.session.connection(bind_arguments={"mapper": IdempotencyRecord})
+			if 'request_hash' not in {c['name'] for c in inspect(connection).get_columns('idempotency_keys')}:
+				connection.execute(text("ALTER TABLE idempotency_keys ADD COLUMN request_hash VARCHAR(64)"))
 			db.session.commit()
 
+		# Username search index for the admin user directory
+		from .user_directory import ensure_search_index
+		ensure_search_index()
+
 		# Seed admin: mark 'test' user as admin if present
 		from .models import User
 		test_user = User.query.filter_by(username='test').first()
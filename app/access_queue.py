@@ -0,0 +1,193 @@
+"""
+Admin access-request queue.
+
+New requests are stored by the "access_request.record" job, off the
+request path. Keyset-paginated listing (unprocessed requests come from a partial index),
+bulk mark-processed in one UPDATE, streaming NDJSON/CSV export and a
+retention job that moves old processed requests into access_requests_archive
+in chunks.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, update
+
+from .clock import utcnow
+from .extensions import db
+from .jobs import handler
+from .models import AccessRequest, AccessRequestArchive
+from .user_directory import decode_cursor, encode_cursor
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_CHUNK = 1000
+STATUSES = ("new", "processed", "all")
+
+_COLUMNS = (
+	AccessRequest.id, AccessRequest.email, AccessRequest.message,
+	AccessRequest.created_at, AccessRequest.processed
+)
+
+
+def _status_clause(status: str):
+	if status == "new":
+		# Must match the partial index predicate to use ix_access_requests_unprocessed
+		return AccessRequest.processed.is_(False)
+	if status == "processed":
+		return AccessRequest.processed.is_(True)
+	return None
+
+
+def _row_dict(row) -> dict:
+	return {
+		"id": row.id,
+		"email": row.email,
+		"message": row.message or "",
+		"created_at": row.created_at,
+		"processed": row.processed
+	}
+
+
+def list_requests(status: str = "new", cursor: Optional[str] = None,
+		limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+	"""Return one page of requests (newest first) and the next page's cursor.
+
+	Raises ValueError for an unknown status or malformed cursor.
+	"""
+	if status not in STATUSES:
+		raise ValueError(f"Unknown status {status!r}")
+	limit = max(1, min(limit, MAX_PAGE_SIZE))
+	stmt = select(*_COLUMNS)
+	clause = _status_clause(status)
+	if clause is not None:
+		stmt = stmt.where(clause)
+	if cursor:
+		after_created, after_id = decode_cursor(cursor)
+		stmt = stmt.where(or_(
+			AccessRequest.created_at < after_created,
+			and_(AccessRequest.created_at == after_created, AccessRequest.id < after_id)
+		))
+	stmt = stmt.order_by(AccessRequest.created_at.desc(), AccessRequest.id.desc()).limit(limit + 1)
+	rows = db.session.execute(stmt).all()
+
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+	return [_row_dict(row) for row in rows], next_cursor
+
+
+def count_pending() -> int:
+	return db.session.scalar(
+		select(func.count()).select_from(AccessRequest).where(_status_clause("new"))
+	)
+
+
+def mark_processed(ids: Optional[Iterable[int]] = None,
+		id_range: Optional[Tuple[int, int]] = None) -> int:
+	"""Mark a selection and/or an inclusive id range processed in one statement"""
+	stmt = update(AccessRequest).where(AccessRequest.processed.is_(False))
+	if ids is not None:
+		stmt = stmt.where(AccessRequest.id.in_(list(ids)))
+	if id_range is not None:
+		low, high = id_range
+		stmt = stmt.where(AccessRequest.id.between(low, high))
+	if ids is None and id_range is None:
+		raise ValueError("Select requests by ids and/or id range")
+	result = db.session.execute(
+		stmt.values(processed=True).execution_options(synchronize_session=False)
+	)
+	db.session.commit()
+	return result.rowcount
+
+
+def _iter_rows(status: str = "all", chunk_size: int = EXPORT_CHUNK) -> Iterator:
+	"""Yield rows in id order, one keyset chunk at a time (constant memory)"""
+	clause = _status_clause(status)
+	last_id = 0
+	while True:
+		stmt = select(*_COLUMNS).where(AccessRequest.id > last_id)
+		if clause is not None:
+			stmt = stmt.where(clause)
+		rows = db.session.execute(stmt.order_by(AccessRequest.id).limit(chunk_size)).all()
+		if not rows:
+			return
+		yield from rows
+		last_id = rows[-1].id
+
+
+def export_ndjson(status: str = "all") -> Iterator[str]:
+	buffer = []
+	for row in _iter_rows(status):
+		record = _row_dict(row)
+		record["created_at"] = record["created_at"].isoformat()
+		buffer.append(json.dumps(record, ensure_ascii=False))
+		if len(buffer) >= EXPORT_CHUNK:
+			yield "\n".join(buffer) + "\n"
+			buffer = []
+	if buffer:
+		yield "\n".join(buffer) + "\n"
+
+
+def export_csv(status: str = "all") -> Iterator[str]:
+	out = io.StringIO()
+	writer = csv.writer(out)
+	writer.writerow(["id", "email", "message", "created_at", "processed"])
+	count = 0
+	for row in _iter_rows(status):
+		writer.writerow([row.id, row.email, row.message or "", row.created_at.isoformat(), int(row.processed)])
+		count += 1
+		if count % EXPORT_CHUNK == 0:
+			yield out.getvalue()
+			out.seek(0)
+			out.truncate()
+	yield out.getvalue()
+
+
+def archive_processed(older_than_days: int = 30, chunk_size: int = 1000,
+		now: Optional[datetime] = None, progress=None) -> int:
+	"""Move processed requests older than N days into the archive table.
+
+	Each chunk is copied and deleted in its own short transaction so the live
+	table is never locked for long. Returns the number of requests moved.
+	"""
+	now = now or utcnow()
+	cutoff = now - timedelta(days=older_than_days)
+	moved = 0
+	while True:
+		ids = db.session.scalars(
+			select(AccessRequest.id)
+			.where(AccessRequest.processed.is_(True), AccessRequest.created_at < cutoff)
+			.order_by(AccessRequest.id)
+			.limit(chunk_size)
+		).all()
+		if not ids:
+			break
+		db.session.execute(
+			insert(AccessRequestArchive).from_select(
+				["id", "email", "message", "created_at", "processed", "archived_at"],
+				select(*_COLUMNS, literal(now, db.DateTime)).where(AccessRequest.id.in_(ids))
+			)
+		)
+		db.session.execute(
+			delete(AccessRequest).where(AccessRequest.id.in_(ids)).execution_options(synchronize_session=False)
+		)
+		db.session.commit()
+		moved += len(ids)
+		if progress:
+			progress(moved)
+	return moved
+
+
+@handler("access_request.record")
+def record_request(email: str, message: str, submitted_at: str) -> None:
+	"""Job: store a request submitted on /auth/request-access"""
+	db.session.add(AccessRequest(
+		email=email, message=message, created_at=datetime.fromisoformat(submitted_at)
+	))
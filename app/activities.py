@@ -0,0 +1,78 @@
+"""
+Timed pet activities (sleep, wash, feed, play).
+
+While an activity is in progress the pet has one pet_activities row of that
+kind; the legacy Pet attributes (is_sleeping, sleep_end_time, ...) read from
+those rows. Finished activities are cleared lazily by the Pet.check_*
+methods when a pet is loaded, and in bulk by sweep_expired(), a range scan
+on the end_time index (`flask sweep-activities`).
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, select, text
+
+from .clock import utcnow
+from .extensions import db
+from .models import PetActivity
+from .sharding import each_shard
+from .state_cache import mark_pets_changed
+
+
+# Columns the activity state used to live in on pets: kind -> (flag, type, start, end)
+LEGACY_COLUMNS = {
+	"sleep": ("is_sleeping", "sleep_type", "sleep_start_time", "sleep_end_time"),
+	"wash": ("is_washing", "wash_type", "wash_start_time", "wash_end_time"),
+	"feed": ("is_feeding", "feed_type", "feed_start_time", "feed_end_time"),
+	"play": ("is_playing", "play_type", "play_start_time", "play_end_time"),
+}
+
+
+def migrate_legacy_columns(pet_cols: set) -> int:
+	"""Copy in-progress activities out of the legacy pets columns, then drop them.
+
+	Runs in one transaction; returns the number of activities copied.
+	"""
+	copied = 0
+	for kind, (flag, type_col, start_col, end_col) in LEGACY_COLUMNS.items():
+		if not {flag, type_col, start_col, end_col} <= pet_cols:
+			continue
+		result = db.session.execute(text(
+			f"INSERT INTO pet_activities (pet_id, kind, activity_type, start_time, end_time) "
+			f"SELECT id, :kind, {type_col}, {start_col}, {end_col} FROM pets "
+			f"WHERE {flag} AND {type_col} IS NOT NULL AND {start_col} IS NOT NULL AND {end_col} IS NOT NULL"
+		), {"kind": kind})
+		copied += result.rowcount
+	for columns in LEGACY_COLUMNS.values():
+		for column in columns:
+			if column in pet_cols:
+				db.session.execute(text(f"ALTER TABLE pets DROP COLUMN {column}"))
+	db.session.commit()
+	print(f"MIGRATION: moved {copied} in-progress activities to pet_activities, dropped legacy pets columns")
+	return copied
+
+
+def expiring(until: datetime, since: Optional[datetime] = None) -> List[Tuple[int, str, datetime]]:
+	"""(pet_id, kind, end_time) of the pinned shard's activities ending in (since, until], soonest first"""
+	stmt = select(PetActivity.pet_id, PetActivity.kind, PetActivity.end_time).where(PetActivity.end_time <= until)
+	if since is not None:
+		stmt = stmt.where(PetActivity.end_time > since)
+	return [tuple(row) for row in db.session.execute(stmt.order_by(PetActivity.end_time))]
+
+
+def sweep_expired(now: Optional[datetime] = None) -> int:
+	"""Delete every finished activity, one statement per shard; returns how many"""
+	now = now or utcnow()
+	swept = 0
+	for _ in each_shard():
+		pet_ids = db.session.scalars(
+			delete(PetActivity).where(PetActivity.end_time <= now).returning(PetActivity.pet_id)
+			.execution_options(synchronize_session=False, state_cache_marked=True)
+		).all()
+		# Only the owners' cached state goes, not the whole cache
+		mark_pets_changed(db.session, pet_ids)
+		db.session.commit()
+		swept += len(pet_ids)
+	return swept
@@ -1,14 +1,27 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 
+from .clock import utcnow
+from .constants import PET_TYPES
 from .extensions import db
-from .models import User, AccessRequest
+from .jobs import defer
+from .jobs import stats as job_stats
+from .models import User
+from .passwords import VerifierBusy, hash_password, needs_rehash, verify_password
+from .replicas import replica_ok
+from .rollups import dashboard
+from .state_cache import state_cache
+from .user_directory import DEFAULT_PAGE_SIZE, bulk_delete_users, list_users
 
 
 bp = Blueprint("auth", __name__, template_folder="templates")
 
 
+@bp.errorhandler(VerifierBusy)
+def password_executor_busy(e):
+	return "Too many password operations in progress, please retry shortly", 503, {"Retry-After": str(e.retry_after)}
+
+
 @bp.route("/register", methods=["GET", "POST"])
 def register():
 	# Public registration disabled
@@ -24,36 +37,77 @@ def request_access():
 		if not email or "@" not in email:
 			flash("Please provide a valid email address", "error")
 			return render_template("request_access.html")
-		# Save request
-		req = AccessRequest(email=email, message=message)
-		db.session.add(req)
-		db.session.commit()
+		# Stored by a job worker; the visitor doesn't wait on the database
+		defer("access_request.record", email=email, message=message, submitted_at=utcnow().isoformat())
 		flash("Your request has been recorded. We'll get back to you.", "success")
 		return redirect(url_for("auth.login"))
 	return render_template("request_access.html")
 
 
 @bp.route("/admin/access-requests", methods=["GET", "POST"])
+@replica_ok
 @login_required
 def access_requests_admin():
 	if not current_user.is_admin:
 		flash("Unauthorized", "error")
 		return redirect(url_for("main.index"))
-	# Mark processed if an id is submitted
+	# Admin-only; loaded on first use like provisioning
+	from .access_queue import count_pending, list_requests, mark_processed
+	status = request.args.get("status", "new")
+	# Mark processed: one request, a selection, or an inclusive id range
 	if request.method == "POST":
-		req_id = request.form.get("request_id")
-		if req_id:
-			req = AccessRequest.query.get(int(req_id))
-			if req:
-				req.processed = True
-				db.session.commit()
-				flash("Request marked as processed", "success")
+		ids = [int(value) for value in request.form.getlist("request_id") if value.isdigit()]
+		low = request.form.get("from_id", "").strip()
+		high = request.form.get("to_id", "").strip()
+		id_range = None
+		if low or high:
+			if not (low.isdigit() and high.isdigit()) or int(low) > int(high):
+				flash("Invalid id range", "error")
+				return redirect(url_for("auth.access_requests_admin", status=status))
+			id_range = (int(low), int(high))
+		if not ids and id_range is None:
+			flash("No requests selected", "error")
+			return redirect(url_for("auth.access_requests_admin", status=status))
+		updated = mark_processed(ids=ids or None, id_range=id_range)
+		flash(f"{updated} request(s) marked as processed", "success")
+		return redirect(url_for("auth.access_requests_admin", status=status))
+
+	try:
+		requests, next_cursor = list_requests(status=status, cursor=request.args.get("cursor"))
+	except ValueError:
+		flash("Invalid page", "error")
 		return redirect(url_for("auth.access_requests_admin"))
-	requests = AccessRequest.query.order_by(AccessRequest.created_at.desc()).all()
-	return render_template("access_requests.html", requests=requests)
+	return render_template(
+		"access_requests.html", requests=requests, next_cursor=next_cursor,
+		status=status, pending=count_pending()
+	)
+
+
+@bp.route("/admin/access-requests/export.<fmt>", methods=["GET"])
+@replica_ok
+@login_required
+def access_requests_export(fmt):
+	if not current_user.is_admin:
+		return jsonify({"error": "Unauthorized"}), 403
+	from .access_queue import STATUSES as ACCESS_REQUEST_STATUSES
+	from .access_queue import export_csv, export_ndjson
+	status = request.args.get("status", "all")
+	if status not in ACCESS_REQUEST_STATUSES:
+		return jsonify({"error": "Unknown status"}), 400
+	if fmt == "ndjson":
+		rows, mimetype = export_ndjson(status), "application/x-ndjson"
+	elif fmt == "csv":
+		rows, mimetype = export_csv(status), "text/csv"
+	else:
+		return jsonify({"error": "Format must be 'ndjson' or 'csv'"}), 404
+	return Response(
+		stream_with_context(rows), mimetype=mimetype,
+		headers={"Content-Disposition": f"attachment; filename=access_requests.{fmt}"}
+	)
 
 
 @bp.route("/admin/users", methods=["GET", "POST"])
+@replica_ok
 @login_required
 def admin_users():
 	if not current_user.is_admin:
@@ -62,31 +116,106 @@ def admin_users():
 
 	if request.method == "POST":
 		user_id = request.form.get("user_id")
-		if not user_id:
+		if not user_id or not user_id.isdigit():
 			flash("Missing user id", "error")
 			return redirect(url_for("auth.admin_users"))
-		target = User.query.get(int(user_id))
+		target = db.session.get(User, int(user_id))
 		if not target:
 			flash("User not found", "error")
 			return redirect(url_for("auth.admin_users"))
 		if target.is_admin:
 			flash("Cannot delete admin accounts", "error")
 			return redirect(url_for("auth.admin_users"))
-		# Remove related data (pet, inventory) if present
-		if target.pet:
-			from .extensions import db as _db
-			_db.session.delete(target.pet)
-		if target.inventory:
-			from .extensions import db as _db
-			_db.session.delete(target.inventory)
-		from .extensions import db as _db
-		_db.session.delete(target)
-		_db.session.commit()
+		# Remove the user and related data (pet, inventory, ...) set-based
+		bulk_delete_users([target.id])
 		flash("User removed", "success")
 		return redirect(url_for("auth.admin_users"))
 
-	users = User.query.order_by(User.created_at.desc()).all()
-	return render_template("admin_users.html", users=users)
+	q = request.args.get("q", "").strip()
+	mode = request.args.get("mode", "substring")
+	try:
+		users, next_cursor = list_users(cursor=request.args.get("cursor"), q=q or None, mode=mode)
+	except ValueError:
+		flash("Invalid page cursor", "error")
+		return redirect(url_for("auth.admin_users", q=q or None, mode=mode))
+	return render_template(
+		"admin_users.html", users=users, next_cursor=next_cursor, q=q, mode=mode, pet_types=PET_TYPES
+	)
+
+
+@bp.route("/admin/users/bulk-delete", methods=["POST"])
+@login_required
+def admin_users_bulk_delete():
+	if not current_user.is_admin:
+		flash("Unauthorized", "error")
+		return redirect(url_for("main.index"))
+	user_ids = [value for value in request.form.getlist("user_ids") if value.isdigit()]
+	if not user_ids:
+		flash("No users selected", "error")
+		return redirect(url_for("auth.admin_users"))
+	removed = bulk_delete_users(user_ids)
+	flash(f"Removed {removed} user(s); admin accounts are skipped", "success")
+	return redirect(url_for("auth.admin_users"))
+
+
+@bp.route("/admin/api/users", methods=["GET"])
+@replica_ok
+@login_required
+def admin_api_users():
+	if not current_user.is_admin:
+		return jsonify({"error": "Unauthorized"}), 403
+	limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+	q = request.args.get("q", "").strip()
+	mode = request.args.get("mode", "substring")
+	if mode not in ("substring", "prefix"):
+		return jsonify({"error": "mode must be 'substring' or 'prefix'"}), 400
+	try:
+		users, next_cursor = list_users(cursor=request.args.get("cursor"), limit=limit, q=q or None, mode=mode)
+	except ValueError:
+		return jsonify({"error": "Invalid cursor"}), 400
+	for user in users:
+		user["created_at"] = user["created_at"].isoformat()
+	return jsonify({"success": True, "users": users, "next_cursor": next_cursor})
+
+
+@bp.route("/admin/api/users/bulk-delete", methods=["POST"])
+@login_required
+def admin_api_users_bulk_delete():
+	if not current_user.is_admin:
+		return jsonify({"error": "Unauthorized"}), 403
+	user_ids = (request.get_json(silent=True) or {}).get("user_ids")
+	if not isinstance(user_ids, list) or not all(isinstance(user_id, int) for user_id in user_ids):
+		return jsonify({"error": "user_ids must be a list of integers"}), 400
+	removed = bulk_delete_users(user_ids)
+	return jsonify({"success": True, "deleted": removed})
+
+
+@bp.route("/admin/api/cache-stats", methods=["GET"])
+@login_required
+def admin_cache_stats():
+	if not current_user.is_admin:
+		return jsonify({"error": "Unauthorized"}), 403
+	return jsonify({"success": True, "state_cache": state_cache.stats()})
+
+
+@bp.route("/admin/api/jobs", methods=["GET"])
+@login_required
+def admin_job_stats():
+	if not current_user.is_admin:
+		return jsonify({"error": "Unauthorized"}), 403
+	return jsonify({"success": True, **job_stats()})
+
+
+@bp.route("/admin/api/analytics", methods=["GET"])
+@replica_ok
+@login_required
+def admin_analytics():
+	if not current_user.is_admin:
+		return jsonify({"error": "Unauthorized"}), 403
+	days = request.args.get("days", 7, type=int)
+	if not 1 <= days <= 366:
+		return jsonify({"error": "days must be between 1 and 366"}), 400
+	return jsonify({"success": True, **dashboard(days)})
 
 
 @bp.route("/login", methods=["GET", "POST"])
@@ -96,9 +225,23 @@ def login():
 		password = request.form.get("password", "")
 		remember = request.form.get("remember") == "on"
 		user = User.query.filter_by(username=username).first()
-		if not user or not check_password_hash(user.password_hash, password):
+		try:
+			valid = user is not None and verify_password(user.password_hash, password)
+		except VerifierBusy as e:
+			flash("Too many sign-ins right now, please try again in a moment", "error")
+			response = make_response(render_template("login.html"), 503)
+			response.headers["Retry-After"] = str(e.retry_after)
+			return response
+		if not valid:
 			flash("Invalid credentials", "error")
 			return render_template("login.html")
+		# Upgrade hashes made with older KDF parameters while we have the password
+		if needs_rehash(user.password_hash):
+			try:
+				user.password_hash = hash_password(password)
+				db.session.commit()
+			except VerifierBusy:
+				pass
 		login_user(user, remember=remember)
 		# Force password change if required
 		if user.must_change_password:
@@ -136,7 +279,7 @@ def admin_create_user():
 	temp_password = secrets.token_urlsafe(8)
 	user = User(
 		username=username,
-		password_hash=generate_password_hash(temp_password),
+		password_hash=hash_password(temp_password),
 		must_change_password=True
 	)
 	db.session.add(user)
@@ -146,6 +289,40 @@ def admin_create_user():
 	return redirect(url_for("main.index"))
 
 
+@bp.route("/admin/users/provision", methods=["POST"])
+@login_required
+def admin_provision_users():
+	if not current_user.is_admin:
+		flash("Unauthorized", "error")
+		return redirect(url_for("main.index"))
+	# Admin-only and heavy to import (process pool, csv); loaded on first use
+	from .provisioning import credentials_csv, parse_roster, provision_users
+
+	upload = request.files.get("roster")
+	text = upload.read().decode("utf-8-sig", errors="replace") if upload and upload.filename else ""
+	text = text or request.form.get("usernames", "")
+	entries = parse_roster(text)
+	if not entries:
+		flash("Provide a roster file or a list of usernames", "error")
+		return redirect(url_for("auth.admin_users"))
+
+	with_pet = request.form.get("with_pet") == "on"
+	pet_type = request.form.get("pet_type") or None
+	if with_pet and pet_type not in PET_TYPES:
+		flash("Please select a valid pet type", "error")
+		return redirect(url_for("auth.admin_users"))
+	try:
+		credentials, skipped = provision_users(entries, with_pet=with_pet, default_pet_type=pet_type)
+	except ValueError as e:
+		flash(str(e), "error")
+		return redirect(url_for("auth.admin_users"))
+
+	return Response(
+		credentials_csv(credentials, skipped), mimetype="text/csv",
+		headers={"Content-Disposition": "attachment; filename=credentials.csv"}
+	)
+
+
 @bp.route("/change-password", methods=["GET", "POST"])
 @login_required
 def change_password():
@@ -158,7 +335,7 @@ def change_password():
 		if new_password != confirm_password:
 			flash("Passwords do not match", "error")
 			return render_template("change_password.html")
-		current_user.password_hash = generate_password_hash(new_password)
+		current_user.password_hash = hash_password(new_password)
 		current_user.must_change_password = False
 		db.session.commit()
 		flash("Password changed successfully", "success")
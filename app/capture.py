@@ -0,0 +1,220 @@
+"""
+Request capture for replay benchmarks (`flask replay-trace`, see app/replay.py).
+
+With TRAFFIC_CAPTURE_PATH set, every request (static files aside) appends
+one compact JSON array to that file:
+
+	[at, user, method, path, endpoint, status, ms, kind, body, headers]
+
+`at` is the app clock at the start of the request in epoch seconds, `user`
+the logged-in user id (or null), `path` includes the query string and `ms`
+is the time spent in the app (streamed bodies excluded). `kind` is "j" for a
+JSON body, "f" for form fields (lists of values), "-" for a body over
+TRAFFIC_CAPTURE_MAX_BODY_BYTES that was left out, or "" for none. Keys
+that look like secrets (password, token, secret, csrf) are dropped from
+bodies wherever they are nested. `headers` keeps the request headers that
+change the response (CAPTURED_HEADERS).
+
+The request thread only appends a tuple to a buffer; a background thread
+encodes the buffer and writes it with one O_APPEND write every
+TRAFFIC_CAPTURE_FLUSH_SECONDS, so pre-forked workers share the file
+without interleaving lines. Lines are in time order within a flush, not
+across processes. TRAFFIC_CAPTURE_SAMPLE keeps that share of users (whole
+sessions, by user id hash); capture stops when the file reaches
+TRAFFIC_CAPTURE_MAX_BYTES, and records are dropped rather than queued
+without bound if writes stall.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import List, Optional
+
+from flask import current_app, g, request, session
+
+from .clock import utcnow
+
+
+FORMAT = "tamagochi-trace"
+VERSION = 1
+FIELDS = ("at", "user", "method", "path", "endpoint", "status", "ms", "kind", "body", "headers")
+CAPTURED_HEADERS = ("Accept", "Accept-Encoding", "Idempotency-Key")
+_HEADER_KEYS = ["HTTP_" + name.upper().replace("-", "_") for name in CAPTURED_HEADERS]
+SECRET_MARKERS = ("password", "token", "secret", "csrf")
+FORM_TYPES = ("application/x-www-form-urlencoded", "multipart/form-data")
+# Records held in memory waiting for the writer before new ones are dropped
+MAX_PENDING = 100000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def init_app(app) -> None:
+	app.extensions["traffic_capture"] = None
+	path = app.config.get("TRAFFIC_CAPTURE_PATH")
+	if not path:
+		return
+	app.extensions["traffic_capture"] = TrafficRecorder(
+		path,
+		max_bytes=app.config.get("TRAFFIC_CAPTURE_MAX_BYTES", 1 << 30),
+		flush_seconds=app.config.get("TRAFFIC_CAPTURE_FLUSH_SECONDS", 1.0),
+	)
+	# Registered before the other extensions' hooks: the clock starts first and stops last
+	app.before_request(_start_timer)
+	app.after_request(_capture)
+
+
+class TrafficRecorder:
+	"""Buffered, append-only writer of capture records (one per process after a fork)"""
+
+	def __init__(self, path: str, max_bytes: int = 1 << 30, flush_seconds: float = 1.0):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.flush_seconds = flush_seconds
+		self.recorded = 0
+		self.dropped = 0
+		self.full = False
+		self._pending: List[tuple] = []
+		self._lock = threading.Lock()
+		self._start_lock = threading.Lock()
+		self._pid = None
+		self._fd = None
+		self._size = 0
+
+	def _start(self) -> None:
+		# Lazily per process: a worker forked from the master gets its own descriptor and writer thread
+		with self._start_lock:
+			if self._pid == os.getpid():
+				return
+			self._pending, self._lock = [], threading.Lock()
+			directory = os.path.dirname(self.path)
+			if directory:
+				os.makedirs(directory, exist_ok=True)
+			self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+			self._size = os.fstat(self._fd).st_size
+			if self._size == 0:
+				self._write(json.dumps({"format": FORMAT, "version": VERSION, "fields": FIELDS}) + "\n")
+			self._pid = os.getpid()
+			threading.Thread(target=self._run, daemon=True, name="traffic-capture").start()
+			atexit.register(self.flush)
+
+	def record(self, entry: tuple) -> None:
+		if self._pid != os.getpid():
+			self._start()
+		if self.full:
+			return
+		with self._lock:
+			if len(self._pending) >= MAX_PENDING:
+				self.dropped += 1
+				return
+			self._pending.append(entry)
+
+	def flush(self) -> int:
+		"""Write the buffered records now; returns how many"""
+		if self._pid != os.getpid():
+			return 0
+		with self._lock:
+			pending, self._pending = self._pending, []
+		if not pending or self.full:
+			return 0
+		dumps = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=str).encode
+		self._write("".join(dumps(_line(*entry)) + "\n" for entry in pending))
+		self.recorded += len(pending)
+		if self._size >= self.max_bytes:
+			self.full = True
+			print(f"CAPTURE: {self.path} reached {self._size} bytes, capture stopped")
+		return len(pending)
+
+	def _write(self, text: str) -> None:
+		data = memoryview(text.encode("utf-8"))
+		while data:
+			written = os.write(self._fd, data)
+			data = data[written:]
+			self._size += written
+
+	def _run(self) -> None:
+		while True:
+			time.sleep(self.flush_seconds)
+			try:
+				self.flush()
+			except OSError as e:
+				print(f"CAPTURE: writing {self.path} failed ({e})")
+
+	def stats(self) -> dict:
+		return {"path": self.path, "recorded": self.recorded, "pending": len(self._pending),
+			"dropped": self.dropped, "bytes": self._size, "full": self.full}
+
+
+def _line(at, user_id, method, path, query, endpoint, status, elapsed, kind, body, headers) -> list:
+	return [
+		round((at - _EPOCH).total_seconds(), 3), int(user_id) if user_id else None, method,
+		f"{path}?{query}" if query else path, endpoint, status, round(elapsed * 1000, 2), kind,
+		redact(body), {name: value for name, value in zip(CAPTURED_HEADERS, headers) if value is not None},
+	]
+
+
+def redact(value):
+	"""Copy of a JSON/form body without keys that look like secrets"""
+	if isinstance(value, dict):
+		return {
+			key: redact(item) for key, item in value.items()
+			if not any(marker in str(key).lower() for marker in SECRET_MARKERS)
+		}
+	if isinstance(value, list):
+		return [redact(item) for item in value]
+	return value
+
+
+def _sampled(user_id: Optional[str], rate: float) -> bool:
+	if rate >= 1.0:
+		return True
+	if user_id is None:
+		return random.random() < rate
+	return zlib.crc32(user_id.encode()) < rate * 2 ** 32
+
+
+def _start_timer() -> None:
+	if request.endpoint != "static":
+		ctx = g._get_current_object()
+		ctx._capture_started = time.perf_counter()
+		ctx._capture_at = utcnow()
+
+
+def _body(req, max_bytes: int):
+	if req.method in ("GET", "HEAD", "OPTIONS"):
+		return "", None
+	if int(req.environ.get("CONTENT_LENGTH") or 0) > max_bytes:
+		return "-", None
+	if req.is_json:
+		return "j", req.get_json(silent=True)
+	if req.mimetype in FORM_TYPES:
+		return "f", req.form.to_dict(flat=False)
+	return "", None
+
+
+def _capture(response):
+	# Proxies resolved once and only raw values kept: redaction and encoding happen on the writer thread
+	ctx = g._get_current_object()
+	started = ctx.__dict__.pop("_capture_started", None)
+	if started is None:
+		return response
+	elapsed = time.perf_counter() - started
+	# The session id rather than user.get_id(), which reloads a user expired by a commit; and only when
+	# flask-login looked at the session already, else reading it here would add Vary: Cookie
+	user_id = session.get("_user_id") if "_login_user" in ctx.__dict__ else None
+	app = current_app._get_current_object()
+	if not _sampled(user_id, app.config["TRAFFIC_CAPTURE_SAMPLE"]):
+		return response
+	req = request._get_current_object()
+	environ = req.environ
+	kind, body = _body(req, app.config["TRAFFIC_CAPTURE_MAX_BODY_BYTES"])
+	app.extensions["traffic_capture"].record((
+		ctx._capture_at, user_id, req.method, req.path, environ.get("QUERY_STRING"), req.endpoint,
+		response.status_code, elapsed, kind, body, [environ.get(key) for key in _HEADER_KEYS],
+	))
+	return response
@@ -0,0 +1,347 @@
+import click
+from flask import Flask
+
+
+def register_commands(app: Flask) -> None:
+	"""Attach the project's `flask` CLI commands to the app"""
+
+	@app.cli.command("simulate")
+	@click.option("--players", default=1000, show_default=True, help="Number of virtual players")
+	@click.option("--hours", default=24.0, show_default=True, help="Virtual hours to simulate")
+	@click.option("--step-minutes", default=5.0, show_default=True, help="Virtual minutes per tick (frozen clock)")
+	@click.option("--speed", type=float, default=None, help="Run on an accelerated clock instead, e.g. 1000")
+	@click.option("--seed", default=42, show_default=True)
+	@click.option("--database-url", default=None, help="Scratch database (default: temporary SQLite file)")
+	def simulate(players, hours, step_minutes, speed, seed, database_url):
+		"""Drive virtual players through the real views on a simulated clock."""
+		from .simulation import format_report, run_simulation
+		report = run_simulation(
+			players=players, hours=hours, step_minutes=step_minutes,
+			speed=speed, seed=seed, database_url=database_url
+		)
+		click.echo(format_report(report))
+
+	@app.cli.command("cache-server")
+	@click.option("--port", default=lambda: app.config["STATE_CACHE_ADDRESS"][1], show_default="STATE_CACHE_PORT or 50055")
+	@click.option("--max-bytes", default=256 * 1024 * 1024, show_default=True)
+	def cache_server(port, max_bytes):
+		"""Run the shared per-user state cache on localhost (for multi-worker setups)."""
+		from .state_cache import serve_shared_backend
+		click.echo(f"State cache listening on 127.0.0.1:{port} (max {max_bytes} bytes)")
+		serve_shared_backend(
+			address=("127.0.0.1", int(port)), max_bytes=max_bytes,
+			ttl=app.config["STATE_CACHE_TTL"]
+		)
+
+	@app.cli.command("ratelimit-server")
+	@click.option("--port", default=lambda: app.config["RATE_LIMIT_ADDRESS"][1], show_default="RATE_LIMIT_PORT or 50056")
+	def ratelimit_server(port):
+		"""Run the shared rate-limit buckets on localhost (for multi-worker setups)."""
+		from .ratelimit import serve_shared_limiter
+		click.echo(f"Rate limiter listening on 127.0.0.1:{port}")
+		serve_shared_limiter(address=("127.0.0.1", int(port)))
+
+	@app.cli.command("sweep-activities")
+	@click.option("--every", type=float, default=None, help="Keep sweeping every N seconds instead of once")
+	def sweep_activities(every):
+		"""Clear finished sleep/wash/feed/play activities (index range scan on end time)."""
+		import time
+		from .activities import sweep_expired
+		while True:
+			started = time.perf_counter()
+			swept = sweep_expired()
+			click.echo(f"Swept {swept} finished activities in {(time.perf_counter() - started) * 1000:.1f} ms")
+			if not every:
+				break
+			time.sleep(every)
+
+	@app.cli.command("refresh-rollups")
+	@click.option("--every", type=float, default=None, help="Keep refreshing every N seconds instead of once")
+	def refresh_rollups(every):
+		"""Recount today's pets-per-maturity-stage gauges for the analytics dashboard."""
+		import time
+		from .rollups import refresh_gauges
+		while True:
+			started = time.perf_counter()
+			stages = refresh_gauges()
+			counts = " ".join(f"{stage}={count}" for stage, count in stages.items())
+			click.echo(f"Refreshed maturity gauges ({counts}) in {(time.perf_counter() - started) * 1000:.1f} ms")
+			if not every:
+				break
+			time.sleep(every)
+
+	@app.cli.command("jobs-worker")
+	@click.option("--threads", default=4, show_default=True, help="Worker threads")
+	@click.option("--batch", default=lambda: app.config["JOB_BATCH_SIZE"], show_default="JOB_BATCH_SIZE")
+	@click.option("--poll", default=1.0, show_default=True, help="Seconds between polls of an empty queue")
+	@click.option("--stats-every", default=60.0, show_default=True, help="Print queue stats every N seconds")
+	def jobs_worker(threads, batch, poll, stats_every):
+		"""Drain the deferred-work queue until interrupted."""
+		import time
+		from .jobs import WorkerPool, job_queue
+		pool = WorkerPool(app, job_queue(), threads=threads, batch=batch, poll_interval=poll)
+		pool.start()
+		click.echo(f"Job workers running: {threads} threads, batches of {batch} ({job_queue().path})")
+		try:
+			while True:
+				time.sleep(stats_every)
+				click.echo(f"{job_queue().stats()} {pool.stats()}")
+		except KeyboardInterrupt:
+			pool.stop(timeout=30)
+			click.echo(f"Stopped: {pool.stats()}")
+
+	@app.cli.command("jobs-stats")
+	@click.option("--requeue-dead", is_flag=True, help="Give dead jobs a fresh set of attempts")
+	def jobs_stats(requeue_dead):
+		"""Show deferred-work queue depth and dead jobs."""
+		from .jobs import job_queue
+		if requeue_dead:
+			click.echo(f"Requeued {job_queue().requeue_dead()} dead jobs")
+		click.echo(job_queue().stats())
+
+	@app.cli.command("purge-idempotency-keys")
+	def purge_idempotency_keys():
+		"""Delete stored Idempotency-Key responses older than the replay window."""
+		from .idempotency import purge_expired
+		removed = purge_expired()
+		click.echo(f"Removed {removed} expired idempotency records")
+
+	@app.cli.command("archive-access-requests")
+	@click.option("--days", default=30, show_default=True, help="Archive processed requests older than this")
+	@click.option("--chunk", default=1000, show_default=True, help="Requests moved per transaction")
+	def archive_access_requests(days, chunk):
+		"""Move old processed access requests into access_requests_archive."""
+		from .access_queue import archive_processed
+		moved = archive_processed(older_than_days=days, chunk_size=chunk)
+		click.echo(f"Archived {moved} processed access requests older than {days} days")
+
+	@app.cli.command("provision-users")
+	@click.argument("roster", type=click.File("r", encoding="utf-8-sig"))
+	@click.option("--output", "-o", type=click.File("w"), default="-", help="Credentials CSV (default: stdout)")
+	@click.option("--pet-type", default=None, help="Also create this pet (and a starter inventory) for every user")
+	@click.option("--workers", type=int, default=None, help="Hashing processes (default: CPU count)")
+	def provision_users_command(roster, output, pet_type, workers):
+		"""Create users from a roster file and write their temporary passwords."""
+		from .provisioning import credentials_csv, parse_roster, provision_users
+		credentials, skipped = provision_users(
+			parse_roster(roster.read()), with_pet=pet_type is not None,
+			default_pet_type=pet_type, workers=workers
+		)
+		output.write(credentials_csv(credentials, skipped))
+		click.echo(f"Created {len(credentials)} users, skipped {len(skipped)}", err=True)
+
+	@app.cli.command("calibrate-password-hash")
+	@click.option("--target-ms", default=250.0, show_default=True, help="Acceptable time per hash on this machine")
+	@click.option("--algorithm", type=click.Choice(["scrypt", "pbkdf2"]), default="scrypt", show_default=True)
+	@click.option("--samples", default=3, show_default=True, help="Hashes timed per candidate (median)")
+	def calibrate_password_hash(target_ms, algorithm, samples):
+		"""Pick password KDF parameters for a target hashing latency."""
+		from .passwords import calibrate
+		method, ms, measured = calibrate(target_ms=target_ms, algorithm=algorithm, samples=samples)
+		for candidate, candidate_ms in measured:
+			click.echo(f"  {candidate:<24} {candidate_ms:>8} ms")
+		click.echo(f"Current: {app.config['PASSWORD_HASH_METHOD']}")
+		click.echo(f"Recommended: PASSWORD_HASH_METHOD={method}  ({ms} ms per hash)")
+		click.echo("Existing users are rehashed with the new parameters on their next login.")
+
+	@app.cli.command("ledger-reconcile")
+	@click.option("--examples", default=20, show_default=True, help="Mismatches to print per kind")
+	def ledger_reconcile(examples):
+		"""Check ledger entries against inventory balances and snapshots."""
+		import time
+		from .ledger import format_report, merge_reports, reconcile
+		from .sharding import each_shard
+		started = time.perf_counter()
+		report = merge_reports([reconcile(limit=examples) for _ in each_shard()], limit=examples)
+		click.echo(format_report(report))
+		click.echo(f"Checked in {time.perf_counter() - started:.2f}s")
+		if not report["ok"]:
+			raise SystemExit(1)
+
+	@app.cli.command("ledger-balance")
+	@click.argument("username")
+	@click.option("--at", "at", type=click.DateTime(), default=None, help="Point in time (UTC), default now")
+	@click.option("--history", "history_count", default=0, help="Also print this many latest entries")
+	def ledger_balance(username, at, history_count):
+		"""Show a user's coins and food at a point in time from the ledger."""
+		from .extensions import db
+		from .ledger import balance_at, history
+		from .models import User
+		from .sharding import on_shard
+		user = db.session.scalar(db.select(User).where(User.username == username))
+		if user is None:
+			raise click.ClickException(f"No user {username!r}")
+		with on_shard(user.shard):
+			balances = balance_at(user.id, at)
+			if balances is None:
+				raise click.ClickException(f"{username} has no inventory")
+			click.echo(" ".join(f"{item}={value}" for item, value in balances.items()))
+			for entry in history(user.id, limit=history_count) if history_count else []:
+				click.echo(f"  #{entry['seq']} {entry['created_at']} {entry['item']} {entry['delta']:+d} ({entry['reason']})")
+
+	@app.cli.command("shard-stats")
+	def shard_stats():
+		"""Show users and pets per shard."""
+		from .extensions import db
+		from .models import Pet, User
+		from .sharding import each_shard, shard_sizes
+		users = shard_sizes()
+		moving = db.session.scalar(db.select(db.func.count()).where(User.shard_moving.is_(True)))
+		for shard in each_shard():
+			pets = db.session.scalar(db.select(db.func.count()).select_from(Pet))
+			click.echo(f"shard {shard}: {users[shard]} users, {pets} pets")
+		if moving:
+			click.echo(f"{moving} users marked as moving (an interrupted move? run shard-move for them again)")
+
+	@app.cli.command("shard-move")
+	@click.argument("usernames", nargs=-1, required=True)
+	@click.option("--to", "target", type=int, required=True, help="Target shard number")
+	@click.option("--grace", type=float, default=None, help="Seconds to let in-flight requests finish (SHARD_MOVE_GRACE_SECONDS)")
+	def shard_move(usernames, target, grace):
+		"""Move users and everything they own to another shard."""
+		from .extensions import db
+		from .models import User
+		from .sharding import move_users
+		ids = db.session.scalars(db.select(User.id).where(User.username.in_(usernames))).all()
+		if len(ids) != len(set(usernames)):
+			raise click.ClickException("Unknown username(s)")
+		try:
+			moved = move_users(ids, target, grace=grace, log=click.echo)
+		except ValueError as e:
+			raise click.ClickException(str(e))
+		click.echo(f"Moved {moved} users to shard {target}")
+
+	@app.cli.command("shard-rebalance")
+	@click.option("--batch", default=100, show_default=True, help="Users moved (and briefly locked out) at a time")
+	@click.option("--limit", type=int, default=None, help="Move at most this many users this run")
+	@click.option("--grace", type=float, default=None, help="Seconds to let in-flight requests finish (SHARD_MOVE_GRACE_SECONDS)")
+	@click.option("--dry-run", is_flag=True, help="Only print the plan")
+	def shard_rebalance(batch, limit, grace, dry_run):
+		"""Even out users per shard, e.g. after adding a shard to DATABASE_SHARD_URLS."""
+		import time
+		from .sharding import move_users, rebalance_plan
+		plan = rebalance_plan(limit=limit)
+		if not plan:
+			click.echo("Shards are balanced")
+			return
+		for target, ids in sorted(plan.items()):
+			click.echo(f"{len(ids)} users -> shard {target}")
+		if dry_run:
+			return
+		started = time.perf_counter()
+		moved = sum(move_users(ids, target, batch=batch, grace=grace, log=click.echo) for target, ids in sorted(plan.items()))
+		click.echo(f"Moved {moved} users in {time.perf_counter() - started:.1f}s")
+
+	@app.cli.command("db-maintenance")
+	@click.option("--every", type=float, default=None, help="Keep checking for due tasks every N seconds instead of once")
+	@click.option("--task", "tasks", type=click.Choice(["backup", "vacuum", "optimize", "analyze"]), multiple=True,
+		help="Only these tasks (repeatable)")
+	@click.option("--force", is_flag=True, help="Run the tasks now whether or not they are due")
+	@click.option("--enable-incremental-vacuum", is_flag=True,
+		help="One-off full VACUUM switching existing SQLite files to auto_vacuum=INCREMENTAL (blocks writers)")
+	def db_maintenance(every, tasks, force, enable_incremental_vacuum):
+		"""Back up, vacuum and re-analyze the databases on their MAINTENANCE_* schedule."""
+		import time
+		from .maintenance import databases, enable_incremental_vacuum as enable, run_due, sqlite_path
+		if enable_incremental_vacuum:
+			for name, engine in databases():
+				path = sqlite_path(engine)
+				if path is not None:
+					started = time.perf_counter()
+					result = enable(path)
+					click.echo(f"{name}: {result} in {time.perf_counter() - started:.1f}s")
+			return
+		while True:
+			runs = run_due(tasks=list(tasks) or None, force=force, log=click.echo)
+			if not runs and not every:
+				click.echo("Nothing due")
+			if not every:
+				break
+			force = False
+			time.sleep(every)
+
+	@app.cli.command("db-backup")
+	@click.option("--dest", default=None, help="Directory for the copies (default MAINTENANCE_BACKUP_DIR)")
+	def db_backup(dest):
+		"""Online backup of every SQLite database, a few pages at a time."""
+		from .maintenance import databases, run_task
+		failed = False
+		for name, engine in databases():
+			run = run_task("backup", name, engine, dest_dir=dest)
+			click.echo(f"{name}: {'ok' if run.ok else 'FAILED'} in {run.seconds:.2f}s {run.detail or ''}")
+			failed = failed or not run.ok
+		if failed:
+			raise SystemExit(1)
+
+	@app.cli.command("db-report")
+	@click.option("--days", default=7, show_default=True, help="Window for maintenance time spent")
+	@click.option("--tables", is_flag=True, help="Also show space and unused bytes per table (reads the whole file)")
+	def db_report(days, tables):
+		"""Show database size, free-page fragmentation and maintenance history."""
+		from .maintenance import format_report, report
+		click.echo(format_report(report(days=days, tables=tables)))
+
+	@app.cli.command("export-state")
+	@click.argument("path")
+	@click.option("--chunk", default=10000, show_default=True, help="Rows fetched from the cursor at a time")
+	def export_state_command(path, chunk):
+		"""Stream every user's game state to an NDJSON file ("-" for stdout, .gz to compress)."""
+		from functools import partial
+		from .state_dump import export_state, open_dump
+		# stdout may be the dump itself
+		log = partial(click.echo, err=True)
+		with open_dump(path, "w") as out:
+			summary = export_state(out, chunk=chunk, log=log)
+		log(f"Exported {summary['rows']} rows in {summary['seconds']}s ({summary['rows_per_second']} rows/s)")
+
+	@app.cli.command("import-state")
+	@click.argument("path")
+	@click.option("--chunk", default=10000, show_default=True, help="Rows inserted per transaction")
+	def import_state_command(path, chunk):
+		"""Load an export-state dump into this (empty) database ("-" for stdin)."""
+		from .state_dump import import_state, open_dump
+		with open_dump(path, "r") as lines:
+			try:
+				summary = import_state(lines, chunk=chunk, log=click.echo)
+			except ValueError as e:
+				raise click.ClickException(str(e))
+		click.echo(f"Imported {summary['rows']} rows in {summary['seconds']}s ({summary['rows_per_second']} rows/s)")
+
+	@app.cli.command("generate-population")
+	@click.option("--users", type=int, required=True, help="Players to create (each with a pet and an inventory)")
+	@click.option("--seed", default=42, show_default=True)
+	@click.option("--prefix", default="pop_", show_default=True, help="Username prefix")
+	@click.option("--access-requests", type=int, default=None, help="Access requests to add (default users / 10)")
+	@click.option("--max-age-days", default=90.0, show_default=True, help="Age of the oldest adult pets")
+	@click.option("--chunk", default=10000, show_default=True, help="Rows inserted per transaction")
+	def generate_population_command(users, seed, prefix, access_requests, max_age_days, chunk):
+		"""Bulk-create a synthetic player population for benchmarks (password: password)."""
+		from .population import generate_population
+		try:
+			summary = generate_population(
+				users, seed=seed, prefix=prefix, access_requests=access_requests,
+				max_age_days=max_age_days, chunk=chunk, log=click.echo
+			)
+		except ValueError as e:
+			raise click.ClickException(str(e))
+		click.echo(" ".join(f"{name}={count}" for name, count in summary["tables"].items()))
+		click.echo(f"Inserted {summary['rows']} rows in {summary['seconds']}s ({summary['rows_per_second']} rows/s)")
+
+	@app.cli.command("replay-trace")
+	@click.argument("trace")
+	@click.option("--speed", default=1.0, show_default=True,
+		help="Replay this many times faster than recorded; 0 = as fast as possible on a frozen clock")
+	@click.option("--threads", default=8, show_default=True, help="Replay threads (each user's requests stay on one)")
+	@click.option("--state", default=None, help="export-state dump to load into the scratch database first")
+	@click.option("--seed", default=42, show_default=True)
+	@click.option("--database-url", default=None, help="Scratch database (default: temporary SQLite file)")
+	@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON")
+	def replay_trace(trace, speed, threads, state, seed, database_url, as_json):
+		"""Replay captured traffic (TRAFFIC_CAPTURE_PATH) against a fresh app; latency per endpoint."""
+		import json
+		from .replay import format_report, run_replay
+		try:
+			report = run_replay(trace, speed=speed, threads=threads, state=state, seed=seed, database_url=database_url)
+		except ValueError as e:
+			raise click.ClickException(str(e))
+		click.echo(json.dumps(report, indent=2) if as_json else format_report(report))
@@ -0,0 +1,76 @@
+"""
+Pluggable clock for time-dependent game logic.
+
+All game code asks `utcnow()` for the current (naive UTC) time instead of
+calling datetime.utcnow() directly. The clock is taken from the app config
+(`CLOCK`) and is resolved once per request, so every stat, timer and
+timestamp written while handling one request sees the same instant.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from flask import current_app, g, has_app_context, has_request_context
+
+
+class RealClock:
+	"""Wall clock (the default)"""
+
+	def now(self) -> datetime:
+		return datetime.utcnow()
+
+
+class FrozenClock:
+	"""Clock that only moves when told to; used for deterministic runs"""
+
+	def __init__(self, start: Optional[datetime] = None):
+		self._now = start or datetime.utcnow()
+		self._lock = threading.Lock()
+
+	def now(self) -> datetime:
+		return self._now
+
+	def set(self, when: datetime) -> None:
+		with self._lock:
+			self._now = when
+
+	def advance(self, delta: timedelta) -> datetime:
+		with self._lock:
+			self._now += delta
+			return self._now
+
+
+class AcceleratedClock:
+	"""Clock running `speed` times faster than real time from a start point"""
+
+	def __init__(self, speed: float = 1000.0, start: Optional[datetime] = None):
+		self.speed = speed
+		self.start = start or datetime.utcnow()
+		self._origin = time.perf_counter()
+
+	def now(self) -> datetime:
+		elapsed = (time.perf_counter() - self._origin) * self.speed
+		return self.start + timedelta(seconds=elapsed)
+
+
+_default_clock = RealClock()
+
+
+def get_clock():
+	"""Return the clock configured for the current app (RealClock outside one)"""
+	if has_app_context():
+		return current_app.config.get("CLOCK") or _default_clock
+	return _default_clock
+
+
+def utcnow() -> datetime:
+	"""Current naive UTC time, fixed for the duration of a request"""
+	if has_request_context():
+		now = g.get("_clock_now")
+		if now is None:
+			now = g._clock_now = get_clock().now()
+		return now
+	return get_clock().now()
@@ -0,0 +1,221 @@
+"""
+Response layer shared by every blueprint: MessagePack on request and
+negotiated compression.
+
+An after_request hook, in this order:
+
+1. JSON responses are re-encoded as MessagePack when the client's Accept
+   header prefers application/msgpack (or application/x-msgpack) to
+   application/json. Uses the `msgpack` package when installed, else a
+   small built-in encoder for JSON-shaped data.
+2. Text, JSON, NDJSON, CSV and MessagePack bodies of COMPRESS_MIN_BYTES or
+   more are compressed with brotli (if the `brotli` package is installed)
+   or gzip, whichever the Accept-Encoding header ranks higher. Streamed
+   responses (admin exports) are compressed chunk by chunk, whatever their
+   size. Files from send_file/static, partial and bodiless responses are
+   left alone.
+
+See benchmarks/bench_compression.py for the CPU cost versus bytes saved
+that the default threshold comes from.
+"""
+from __future__ import annotations
+
+import json
+import struct
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import Response, current_app, request
+
+try:
+	import brotli
+except ImportError:  # Optional: gzip only
+	brotli = None
+
+try:
+	import msgpack
+except ImportError:  # Optional: built-in encoder below
+	msgpack = None
+
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+COMPRESSIBLE_TYPES = {
+	"application/json", "application/x-ndjson", "application/javascript",
+	"application/xml", "image/svg+xml", *MSGPACK_TYPES,
+}
+
+
+def init_app(app) -> None:
+	app.after_request(encode_response)
+
+
+# MessagePack
+
+def _pack(obj, out: bytearray) -> None:
+	if obj is None:
+		out.append(0xc0)
+	elif obj is True or obj is False:
+		out.append(0xc3 if obj else 0xc2)
+	elif isinstance(obj, int):
+		if 0 <= obj <= 0x7f:
+			out.append(obj)
+		elif -32 <= obj < 0:
+			out.append(obj & 0xff)
+		elif obj > 0:
+			for fmt, code in (("B", 0xcc), (">H", 0xcd), (">I", 0xce), (">Q", 0xcf)):
+				if obj < 1 << (8 * struct.calcsize(fmt)):
+					out.append(code)
+					out += struct.pack(fmt, obj)
+					return
+			raise OverflowError("integer too large for MessagePack")
+		else:
+			for fmt, code in (("b", 0xd0), (">h", 0xd1), (">i", 0xd2), (">q", 0xd3)):
+				if obj >= -(1 << (8 * struct.calcsize(fmt) - 1)):
+					out.append(code)
+					out += struct.pack(fmt, obj)
+					return
+			raise OverflowError("integer too small for MessagePack")
+	elif isinstance(obj, float):
+		out.append(0xcb)
+		out += struct.pack(">d", obj)
+	elif isinstance(obj, str):
+		data = obj.encode("utf-8")
+		size = len(data)
+		if size <= 31:
+			out.append(0xa0 | size)
+		elif size <= 0xff:
+			out += bytes((0xd9, size))
+		elif size <= 0xffff:
+			out.append(0xda)
+			out += struct.pack(">H", size)
+		else:
+			out.append(0xdb)
+			out += struct.pack(">I", size)
+		out += data
+	elif isinstance(obj, (list, tuple)):
+		_pack_header(len(obj), 0x90, 0xdc, out)
+		for item in obj:
+			_pack(item, out)
+	elif isinstance(obj, dict):
+		_pack_header(len(obj), 0x80, 0xde, out)
+		for key, value in obj.items():
+			_pack(key, out)
+			_pack(value, out)
+	else:
+		raise TypeError(f"cannot encode {type(obj).__name__} as MessagePack")
+
+
+def _pack_header(size: int, fix: int, code16: int, out: bytearray) -> None:
+	# Arrays and maps: fixarray/fixmap, then 16- and 32-bit lengths
+	if size <= 15:
+		out.append(fix | size)
+	elif size <= 0xffff:
+		out.append(code16)
+		out += struct.pack(">H", size)
+	else:
+		out.append(code16 + 1)
+		out += struct.pack(">I", size)
+
+
+def packb(obj) -> bytes:
+	"""MessagePack encoding of JSON-shaped data"""
+	if msgpack is not None:
+		return msgpack.packb(obj, use_bin_type=True)
+	out = bytearray()
+	_pack(obj, out)
+	return bytes(out)
+
+
+def _wants_msgpack() -> Optional[str]:
+	best = request.accept_mimetypes.best_match(["application/json", *MSGPACK_TYPES])
+	return best if best in MSGPACK_TYPES else None
+
+
+# Compression
+
+class _Compressor:
+	"""Streaming gzip or brotli behind one interface"""
+
+	def __init__(self, coding: str, config) -> None:
+		self.coding = coding
+		if coding == "br":
+			self._brotli = brotli.Compressor(quality=config.get("COMPRESS_BROTLI_QUALITY", 5))
+		else:
+			# wbits=31: gzip container rather than raw zlib
+			self._zlib = zlib.compressobj(config.get("COMPRESS_LEVEL", 6), zlib.DEFLATED, 31)
+
+	def compress(self, data: bytes) -> bytes:
+		if self.coding == "br":
+			return self._brotli.process(data)
+		return self._zlib.compress(data)
+
+	def flush(self) -> bytes:
+		if self.coding == "br":
+			return self._brotli.finish()
+		return self._zlib.flush()
+
+
+def choose_encoding(accept_encodings) -> Optional[str]:
+	"""'br', 'gzip' or None for an Accept-Encoding header (werkzeug Accept)"""
+	gzip_q = accept_encodings["gzip"]
+	if brotli is not None and accept_encodings["br"] and accept_encodings["br"] >= gzip_q:
+		return "br"
+	return "gzip" if gzip_q else None
+
+
+def compress(data: bytes, coding: str, config) -> bytes:
+	compressor = _Compressor(coding, config)
+	return compressor.compress(data) + compressor.flush()
+
+
+def _compress_stream(chunks: Iterable[bytes], original, compressor: _Compressor) -> Iterator[bytes]:
+	try:
+		for chunk in chunks:
+			data = compressor.compress(chunk)
+			if data:
+				yield data
+		yield compressor.flush()
+	finally:
+		# Lets stream_with_context pop its request context on early disconnects
+		close = getattr(original, "close", None)
+		if close is not None:
+			close()
+
+
+def _compressible(response: Response) -> bool:
+	mimetype = response.mimetype or ""
+	return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+def encode_response(response: Response) -> Response:
+	config = current_app.config
+	if response.direct_passthrough or "Content-Encoding" in response.headers:
+		return response
+
+	if response.mimetype == "application/json" and config.get("MSGPACK_ENABLED", True):
+		response.vary.add("Accept")
+		mimetype = None if response.is_streamed else _wants_msgpack()
+		if mimetype:
+			response.set_data(packb(json.loads(response.get_data())))
+			response.mimetype = mimetype
+
+	if not config.get("COMPRESS_ENABLED", True) or not _compressible(response):
+		return response
+	response.vary.add("Accept-Encoding")
+	if request.method == "HEAD" or response.status_code < 200 or response.status_code in (204, 206, 304):
+		return response
+	coding = choose_encoding(request.accept_encodings)
+	if coding is None:
+		return response
+
+	if response.is_streamed:
+		original = response.response
+		response.response = _compress_stream(response.iter_encoded(), original, _Compressor(coding, config))
+		response.headers.pop("Content-Length", None)
+	else:
+		data = response.get_data()
+		if len(data) < config.get("COMPRESS_MIN_BYTES", 512):
+			return response
+		response.set_data(compress(data, coding, config))
+	response.headers["Content-Encoding"] = coding
+	return response
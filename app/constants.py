@@ -80,6 +80,18 @@ PLAY_RESTRICTIONS = {
     'max_joy': 89  # Joy must be 89% or lower to play
 }
 
+# Timed Activities (one pet_activities row per kind while in progress)
+ACTIVITY_KINDS = ["sleep", "wash", "feed", "play"]
+
+# Stat History (per-pet ring buffers for charts): (tier, seconds per slot, slots)
+STAT_HISTORY_STATS = ["hunger", "happiness", "cleanliness", "energy"]
+# 1872 bytes per pet: small enough for two rows per 4 KiB SQLite page
+STAT_HISTORY_TIERS = [
+    ("minute", 60, 240),     # last 4 hours
+    ("hour", 3600, 168),     # last 7 days
+    ("day", 86400, 60)       # last 60 days
+]
+
 # Inventory Configuration
 INVENTORY_DEFAULTS = {
     'tree_seed': 5,
@@ -94,6 +106,11 @@ INVENTORY_LIMITS = {
     'coins_max': 10000    # Max coins
 }
 
+# Ledger encoding: items and reasons are stored as their index in these lists,
+# so only ever append to them
+LEDGER_ITEMS = ["coins", "tree_seed", "blueberries", "mushroom", "acorn"]
+LEDGER_REASONS = ["open", "adjust", "purchase", "refund", "feed", "higher_lower", "labyrinth"]
+
 # Shop Configuration
 SHOP_PRICES = {
     "tree_seed": 1,
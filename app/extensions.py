@@ -1,8 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 
+from .sharding import ShardedSession
 
-db = SQLAlchemy()
+
+# ShardedSession sends per-user tables to the pinned shard (see app/sharding.py)
+# and pinned GET reads to a replica (see app/replicas.py)
+db = SQLAlchemy(session_options={"class_": ShardedSession})
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 
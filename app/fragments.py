@@ -0,0 +1,69 @@
+"""
+Cached template fragments for pages that are mostly the same for everyone.
+
+The game page's body (game_body.html: menus, storage, shop, minigames and
+overlays) has no per-user values, so it is rendered once per variant,
+whitespace-collapsed and reused; game.html renders it with
+`{{ fragment("game_body.html", admin=...) }}` and passes the player's pet
+and inventory as a small JSON blob that main.js applies on load.
+
+Entries are keyed by the template file's mtime, the constants the fragment
+prints (FOOD_VALUES, SHOP_PRICES), the script root its URLs are built
+under and the variant arguments, so editing any of them renders it afresh.
+FRAGMENT_CACHE_ENABLED=False renders on every request instead.
+"""
+from __future__ import annotations
+
+import os
+import re
+
+from flask import current_app, request
+from markupsafe import Markup
+
+from .constants import FOOD_VALUES, SHOP_PRICES
+
+
+MAX_ENTRIES = 32
+
+_INDENT = re.compile(r"\n[ \t]+")
+_BLANK_LINES = re.compile(r"\n{2,}")
+_COMMENTS = re.compile(r"<!--.*?-->", re.S)
+
+
+def init_app(app) -> None:
+	app.extensions["fragment_cache"] = {}
+	app.jinja_env.globals["fragment"] = fragment
+
+
+def _constants() -> dict:
+	return {"food_values": FOOD_VALUES, "shop_prices": SHOP_PRICES}
+
+
+def collapse_whitespace(html: str) -> str:
+	"""Drop comments, indentation and blank lines (no <pre>/<textarea> in fragments)"""
+	html = _COMMENTS.sub("", html)
+	html = _INDENT.sub("\n", html)
+	return _BLANK_LINES.sub("\n", html).strip()
+
+
+def fragment(name: str, **variant) -> Markup:
+	"""Rendered template `name`, from the cache when nothing it depends on changed"""
+	template = current_app.jinja_env.get_template(name)
+	if not current_app.config.get("FRAGMENT_CACHE_ENABLED", True):
+		return Markup(template.render(**_constants(), **variant))
+
+	constants = _constants()
+	key = (
+		name, os.stat(template.filename).st_mtime_ns if template.filename else None,
+		request.script_root, tuple(sorted(variant.items())),
+		tuple((group, tuple(sorted(values.items()))) for group, values in constants.items()),
+	)
+	cache = current_app.extensions["fragment_cache"]
+	html = cache.get(key)
+	if html is None:
+		html = Markup(collapse_whitespace(template.render(**constants, **variant)))
+		if len(cache) >= MAX_ENTRIES:
+			# Only stale mtimes/constants pile up; start over rather than track age
+			cache.clear()
+		cache[key] = html
+	return html
@@ -0,0 +1,251 @@
+"""
+Idempotency keys for mutating game endpoints.
+
+Clients may send an `Idempotency-Key` header with POSTs. The first response
+for a (user, key) pair is stored for IDEMPOTENCY_WINDOW_SECONDS in the
+idempotency_keys table, fronted by a small in-memory LRU, and replayed for
+retries without re-running the view, so a flaky connection cannot feed or
+buy twice. A key is bound to a hash of the method, path and body of the
+request that first used it; reusing it for anything else is a 422.
+
+The key is claimed in the view's own transaction: a before_commit listener
+inserts a pending row (status 0) with the view's first commit, so the work
+and the claim commit together, and a concurrent request with the same key
+fails its commit on the unique constraint instead of doing the work again.
+The response is written into the claimed row once the view returns. A retry
+that finds the row still pending gets a 409.
+
+Only successful responses are stored. When the view raises or answers with
+an error status the claim is deleted in a transaction of its own, so the
+retry runs the view again instead of replaying the error or getting 409s
+for the rest of the window.
+"""
+from __future__ import annotations
+
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .clock import utcnow
+from .extensions import db
+from .models import IdempotencyRecord
+from .sharding import each_shard
+from .state_cache import LocalBackend
+
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 64
+PENDING = 0
+
+_CLAIM_KEY = "idempotency_claim"
+_listeners_registered = False
+
+
+def init_app(app) -> None:
+	app.extensions["idempotency_cache"] = LocalBackend(
+		max_bytes=app.config.get("IDEMPOTENCY_CACHE_MAX_BYTES", 8 * 1024 * 1024),
+		ttl=app.config.get("IDEMPOTENCY_WINDOW_SECONDS", 86400)
+	)
+	global _listeners_registered
+	if _listeners_registered:
+		return
+	event.listen(db.session, "before_commit", _before_commit)
+	event.listen(db.session, "after_commit", _after_commit)
+	event.listen(db.session, "after_rollback", _after_rollback)
+	_listeners_registered = True
+
+
+def _window() -> timedelta:
+	return timedelta(seconds=current_app.config.get("IDEMPOTENCY_WINDOW_SECONDS", 86400))
+
+
+def request_hash(req) -> str:
+	"""Fingerprint of the method, path (with query string) and body a key was first used for"""
+	digest = hashlib.sha256()
+	for part in (req.method.encode(), req.path.encode(), req.query_string, req.get_data(cache=True)):
+		digest.update(len(part).to_bytes(8, "big"))
+		digest.update(part)
+	return digest.hexdigest()
+
+
+def _lookup(user_id: int, key: str):
+	"""Return (request_hash, status_code, body) of a live record, or None"""
+	front = current_app.extensions["idempotency_cache"]
+	stored = front.get((user_id, key))
+	if stored is not None:
+		return stored
+	now = utcnow()
+	row = db.session.execute(
+		select(
+			IdempotencyRecord.request_hash, IdempotencyRecord.status_code,
+			IdempotencyRecord.body, IdempotencyRecord.created_at
+		)
+		.where(IdempotencyRecord.user_id == user_id, IdempotencyRecord.key == key)
+		.where(IdempotencyRecord.created_at >= now - _window())
+	).first()
+	if row is None:
+		return None
+	stored = (row.request_hash, row.status_code, bytes(row.body))
+	if row.status_code != PENDING:
+		remaining = (row.created_at + _window() - now).total_seconds()
+		front.set((user_id, key), stored, ttl=remaining)
+	return stored
+
+
+def _insert(connection, claim: dict, status_code: int, body: bytes) -> None:
+	"""Insert the record for a claim, replacing an expired one for the same key.
+
+	Raises IntegrityError when a live record exists (a concurrent request
+	stored it first).
+	"""
+	table = IdempotencyRecord.__table__
+	now = utcnow()
+	connection.execute(
+		delete(table)
+		.where(table.c.user_id == claim["user_id"], table.c.key == claim["key"])
+		.where(table.c.created_at < now - _window())
+	)
+	connection.execute(insert(table).values(
+		user_id=claim["user_id"], key=claim["key"], endpoint=claim["endpoint"],
+		request_hash=claim["request_hash"], status_code=status_code, body=body, created_at=now
+	))
+
+
+def _before_commit(session) -> None:
+	claim = session.info.get(_CLAIM_KEY)
+	if claim is None or claim["reserved"]:
+		return
+	# The user's shard, pinned for the request (see app/sharding.py)
+	connection = session.connection(bind_arguments={"mapper": IdempotencyRecord})
+	try:
+		_insert(connection, claim, PENDING, b"")
+	except IntegrityError:
+		claim["conflict"] = True
+		raise
+	claim["reserved"] = True
+
+
+def _after_commit(session) -> None:
+	claim = session.info.get(_CLAIM_KEY)
+	if claim is not None and claim["reserved"]:
+		claim["committed"] = True
+
+
+def _after_rollback(session) -> None:
+	claim = session.info.get(_CLAIM_KEY)
+	if claim is not None and not claim["committed"]:
+		claim["reserved"] = False
+
+
+def _store(claim: dict, response) -> None:
+	status_code, body = response.status_code, response.get_data()
+	if claim["committed"]:
+		table = IdempotencyRecord.__table__
+		db.session.execute(
+			update(table)
+			.where(table.c.user_id == claim["user_id"], table.c.key == claim["key"])
+			.values(status_code=status_code, body=body)
+		)
+		db.session.commit()
+	else:
+		# The view committed nothing; store its answer on its own
+		try:
+			_insert(db.session.connection(bind_arguments={"mapper": IdempotencyRecord}), claim, status_code, body)
+			db.session.commit()
+		except IntegrityError:
+			# A live record: a concurrent request (another worker) stored this key first
+			db.session.rollback()
+			return
+	current_app.extensions["idempotency_cache"].set(
+		(claim["user_id"], claim["key"]), (claim["request_hash"], status_code, body)
+	)
+
+
+def _release(claim: dict) -> None:
+	"""Delete a claim the view committed but did not complete, so a retry can run"""
+	db.session.rollback()
+	if not claim["committed"]:
+		return
+	table = IdempotencyRecord.__table__
+	db.session.execute(
+		delete(table)
+		.where(table.c.user_id == claim["user_id"], table.c.key == claim["key"])
+		.where(table.c.status_code == PENDING)
+	)
+	db.session.commit()
+
+
+def _replay(stored, fingerprint: str):
+	stored_hash, status_code, body = stored
+	# Records stored before request hashes were kept have none
+	if stored_hash is not None and stored_hash != fingerprint:
+		return jsonify({"error": f"{HEADER} was already used for a different request"}), 422
+	if status_code == PENDING:
+		return jsonify({"error": f"A request with this {HEADER} is still in progress or did not finish"}), 409
+	response = current_app.response_class(body, status=status_code, mimetype="application/json")
+	response.headers["Idempotent-Replayed"] = "true"
+	return response
+
+
+def idempotent(view):
+	"""Replay the stored response for a repeated Idempotency-Key instead of re-running the view"""
+	@wraps(view)
+	def wrapper(*args, **kwargs):
+		key = request.headers.get(HEADER)
+		if not key:
+			return view(*args, **kwargs)
+		if len(key) > MAX_KEY_LENGTH:
+			return jsonify({"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"}), 400
+
+		user_id = current_user.id
+		fingerprint = request_hash(request)
+		stored = _lookup(user_id, key)
+		if stored is not None:
+			return _replay(stored, fingerprint)
+
+		claim = {
+			"user_id": user_id, "key": key, "endpoint": request.endpoint, "request_hash": fingerprint,
+			"reserved": False, "committed": False, "conflict": False,
+		}
+		db.session.info[_CLAIM_KEY] = claim
+		try:
+			response = current_app.make_response(view(*args, **kwargs))
+		except IntegrityError:
+			db.session.info.pop(_CLAIM_KEY, None)
+			if not claim["conflict"]:
+				_release(claim)
+				raise
+			# A concurrent request claimed the key first; this one's work was rolled back
+			db.session.rollback()
+			stored = _lookup(user_id, key)
+			if stored is None:
+				raise
+			return _replay(stored, fingerprint)
+		except Exception:
+			db.session.info.pop(_CLAIM_KEY, None)
+			_release(claim)
+			raise
+		db.session.info.pop(_CLAIM_KEY, None)
+
+		if response.status_code >= 400:
+			_release(claim)
+		else:
+			_store(claim, response)
+		return response
+	return wrapper
+
+
+def purge_expired(now=None) -> int:
+	"""Delete stored responses older than the replay window; returns rows removed"""
+	cutoff = (now or utcnow()) - _window()
+	removed = 0
+	for _ in each_shard():
+		result = db.session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.created_at < cutoff))
+		db.session.commit()
+		removed += result.rowcount
+	return removed
@@ -0,0 +1,349 @@
+"""
+Deferred work: a durable job queue in a local SQLite file plus worker threads.
+
+Views call defer(kind, **payload) for work the player doesn't need to wait
+for. Inside a transaction the job is held on the session and written to the
+queue after the commit (dropped on rollback), so workers never see work for
+data that didn't commit; outside one it is written straight away. If the
+queue can't be written after the commit, the jobs are logged and counted as
+dropped rather than failing a request whose write already happened.
+
+Workers claim jobs in batches with a lease (a claimed job's run_at moves to
+the end of its lease, so a crashed worker's jobs are picked up again), run
+the function registered with @handler(kind) in an app context and commit,
+then ack (delete) the batch. A failing job is rescheduled with exponential
+backoff and kept as dead after JOB_MAX_ATTEMPTS tries.
+Handlers in modules not loaded at startup are found through
+HANDLER_MODULES, which maps a kind's prefix to the module registering it.
+
+Workers are either in-process threads (JOB_WORKER_THREADS, started on the
+first enqueue) or a separate pool started with `flask jobs-worker`; any
+number of them can share one queue file.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter, namedtuple
+from importlib import import_module
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from .extensions import db
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+	id INTEGER PRIMARY KEY,
+	kind TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	run_at REAL NOT NULL,
+	created_at REAL NOT NULL,
+	claimed_by TEXT,
+	last_error TEXT,
+	dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_ready ON jobs (run_at) WHERE dead = 0;
+"""
+
+Job = namedtuple("Job", ["id", "kind", "payload", "attempts"])
+
+_handlers: Dict[str, Callable] = {}
+# Modules whose @handler kinds ("<prefix>.<name>") register on first use rather than at startup
+HANDLER_MODULES = {"access_request": ".access_queue"}
+_PENDING_KEY = "jobs_pending"
+_listeners_registered = False
+
+
+def handler(kind: str):
+	"""Register the function that runs jobs of this kind (called with the payload as kwargs)"""
+	def register(fn):
+		_handlers[kind] = fn
+		return fn
+	return register
+
+
+def handler_for(kind: str) -> Callable:
+	"""Registered function for `kind`, importing its module first if needed; KeyError if none"""
+	if kind not in _handlers and kind.split(".", 1)[0] in HANDLER_MODULES:
+		import_module(HANDLER_MODULES[kind.split(".", 1)[0]], __package__)
+	try:
+		return _handlers[kind]
+	except KeyError:
+		raise KeyError(f"No job handler for {kind!r}") from None
+
+
+class JobQueue:
+	"""Jobs table in its own SQLite file; one connection per thread"""
+
+	def __init__(self, path: str, lease: float = 60.0, max_attempts: int = 5,
+			backoff: float = 2.0, max_backoff: float = 600.0):
+		self.path = path
+		self.lease = lease
+		self.max_attempts = max_attempts
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self.counters = Counter()
+
+	def _connect(self) -> sqlite3.Connection:
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+			conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			conn.executescript(_SCHEMA)
+			self._local.conn = conn
+		return conn
+
+	def _count(self, name: str, amount: int) -> None:
+		with self._lock:
+			self.counters[name] += amount
+
+	def put_many(self, jobs: Iterable[Tuple[str, dict]], delay: float = 0.0) -> int:
+		now = time.time()
+		rows = [(kind, json.dumps(payload, separators=(",", ":")), now + delay, now) for kind, payload in jobs]
+		if rows:
+			conn = self._connect()
+			conn.execute("BEGIN IMMEDIATE")
+			try:
+				conn.executemany("INSERT INTO jobs (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)", rows)
+				conn.execute("COMMIT")
+			except BaseException:
+				# SQLite may already have rolled back (e.g. disk full)
+				if conn.in_transaction:
+					conn.execute("ROLLBACK")
+				raise
+			self._count("enqueued", len(rows))
+		return len(rows)
+
+	def put(self, kind: str, payload: dict, delay: float = 0.0) -> None:
+		self.put_many([(kind, payload)], delay)
+
+	def claim(self, worker: str, limit: int = 100) -> List[Job]:
+		"""Lease up to `limit` ready jobs, oldest first"""
+		now = time.time()
+		conn = self._connect()
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			rows = conn.execute(
+				"UPDATE jobs SET claimed_by = ?, run_at = ?, attempts = attempts + 1 WHERE id IN ("
+				"SELECT id FROM jobs WHERE dead = 0 AND run_at <= ? ORDER BY run_at LIMIT ?"
+				") RETURNING id, kind, payload, attempts",
+				(worker, now + self.lease, now, limit)
+			).fetchall()
+			conn.execute("COMMIT")
+		except BaseException:
+			conn.execute("ROLLBACK")
+			raise
+		return [Job(job_id, kind, json.loads(payload), attempts) for job_id, kind, payload, attempts in rows]
+
+	def ack(self, ids: List[int]) -> None:
+		if ids:
+			conn = self._connect()
+			conn.execute("BEGIN IMMEDIATE")
+			conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+			conn.execute("COMMIT")
+			self._count("acked", len(ids))
+
+	def fail(self, job: Job, error: str) -> bool:
+		"""Reschedule a failed job with backoff; returns False once it is dead"""
+		if job.attempts >= self.max_attempts:
+			self._connect().execute(
+				"UPDATE jobs SET dead = 1, claimed_by = NULL, last_error = ? WHERE id = ?", (error, job.id)
+			)
+			self._count("dead", 1)
+			return False
+		delay = min(self.max_backoff, self.backoff * 2 ** (job.attempts - 1)) * random.uniform(0.5, 1.0)
+		self._connect().execute(
+			"UPDATE jobs SET run_at = ?, claimed_by = NULL, last_error = ? WHERE id = ?",
+			(time.time() + delay, error, job.id)
+		)
+		self._count("retried", 1)
+		return True
+
+	def requeue_dead(self) -> int:
+		return self._connect().execute(
+			"UPDATE jobs SET dead = 0, attempts = 0, run_at = ? WHERE dead = 1", (time.time(),)
+		).rowcount
+
+	def stats(self) -> dict:
+		now = time.time()
+		ready, delayed, running, dead, oldest = self._connect().execute(
+			"SELECT "
+			"COALESCE(SUM(dead = 0 AND run_at <= ?), 0), "
+			"COALESCE(SUM(dead = 0 AND run_at > ? AND claimed_by IS NULL), 0), "
+			"COALESCE(SUM(dead = 0 AND run_at > ? AND claimed_by IS NOT NULL), 0), "
+			"COALESCE(SUM(dead), 0), "
+			"MIN(CASE WHEN dead = 0 AND run_at <= ? THEN created_at END) "
+			"FROM jobs", (now, now, now, now)
+		).fetchone()
+		with self._lock:
+			counters = dict(self.counters)
+		return {
+			"ready": ready, "delayed": delayed, "running": running, "dead": dead,
+			"oldest_ready_seconds": round(now - oldest, 1) if oldest else 0.0,
+			"this_process": counters,
+		}
+
+
+class WorkerPool:
+	"""Threads that drain a JobQueue, running each job in an app context"""
+
+	def __init__(self, app, queue: JobQueue, threads: int = 1, batch: int = 50, poll_interval: float = 1.0):
+		self.app = app
+		self.queue = queue
+		self.threads = threads
+		self.batch = batch
+		self.poll_interval = poll_interval
+		self._wake = threading.Event()
+		self._stop = threading.Event()
+		self._workers: List[threading.Thread] = []
+		self._lock = threading.Lock()
+		self.processed = Counter()
+		self.failed = Counter()
+		self.busy_seconds = 0.0
+
+	def start(self) -> None:
+		for n in range(self.threads):
+			worker = threading.Thread(target=self._run, args=(f"{os.getpid()}-{n}",), daemon=True, name=f"jobs-{n}")
+			worker.start()
+			self._workers.append(worker)
+
+	def wake(self) -> None:
+		self._wake.set()
+
+	def stop(self, timeout: Optional[float] = None) -> None:
+		self._stop.set()
+		self._wake.set()
+		for worker in self._workers:
+			worker.join(timeout)
+
+	def run_once(self, worker: str) -> int:
+		"""Claim and run one batch; returns the number of jobs claimed"""
+		jobs = self.queue.claim(worker, self.batch)
+		if not jobs:
+			return 0
+		started = time.perf_counter()
+		done, processed, failed = [], Counter(), Counter()
+		with self.app.app_context():
+			for job in jobs:
+				try:
+					handler_for(job.kind)(**job.payload)
+					db.session.commit()
+				except Exception as e:
+					db.session.rollback()
+					failed[job.kind] += 1
+					self.queue.fail(job, f"{type(e).__name__}: {e}")
+					print(f"JOB ERROR: {job.kind} #{job.id} attempt {job.attempts}: {e}")
+				else:
+					done.append(job.id)
+					processed[job.kind] += 1
+		self.queue.ack(done)
+		with self._lock:
+			self.processed.update(processed)
+			self.failed.update(failed)
+			self.busy_seconds += time.perf_counter() - started
+		return len(jobs)
+
+	def _run(self, worker: str) -> None:
+		while not self._stop.is_set():
+			try:
+				claimed = self.run_once(worker)
+			except sqlite3.OperationalError as e:
+				print(f"JOB ERROR: queue unavailable: {e}")
+				claimed = 0
+			if not claimed:
+				self._wake.wait(self.poll_interval)
+				self._wake.clear()
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"threads": self.threads,
+				"processed": dict(self.processed),
+				"failed": dict(self.failed),
+				"busy_seconds": round(self.busy_seconds, 3),
+			}
+
+
+def init_app(app) -> None:
+	path = app.config.get("JOB_QUEUE_PATH") or os.path.join(app.instance_path, "jobs.sqlite")
+	app.extensions["job_queue"] = JobQueue(
+		path,
+		lease=app.config.get("JOB_LEASE_SECONDS", 60.0),
+		max_attempts=app.config.get("JOB_MAX_ATTEMPTS", 5),
+		backoff=app.config.get("JOB_BACKOFF_SECONDS", 2.0)
+	)
+	app.extensions["job_workers"] = None
+	global _listeners_registered
+	if _listeners_registered:
+		return
+	event.listen(db.session, "after_commit", _after_commit)
+	event.listen(db.session, "after_soft_rollback", _after_soft_rollback)
+	_listeners_registered = True
+
+
+def job_queue() -> JobQueue:
+	return current_app.extensions["job_queue"]
+
+
+def _in_process_workers(app) -> Optional[WorkerPool]:
+	pool = app.extensions.get("job_workers")
+	threads = app.config.get("JOB_WORKER_THREADS", 0)
+	if pool is None and threads > 0:
+		pool = WorkerPool(
+			app, app.extensions["job_queue"], threads=threads,
+			batch=app.config.get("JOB_BATCH_SIZE", 50), poll_interval=app.config.get("JOB_POLL_SECONDS", 1.0)
+		)
+		app.extensions["job_workers"] = pool
+		pool.start()
+	return pool
+
+
+def enqueue(jobs: List[Tuple[str, dict]]) -> None:
+	"""Write jobs to the queue now and nudge this process's workers"""
+	app = current_app._get_current_object()
+	app.extensions["job_queue"].put_many(jobs)
+	pool = _in_process_workers(app)
+	if pool is not None:
+		pool.wake()
+
+
+def defer(kind: str, **payload) -> None:
+	"""Run _handlers[kind](**payload) on a worker once the current transaction commits"""
+	handler_for(kind)
+	if db.session().in_transaction():
+		db.session.info.setdefault(_PENDING_KEY, []).append((kind, payload))
+	else:
+		enqueue([(kind, payload)])
+
+
+def _after_commit(session) -> None:
+	pending = session.info.pop(_PENDING_KEY, None)
+	if pending and has_app_context():
+		# The caller's write has committed; a queue failure must not turn it into an error response
+		try:
+			enqueue(pending)
+		except (sqlite3.Error, OSError) as e:
+			job_queue()._count("dropped", len(pending))
+			kinds = ", ".join(sorted({kind for kind, _ in pending}))
+			print(f"JOB ERROR: enqueue after commit failed, {len(pending)} job(s) dropped ({kinds}): {e}")
+
+
+def _after_soft_rollback(session, previous_transaction) -> None:
+	session.info.pop(_PENDING_KEY, None)
+
+
+def stats() -> dict:
+	pool = current_app.extensions.get("job_workers")
+	return {"queue": job_queue().stats(), "workers": pool.stats() if pool else None}
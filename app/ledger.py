@@ -0,0 +1,320 @@
+"""
+Append-only coin and food ledger.
+
+Every change to an Inventory's coins or food is written to ledger_entries in
+the transaction that makes it: Inventory methods queue (item, delta, reason)
+on the session, and on flush the queue is inserted with one executemany,
+plus an "adjust" entry for any change made without those methods. Items and reasons are stored as small integers (their index in
+LEDGER_ITEMS / LEDGER_REASONS).
+
+Entries are keyed (owner_id, seq), seq counting each owner's entries
+(Inventory.ledger_seq). Every SNAPSHOT_EVERY entries a ledger_snapshots row
+records all of the owner's balances, so the balance at any time is one index
+seek for the snapshot before it plus at most SNAPSHOT_EVERY entries.
+
+An owner's ledger opens on the first change to their inventory, with "open"
+entries for the balances it had, so bulk-inserted and pre-existing
+inventories need no backfill. `flask ledger-reconcile` checks that entries
+sum to every inventory's balances and that snapshots agree with entries.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, insert, inspect, select, text
+
+from .clock import utcnow
+from .constants import INVENTORY_DEFAULTS, LEDGER_ITEMS, LEDGER_REASONS
+from .extensions import db
+from .models import LEDGER_PENDING_KEY, Inventory, LedgerEntry, LedgerSnapshot
+
+
+SNAPSHOT_EVERY = 64
+
+ITEM_CODES = {item: code for code, item in enumerate(LEDGER_ITEMS)}
+REASON_CODES = {reason: code for code, reason in enumerate(LEDGER_REASONS)}
+
+_ROWS_KEY = "ledger_rows"
+_listeners_registered = False
+
+
+def _entries_for(inventory: Inventory, recorded: list, now: datetime):
+	"""Ledger rows and optional snapshot for one inventory's changes in this flush"""
+	state = inspect(inventory)
+	is_new = state.pending
+	before, after = {}, {}
+	for item in LEDGER_ITEMS:
+		value = getattr(inventory, item)
+		if value is None:
+			# Column defaults are applied at INSERT; the opening entries need them now
+			value = INVENTORY_DEFAULTS[item]
+			setattr(inventory, item, value)
+		after[item] = value
+		if not is_new:
+			history = state.attrs[item].history
+			before[item] = history.deleted[0] if history.deleted else value
+
+	if not is_new and not recorded and before == after:
+		return [], None
+
+	explained = dict.fromkeys(LEDGER_ITEMS, 0)
+	for item, delta, _ in recorded:
+		explained[item] += delta
+
+	rows = []
+	first_seq = inventory.ledger_seq or 0
+	opening = first_seq == 0
+	if opening:
+		for item in LEDGER_ITEMS:
+			rows.append((item, after[item] - explained[item] if is_new else before[item], "open"))
+	rows.extend(recorded)
+	if not is_new:
+		for item in LEDGER_ITEMS:
+			unexplained = after[item] - before[item] - explained[item]
+			if unexplained:
+				rows.append((item, unexplained, "adjust"))
+
+	seq = first_seq
+	entries = []
+	for item, delta, reason in rows:
+		seq += 1
+		entries.append({
+			"owner_id": inventory.owner_id, "seq": seq, "item": ITEM_CODES[item],
+			"delta": delta, "reason": REASON_CODES[reason], "created_at": now,
+		})
+	inventory.ledger_seq = seq
+
+	snapshot = None
+	if opening or seq // SNAPSHOT_EVERY != first_seq // SNAPSHOT_EVERY:
+		snapshot = {"owner_id": inventory.owner_id, "seq": seq, "created_at": now, **after}
+	return entries, snapshot
+
+
+def _before_flush(session, flush_context, instances) -> None:
+	pending = session.info.pop(LEDGER_PENDING_KEY, None) or []
+	if not has_app_context() or not current_app.config.get("LEDGER_ENABLED", True):
+		return
+
+	by_inventory = {}
+	for inventory, item, delta, reason in pending:
+		by_inventory.setdefault(inventory, []).append((item, delta, reason))
+	for obj in (*session.new, *session.dirty):
+		if isinstance(obj, Inventory):
+			by_inventory.setdefault(obj, [])
+	if not by_inventory:
+		return
+
+	now = utcnow()
+	entries, snapshots = [], []
+	for inventory, recorded in by_inventory.items():
+		if inventory in session.deleted or inventory.owner_id is None:
+			continue
+		rows, snapshot = _entries_for(inventory, recorded, now)
+		entries.extend(rows)
+		if snapshot:
+			snapshots.append(snapshot)
+
+	if entries:
+		session.info[_ROWS_KEY] = (entries, snapshots)
+
+
+def _after_flush(session, flush_context) -> None:
+	# Inserted after the flush so new users/inventories exist for the foreign keys;
+	# Core statements on the flush's connection: same transaction, no autoflush
+	rows = session.info.pop(_ROWS_KEY, None)
+	if rows is None:
+		return
+	entries, snapshots = rows
+	# The inventories' shard (see app/sharding.py)
+	connection = session.connection(bind_arguments={"mapper": LedgerEntry})
+	connection.execute(insert(LedgerEntry.__table__), entries)
+	if snapshots:
+		connection.execute(insert(LedgerSnapshot.__table__), snapshots)
+
+
+def _after_rollback(session) -> None:
+	session.info.pop(LEDGER_PENDING_KEY, None)
+	session.info.pop(_ROWS_KEY, None)
+
+
+def balance_at(owner_id: int, at: Optional[datetime] = None) -> Optional[Dict[str, int]]:
+	"""owner_id's balances at time `at` (now if None); None without an inventory"""
+	inventory = db.session.scalar(select(Inventory).where(Inventory.owner_id == owner_id))
+	if inventory is None:
+		return None
+	if at is None or not inventory.ledger_seq:
+		return {item: getattr(inventory, item) for item in LEDGER_ITEMS}
+
+	snapshot = db.session.scalar(
+		select(LedgerSnapshot)
+		.where(LedgerSnapshot.owner_id == owner_id, LedgerSnapshot.created_at <= at)
+		.order_by(LedgerSnapshot.created_at.desc(), LedgerSnapshot.seq.desc()).limit(1)
+	)
+	if snapshot is None:
+		# Before the ledger opened the balances were the opening ones
+		balances = dict.fromkeys(LEDGER_ITEMS, 0)
+		opening = db.session.execute(
+			select(LedgerEntry.item, LedgerEntry.delta)
+			.where(LedgerEntry.owner_id == owner_id, LedgerEntry.seq <= len(LEDGER_ITEMS))
+		)
+		for item, delta in opening:
+			balances[LEDGER_ITEMS[item]] += delta
+		return balances
+
+	balances = {item: getattr(snapshot, item) for item in LEDGER_ITEMS}
+	# Entries between this snapshot and the next one, up to `at`
+	next_seq = db.session.scalar(
+		select(db.func.min(LedgerSnapshot.seq))
+		.where(LedgerSnapshot.owner_id == owner_id, LedgerSnapshot.seq > snapshot.seq)
+	)
+	stmt = (
+		select(LedgerEntry.item, db.func.sum(LedgerEntry.delta))
+		.where(LedgerEntry.owner_id == owner_id, LedgerEntry.seq > snapshot.seq, LedgerEntry.created_at <= at)
+		.group_by(LedgerEntry.item)
+	)
+	if next_seq is not None:
+		stmt = stmt.where(LedgerEntry.seq <= next_seq)
+	for item, delta in db.session.execute(stmt):
+		balances[LEDGER_ITEMS[item]] += delta
+	return balances
+
+
+def history(owner_id: int, limit: int = 50, before_seq: Optional[int] = None) -> List[dict]:
+	"""owner_id's newest entries (older than before_seq), decoded"""
+	stmt = select(LedgerEntry).where(LedgerEntry.owner_id == owner_id)
+	if before_seq is not None:
+		stmt = stmt.where(LedgerEntry.seq < before_seq)
+	entries = db.session.scalars(stmt.order_by(LedgerEntry.seq.desc()).limit(limit))
+	return [
+		{
+			"seq": entry.seq, "item": LEDGER_ITEMS[entry.item], "delta": entry.delta,
+			"reason": LEDGER_REASONS[entry.reason], "created_at": entry.created_at.isoformat(),
+		}
+		for entry in entries
+	]
+
+
+def _sum_columns(prefix: str = "") -> str:
+	return ", ".join(
+		f"SUM(CASE WHEN {prefix}item = {code} THEN {prefix}delta ELSE 0 END) AS {item}"
+		for code, item in enumerate(LEDGER_ITEMS)
+	)
+
+
+def reconcile(limit: int = 20) -> dict:
+	"""Check the ledger against inventories and snapshots.
+
+	Each owner's entries must be numbered 1..ledger_seq without gaps and sum to
+	the inventory's balances; each snapshot must equal the previous one plus
+	the entries between them. One grouped scan of ledger_entries in primary
+	key order for the balances, one primary-key range per snapshot; returns
+	counts plus up to `limit` examples of each kind of mismatch. Checks the
+	pinned shard (see app/sharding.py); merge per-shard reports with
+	merge_reports().
+	"""
+	on_shard = {"mapper": LedgerEntry}
+	per_owner = (
+		f"SELECT owner_id, COUNT(*) AS entries, MAX(seq) AS last_seq, {_sum_columns()} "
+		f"FROM ledger_entries GROUP BY owner_id"
+	)
+	differs = " OR ".join(f"l.{item} != i.{item}" for item in LEDGER_ITEMS)
+	mismatch = f"i.owner_id IS NOT NULL AND (l.entries != i.ledger_seq OR l.last_seq != i.ledger_seq OR {differs})"
+	owners, entries, orphans, bad_balances = db.session.execute(text(
+		f"SELECT COUNT(*), COALESCE(SUM(l.entries), 0), "
+		f"COALESCE(SUM(CASE WHEN i.owner_id IS NULL THEN 1 ELSE 0 END), 0), "
+		f"COALESCE(SUM(CASE WHEN {mismatch} THEN 1 ELSE 0 END), 0) "
+		f"FROM ({per_owner}) l LEFT JOIN inventories i ON i.owner_id = l.owner_id"
+	), bind_arguments=on_shard).one()
+	# Opened ledgers whose entries are gone entirely
+	missing = db.session.execute(text(
+		"SELECT COUNT(*) FROM inventories i WHERE i.ledger_seq > 0 AND NOT EXISTS "
+		"(SELECT 1 FROM ledger_entries e WHERE e.owner_id = i.owner_id)"
+	), bind_arguments=on_shard).scalar()
+
+	balance_examples = []
+	if bad_balances:
+		rows = db.session.execute(text(
+			f"SELECT i.owner_id, i.ledger_seq, l.entries, l.last_seq, "
+			f"{', '.join(f'i.{item}, l.{item}' for item in LEDGER_ITEMS)} "
+			f"FROM ({per_owner}) l JOIN inventories i ON i.owner_id = l.owner_id WHERE {mismatch} LIMIT :limit"
+		), {"limit": limit}, bind_arguments=on_shard).all()
+		balance_examples = [
+			{
+				"owner_id": row[0], "ledger_seq": row[1], "entries": row[2], "last_seq": row[3],
+				**{
+					item: (row[4 + 2 * n], row[5 + 2 * n])
+					for n, item in enumerate(LEDGER_ITEMS) if row[4 + 2 * n] != row[5 + 2 * n]
+				},
+			}
+			for row in rows
+		]
+
+	# Each snapshot minus the previous one must equal the entries in between
+	window = "OVER (PARTITION BY owner_id ORDER BY seq)"
+	steps = ", ".join(f"{item} - LAG({item}, 1, 0) {window} AS {item}" for item in LEDGER_ITEMS)
+	sums = ", ".join(
+		f"COALESCE(SUM(CASE WHEN e.item = {code} THEN e.delta ELSE 0 END), 0)" for code, _ in enumerate(LEDGER_ITEMS)
+	)
+	bad_snapshots = db.session.execute(text(
+		f"SELECT s.owner_id, s.seq FROM (SELECT owner_id, seq, LAG(seq, 1, 0) {window} AS prev_seq, {steps} "
+		f"FROM ledger_snapshots) s "
+		f"WHERE (s.seq - s.prev_seq, {', '.join(f's.{item}' for item in LEDGER_ITEMS)}) != "
+		f"(SELECT COUNT(*), {sums} FROM ledger_entries e "
+		f"WHERE e.owner_id = s.owner_id AND e.seq > s.prev_seq AND e.seq <= s.seq)"
+	), bind_arguments=on_shard).all()
+	snapshot_count = db.session.execute(text("SELECT COUNT(*) FROM ledger_snapshots"), bind_arguments=on_shard).scalar()
+
+	return {
+		"entries": entries,
+		"owners": owners,
+		"snapshots": snapshot_count,
+		"balance_mismatches": bad_balances + missing,
+		"snapshot_mismatches": len(bad_snapshots),
+		"orphan_owners": orphans,
+		"examples": {
+			"balances": balance_examples,
+			"snapshots": [tuple(row) for row in bad_snapshots[:limit]],
+		},
+		"ok": not bad_balances and not missing and not bad_snapshots,
+	}
+
+
+def merge_reports(reports: List[dict], limit: int = 20) -> dict:
+	"""One report from the reconcile() of each shard"""
+	merged = {
+		key: sum(report[key] for report in reports)
+		for key in ("entries", "owners", "snapshots", "balance_mismatches", "snapshot_mismatches", "orphan_owners")
+	}
+	merged["examples"] = {
+		kind: [example for report in reports for example in report["examples"][kind]][:limit]
+		for kind in ("balances", "snapshots")
+	}
+	merged["ok"] = all(report["ok"] for report in reports)
+	return merged
+
+
+def format_report(report: dict) -> str:
+	lines = [
+		f"Entries: {report['entries']} for {report['owners']} owners, {report['snapshots']} snapshots",
+		f"Balance mismatches: {report['balance_mismatches']}",
+		f"Snapshot mismatches: {report['snapshot_mismatches']}",
+		f"Owners with entries but no inventory: {report['orphan_owners']}",
+	]
+	for example in report["examples"]["balances"]:
+		lines.append(f"  owner {example['owner_id']}: {example}")
+	for owner_id, seq in report["examples"]["snapshots"]:
+		lines.append(f"  snapshot owner {owner_id} seq {seq} disagrees with entries")
+	lines.append("OK" if report["ok"] else "MISMATCH")
+	return "\n".join(lines)
+
+
+def init_app(app) -> None:
+	global _listeners_registered
+	if _listeners_registered:
+		return
+	event.listen(db.session, "before_flush", _before_flush)
+	event.listen(db.session, "after_flush", _after_flush)
+	event.listen(db.session, "after_rollback", _after_rollback)
+	_listeners_registered = True
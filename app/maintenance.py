@@ -0,0 +1,415 @@
+"""
+SQLite maintenance: online backups, incremental vacuum and query-planner
+statistics, run on a schedule by `flask db-maintenance --every N`.
+
+Tasks, per database (the primary and every shard):
+
+	backup    copy with the online backup API, MAINTENANCE_BACKUP_STEP_PAGES
+	          pages per step and a pause between steps, into
+	          MAINTENANCE_BACKUP_DIR (keeping the newest MAINTENANCE_BACKUP_KEEP)
+	vacuum    PRAGMA incremental_vacuum in short steps until the free list is
+	          empty or MAINTENANCE_VACUUM_BUDGET_SECONDS is spent
+	optimize  PRAGMA optimize (re-analyzes tables whose statistics are stale)
+	analyze   a full ANALYZE, bounded by PRAGMA analysis_limit
+
+Each run is recorded in maintenance_runs; a task is due once its
+MAINTENANCE_<TASK>_SECONDS have passed since its last successful run (0
+turns it off). `flask db-report` shows free pages, file sizes and time
+spent.
+
+Writers and backups: in WAL mode (SQLITE_JOURNAL_MODE=wal) the backup
+copies one read snapshot step by step and never blocks writers. With the
+default rollback journal each step only holds a read lock for itself, but
+any write by another connection restarts the copy. A step that makes no
+progress counts as a restart, and busy steps count against a cap of
+(MAINTENANCE_BACKUP_MAX_RESTARTS + 2) passes over the file; past either
+limit the copy is redone in one step, holding writers off for that step
+(reported as blocked_seconds).
+
+New database files are created with auto_vacuum=INCREMENTAL; existing ones
+need a one-off full VACUUM (`flask db-maintenance --enable-incremental-vacuum`)
+before incremental vacuum does anything. Other databases: ANALYZE runs for
+the analyze task, the rest is left to the server (autovacuum, pg_dump).
+"""
+from __future__ import annotations
+
+import glob
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import func, select, text
+
+from .clock import utcnow
+from .extensions import db
+from .models import MaintenanceRun
+
+
+TASKS = ("backup", "vacuum", "optimize", "analyze")
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+class _TooManyRestarts(Exception):
+	pass
+
+
+def databases() -> List[Tuple[str, object]]:
+	"""(name, engine) of the primary and every shard"""
+	keys = current_app.extensions.get("shards") or [None]
+	return [(key or "primary", db.engines[key]) for key in keys]
+
+
+def sqlite_path(engine) -> Optional[str]:
+	"""File behind a SQLite engine; None for other databases and in-memory ones"""
+	if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+		return None
+	return engine.url.database
+
+
+def _connect(path: str) -> sqlite3.Connection:
+	return sqlite3.connect(path, timeout=30.0, isolation_level=None)
+
+
+def _pragma(conn: sqlite3.Connection, name: str):
+	return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def prepare_databases(app) -> None:
+	"""New files get auto_vacuum=INCREMENTAL; apply SQLITE_JOURNAL_MODE if set.
+
+	Runs before the tables are created (auto_vacuum can only be chosen for an
+	empty database).
+	"""
+	journal_mode = app.config.get("SQLITE_JOURNAL_MODE")
+	for name, engine in databases():
+		path = sqlite_path(engine)
+		if path is None:
+			continue
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		conn = _connect(path)
+		try:
+			if _pragma(conn, "page_count") == 0:
+				conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+				conn.execute("VACUUM")
+			if journal_mode and _pragma(conn, "journal_mode") != journal_mode.lower():
+				mode = conn.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0]
+				print(f"MAINTENANCE DEBUG: {name} journal_mode={mode}")
+		finally:
+			conn.close()
+
+
+def file_stats(path: str) -> dict:
+	"""Size, pages and free-list fragmentation of one database file"""
+	conn = _connect(path)
+	try:
+		page_size, pages, free = (_pragma(conn, name) for name in ("page_size", "page_count", "freelist_count"))
+		stats = {
+			"path": path,
+			"bytes": os.path.getsize(path),
+			"wal_bytes": os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0,
+			"page_size": page_size,
+			"pages": pages,
+			"free_pages": free,
+			"free_ratio": round(free / pages, 4) if pages else 0.0,
+			"auto_vacuum": AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"), "?"),
+			"journal_mode": _pragma(conn, "journal_mode"),
+		}
+	finally:
+		conn.close()
+	return stats
+
+
+def table_stats(path: str) -> List[dict]:
+	"""Pages and unused bytes per table/index from dbstat (reads every page)"""
+	conn = _connect(path)
+	try:
+		rows = conn.execute(
+			"SELECT name, COUNT(*), SUM(pgsize), SUM(unused) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC"
+		).fetchall()
+	finally:
+		conn.close()
+	return [
+		{"name": name, "pages": pages, "bytes": size, "unused_ratio": round(unused / size, 4) if size else 0.0}
+		for name, pages, size, unused in rows
+	]
+
+
+# Tasks on one SQLite file
+
+def backup(path: str, dest: str, step_pages: int = 1024, pause: float = 0.05,
+		max_restarts: int = 3, verify: bool = False) -> dict:
+	"""Online copy of `path` to `dest` in steps of `step_pages` pages"""
+	os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+	partial = dest + ".part"
+	if os.path.exists(partial):
+		os.remove(partial)
+	src, dst = _connect(path), sqlite3.connect(partial)
+	snapshot = _pragma(src, "journal_mode") == "wal"
+	progress_state = {"steps": 0, "restarts": 0, "remaining": None}
+
+	def progress(status, remaining, total):
+		progress_state["steps"] += 1
+		previous = progress_state["remaining"]
+		# A writer between two steps restarts the copy, which can land on the same remaining count
+		# every time; a busy step makes no progress either and only counts against the step cap
+		if previous is not None and remaining >= previous and status == sqlite3.SQLITE_OK:
+			progress_state["restarts"] += 1
+		max_steps = (max_restarts + 2) * -(-total // max(step_pages, 1))
+		if progress_state["restarts"] > max_restarts or progress_state["steps"] > max_steps:
+			raise _TooManyRestarts()
+		progress_state["remaining"] = remaining
+		# Busy steps already slept (backup's sleep argument)
+		if remaining and status == sqlite3.SQLITE_OK:
+			time.sleep(pause)
+
+	blocked = 0.0
+	try:
+		if snapshot:
+			# Every step reads this one snapshot; WAL writers are never waited on
+			src.execute("BEGIN")
+			src.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+		try:
+			# sleep: wait after a busy step (a writer holding its lock), 0.25s by default
+			src.backup(dst, pages=step_pages, progress=progress, sleep=pause)
+		except _TooManyRestarts:
+			started = time.perf_counter()
+			src.backup(dst, pages=-1, sleep=pause)
+			blocked = time.perf_counter() - started
+		if snapshot:
+			src.execute("COMMIT")
+		if verify and dst.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+			raise RuntimeError(f"Backup of {path} failed its integrity check")
+	finally:
+		src.close()
+		dst.close()
+	os.replace(partial, dest)
+	return {
+		"dest": dest, "bytes": os.path.getsize(dest), "steps": progress_state["steps"],
+		"restarts": progress_state["restarts"], "blocked_seconds": round(blocked, 3),
+	}
+
+
+def incremental_vacuum(path: str, step_pages: int = 256, budget: float = 10.0, pause: float = 0.05) -> dict:
+	"""Return free pages to the filesystem a step (one short transaction) at a time"""
+	conn = _connect(path)
+	try:
+		if _pragma(conn, "auto_vacuum") != 2:
+			return {"skipped": "auto_vacuum is not incremental", "free_pages": _pragma(conn, "freelist_count")}
+		before = _pragma(conn, "freelist_count")
+		deadline = time.monotonic() + budget
+		free = before
+		while free and time.monotonic() < deadline:
+			started = time.monotonic()
+			# execute() would stop after the first page; executescript() steps it to completion
+			conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+			free = _pragma(conn, "freelist_count")
+			if free:
+				# Writers waiting in SQLite's busy handler back off in growing sleeps;
+				# leave the write lock free at least as long as the step held it
+				time.sleep(max(pause, time.monotonic() - started))
+	finally:
+		conn.close()
+	return {"freed_pages": before - free, "free_pages": free}
+
+
+def enable_incremental_vacuum(path: str) -> dict:
+	"""Switch a file to auto_vacuum=INCREMENTAL: a full VACUUM, blocking writers meanwhile"""
+	conn = _connect(path)
+	try:
+		before = os.path.getsize(path)
+		conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+		conn.execute("VACUUM")
+		mode = AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"))
+	finally:
+		conn.close()
+	return {"auto_vacuum": mode, "bytes_before": before, "bytes": os.path.getsize(path)}
+
+
+def optimize(path: str, analysis_limit: int = 1000) -> dict:
+	conn = _connect(path)
+	try:
+		conn.execute(f"PRAGMA analysis_limit={int(analysis_limit)}")
+		conn.execute("PRAGMA optimize")
+	finally:
+		conn.close()
+	return {}
+
+
+def analyze(path: str, analysis_limit: int = 1000) -> dict:
+	conn = _connect(path)
+	try:
+		conn.execute(f"PRAGMA analysis_limit={int(analysis_limit)}")
+		conn.execute("ANALYZE")
+	finally:
+		conn.close()
+	return {}
+
+
+# Scheduling
+
+def backup_dir() -> str:
+	return current_app.config.get("MAINTENANCE_BACKUP_DIR") or os.path.join(current_app.instance_path, "backups")
+
+
+def _prune_backups(directory: str, name: str, keep: int) -> int:
+	copies = sorted(glob.glob(os.path.join(directory, f"{name}-*.sqlite")))
+	stale = copies[:-keep] if keep > 0 else []
+	for path in stale:
+		os.remove(path)
+	return len(stale)
+
+
+def _run_sqlite_task(task: str, name: str, path: str, dest_dir: Optional[str] = None) -> dict:
+	config = current_app.config
+	pause = config.get("MAINTENANCE_STEP_PAUSE_SECONDS", 0.05)
+	limit = config.get("MAINTENANCE_ANALYSIS_LIMIT", 1000)
+	if task == "backup":
+		directory = dest_dir or backup_dir()
+		stamp = utcnow().strftime("%Y%m%dT%H%M%S")
+		result = backup(
+			path, os.path.join(directory, f"{name}-{stamp}.sqlite"),
+			step_pages=config.get("MAINTENANCE_BACKUP_STEP_PAGES", 1024), pause=pause,
+			max_restarts=config.get("MAINTENANCE_BACKUP_MAX_RESTARTS", 3),
+		)
+		result["pruned"] = _prune_backups(directory, name, config.get("MAINTENANCE_BACKUP_KEEP", 7))
+		return result
+	if task == "vacuum":
+		return incremental_vacuum(
+			path, step_pages=config.get("MAINTENANCE_VACUUM_STEP_PAGES", 256),
+			budget=config.get("MAINTENANCE_VACUUM_BUDGET_SECONDS", 10.0), pause=pause,
+		)
+	if task == "optimize":
+		return optimize(path, limit)
+	return analyze(path, limit)
+
+
+def run_task(task: str, name: str, engine, dest_dir: Optional[str] = None) -> MaintenanceRun:
+	"""Run one task on one database and record it"""
+	if task not in TASKS:
+		raise ValueError(f"Unknown maintenance task {task!r}")
+	started_at, started = utcnow(), time.perf_counter()
+	ok, detail = True, None
+	try:
+		path = sqlite_path(engine)
+		if path is not None:
+			result = _run_sqlite_task(task, name, path, dest_dir)
+		elif task == "analyze":
+			with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+				conn.execute(text("ANALYZE"))
+			result = {}
+		else:
+			result = {"skipped": f"not SQLite ({engine.dialect.name})"}
+		detail = " ".join(f"{key}={value}" for key, value in result.items()) or None
+	except Exception as e:
+		ok, detail = False, f"{type(e).__name__}: {e}"
+	run = MaintenanceRun(
+		task=task, database=name, started_at=started_at, seconds=round(time.perf_counter() - started, 3),
+		ok=ok, detail=detail[:255] if detail else None,
+	)
+	db.session.add(run)
+	db.session.commit()
+	print(f"MAINTENANCE DEBUG: {task} {name} {'ok' if ok else 'FAILED'} in {run.seconds}s {detail or ''}")
+	return run
+
+
+def _last_runs() -> Dict[Tuple[str, str], datetime]:
+	rows = db.session.execute(
+		select(MaintenanceRun.task, MaintenanceRun.database, func.max(MaintenanceRun.started_at))
+		.where(MaintenanceRun.ok.is_(True))
+		.group_by(MaintenanceRun.task, MaintenanceRun.database)
+	)
+	return {(task, name): started_at for task, name, started_at in rows}
+
+
+def due_tasks(now: Optional[datetime] = None) -> List[Tuple[str, str, object]]:
+	"""(task, database name, engine) whose interval has passed, in TASKS order"""
+	now = now or utcnow()
+	last = _last_runs()
+	due = []
+	for task in TASKS:
+		interval = current_app.config.get(f"MAINTENANCE_{task.upper()}_SECONDS", 0)
+		if not interval:
+			continue
+		for name, engine in databases():
+			previous = last.get((task, name))
+			if previous is None or now - previous >= timedelta(seconds=interval):
+				due.append((task, name, engine))
+	return due
+
+
+def run_due(tasks: Optional[List[str]] = None, force: bool = False,
+		log: Callable[[str], None] = print) -> List[MaintenanceRun]:
+	"""Run every due task (all of `tasks` with force); returns the runs"""
+	if force:
+		todo = [(task, name, engine) for task in TASKS for name, engine in databases()]
+	else:
+		todo = due_tasks()
+	runs = []
+	for task, name, engine in todo:
+		if tasks and task not in tasks:
+			continue
+		run = run_task(task, name, engine)
+		log(f"{task:<8} {name:<10} {'ok' if run.ok else 'FAILED':<6} {run.seconds:>8.3f}s  {run.detail or ''}")
+		runs.append(run)
+	return runs
+
+
+def report(days: int = 7, tables: bool = False) -> dict:
+	"""File stats per database plus each task's last run and time spent over `days`"""
+	since = utcnow() - timedelta(days=days)
+	spent = {
+		(task, name): (count, seconds) for task, name, count, seconds in db.session.execute(
+			select(MaintenanceRun.task, MaintenanceRun.database, func.count(), func.sum(MaintenanceRun.seconds))
+			.where(MaintenanceRun.started_at >= since)
+			.group_by(MaintenanceRun.task, MaintenanceRun.database)
+		)
+	}
+	newest = select(func.max(MaintenanceRun.id)).group_by(MaintenanceRun.task, MaintenanceRun.database)
+	latest = {
+		(run.task, run.database): run
+		for run in db.session.scalars(select(MaintenanceRun).where(MaintenanceRun.id.in_(newest)))
+	}
+	out = {}
+	for name, engine in databases():
+		path = sqlite_path(engine)
+		entry = {"dialect": engine.dialect.name, "file": file_stats(path) if path else None, "tasks": {}}
+		if tables and path:
+			entry["tables"] = table_stats(path)
+		for task in TASKS:
+			run = latest.get((task, name))
+			count, seconds = spent.get((task, name), (0, 0.0))
+			entry["tasks"][task] = {
+				"last_run": run.started_at.isoformat(timespec="seconds") if run else None,
+				"last_ok": run.ok if run else None,
+				"last_seconds": run.seconds if run else None,
+				"last_detail": run.detail if run else None,
+				"runs": count,
+				"seconds": round(seconds or 0.0, 3),
+			}
+		out[name] = entry
+	return {"days": days, "databases": out}
+
+
+def format_report(data: dict) -> str:
+	lines = []
+	for name, entry in data["databases"].items():
+		stats = entry["file"]
+		if stats is None:
+			lines.append(f"{name} ({entry['dialect']})")
+		else:
+			lines.append(
+				f"{name}: {stats['path']} {stats['bytes'] / 1e6:.1f} MB (+{stats['wal_bytes'] / 1e6:.1f} MB WAL), "
+				f"{stats['pages']} pages of {stats['page_size']} B, {stats['free_pages']} free "
+				f"({stats['free_ratio']:.1%}), auto_vacuum={stats['auto_vacuum']}, journal_mode={stats['journal_mode']}"
+			)
+		for table in entry.get("tables", []):
+			lines.append(f"  {table['name']:<40} {table['bytes'] / 1e6:>9.1f} MB  {table['unused_ratio']:>6.1%} unused")
+		for task, info in entry["tasks"].items():
+			last = "never" if info["last_run"] is None else (
+				f"{info['last_run']} {'ok' if info['last_ok'] else 'FAILED'} {info['last_seconds']}s {info['last_detail'] or ''}"
+			)
+			lines.append(f"  {task:<8} last: {last.strip()}; {info['runs']} runs, {info['seconds']}s in {data['days']} days")
+	return "\n".join(lines)
@@ -4,17 +4,27 @@ from datetime import datetime, timedelta
 from typing import Optional
 
 from flask_login import UserMixin
+from sqlalchemy.orm import attribute_keyed_dict
 
 from .extensions import db, login_manager
+from .clock import utcnow
+from .sharding import new_user_shard
 from .constants import (
     PET_TYPES, FOOD_TYPES, STAT_DECAY_RATES, INVENTORY_DEFAULTS, 
     INVENTORY_LIMITS, PET_APPEARANCE_THRESHOLDS,
     MATURITY_ORDER, MATURITY_DURATIONS_DAYS
 )
 
+# session.info key Inventory methods queue ledger entries under (see app/ledger.py)
+LEDGER_PENDING_KEY = "ledger_pending"
+
 
 class User(db.Model, UserMixin):
 	__tablename__ = "users"
+	__table_args__ = (
+		# Keyset pagination of the admin user directory (newest first)
+		db.Index("ix_users_created_at_id", "created_at", "id"),
+	)
 
 	id = db.Column(db.Integer, primary_key=True)
 	username = db.Column(db.String(80), unique=True, nullable=False, index=True)
@@ -22,7 +32,11 @@ class User(db.Model, UserMixin):
 	# Admin and security flags
 	is_admin = db.Column(db.Boolean, nullable=False, default=False)
 	must_change_password = db.Column(db.Boolean, nullable=False, default=False)
-	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+	# Shard holding the user's pet, inventory and ledger (see app/sharding.py)
+	# Server defaults match the ALTER in create_app, for rows inserted without the ORM
+	shard = db.Column(db.SmallInteger, nullable=False, default=new_user_shard, server_default="0")
+	shard_moving = db.Column(db.Boolean, nullable=False, default=False, server_default="0")
 	# Minigame tracking
 	last_played_higher_lower = db.Column(db.DateTime, nullable=True)
 	pet = db.relationship("Pet", back_populates="owner", uselist=False)
@@ -33,7 +47,7 @@ class User(db.Model, UserMixin):
 	
 	def can_play_higher_lower(self, now: Optional[datetime] = None) -> bool:
 		"""Check if user can play Higher or Lower (once per day, resets at 6 AM server time)"""
-		now = now or datetime.utcnow()
+		now = now or utcnow()
 		
 		if not self.last_played_higher_lower:
 			return True
@@ -51,8 +65,49 @@ class User(db.Model, UserMixin):
 		return self.last_played_higher_lower < reset_time
 
 
-class Pet(db.Model):
+def _activity_flag(kind: str) -> property:
+	return property(lambda self: self.get_activity(kind) is not None)
+
+
+def _activity_field(kind: str, field: str) -> property:
+	def getter(self):
+		activity = self.get_activity(kind)
+		return getattr(activity, field) if activity is not None else None
+	return property(getter)
+
+
+class ActivityFields:
+	"""Read-only legacy activity attributes (is_sleeping, sleep_type, sleep_start_time,
+	sleep_end_time, ... for wash/feed/play) backed by get_activity(kind)"""
+	__slots__ = ()
+
+	is_sleeping = _activity_flag("sleep")
+	sleep_type = _activity_field("sleep", "activity_type")
+	sleep_start_time = _activity_field("sleep", "start_time")
+	sleep_end_time = _activity_field("sleep", "end_time")
+
+	is_washing = _activity_flag("wash")
+	wash_type = _activity_field("wash", "activity_type")
+	wash_start_time = _activity_field("wash", "start_time")
+	wash_end_time = _activity_field("wash", "end_time")
+
+	is_feeding = _activity_flag("feed")
+	feed_type = _activity_field("feed", "activity_type")
+	feed_start_time = _activity_field("feed", "start_time")
+	feed_end_time = _activity_field("feed", "end_time")
+
+	is_playing = _activity_flag("play")
+	play_type = _activity_field("play", "activity_type")
+	play_start_time = _activity_field("play", "start_time")
+	play_end_time = _activity_field("play", "end_time")
+
+
+class Pet(ActivityFields, db.Model):
 	__tablename__ = "pets"
+	__table_args__ = (
+		# Maturity stage is a function of created_at: stage counts are range counts
+		db.Index("ix_pets_created_at", "created_at"),
+	)
 
 	id = db.Column(db.Integer, primary_key=True)
 	owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, unique=True)
@@ -66,45 +121,43 @@ class Pet(db.Model):
 	energy = db.Column(db.Integer, nullable=False, default=50)
 	
 	# Timestamps for decay calculations
-	last_fed = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-	last_played = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-	last_bathed = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-	last_slept = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-	
-	# Sleep state tracking
-	is_sleeping = db.Column(db.Boolean, nullable=False, default=False)
-	sleep_start_time = db.Column(db.DateTime, nullable=True)
-	sleep_type = db.Column(db.String(10), nullable=True)  # 'nap' or 'sleep'
-	sleep_end_time = db.Column(db.DateTime, nullable=True)
+	last_fed = db.Column(db.DateTime, nullable=False, default=utcnow)
+	last_played = db.Column(db.DateTime, nullable=False, default=utcnow)
+	last_bathed = db.Column(db.DateTime, nullable=False, default=utcnow)
+	last_slept = db.Column(db.DateTime, nullable=False, default=utcnow)
+	created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
 	
-	# Wash state tracking
-	is_washing = db.Column(db.Boolean, nullable=False, default=False)
-	wash_start_time = db.Column(db.DateTime, nullable=True)
-	wash_type = db.Column(db.String(15), nullable=True)  # 'wash_hands', 'shower', or 'bath'
-	wash_end_time = db.Column(db.DateTime, nullable=True)
-
-	# Feed state tracking (frontend duration persistence)
-	is_feeding = db.Column(db.Boolean, nullable=False, default=False)
-	feed_start_time = db.Column(db.DateTime, nullable=True)
-	feed_type = db.Column(db.String(30), nullable=True)
-	feed_end_time = db.Column(db.DateTime, nullable=True)
-
-	# Play state tracking (frontend duration persistence)
-	is_playing = db.Column(db.Boolean, nullable=False, default=False)
-	play_start_time = db.Column(db.DateTime, nullable=True)
-	play_type = db.Column(db.String(30), nullable=True)
-	play_end_time = db.Column(db.DateTime, nullable=True)
-
 	# Relationships
 	owner = db.relationship("User", back_populates="pet")
+	# Timed activities in progress (sleep/wash/feed/play), keyed by kind
+	activities = db.relationship(
+		"PetActivity", collection_class=attribute_keyed_dict("kind"),
+		back_populates="pet", cascade="all, delete-orphan", lazy="selectin"
+	)
+
+	def get_activity(self, kind: str) -> Optional["PetActivity"]:
+		return self.activities.get(kind)
+
+	def start_activity(self, kind: str, activity_type: str, start: datetime, duration: timedelta) -> None:
+		"""Begin (or restart) the pet's activity of this kind"""
+		activity = self.activities.get(kind)
+		if activity is None:
+			self.activities[kind] = PetActivity(kind=kind, activity_type=activity_type, start_time=start, end_time=start + duration)
+		else:
+			# Update in place: a delete + insert of the same key in one flush would collide
+			activity.activity_type = activity_type
+			activity.start_time = start
+			activity.end_time = start + duration
+
+	def end_activity(self, kind: str) -> None:
+		self.activities.pop(kind, None)
 
 	def compute_maturity_stage(self, now: Optional[datetime] = None) -> str:
 		"""Return computed maturity stage based on created_at and configured durations.
 
 		Stages: child (first day), teen (second day), adult (after).
 		"""
-		now = now or datetime.utcnow()
+		now = now or utcnow()
 		elapsed_days = (now - self.created_at).total_seconds() / 86400.0
 		child_days = MATURITY_DURATIONS_DAYS.get("child") or 0
 		teen_days = child_days + (MATURITY_DURATIONS_DAYS.get("teen") or 0)
@@ -116,7 +169,7 @@ class Pet(db.Model):
 
 	def compute_next_maturity_change(self, now: Optional[datetime] = None) -> Optional[datetime]:
 		"""Return the UTC datetime when the pet will enter the next stage, or None for adult."""
-		now = now or datetime.utcnow()
+		now = now or utcnow()
 		stage = self.compute_maturity_stage(now)
 		child_days = MATURITY_DURATIONS_DAYS.get("child") or 0
 		teen_days = child_days + (MATURITY_DURATIONS_DAYS.get("teen") or 0)
@@ -128,7 +181,7 @@ class Pet(db.Model):
 
 	def update_stats(self):
 		"""Update stats based on time passed since last actions"""
-		now = datetime.utcnow()
+		now = utcnow()
 		
 		# Decay rates from constants
 		normal_decay_rate = STAT_DECAY_RATES['normal']
@@ -184,7 +237,7 @@ class Pet(db.Model):
 			print("SLEEP DEBUG: check_wake_up called but pet not sleeping or no end time")
 			return
 		
-		now = datetime.utcnow()
+		now = utcnow()
 		print(f"SLEEP DEBUG: Checking wake up - now: {now}, sleep_end_time: {self.sleep_end_time}")
 		
 		# Check if sleep end time has passed
@@ -198,10 +251,7 @@ class Pet(db.Model):
 	
 	def wake_up(self):
 		"""Wake up the pet from sleep"""
-		self.is_sleeping = False
-		self.sleep_start_time = None
-		self.sleep_type = None
-		self.sleep_end_time = None
+		self.end_activity("sleep")
 		print("SLEEP DEBUG: Pet has woken up")
 	
 	def check_wash_finish(self):
@@ -210,7 +260,7 @@ class Pet(db.Model):
 			print("WASH DEBUG: check_wash_finish called but pet not washing or no end time")
 			return
 		
-		now = datetime.utcnow()
+		now = utcnow()
 		print(f"WASH DEBUG: Checking wash finish - now: {now}, wash_end_time: {self.wash_end_time}")
 		
 		# Check if wash end time has passed
@@ -224,35 +274,54 @@ class Pet(db.Model):
 	
 	def finish_washing(self):
 		"""Finish washing the pet"""
-		self.is_washing = False
-		self.wash_start_time = None
-		self.wash_type = None
-		self.wash_end_time = None
+		self.end_activity("wash")
 		print("WASH DEBUG: Pet has finished washing")
 
 	def check_feed_finish(self):
 		"""Clear feeding state if finished"""
 		if not self.is_feeding or not self.feed_end_time:
 			return
-		now = datetime.utcnow()
+		now = utcnow()
 		if now >= self.feed_end_time:
 			print("FEED DEBUG: Feeding finished")
-			self.is_feeding = False
-			self.feed_start_time = None
-			self.feed_type = None
-			self.feed_end_time = None
+			self.end_activity("feed")
 
 	def check_play_finish(self):
 		"""Clear playing state if finished"""
 		if not self.is_playing or not self.play_end_time:
 			return
-		now = datetime.utcnow()
+		now = utcnow()
 		if now >= self.play_end_time:
 			print("PLAY DEBUG: Playing finished")
-			self.is_playing = False
-			self.play_start_time = None
-			self.play_type = None
-			self.play_end_time = None
+			self.end_activity("play")
+
+
+class PetActivity(db.Model):
+	__tablename__ = "pet_activities"
+
+	pet_id = db.Column(db.Integer, db.ForeignKey("pets.id"), primary_key=True)
+	kind = db.Column(db.String(5), primary_key=True)  # one of ACTIVITY_KINDS
+	activity_type = db.Column(db.String(30), nullable=False)  # nap/sleep, wash type, food type, play type
+	start_time = db.Column(db.DateTime, nullable=False)
+	# Expiry sweeps are a range scan on this index
+	end_time = db.Column(db.DateTime, nullable=False, index=True)
+
+	pet = db.relationship("Pet", back_populates="activities")
+
+
+class PetStatHistory(db.Model):
+	"""Packed stat samples of one pet, one ring buffer per STAT_HISTORY_TIERS entry.
+
+	`data` holds each tier's slots back to back, one byte per stat per slot
+	(see app/stat_history.py); *_at is the latest slot number written per tier.
+	"""
+	__tablename__ = "pet_stat_history"
+
+	pet_id = db.Column(db.Integer, db.ForeignKey("pets.id"), primary_key=True, autoincrement=False)
+	minute_at = db.Column(db.Integer, nullable=True)
+	hour_at = db.Column(db.Integer, nullable=True)
+	day_at = db.Column(db.Integer, nullable=True)
+	data = db.Column(db.LargeBinary, nullable=False)
 
 
 class Inventory(db.Model):
@@ -261,19 +330,40 @@ class Inventory(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
 	owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, unique=True)
 
+	# Balances keep their previous value on change (active_history) so the
+	# ledger can record changes made without the methods below
+
 	# Currency
-	coins = db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['coins'])
+	coins = db.column_property(
+		db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['coins']), active_history=True
+	)
 
 	# Food quantities (max defined in constants)
-	tree_seed = db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['tree_seed'])
-	blueberries = db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['blueberries'])
-	mushroom = db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['mushroom'])
-	acorn = db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['acorn'])
-
-	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	tree_seed = db.column_property(
+		db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['tree_seed']), active_history=True
+	)
+	blueberries = db.column_property(
+		db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['blueberries']), active_history=True
+	)
+	mushroom = db.column_property(
+		db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['mushroom']), active_history=True
+	)
+	acorn = db.column_property(
+		db.Column(db.Integer, nullable=False, default=INVENTORY_DEFAULTS['acorn']), active_history=True
+	)
+
+	# Number of ledger entries written for this owner (0 = ledger not opened yet)
+	ledger_seq = db.Column(db.Integer, nullable=False, default=0)
+
+	created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
 	
 	# Relationships
 	owner = db.relationship("User", back_populates="inventory")
+
+	def _log(self, item: str, delta: int, reason: str) -> None:
+		"""Queue a ledger entry; app.ledger writes it when the session flushes"""
+		if delta:
+			db.session.info.setdefault(LEDGER_PENDING_KEY, []).append((self, item, delta, reason))
 	
 	def get_food_quantity(self, food_type: str) -> int:
 		"""Get the quantity of a specific food type"""
@@ -281,7 +371,7 @@ class Inventory(db.Model):
 			return 0
 		return getattr(self, food_type, 0)
 	
-	def consume_food(self, food_type: str, quantity: int = 1) -> bool:
+	def consume_food(self, food_type: str, quantity: int = 1, reason: str = "adjust") -> bool:
 		"""Consume food from inventory. Returns True if successful, False if not enough food"""
 		if food_type not in FOOD_TYPES:
 			return False
@@ -291,9 +381,10 @@ class Inventory(db.Model):
 			return False
 		
 		setattr(self, food_type, current_quantity - quantity)
+		self._log(food_type, -quantity, reason)
 		return True
 	
-	def add_food(self, food_type: str, quantity: int) -> bool:
+	def add_food(self, food_type: str, quantity: int, reason: str = "adjust") -> bool:
 		"""Add food to inventory. Returns True if successful (respects max 100 limit)"""
 		if food_type not in FOOD_TYPES:
 			return False
@@ -306,27 +397,31 @@ class Inventory(db.Model):
 			return False
 
 		setattr(self, food_type, new_quantity)
+		self._log(food_type, quantity, reason)
 		return True
 
 	def can_afford(self, cost: int) -> bool:
 		"""Check if user can afford the given cost"""
 		return self.coins >= cost
 
-	def spend_coins(self, amount: int) -> bool:
+	def spend_coins(self, amount: int, reason: str = "adjust") -> bool:
 		"""Spend coins. Returns True if successful"""
 		if self.coins < amount:
 			return False
 
 		self.coins -= amount
+		self._log("coins", -amount, reason)
 		return True
 
-	def add_coins(self, amount: int) -> bool:
+	def add_coins(self, amount: int, reason: str = "adjust") -> bool:
 		"""Add coins (respects max limit). Returns True if successful"""
+		old_total = self.coins
 		new_total = self.coins + amount
 		if new_total > INVENTORY_LIMITS['coins_max']:
 			self.coins = INVENTORY_LIMITS['coins_max']  # Set to max
 		else:
 			self.coins = new_total
+		self._log("coins", self.coins - old_total, reason)
 		return True
 
 	def get_max_affordable(self, price_per_unit: int) -> int:
@@ -334,13 +429,59 @@ class Inventory(db.Model):
 		return self.coins // price_per_unit
 
 
+class LedgerEntry(db.Model):
+	"""One change to an owner's coins or food; append-only.
+
+	item and reason are indexes into LEDGER_ITEMS / LEDGER_REASONS.
+	"""
+	__tablename__ = "ledger_entries"
+	__table_args__ = {"sqlite_with_rowid": False}
+
+	owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True, autoincrement=False)
+	seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+	item = db.Column(db.SmallInteger, nullable=False)
+	delta = db.Column(db.Integer, nullable=False)
+	reason = db.Column(db.SmallInteger, nullable=False)
+	created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+
+class LedgerSnapshot(db.Model):
+	"""An owner's balances after their entry number `seq`"""
+	__tablename__ = "ledger_snapshots"
+	__table_args__ = (
+		# Latest snapshot at or before a point in time
+		db.Index("ix_ledger_snapshots_owner_created", "owner_id", "created_at"),
+		{"sqlite_with_rowid": False},
+	)
+
+	owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True, autoincrement=False)
+	seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+	created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+	coins = db.Column(db.Integer, nullable=False)
+	tree_seed = db.Column(db.Integer, nullable=False)
+	blueberries = db.Column(db.Integer, nullable=False)
+	mushroom = db.Column(db.Integer, nullable=False)
+	acorn = db.Column(db.Integer, nullable=False)
+
+
+class DailyRollup(db.Model):
+	"""One per-day analytics figure, e.g. (day, "feed", "acorn") -> 1234 (see app/rollups.py)"""
+	__tablename__ = "daily_rollups"
+	__table_args__ = {"sqlite_with_rowid": False}
+
+	day = db.Column(db.Date, primary_key=True)
+	metric = db.Column(db.String(20), primary_key=True)
+	key = db.Column(db.String(30), primary_key=True)
+	value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
 class AccessRequest(db.Model):
 	__tablename__ = "access_requests"
 
 	id = db.Column(db.Integer, primary_key=True)
 	email = db.Column(db.String(255), nullable=False, index=True)
 	message = db.Column(db.Text, nullable=True)
-	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
 	processed = db.Column(db.Boolean, nullable=False, default=False)
 
 	def to_dict(self) -> dict:
@@ -352,6 +493,63 @@ class AccessRequest(db.Model):
 			"processed": self.processed
 		}
 
+
+# Admin queue: newest-first pages of all requests, and of unprocessed ones only
+db.Index("ix_access_requests_created_at_id", AccessRequest.created_at, AccessRequest.id)
+db.Index(
+	"ix_access_requests_unprocessed", AccessRequest.created_at, AccessRequest.id,
+	sqlite_where=AccessRequest.processed.is_(False),
+	postgresql_where=AccessRequest.processed.is_(False)
+)
+
+
+class AccessRequestArchive(db.Model):
+	"""Processed access requests moved out of the live queue by the retention job"""
+	__tablename__ = "access_requests_archive"
+
+	id = db.Column(db.Integer, primary_key=True)
+	email = db.Column(db.String(255), nullable=False)
+	message = db.Column(db.Text, nullable=True)
+	created_at = db.Column(db.DateTime, nullable=False)
+	processed = db.Column(db.Boolean, nullable=False, default=True)
+	archived_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+
+class IdempotencyRecord(db.Model):
+	"""Stored response of a mutating request, replayed for retries with the same Idempotency-Key"""
+	__tablename__ = "idempotency_keys"
+	__table_args__ = (
+		db.UniqueConstraint("user_id", "key", name="uq_idempotency_user_key"),
+	)
+
+	id = db.Column(db.Integer, primary_key=True)
+	user_id = db.Column(db.Integer, nullable=False)
+	key = db.Column(db.String(64), nullable=False)
+	endpoint = db.Column(db.String(64), nullable=False)
+	# sha256 of the method, path and body the key was first used for
+	request_hash = db.Column(db.String(64), nullable=True)
+	# 0 while claimed by a request that has not stored its response yet
+	status_code = db.Column(db.SmallInteger, nullable=False)
+	body = db.Column(db.LargeBinary, nullable=False)
+	created_at = db.Column(db.DateTime, nullable=False, default=utcnow, index=True)
+
+
+class MaintenanceRun(db.Model):
+	"""One run of a database maintenance task (see app/maintenance.py)"""
+	__tablename__ = "maintenance_runs"
+	__table_args__ = (
+		db.Index("ix_maintenance_runs_task_started", "task", "database", "started_at"),
+	)
+
+	id = db.Column(db.Integer, primary_key=True)
+	task = db.Column(db.String(20), nullable=False)  # backup, vacuum, optimize, analyze
+	database = db.Column(db.String(40), nullable=False)  # primary, shard1, ...
+	started_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+	seconds = db.Column(db.Float, nullable=False)
+	ok = db.Column(db.Boolean, nullable=False, default=True)
+	detail = db.Column(db.String(255), nullable=True)
+
+
 @login_manager.user_loader
 def load_user(user_id: str) -> Optional[User]:
 	return db.session.get(User, int(user_id))
@@ -0,0 +1,176 @@
+"""
+Password hashing and verification off the request threads.
+
+Key derivation (scrypt/pbkdf2) is deliberately slow. Verification runs on a
+small dedicated thread pool (hashlib releases the GIL while deriving) with a
+bound on queued work, so a burst of logins cannot tie up every worker that
+also serves game API requests: once PASSWORD_VERIFY_QUEUE logins are
+in progress, further ones are turned away with VerifierBusy (503 +
+Retry-After). Each waiting login holds a server thread, so keep the queue
+limit below the server's thread count.
+
+Hashes record their parameters ("scrypt:32768:8:1$salt$hash"); when
+PASSWORD_HASH_METHOD changes, a user's hash is upgraded on their next
+successful login. `flask calibrate-password-hash` picks a cost for a target
+latency on the current machine.
+"""
+from __future__ import annotations
+
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+# Configured method -> the parameter field werkzeug writes for it
+_prefixes: Dict[str, str] = {}
+
+
+class VerifierBusy(Exception):
+	"""Too many password checks queued; retry after `retry_after` seconds"""
+
+	def __init__(self, retry_after: int):
+		super().__init__(f"Password verification busy, retry after {retry_after}s")
+		self.retry_after = retry_after
+
+
+class PasswordVerifier:
+	"""Bounded executor for password hashing and verification"""
+
+	def __init__(self, workers: int = 2, max_pending: int = 4, timeout: float = 10.0):
+		self.workers = workers
+		self.max_pending = max_pending
+		self.timeout = timeout
+		self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+		self._lock = threading.Lock()
+		self._pending = 0
+		self._avg_seconds = 0.1
+		self.completed = 0
+		self.rejected = 0
+
+	def _run(self, fn, *args):
+		with self._lock:
+			if self._pending >= self.max_pending:
+				self.rejected += 1
+				# Time for the queue ahead to drain, rounded up to whole seconds
+				raise VerifierBusy(max(1, int(self._pending / self.workers * self._avg_seconds + 0.999)))
+			self._pending += 1
+
+		def task():
+			started = time.perf_counter()
+			try:
+				return fn(*args)
+			finally:
+				elapsed = time.perf_counter() - started
+				with self._lock:
+					self._pending -= 1
+					self.completed += 1
+					self._avg_seconds += (elapsed - self._avg_seconds) * 0.1
+
+		future = self._executor.submit(task)
+		try:
+			return future.result(timeout=self.timeout)
+		except FutureTimeout:
+			raise VerifierBusy(max(1, int(self._avg_seconds * self.max_pending / self.workers)))
+
+	def verify(self, password_hash: str, password: str) -> bool:
+		return self._run(check_password_hash, password_hash, password)
+
+	def hash(self, password: str, method: str = DEFAULT_METHOD) -> str:
+		return self._run(partial(generate_password_hash, method=method), password)
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"workers": self.workers,
+				"max_pending": self.max_pending,
+				"pending": self._pending,
+				"completed": self.completed,
+				"rejected": self.rejected,
+				"avg_ms": round(self._avg_seconds * 1000, 1),
+			}
+
+	def shutdown(self) -> None:
+		self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def init_app(app) -> None:
+	app.extensions["password_verifier"] = PasswordVerifier(
+		workers=app.config.get("PASSWORD_VERIFY_WORKERS", 2),
+		max_pending=app.config.get("PASSWORD_VERIFY_QUEUE", 4),
+		timeout=app.config.get("PASSWORD_VERIFY_TIMEOUT", 10.0)
+	)
+
+
+def hash_method() -> str:
+	return current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+
+
+def hash_password(password: str) -> str:
+	"""Hash with the configured parameters on the password executor"""
+	return current_app.extensions["password_verifier"].hash(password, hash_method())
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+	"""Check a password on the password executor; raises VerifierBusy when saturated"""
+	return current_app.extensions["password_verifier"].verify(password_hash, password)
+
+
+def method_prefix(method: str) -> str:
+	"""Parameter field of hashes made with `method`, defaults filled in ("scrypt" -> "scrypt:32768:8:1")"""
+	prefix = _prefixes.get(method)
+	if prefix is None:
+		# Hash a probe once rather than re-implement werkzeug's defaults
+		prefix = _prefixes[method] = generate_password_hash("", method=method).split("$", 1)[0]
+	return prefix
+
+
+def needs_rehash(password_hash: str, method: Optional[str] = None) -> bool:
+	"""True if the hash was made with other parameters than the configured ones"""
+	return password_hash.split("$", 1)[0] != method_prefix(method or hash_method())
+
+
+# -- calibration -------------------------------------------------------------
+
+def _time_method(method: str, samples: int) -> float:
+	timings = []
+	for _ in range(samples):
+		started = time.perf_counter()
+		generate_password_hash("calibration-password", method=method)
+		timings.append(time.perf_counter() - started)
+	return statistics.median(timings) * 1000
+
+
+def calibrate(target_ms: float = 250.0, algorithm: str = "scrypt",
+		samples: int = 3) -> Tuple[str, float, List[Tuple[str, float]]]:
+	"""Find the costliest method whose median hash time stays under target_ms.
+
+	scrypt doubles N from 2**14 (r=8, p=1; memory grows with N); pbkdf2
+	steps sha256 iterations from 100k. Returns (method, ms, all measurements).
+	"""
+	if algorithm == "scrypt":
+		candidates = [f"scrypt:{2 ** exponent}:8:1" for exponent in range(14, 21)]
+	elif algorithm == "pbkdf2":
+		candidates = [f"pbkdf2:sha256:{iterations}" for iterations in range(100000, 2000001, 100000)]
+	else:
+		raise ValueError("algorithm must be 'scrypt' or 'pbkdf2'")
+
+	measured = []
+	best = (candidates[0], None)
+	for method in candidates:
+		ms = _time_method(method, samples)
+		measured.append((method, round(ms, 1)))
+		if ms > target_ms:
+			break
+		best = (method, ms)
+	if best[1] is None:
+		best = (candidates[0], measured[0][1])
+	return best[0], round(best[1], 1), measured
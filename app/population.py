@@ -0,0 +1,240 @@
+"""
+Synthetic player population for benchmarks and capacity planning
+(`flask generate-population --users 100000`).
+
+Creates N users, each with a pet of a random PET_TYPES type, varied stats,
+an inventory and a created_at spread over the maturity stages (STAGE_MIX:
+child, teen and adult pets in those proportions, adults up to
+max_age_days old). A share of pets is asleep or in the bath at `now`
+(live pet_activities timers), and access requests pile up over the last
+30 days. Everything derives from `seed`: the same seed, size and `now`
+give the same rows.
+
+Rows are generated lazily table by table and go through the bulk loader of
+`flask import-state` (state_dump.load_sections): executemany in chunks,
+secondary indexes rebuilt once at the end, users placed on their shard by
+username hash. Ids are assigned after the current maximum, so run it
+against a benchmark database, not one taking writes. Every user's password
+is `password`, hashed once.
+"""
+from __future__ import annotations
+
+import random
+from array import array
+from itertools import islice, repeat
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+from .clock import utcnow
+from .constants import FOOD_TYPES, MATURITY_DURATIONS_DAYS, PET_TYPES, SLEEP_DURATIONS, WASH_DURATIONS
+from .extensions import db
+from .passwords import hash_method
+from .sharding import home_shard
+from .state_dump import IMPORT_CHUNK, PROGRESS_SECONDS, load_sections
+
+
+# Share of pets per maturity stage
+STAGE_MIX = {"child": 0.25, "teen": 0.25, "adult": 0.5}
+SLEEPING_SHARE = 0.10
+WASHING_SHARE = 0.05
+PROCESSED_SHARE = 0.8
+RECENT_SECONDS = 6 * 3600
+PET_NAMES = ["Acorn", "Biscuit", "Clover", "Dumpling", "Hazel", "Maple", "Nibbles", "Pip", "Sprout", "Truffle"]
+REQUEST_MESSAGES = ["", "Please let me in!", "A friend sent me the link.", "Can I try the game?"]
+
+_IDLE, _SLEEPING, _WASHING = 0, 1, 2
+
+
+def _text(moment: datetime) -> str:
+	# The dump's datetime text (see app/state_dump.py)
+	return moment.isoformat(" ", "microseconds")
+
+
+class _Ago:
+	"""Datetime text `seconds` before `now`; the last day's texts are formatted once per whole second"""
+
+	CACHED_SECONDS = 86400
+
+	def __init__(self, now: datetime):
+		self.now = now
+		self.cache: Dict[int, str] = {}
+
+	def __call__(self, seconds: float) -> str:
+		seconds = int(seconds)
+		text = self.cache.get(seconds)
+		if text is None:
+			text = _text(self.now - timedelta(seconds=seconds))
+			if seconds < self.CACHED_SECONDS:
+				self.cache[seconds] = text
+		return text
+
+
+def _stage_windows(max_age_days: float) -> List[Tuple[str, float, float, float]]:
+	"""(stage, share, youngest, oldest age in seconds) per stage"""
+	child = (MATURITY_DURATIONS_DAYS.get("child") or 0) * 86400
+	teen = child + (MATURITY_DURATIONS_DAYS.get("teen") or 0) * 86400
+	bounds = {"child": (0, child), "teen": (child, teen), "adult": (teen, max(teen, max_age_days * 86400))}
+	return [(stage, share, *bounds[stage]) for stage, share in STAGE_MIX.items()]
+
+
+class _Plan:
+	"""Per-user choices every table's rows depend on (shard, age, activity), a few bytes per user"""
+
+	def __init__(self, users: int, seed: int, prefix: str, shards: int, max_age_days: float):
+		draw = random.Random(seed).random
+		windows, cumulative = [], 0.0
+		for _, share, youngest, oldest in _stage_windows(max_age_days):
+			cumulative += share
+			windows.append((cumulative, youngest, oldest - youngest))
+		self.shard = array("B", bytes(users)) if shards == 1 else array("B", (
+			home_shard(f"{prefix}{n:07d}", shards) for n in range(users)
+		))
+		self.age = array("l")
+		self.activity = array("B")
+		for n in range(users):
+			pick = draw() * cumulative
+			youngest, span = next((youngest, span) for bound, youngest, span in windows if pick < bound)
+			self.age.append(int(youngest + draw() * span))
+			pick = draw()
+			self.activity.append(_SLEEPING if pick < SLEEPING_SHARE else _WASHING if pick < SLEEPING_SHARE + WASHING_SHARE else _IDLE)
+
+	def owners(self, shard: int) -> Iterator[int]:
+		return (n for n, user_shard in enumerate(self.shard) if user_shard == shard)
+
+
+def _batches(values: Iterable[int], size: int) -> Iterator[List[int]]:
+	values = iter(values)
+	while batch := list(islice(values, size)):
+		yield batch
+
+
+def _next_id(engine, table) -> int:
+	with engine.connect() as conn:
+		return (conn.scalar(select(func.max(table.c.id))) or 0) + 1
+
+
+def generate_population(users: int, seed: int = 42, prefix: str = "pop_", access_requests: Optional[int] = None,
+		max_age_days: float = 90.0, now: Optional[datetime] = None, chunk: int = IMPORT_CHUNK,
+		log: Callable[[str], None] = print, progress_every: float = PROGRESS_SECONDS) -> Dict[str, object]:
+	"""Bulk-insert a synthetic population; returns rows, seconds, rows/s and rows per table.
+
+	Raises ValueError when users named `prefix`... already exist.
+	"""
+	now = now or utcnow()
+	access_requests = users // 10 if access_requests is None else access_requests
+	tables = db.metadata.tables
+	keys = current_app.extensions.get("shards") or [None]
+	engines = [db.engines[key] for key in keys]
+	users_table = tables["users"]
+	if db.session.execute(select(users_table.c.id).where(
+		users_table.c.username >= prefix, users_table.c.username < prefix + "\U0010ffff"
+	).limit(1)).first():
+		raise ValueError(f"Users named {prefix}... already exist; pick another prefix")
+
+	plan = _Plan(users, seed, prefix, len(engines), max_age_days)
+	first_user = _next_id(engines[0], users_table)
+	password_hash = generate_password_hash("password", method=hash_method())
+
+	# Values come from rng.random() arithmetic (randint() and choice() cost several times more), built a
+	# column at a time per batch of owners and zipped into tuples in table column order that go to
+	# executemany untouched; about 1.5x faster than assembling each row's tuple in a loop
+	ago = _Ago(now)
+	# Pets were last fed, played with, bathed and put to bed in the last RECENT_SECONDS
+	recent_texts = [ago(seconds) for seconds in range(RECENT_SECONDS + 1)]
+
+	def user_rows():
+		draw = random.Random(f"{seed}:users").random
+		for batch in _batches(range(users), chunk):
+			yield from zip(
+				[first_user + n for n in batch], [f"{prefix}{n:07d}" for n in batch], repeat(password_hash),
+				repeat(False), repeat(False), [ago(plan.age[n] + draw() * 600) for n in batch],
+				[plan.shard[n] for n in batch], repeat(False),
+				[ago(draw() * 48 * 3600) if draw() < 0.3 else None for _ in batch],
+			)
+
+	def pet_rows(shard, first_pet):
+		draw = random.Random(f"{seed}:pets:{shard}").random
+		first = first_pet
+		for batch in _batches(plan.owners(shard), chunk):
+			ages = [plan.age[n] for n in batch]
+			recent = [min(age, RECENT_SECONDS) for age in ages]
+			# 0..100, leaning towards well looked-after pets; sleeping pets are low on energy
+			hunger, happiness, cleanliness = ([int(101 * max(draw(), draw())) for _ in batch] for _ in range(3))
+			energy = [int(draw() * 51) if plan.activity[n] == _SLEEPING else int(101 * max(draw(), draw())) for n in batch]
+			yield from zip(
+				range(first, first + len(batch)), [first_user + n for n in batch],
+				[PET_TYPES[int(draw() * len(PET_TYPES))] for _ in batch],
+				[f"{PET_NAMES[int(draw() * len(PET_NAMES))]} {n}" for n in batch],
+				hunger, happiness, cleanliness, energy,
+				*([recent_texts[int(draw() * seconds)] for seconds in recent] for _ in range(4)),
+				[ago(age) for age in ages],
+			)
+			first += len(batch)
+
+	def activity_rows(shard, first_pet):
+		rng = random.Random(f"{seed}:activities:{shard}")
+		for k, n in enumerate(plan.owners(shard)):
+			if plan.activity[n] == _SLEEPING:
+				kind, kind_type = "sleep", rng.choice(list(SLEEP_DURATIONS))
+				duration = SLEEP_DURATIONS[kind_type]["minutes"] * 60
+			elif plan.activity[n] == _WASHING:
+				kind, kind_type = "wash", rng.choice(list(WASH_DURATIONS))
+				duration = WASH_DURATIONS[kind_type]
+			else:
+				continue
+			start = now - timedelta(seconds=rng.uniform(0, duration * 0.9))
+			yield (first_pet + k, kind, kind_type, _text(start), _text(start + timedelta(seconds=duration)))
+
+	def inventory_rows(shard, first_inventory):
+		rng = random.Random(f"{seed}:inventories:{shard}")
+		draw, coins = rng.random, rng.expovariate
+		first = first_inventory
+		for batch in _batches(plan.owners(shard), chunk):
+			yield from zip(
+				range(first, first + len(batch)), [first_user + n for n in batch],
+				[int(coins(1 / 150)) for _ in batch],
+				*([int(draw() * 16) for _ in batch] for _ in FOOD_TYPES),
+				repeat(0), [ago(plan.age[n]) for n in batch],
+			)
+			first += len(batch)
+
+	def request_rows(first_request):
+		rng = random.Random(f"{seed}:access_requests")
+		draw = rng.random
+		for k in range(access_requests):
+			yield (first_request + k, f"applicant{first_request + k}@example.com",
+				REQUEST_MESSAGES[int(draw() * len(REQUEST_MESSAGES))], ago(draw() * 30 * 86400), draw() < PROCESSED_SHARE)
+
+	def header(name, shard, columns, rows):
+		return {"table": name, "shard": shard, "columns": columns, "rows": rows}
+
+	def sections():
+		yield header("users", 0, ["id", "username", "password_hash", "is_admin", "must_change_password",
+			"created_at", "shard", "shard_moving", "last_played_higher_lower"], users), user_rows()
+		if access_requests:
+			yield header("access_requests", 0, ["id", "email", "message", "created_at", "processed"],
+				access_requests), request_rows(_next_id(engines[0], tables["access_requests"]))
+		for shard, engine in enumerate(engines):
+			owners = plan.shard.count(shard)
+			active = sum(1 for n in plan.owners(shard) if plan.activity[n] != _IDLE)
+			first_pet = _next_id(engine, tables["pets"])
+			yield header("pets", shard, ["id", "owner_id", "pet_type", "name", "hunger", "happiness", "cleanliness",
+				"energy", "last_fed", "last_played", "last_bathed", "last_slept", "created_at"], owners), pet_rows(shard, first_pet)
+			yield header("pet_activities", shard, ["pet_id", "kind", "activity_type", "start_time", "end_time"],
+				active), activity_rows(shard, first_pet)
+			yield header("inventories", shard, ["id", "owner_id", "coins", *FOOD_TYPES, "ledger_seq", "created_at"],
+				owners), inventory_rows(shard, _next_id(engine, tables["inventories"]))
+
+	names = ["users", "access_requests", "pets", "pet_activities", "inventories"]
+	summary = load_sections(names, sections(), chunk=chunk, log=log, progress_every=progress_every,
+		driver_values=True)
+	active = sum(1 for value in plan.activity if value != _IDLE)
+	summary["tables"] = {
+		"users": users, "pets": users, "pet_activities": active, "inventories": users,
+		"access_requests": access_requests,
+	}
+	return summary
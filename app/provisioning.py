@@ -0,0 +1,176 @@
+"""
+Bulk user provisioning.
+
+Creates many accounts at once from a roster (one username per line, or CSV
+with username[,pet_type,pet_name]). Temporary passwords are hashed in a
+process pool across cores, users/pets/inventories go in with executemany
+bulk inserts in a single transaction, and the generated credentials come
+back as CSV for the admin to hand out.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from .clock import utcnow
+from .constants import INVENTORY_DEFAULTS, PET_TYPES
+from .extensions import db
+from .models import Inventory, Pet, User
+from .passwords import DEFAULT_METHOD, hash_method
+from .sharding import on_shard
+
+
+MAX_BATCH = 5000
+# Below this many passwords the pool start-up costs more than it saves
+POOL_THRESHOLD = 8
+LOOKUP_CHUNK = 500
+USERNAME_MAX = User.__table__.c.username.type.length
+PET_NAME_MAX = Pet.__table__.c.name.type.length
+
+
+class RosterEntry(NamedTuple):
+	username: str
+	pet_type: Optional[str] = None
+	pet_name: Optional[str] = None
+
+
+class Credential(NamedTuple):
+	username: str
+	password: str
+	pet_type: Optional[str]
+
+
+def parse_roster(text: str) -> List[RosterEntry]:
+	"""Read a roster: plain usernames or CSV rows; a 'username' header row is skipped"""
+	entries = []
+	for row in csv.reader(io.StringIO(text)):
+		cells = [cell.strip() for cell in row]
+		if not cells or not cells[0] or cells[0].startswith("#"):
+			continue
+		if cells[0].lower() == "username":
+			continue
+		cells += [""] * (3 - len(cells))
+		entries.append(RosterEntry(cells[0], cells[1].lower() or None, cells[2] or None))
+	return entries
+
+
+def hash_passwords(passwords: List[str], workers: Optional[int] = None,
+		method: str = DEFAULT_METHOD) -> List[str]:
+	"""Hash passwords in parallel worker processes (inline for small batches)"""
+	hasher = partial(generate_password_hash, method=method)
+	workers = workers or os.cpu_count() or 1
+	if workers <= 1 or len(passwords) < POOL_THRESHOLD:
+		return [hasher(password) for password in passwords]
+	workers = min(workers, len(passwords))
+	# spawn: never fork a process that holds DB connections and server threads
+	with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+		chunksize = max(1, len(passwords) // (workers * 4))
+		return list(pool.map(hasher, passwords, chunksize=chunksize))
+
+
+def _existing_usernames(usernames: List[str]) -> set:
+	existing = set()
+	for start in range(0, len(usernames), LOOKUP_CHUNK):
+		chunk = usernames[start:start + LOOKUP_CHUNK]
+		existing.update(db.session.scalars(select(User.username).where(User.username.in_(chunk))))
+	return existing
+
+
+def validate_roster(entries: Iterable[RosterEntry], with_pet: bool = False,
+		default_pet_type: Optional[str] = None) -> Tuple[List[RosterEntry], List[Tuple[str, str]]]:
+	"""Split a roster into creatable entries and (username, reason) skips"""
+	accepted, skipped, seen = [], [], set()
+	for entry in entries:
+		username = entry.username
+		pet_type = entry.pet_type or (default_pet_type if with_pet else None)
+		if len(username) > USERNAME_MAX:
+			skipped.append((username, f"username longer than {USERNAME_MAX} characters"))
+		elif username in seen:
+			skipped.append((username, "duplicate in roster"))
+		elif pet_type is not None and pet_type not in PET_TYPES:
+			skipped.append((username, f"unknown pet type {pet_type!r}"))
+		else:
+			seen.add(username)
+			pet_name = (entry.pet_name or pet_type.capitalize())[:PET_NAME_MAX] if pet_type else None
+			accepted.append(RosterEntry(username, pet_type, pet_name))
+
+	existing = _existing_usernames([entry.username for entry in accepted])
+	if existing:
+		skipped.extend((entry.username, "already exists") for entry in accepted if entry.username in existing)
+		accepted = [entry for entry in accepted if entry.username not in existing]
+	return accepted, skipped
+
+
+def provision_users(entries: Iterable[RosterEntry], with_pet: bool = False,
+		default_pet_type: Optional[str] = None,
+		workers: Optional[int] = None) -> Tuple[List[Credential], List[Tuple[str, str]]]:
+	"""Create users (and optionally pets + inventories) in one transaction per database.
+
+	Returns the generated credentials and the skipped (username, reason) pairs.
+	Raises ValueError when the roster exceeds MAX_BATCH.
+	"""
+	entries = list(entries)
+	if len(entries) > MAX_BATCH:
+		raise ValueError(f"At most {MAX_BATCH} users per batch")
+	accepted, skipped = validate_roster(entries, with_pet, default_pet_type)
+	if not accepted:
+		return [], skipped
+
+	passwords = [secrets.token_urlsafe(8) for _ in accepted]
+	hashes = hash_passwords(passwords, workers, hash_method())
+
+	now = utcnow()
+	db.session.execute(insert(User), [
+		{"username": entry.username, "password_hash": password_hash, "must_change_password": True, "created_at": now}
+		for entry, password_hash in zip(accepted, hashes)
+	])
+
+	with_pets = [entry for entry in accepted if entry.pet_type]
+	if with_pets:
+		ids, shards = {}, {}
+		usernames = [entry.username for entry in with_pets]
+		for start in range(0, len(usernames), LOOKUP_CHUNK):
+			chunk = usernames[start:start + LOOKUP_CHUNK]
+			for username, user_id, shard in db.session.execute(
+				select(User.username, User.id, User.shard).where(User.username.in_(chunk))
+			):
+				ids[username] = user_id
+				shards.setdefault(shard, []).append(username)
+		by_username = {entry.username: entry for entry in with_pets}
+		for shard, names in shards.items():
+			with on_shard(shard):
+				db.session.execute(insert(Pet), [
+					{"owner_id": ids[name], "pet_type": by_username[name].pet_type, "name": by_username[name].pet_name}
+					for name in names
+				])
+				db.session.execute(insert(Inventory), [
+					{"owner_id": ids[name], **INVENTORY_DEFAULTS} for name in names
+				])
+	db.session.commit()
+
+	credentials = [
+		Credential(entry.username, password, entry.pet_type)
+		for entry, password in zip(accepted, passwords)
+	]
+	return credentials, skipped
+
+
+def credentials_csv(credentials: Iterable[Credential], skipped: Iterable[Tuple[str, str]] = ()) -> str:
+	"""CSV of username,temporary_password,pet_type,note for download"""
+	out = io.StringIO()
+	writer = csv.writer(out)
+	writer.writerow(["username", "temporary_password", "pet_type", "note"])
+	for credential in credentials:
+		writer.writerow([credential.username, credential.password, credential.pet_type or "", ""])
+	for username, reason in skipped:
+		writer.writerow([username, "", "", f"skipped: {reason}"])
+	return out.getvalue()
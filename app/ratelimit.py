@@ -0,0 +1,227 @@
+"""
+Per-route rate limiting with token buckets.
+
+Each policy refills `rate` tokens per second up to `burst`; a request takes
+one token from the bucket of its identity (user id, client IP, user id
+falling back to IP for anonymous requests, or "form:<field>": the client IP
+plus the submitted value of that form field, for requests that submit it).
+Empty bucket -> 429 with a Retry-After header saying when the next token
+arrives.
+
+Policies are keyed by endpoint in RATE_LIMITS, one policy or a list of them
+(a request must get a token from each); several endpoints may share one
+bucket by using the same policy name. Endpoints without a policy (static
+files, pages) are not limited. The sign-in and access-request forms are
+limited per account/address submitted, under a much higher per-IP ceiling:
+a class signing in together shares one school NAT address.
+
+Backends:
+	LocalLimiter  - in-process buckets, no locks (one set of buckets per worker)
+	SharedLimiter - client for `flask ratelimit-server` on localhost, shared by
+	                all workers; costs one local IPC round trip per request
+
+Client IPs come from request.remote_addr; behind a reverse proxy wrap the
+app in werkzeug's ProxyFix so that is the real client address.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from flask import current_app, jsonify, request, session
+
+from .state_cache import manager_class
+
+
+class Policy(NamedTuple):
+	name: str
+	rate: float  # tokens per second
+	burst: int
+	key: str = "user"  # "user" (falls back to IP when anonymous), "ip" or "form:<field>" (IP + field)
+
+
+DEFAULT_POLICIES = {
+	# Polling: the page polls every few seconds; allow bursts from several tabs
+	"main.get_pet_stats": Policy("stats", 2.0, 20),
+	"main.minigame_availability": Policy("stats", 2.0, 20),
+	"main.pet_history": Policy("stats", 2.0, 20),
+	# Game writes share one bucket per user
+	"main.pet_action": Policy("game_write", 3.0, 10),
+	"main.shop_purchase": Policy("game_write", 3.0, 10),
+	"main.minigame_higher_lower": Policy("game_write", 3.0, 10),
+	"main.minigame_labyrinth": Policy("game_write", 3.0, 10),
+	"main.pet_test_action": Policy("game_write", 3.0, 10),
+	"main.set_maturity_stage": Policy("game_write", 3.0, 10),
+	# Credential guessing per account, and a ceiling per client IP that a whole class behind one
+	# NAT address stays under (the IP ceiling also covers loading the page)
+	"auth.login": [
+		Policy("login", 10 / 60, 10, "form:username"),
+		Policy("login_ip", 1.0, 120, "ip"),
+	],
+	# Form spam per address submitted, and per client IP
+	"auth.request_access": [
+		Policy("request_access", 3 / 3600, 3, "form:email"),
+		Policy("request_access_ip", 60 / 3600, 60, "ip"),
+	],
+}
+
+
+class LocalLimiter:
+	"""Token buckets in a dict of (tokens, updated_at) tuples.
+
+	No lock on the hot path: each check reads a tuple and stores a new one,
+	both atomic under the GIL. Two threads racing on the same key can both
+	spend the same token, so a bucket may over-admit by a request per
+	concurrent racer, which is fine for capacity protection.
+	"""
+
+	def __init__(self, prune_every: int = 10000):
+		self._buckets = {}
+		self._prune_every = prune_every
+		self._calls = 0
+		self._prune_lock = threading.Lock()
+		self.allowed = 0
+		self.limited = 0
+
+	def take(self, key, rate: float, burst: int, now: Optional[float] = None) -> float:
+		"""Take a token; returns 0.0 if allowed, else seconds until one is available"""
+		now = time.monotonic() if now is None else now
+		state = self._buckets.get(key)
+		if state is None:
+			tokens = burst
+		else:
+			tokens, updated_at = state
+			tokens = min(burst, tokens + (now - updated_at) * rate)
+		self._calls += 1
+		if self._calls >= self._prune_every:
+			self._prune(now)
+		if tokens >= 1.0:
+			self._buckets[key] = (tokens - 1.0, now)
+			self.allowed += 1
+			return 0.0
+		self._buckets[key] = (tokens, now)
+		self.limited += 1
+		return (1.0 - tokens) / rate
+
+	def _prune(self, now: float) -> None:
+		"""Drop buckets idle for an hour (they would be full again by then)"""
+		if not self._prune_lock.acquire(blocking=False):
+			return
+		try:
+			self._calls = 0
+			cutoff = now - 3600
+			for key, (_, updated_at) in list(self._buckets.items()):
+				if updated_at < cutoff:
+					self._buckets.pop(key, None)
+		finally:
+			self._prune_lock.release()
+
+	def reset(self) -> None:
+		self._buckets.clear()
+
+	def stats(self) -> dict:
+		return {"buckets": len(self._buckets), "allowed": self.allowed, "limited": self.limited}
+
+
+class SharedLimiter:
+	"""Proxy to a LocalLimiter living in a ratelimit-server process on localhost"""
+
+	def __init__(self, address=("127.0.0.1", 50056), authkey: bytes = b"tamagochi"):
+		manager = manager_class("LimiterManager")
+		manager.register("limiter")
+		self._manager = manager(address=address, authkey=authkey)
+		self._connected = False
+		self._connect_lock = threading.Lock()
+		self._local = threading.local()
+
+	@property
+	def _limiter(self):
+		# Connect on first use; proxies are not thread-safe so keep one per thread
+		proxy = getattr(self._local, "proxy", None)
+		if proxy is None:
+			with self._connect_lock:
+				if not self._connected:
+					self._manager.connect()
+					self._connected = True
+			proxy = self._local.proxy = self._manager.limiter()
+		return proxy
+
+	def take(self, key, rate: float, burst: int, now: Optional[float] = None) -> float:
+		# The server's monotonic clock is the only one all workers agree on
+		return self._limiter.take(key, rate, burst)
+
+	def reset(self) -> None:
+		self._limiter.reset()
+
+	def stats(self) -> dict:
+		return self._limiter.stats()
+
+
+def serve_shared_limiter(address=("127.0.0.1", 50056), authkey: bytes = b"tamagochi") -> None:
+	"""Run a limiter process that SharedLimiter clients connect to (blocks)"""
+	limiter = LocalLimiter()
+	manager = manager_class("LimiterManager")
+	manager.register("limiter", callable=lambda: limiter)
+	manager(address=address, authkey=authkey).get_server().serve_forever()
+
+
+# -- Flask integration -------------------------------------------------------
+
+def _too_many_requests(retry_after: float):
+	retry_after = max(1, math.ceil(retry_after))
+	if request.path.startswith("/api/"):
+		response = jsonify({"error": "Too many requests, slow down", "retry_after": retry_after})
+	else:
+		response = current_app.response_class("Too many requests, please try again shortly", mimetype="text/plain")
+	response.status_code = 429
+	response.headers["Retry-After"] = str(retry_after)
+	return response
+
+
+def make_hook(limiter, policies: dict):
+	"""Build the before_request hook charging each request to its policy's bucket"""
+
+	def check_rate_limit():
+		endpoint_policies = policies.get(request.endpoint)
+		if endpoint_policies is None:
+			return None
+		retry_after = 0.0
+		for policy in endpoint_policies:
+			if policy.key == "user":
+				# Key logged-in users by the id flask-login keeps in the session, so
+				# limiting never needs the user row (throttled requests skip the DB)
+				identity = session.get("_user_id") or request.remote_addr or "unknown"
+			elif policy.key.startswith("form:"):
+				value = request.form.get(policy.key[5:], "").strip().lower()
+				if not value:
+					continue  # Nothing submitted (e.g. loading the form)
+				identity = (request.remote_addr or "unknown", value)
+			else:
+				identity = request.remote_addr or "unknown"
+			retry_after = max(retry_after, limiter.take((policy.name, identity), policy.rate, policy.burst))
+		if retry_after:
+			return _too_many_requests(retry_after)
+		return None
+
+	return check_rate_limit
+
+
+def init_app(app) -> None:
+	if app.config.get("RATE_LIMIT_BACKEND") == "shared":
+		host, port = app.config.get("RATE_LIMIT_ADDRESS", ("127.0.0.1", 50056))
+		limiter = SharedLimiter((host, int(port)), app.config.get("RATE_LIMIT_AUTHKEY", b"tamagochi"))
+	else:
+		limiter = LocalLimiter()
+	policies = dict(DEFAULT_POLICIES)
+	policies.update(app.config.get("RATE_LIMITS") or {})
+	# A policy of None switches limiting off for that endpoint; a list applies every policy in it
+	policies = {
+		endpoint: tuple(Policy(*item) for item in (policy if isinstance(policy, list) else [policy]))
+		for endpoint, policy in policies.items() if policy is not None
+	}
+	app.extensions["rate_limiter"] = limiter
+	app.extensions["rate_limit_policies"] = policies
+	if app.config.get("RATE_LIMIT_ENABLED", True):
+		app.before_request(make_hook(limiter, policies))
@@ -0,0 +1,370 @@
+"""
+Replay of captured traffic (app/capture.py) as a benchmark.
+
+Re-executes a trace through the real views (via Flask's test client)
+against a fresh app on a scratch database and reports latency per endpoint
+next to the latency recorded when the trace was captured, so two branches
+can be compared on the same real workload. Replayed latency is timed around
+the test client call and includes the WSGI round trip the recorded one
+(timed inside the app) leaves out; compare replays with replays.
+
+The scratch database gets every traced user under their recorded id,
+logged in directly (login, logout, register and change-password requests
+are skipped: their passwords were never captured), with a pet and an
+inventory unless the trace shows them choosing one. Pass `state` (an
+export-state dump) to start from the real game state instead.
+
+- speed > 0: each request goes out at its recorded offset divided by
+  `speed`, on an AcceleratedClock running `speed` times real time from the
+  trace's first request, so game time at every request matches the trace.
+  Users are spread over `threads` threads, each user's requests in order
+  on one; "lag" is how late requests went out, so a replayer that cannot
+  keep up shows there rather than as latency.
+- speed 0: as fast as possible on one thread, the FrozenClock set to each
+  request's recorded time; the same trace and state give the same run.
+"""
+from __future__ import annotations
+
+import contextlib
+import heapq
+import json
+import os
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from .capture import FORMAT, VERSION
+from .clock import AcceleratedClock, FrozenClock
+from .constants import PET_TYPES
+from .state_dump import import_state, open_dump
+
+
+# Capture writers flush about once a second per process; a record can follow later ones by this much
+REORDER_SECONDS = 10.0
+SKIPPED_ENDPOINTS = {"auth.login", "auth.logout", "auth.register", "auth.change_password"}
+# Records queued per replay thread ahead of their send time
+QUEUE_DEPTH = 1000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def read_trace(lines: Iterable[str]) -> Iterator[list]:
+	"""Capture records from a trace file's lines (every process may have written a header)"""
+	broken = None
+	for number, line in enumerate(lines, 1):
+		if broken:
+			raise ValueError(broken)
+		if not line.strip():
+			continue
+		try:
+			value = json.loads(line)
+		except ValueError as e:
+			# Fine as the last line: a worker killed mid-write
+			broken = f"Line {number} is not JSON, a corrupt trace? ({e})"
+			continue
+		if isinstance(value, dict):
+			if value.get("format") != FORMAT or value.get("version") != VERSION:
+				raise ValueError(f"Line {number} is not a {FORMAT} v{VERSION} header")
+			continue
+		yield value
+
+
+def in_time_order(records: Iterable[list], window: float = REORDER_SECONDS) -> Iterator[list]:
+	"""Records sorted by time, given none turns up more than `window` seconds after a later one"""
+	heap, newest = [], None
+	for n, record in enumerate(records):
+		heapq.heappush(heap, (record[0], n, record))
+		newest = record[0] if newest is None else max(newest, record[0])
+		while heap[0][0] < newest - window:
+			yield heapq.heappop(heap)[2]
+	while heap:
+		yield heapq.heappop(heap)[2]
+
+
+def _percentiles(samples_ms: List[float]) -> dict:
+	if not samples_ms:
+		return {"n": 0}
+	ordered = sorted(samples_ms)
+
+	def pick(q):
+		return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+	return {
+		"n": len(ordered), "p50": round(pick(0.50), 2), "p90": round(pick(0.90), 2),
+		"p99": round(pick(0.99), 2), "max": round(ordered[-1], 2), "mean": round(sum(ordered) / len(ordered), 2),
+	}
+
+
+class _Tally:
+	"""One replay thread's results, merged at the end"""
+
+	def __init__(self):
+		self.replayed = defaultdict(list)
+		self.recorded = defaultdict(list)
+		self.statuses = defaultdict(Counter)
+		self.lag: List[float] = []
+		self.matched = 0
+		self.errors = 0
+
+
+class TraceReplay:
+	def __init__(self, trace: str, speed: float = 1.0, threads: int = 8, database_url: Optional[str] = None,
+			state: Optional[str] = None, seed: int = 42, reorder_seconds: float = REORDER_SECONDS):
+		self.trace = trace
+		self.speed = speed
+		self.threads = max(1, threads) if speed else 1
+		self.state = state
+		self.seed = seed
+		self.reorder_seconds = reorder_seconds
+
+		# Scanned first, so an empty trace leaves no scratch directory behind
+		self._scan()
+		self._tmpdir = tempfile.mkdtemp(prefix="tamagochi-replay-")
+		if database_url is None:
+			database_url = f"sqlite:///{os.path.join(self._tmpdir, 'replay.sqlite')}"
+		self.database_url = database_url
+		self.start = _EPOCH + timedelta(seconds=self.first)
+		self.clock = FrozenClock(start=self.start)
+
+		from . import create_app
+		self.app = create_app({
+			"SQLALCHEMY_DATABASE_URI": database_url,
+			"CLOCK": self.clock,
+			"TESTING": True,
+			# Multiplied speeds would trip limits the original traffic did not
+			"RATE_LIMIT_ENABLED": False,
+			# Everything in the scratch database, whatever DATABASE_SHARD_URLS says
+			"SQLALCHEMY_SHARD_URLS": [],
+			"JOB_QUEUE_PATH": os.path.join(self._tmpdir, "jobs.sqlite"),
+			# Never append the replay to the trace being replayed
+			"TRAFFIC_CAPTURE_PATH": None,
+		})
+		self.clients = {}
+
+	def close(self) -> None:
+		"""Release the database and remove the scratch directory"""
+		from .extensions import db
+
+		with self.app.app_context():
+			for engine in db.engines.values():
+				engine.dispose()
+		if self._tmpdir is not None:
+			shutil.rmtree(self._tmpdir, ignore_errors=True)
+			self._tmpdir = None
+
+	def __enter__(self) -> "TraceReplay":
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.close()
+
+	# -- setup -------------------------------------------------------------
+
+	def _records(self) -> Iterator[list]:
+		with open_dump(self.trace) as lines:
+			yield from in_time_order(read_trace(lines), self.reorder_seconds)
+
+	def _scan(self) -> None:
+		"""Users, who picks a pet and who is an admin, and the trace's time span"""
+		self.users, self.petless, self.admins = set(), set(), set()
+		self.first = self.last = None
+		self.total = 0
+		with open_dump(self.trace) as lines:
+			for at, user, method, path, endpoint, status, *_ in read_trace(lines):
+				self.total += 1
+				self.first = at if self.first is None else min(self.first, at)
+				self.last = at if self.last is None else max(self.last, at)
+				if user is None:
+					continue
+				self.users.add(user)
+				if endpoint == "main.select_pet" and method == "POST":
+					self.petless.add(user)
+				if "/admin/" in path and status < 400:
+					self.admins.add(user)
+		if not self.total:
+			raise ValueError(f"{self.trace} holds no requests")
+
+	def _client(self, user_id: Optional[int]):
+		client = self.app.test_client()
+		if user_id is not None:
+			with client.session_transaction() as sess:
+				sess["_user_id"] = str(user_id)
+				sess["_fresh"] = True
+		return client
+
+	def _create_users(self) -> None:
+		from .extensions import db
+		from .models import User
+
+		with self.app.app_context():
+			if self.state:
+				with open_dump(self.state) as lines:
+					import_state(lines, log=lambda message: None)
+			existing = set(db.session.scalars(select(User.id)))
+			missing = self.users - existing
+			ordered = sorted(missing)
+			password_hash = generate_password_hash("replay")
+			for start in range(0, len(ordered), 10000):
+				db.session.execute(insert(User), [
+					{"id": user_id, "username": f"replay_{user_id}", "password_hash": password_hash,
+						"is_admin": user_id in self.admins, "created_at": self.start}
+					for user_id in ordered[start:start + 10000]
+				])
+			db.session.commit()
+
+		for user_id in sorted(self.users):
+			self.clients[user_id] = self._client(user_id)
+			if user_id in missing and user_id not in self.petless:
+				self.clients[user_id].post("/select-pet", data={
+					"pet_type": PET_TYPES[user_id % len(PET_TYPES)], "pet_name": f"Pet{user_id}"
+				})
+
+	# -- requests ----------------------------------------------------------
+
+	def _send(self, client, record: list, tally: _Tally) -> None:
+		at, user, method, path, endpoint, status, ms, kind, body, headers = record
+		options = {"method": method, "headers": headers}
+		if kind == "j":
+			options["json"] = body
+		elif kind == "f":
+			options["data"] = body
+		key = f"{method} {endpoint or '(no route)'}"
+		started = time.perf_counter()
+		try:
+			response = client.open(path, **options)
+			response.get_data()
+			response.close()
+			replayed = response.status_code
+		except Exception:
+			# TESTING propagates view errors; the server would have answered 500
+			replayed = 500
+			tally.errors += 1
+		tally.replayed[key].append((time.perf_counter() - started) * 1000)
+		tally.recorded[key].append(ms)
+		tally.statuses[key][replayed] += 1
+		tally.matched += replayed == status
+
+	def _run_frozen(self, records: Iterator[list], tally: _Tally) -> None:
+		anonymous = self._client(None)
+		for record in records:
+			at = _EPOCH + timedelta(seconds=record[0])
+			if at > self.clock.now():
+				self.clock.set(at)
+			self._send(self.clients.get(record[1], anonymous), record, tally)
+
+	def _run_accelerated(self, records: Iterator[list], tallies: List[_Tally]) -> None:
+		self.app.config["CLOCK"] = AcceleratedClock(speed=self.speed, start=self.start)
+		origin = time.perf_counter()
+		queues = [queue.Queue(QUEUE_DEPTH) for _ in range(self.threads)]
+
+		def work(jobs: queue.Queue, tally: _Tally) -> None:
+			anonymous = self._client(None)
+			while True:
+				record = jobs.get()
+				if record is None:
+					return
+				wait = origin + (record[0] - self.first) / self.speed - time.perf_counter()
+				if wait > 0:
+					time.sleep(wait)
+				tally.lag.append(max(0.0, -wait) * 1000)
+				self._send(self.clients.get(record[1], anonymous), record, tally)
+
+		workers = [threading.Thread(target=work, args=(jobs, tally), daemon=True) for jobs, tally in zip(queues, tallies)]
+		for worker in workers:
+			worker.start()
+		# Each user's requests stay in order on one thread; anonymous ones go round the threads
+		for n, record in enumerate(records):
+			queues[(record[1] if record[1] is not None else n) % self.threads].put(record)
+		for jobs in queues:
+			jobs.put(None)
+		for worker in workers:
+			worker.join()
+
+	# -- driver ------------------------------------------------------------
+
+	def run(self) -> dict:
+		random.seed(self.seed)  # minigame rolls use the module-level RNG
+		skipped = Counter()
+
+		def replayable():
+			for record in self._records():
+				if record[4] in SKIPPED_ENDPOINTS:
+					skipped[record[4]] += 1
+				else:
+					yield record
+
+		tallies = [_Tally() for _ in range(self.threads)]
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+			setup_started = time.perf_counter()
+			self._create_users()
+			setup_seconds = time.perf_counter() - setup_started
+			started = time.perf_counter()
+			if self.speed:
+				self._run_accelerated(replayable(), tallies)
+			else:
+				self._run_frozen(replayable(), tallies[0])
+			wall_seconds = time.perf_counter() - started
+
+		replayed, recorded, statuses = defaultdict(list), defaultdict(list), defaultdict(Counter)
+		for tally in tallies:
+			for key, samples in tally.replayed.items():
+				replayed[key].extend(samples)
+				recorded[key].extend(tally.recorded[key])
+				statuses[key].update(tally.statuses[key])
+		sent = sum(len(samples) for samples in replayed.values())
+		endpoints = {
+			key: {
+				"replayed": _percentiles(replayed[key]), "recorded": _percentiles(recorded[key]),
+				"statuses": dict(sorted(statuses[key].items())),
+			}
+			for key in sorted(replayed, key=lambda key: -len(replayed[key]))
+		}
+		return {
+			"trace": self.trace,
+			"mode": f"accelerated x{self.speed:g}, {self.threads} threads" if self.speed else "frozen, as fast as possible",
+			"users": len(self.users),
+			"trace_seconds": round(self.last - self.first, 3),
+			"setup_seconds": round(setup_seconds, 3),
+			"wall_seconds": round(wall_seconds, 3),
+			"requests": sent,
+			"requests_per_second": round(sent / wall_seconds, 1) if wall_seconds else None,
+			"skipped": dict(skipped),
+			"status_match": round(sum(tally.matched for tally in tallies) / sent, 4) if sent else None,
+			"errors": sum(tally.errors for tally in tallies),
+			"lag_ms": _percentiles([lag for tally in tallies for lag in tally.lag]),
+			"endpoints": endpoints,
+		}
+
+
+def run_replay(trace: str, **kwargs) -> dict:
+	"""Build a scratch app, replay the trace and return its report"""
+	with TraceReplay(trace, **kwargs) as replay:
+		return replay.run()
+
+
+def format_report(report: dict) -> str:
+	lines = [
+		f"Trace: {report['trace']}  users: {report['users']}  span: {report['trace_seconds']}s  mode: {report['mode']}",
+		f"Setup: {report['setup_seconds']}s  run: {report['wall_seconds']}s  "
+		f"requests: {report['requests']}  throughput: {report['requests_per_second']} req/s",
+		f"Status codes matching the trace: {report['status_match']}  errors: {report['errors']}  skipped: {report['skipped']}",
+	]
+	if report["lag_ms"]["n"]:
+		lag = report["lag_ms"]
+		lines.append(f"Send lag ms: p50 {lag['p50']}  p99 {lag['p99']}  max {lag['max']}")
+	lines.append("Latency ms (replayed / recorded):")
+	lines.append(f"  {'endpoint':<40} {'n':>7}" + "".join(f"{name:>16}" for name in ("p50", "p90", "p99", "max")) + "  statuses")
+	for key, stats in report["endpoints"].items():
+		replayed, recorded = stats["replayed"], stats["recorded"]
+		cells = "".join(f"{replayed[name]:.1f}/{recorded[name]:.1f}".rjust(16) for name in ("p50", "p90", "p99", "max"))
+		lines.append(f"  {key:<40} {replayed['n']:>7}{cells}  {stats['statuses']}")
+	return "\n".join(lines)
@@ -0,0 +1,222 @@
+"""
+Read-replica routing for read-only GET endpoints.
+
+With DATABASE_REPLICA_URLS set (comma-separated; Postgres streaming
+replicas, or any database holding a copy of the schema, such as a SQLite
+snapshot), every replica becomes a Flask-SQLAlchemy bind named replica<n>
+and db.session is a RoutingSession:
+
+- Only views marked @replica_ok read from a replica: endpoints that never
+  write (admin listings, pet history, minigame availability). A GET/HEAD
+  request to one is pinned, in a before_request hook, to the next healthy
+  replica (round robin) and its reads go there. Every other request,
+  including GETs that update what they read (the game page, pet stats,
+  pet selection), stays on the primary, so stale replica rows are never
+  flushed back.
+- The per-user game tables (PRIMARY_TABLES) are read from the primary even
+  in marked requests: a second device must not see a pet or inventory
+  older than the write another device just made. Flushes, Core
+  INSERT/UPDATE/DELETE and SELECT ... FOR UPDATE always go to the primary,
+  and once the request has written, its later reads do too.
+- Read-your-writes: a request that wrote stamps the user's (cookie) session
+  with now + REPLICA_READ_YOUR_WRITES_SECONDS, and until then that user's
+  requests read from the primary on whichever worker serves them.
+- Lag: every REPLICA_CHECK_SECONDS a request probes its replica (Postgres:
+  now() - pg_last_xact_replay_timestamp(); other databases report none)
+  and replicas behind by more than REPLICA_MAX_LAG_SECONDS are skipped. A
+  replica that fails the probe or drops a connection is skipped for
+  REPLICA_RETRY_SECONDS. With no usable replica, reads use the primary.
+
+Keep REPLICA_MAX_LAG_SECONDS below the read-your-writes window, so a user
+never reads data older than their last write. CLI commands, job workers and
+unmarked endpoints never touch the replicas.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from flask import current_app, request, session as cookie_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.dml import UpdateBase
+
+
+BIND_PREFIX = "replica"
+READ_METHODS = ("GET", "HEAD")
+# Per-user game state, read-modify-written by the game endpoints
+PRIMARY_TABLES = frozenset({"pets", "inventories", "pet_activities"})
+_PIN_KEY = "replica_bind"
+_WROTE_KEY = "replica_wrote"
+_PRIMARY_UNTIL = "_primary_until"
+
+
+class RoutingSession(Session):
+	"""db.session: reads of a pinned request go to its replica bind"""
+
+	def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+		writing = (
+			self._flushing or isinstance(clause, UpdateBase)
+			or getattr(clause, "_for_update_arg", None) is not None
+		)
+		if writing:
+			self.info[_WROTE_KEY] = True
+		pinned = self.info.get(_PIN_KEY)
+		if (
+			pinned is None or bind is not None or writing or self.info.get(_WROTE_KEY)
+			or _reads_primary_table(mapper, clause)
+		):
+			return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+		engine = super().get_bind(mapper=mapper, clause=clause, **kwargs)
+		# Models on another bind (none today) keep it
+		if engine is not self._db.engines.get(None):
+			return engine
+		return self._db.engines[pinned]
+
+
+def _reads_primary_table(mapper, clause) -> bool:
+	if mapper is not None:
+		return mapper.local_table.name in PRIMARY_TABLES
+	final_froms = getattr(clause, "get_final_froms", None)
+	if final_froms is None:
+		return False
+	return any(getattr(table, "name", None) in PRIMARY_TABLES for table in final_froms())
+
+
+class ReplicaSet:
+	"""Health, lag and round-robin choice of the configured replicas"""
+
+	def __init__(self, keys: List[str], check_interval: float, max_lag: float, retry_after: float) -> None:
+		self.keys = keys
+		self.check_interval = check_interval
+		self.max_lag = max_lag
+		self.retry_after = retry_after
+		self._lock = threading.Lock()
+		self._next = 0
+		self._checked: Dict[str, float] = {key: 0.0 for key in keys}
+		self._down_until: Dict[str, float] = {key: 0.0 for key in keys}
+		self.lag: Dict[str, Optional[float]] = {key: None for key in keys}
+		self._watched: set = set()
+
+	def mark_down(self, key: str) -> None:
+		self._down_until[key] = time.monotonic() + self.retry_after
+		print(f"REPLICA DEBUG: {key} unavailable, reading from the primary for {self.retry_after:.0f}s")
+
+	def _watch(self, key: str, engine) -> None:
+		# A dropped connection mid-request also takes the replica out of rotation
+		def on_error(context):
+			if context.is_disconnect:
+				self.mark_down(key)
+
+		event.listen(engine, "handle_error", on_error)
+		self._watched.add(key)
+
+	def _probe(self, key: str, engine) -> None:
+		if key not in self._watched:
+			self._watch(key, engine)
+		self._checked[key] = time.monotonic()
+		try:
+			with engine.connect() as conn:
+				if engine.dialect.name == "postgresql":
+					lag = conn.scalar(text("SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"))
+					# NULL on a primary or a replica that has replayed nothing yet
+					self.lag[key] = float(lag) if lag is not None else 0.0
+				else:
+					conn.execute(text("SELECT 1"))
+					self.lag[key] = 0.0
+		except Exception as e:
+			print(f"REPLICA DEBUG: probe of {key} failed: {e}")
+			self.mark_down(key)
+
+	def choose(self, engines) -> Optional[str]:
+		"""Next usable replica's bind key, or None for the primary"""
+		now = time.monotonic()
+		with self._lock:
+			start = self._next
+			self._next = (self._next + 1) % len(self.keys)
+		for offset in range(len(self.keys)):
+			key = self.keys[(start + offset) % len(self.keys)]
+			if self._down_until[key] > now:
+				continue
+			if now - self._checked[key] >= self.check_interval:
+				self._probe(key, engines[key])
+				if self._down_until[key] > now:
+					continue
+			if self.lag[key] is not None and self.lag[key] <= self.max_lag:
+				return key
+		return None
+
+	def stats(self) -> dict:
+		now = time.monotonic()
+		return {
+			key: {"lag_seconds": self.lag[key], "down": self._down_until[key] > now}
+			for key in self.keys
+		}
+
+
+def _db():
+	return current_app.extensions["sqlalchemy"]
+
+
+def replica_ok(view: Callable) -> Callable:
+	"""Mark a view that only reads as safe to serve from a replica (GET/HEAD)"""
+	view.replica_ok = True
+	return view
+
+
+def _pin_reads() -> None:
+	if request.method not in READ_METHODS:
+		return
+	view = current_app.view_functions.get(request.endpoint)
+	if not getattr(view, "replica_ok", False):
+		return
+	if cookie_session.get(_PRIMARY_UNTIL, 0) > time.time():
+		return
+	db = _db()
+	key = current_app.extensions["replicas"].choose(db.engines)
+	if key is not None:
+		db.session.info[_PIN_KEY] = key
+
+
+def _remember_writes(response):
+	db = _db()
+	if db.session.info.get(_WROTE_KEY):
+		cookie_session[_PRIMARY_UNTIL] = time.time() + current_app.config.get("REPLICA_READ_YOUR_WRITES_SECONDS", 5.0)
+	return response
+
+
+def pinned_replica() -> Optional[str]:
+	"""Bind key the current request reads from, or None for the primary"""
+	db = _db()
+	if db.session.info.get(_WROTE_KEY):
+		return None
+	return db.session.info.get(_PIN_KEY)
+
+
+def stats() -> dict:
+	replicas = current_app.extensions.get("replicas")
+	return replicas.stats() if replicas is not None else {}
+
+
+def init_app(app) -> None:
+	"""Register the replica binds and hooks; call before db.init_app(app)"""
+	urls = app.config.get("SQLALCHEMY_REPLICA_URLS") or []
+	if not urls:
+		return
+	binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+	keys = []
+	for n, url in enumerate(urls):
+		key = f"{BIND_PREFIX}{n}"
+		binds[key] = url
+		keys.append(key)
+	app.config["SQLALCHEMY_BINDS"] = binds
+	replicas = ReplicaSet(
+		keys,
+		check_interval=app.config.get("REPLICA_CHECK_SECONDS", 5.0),
+		max_lag=app.config.get("REPLICA_MAX_LAG_SECONDS", 2.0),
+		retry_after=app.config.get("REPLICA_RETRY_SECONDS", 30.0),
+	)
+	app.extensions["replicas"] = replicas
+	app.before_request(_pin_reads)
+	app.after_request(_remember_writes)
@@ -0,0 +1,169 @@
+"""
+Per-day analytics rollups: daily_rollups holds one value per (day, metric, key).
+
+Counters are bumped by the views in the transaction that does the work:
+bump() queues the increment on the session and a before_commit listener
+upserts the queue (value = value + n), so a rolled-back request counts
+nothing and an Idempotency-Key replay is not counted twice. Counters:
+
+	action           key = feed / play / wash / sleep
+	feed, play, wash, sleep
+	                 key = food / play / wash / sleep type
+	shop_orders, shop_units, shop_revenue
+	                 key = food type (revenue in coins)
+	minigame_plays, minigame_wins
+	                 key = higher_lower / labyrinth
+
+Gauges are overwritten by refresh_gauges() (`flask refresh-rollups`):
+
+	maturity         key = child / teen / adult, pets in that stage
+	pets             key = total
+
+Maturity is a function of created_at, so stage counts are range counts on
+the pets.created_at index rather than a scan. The admin dashboard
+(dashboard()) reads daily_rollups only.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import and_, event, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .clock import utcnow
+from .constants import MATURITY_DURATIONS_DAYS, MATURITY_ORDER
+from .extensions import db
+from .models import DailyRollup, Pet
+from .sharding import each_shard
+
+
+_PENDING_KEY = "rollups_pending"
+# Minigames that can be lost; the others have no win rate
+SCORED_GAMES = ("higher_lower",)
+_listeners_registered = False
+
+
+def bump(metric: str, key: str, amount: int = 1) -> None:
+	"""Add `amount` to today's (metric, key) counter when the session commits"""
+	if amount:
+		db.session.info.setdefault(_PENDING_KEY, Counter())[(metric, key)] += amount
+
+
+def record_action(action: str, kind: str) -> None:
+	"""Count one pet action and its food/play/wash/sleep type"""
+	bump("action", action)
+	bump(action, kind)
+
+
+def _upsert(connection, rows: Iterable[dict], increment: bool) -> None:
+	table = DailyRollup.__table__
+	rows = list(rows)
+	if not rows:
+		return
+	dialect = connection.dialect.name
+	if dialect in ("sqlite", "postgresql"):
+		insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+		stmt = insert(table)
+		value = table.c.value + stmt.excluded.value if increment else stmt.excluded.value
+		connection.execute(
+			stmt.on_conflict_do_update(index_elements=["day", "metric", "key"], set_={"value": value}),
+			rows
+		)
+		return
+	for row in rows:
+		match = and_(table.c.day == row["day"], table.c.metric == row["metric"], table.c.key == row["key"])
+		new_value = table.c.value + row["value"] if increment else row["value"]
+		if connection.execute(update(table).where(match).values(value=new_value)).rowcount == 0:
+			connection.execute(table.insert(), row)
+
+
+def _before_commit(session) -> None:
+	pending = session.info.pop(_PENDING_KEY, None)
+	if not pending:
+		return
+	day = utcnow().date()
+	_upsert(session.connection(), (
+		{"day": day, "metric": metric, "key": key, "value": amount}
+		for (metric, key), amount in pending.items()
+	), increment=True)
+
+
+def _after_soft_rollback(session, previous_transaction) -> None:
+	# Soft rollback also fires when no transaction had begun yet
+	session.info.pop(_PENDING_KEY, None)
+
+
+def maturity_counts(now: Optional[datetime] = None) -> Dict[str, int]:
+	"""Pets per maturity stage, by range counts on pets.created_at in every shard"""
+	now = now or utcnow()
+	child_days = MATURITY_DURATIONS_DAYS.get("child") or 0
+	teen_days = child_days + (MATURITY_DURATIONS_DAYS.get("teen") or 0)
+	# Same boundaries as Pet.compute_maturity_stage (elapsed < duration)
+	child_since = now - timedelta(days=child_days)
+	teen_since = now - timedelta(days=teen_days)
+	count = db.func.count()
+	total = child = teen = 0
+	for _ in each_shard():
+		total += db.session.scalar(select(count).select_from(Pet))
+		child += db.session.scalar(select(count).where(Pet.created_at > child_since))
+		teen += db.session.scalar(select(count).where(Pet.created_at > teen_since, Pet.created_at <= child_since))
+	return {"child": child, "teen": teen, "adult": total - child - teen}
+
+
+def refresh_gauges(now: Optional[datetime] = None) -> Dict[str, int]:
+	"""Overwrite today's maturity and pet-count gauges; returns the stage counts"""
+	now = now or utcnow()
+	stages = maturity_counts(now)
+	day = now.date()
+	rows = [{"day": day, "metric": "maturity", "key": stage, "value": stages[stage]} for stage in MATURITY_ORDER]
+	rows.append({"day": day, "metric": "pets", "key": "total", "value": sum(stages.values())})
+	_upsert(db.session.connection(), rows, increment=False)
+	db.session.commit()
+	return stages
+
+
+def dashboard(days: int = 7, today: Optional[date] = None) -> dict:
+	"""Rollups of the last `days` days, newest first, plus the latest gauges"""
+	today = today or utcnow().date()
+	since = today - timedelta(days=days - 1)
+	rows = db.session.execute(
+		select(DailyRollup.day, DailyRollup.metric, DailyRollup.key, DailyRollup.value)
+		.where(DailyRollup.day >= since, DailyRollup.day <= today)
+		.order_by(DailyRollup.day.desc())
+	)
+	by_day = {}
+	gauges, gauges_day = {}, None
+	for day, metric, key, value in rows:
+		if metric in ("maturity", "pets"):
+			# Only the most recent refresh matters for gauges
+			if gauges_day is None:
+				gauges_day = day
+			if day == gauges_day:
+				gauges.setdefault(metric, {})[key] = value
+			continue
+		by_day.setdefault(day.isoformat(), {}).setdefault(metric, {})[key] = value
+
+	for metrics in by_day.values():
+		plays, wins = metrics.get("minigame_plays", {}), metrics.get("minigame_wins", {})
+		metrics["minigame_win_rate"] = {
+			game: round(wins.get(game, 0) / count, 3)
+			for game, count in plays.items() if count and game in SCORED_GAMES
+		}
+	return {
+		"since": since.isoformat(),
+		"days": by_day,
+		"maturity": gauges.get("maturity", {}),
+		"pets": gauges.get("pets", {}).get("total"),
+		"gauges_as_of": gauges_day.isoformat() if gauges_day else None,
+	}
+
+
+def init_app(app) -> None:
+	global _listeners_registered
+	if _listeners_registered:
+		return
+	event.listen(db.session, "before_commit", _before_commit)
+	event.listen(db.session, "after_soft_rollback", _after_soft_rollback)
+	_listeners_registered = True
@@ -0,0 +1,290 @@
+"""
+Pre-fork HTTP server for production (`python serve.py`).
+
+The master binds the listening socket and builds the app once, so schema
+checks, migrations and the admin seed run there only. It then compiles
+every template and the URL map, disposes the SQLAlchemy engines so no
+pooled connection crosses a fork, runs gc.freeze() and forks the workers,
+which share all of that copy-on-write and serve the inherited socket with
+Werkzeug's threaded server. With --no-preload each worker builds its own
+app after the fork instead (the old one-app-per-process behaviour).
+
+Signals to the master:
+	SIGTERM, SIGINT  stop; workers finish in-flight requests (up to --grace seconds)
+	SIGHUP           graceful reload: re-exec the master on the same socket; the new
+	                 master forks fresh workers, then retires the old ones
+Workers that exit are replaced.
+
+Per-process state does not survive the fork as one: with more than one
+worker the in-process state cache (STATE_CACHE_BACKEND=local) is turned
+off, since a write in one worker would leave the others serving stale
+state until the TTL, and a per-process rate limiter (RATE_LIMIT_BACKEND=
+local) is refused, since every worker would grant the full limit. Run
+`flask cache-server` / `flask ratelimit-server` and set the backends to
+"shared" (or RATE_LIMIT_ENABLED=0, or --workers 1).
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from werkzeug.serving import make_server
+
+from .extensions import db
+
+
+LISTEN_FD_ENV = "TAMAGOCHI_LISTEN_FD"
+RETIRE_PIDS_ENV = "TAMAGOCHI_RETIRE_PIDS"
+# Exit status of a worker whose app can't run with this many workers; the master stops
+EX_CONFIG = 78
+
+
+def _log(message: str, stream=None) -> None:
+	# One write per line, so lines from several processes don't interleave
+	stream = stream or sys.stdout
+	stream.write(message + "\n")
+	stream.flush()
+
+
+def default_workers() -> int:
+	"""One worker per core this process may run on"""
+	try:
+		return max(1, len(os.sched_getaffinity(0)))
+	except AttributeError:
+		return max(1, os.cpu_count() or 1)
+
+
+def listen(host: str, port: int, backlog: int = 2048) -> socket.socket:
+	"""The listening socket, inherited from the previous master after a reload"""
+	fd = os.environ.pop(LISTEN_FD_ENV, None)
+	if fd is not None:
+		sock = socket.socket(fileno=int(fd))
+	else:
+		sock = socket.create_server((host, port), backlog=backlog)
+	# Workers race for each connection; the losers must not block in accept()
+	sock.setblocking(False)
+	return sock
+
+
+def check_worker_state(app: Flask, workers: int) -> None:
+	"""Turn off per-process caching and refuse a per-process rate limiter when serving with several workers"""
+	if workers < 2:
+		return
+	config = app.config
+	if config.get("STATE_CACHE_ENABLED", True) and config.get("STATE_CACHE_BACKEND") != "shared":
+		config["STATE_CACHE_ENABLED"] = False
+		_log(f"WARNING: state cache turned off: with {workers} workers a per-process cache keeps serving "
+			"state another worker changed; run `flask cache-server` and set STATE_CACHE_BACKEND=shared", sys.stderr)
+	if config.get("RATE_LIMIT_ENABLED", True) and config.get("RATE_LIMIT_BACKEND") != "shared":
+		raise SystemExit(
+			f"Refusing to serve with {workers} workers and per-process rate limits (each worker would allow "
+			"the full limit): run `flask ratelimit-server` and set RATE_LIMIT_BACKEND=shared, "
+			"set RATE_LIMIT_ENABLED=0, or use --workers 1"
+		)
+
+
+def warm(app: Flask) -> dict:
+	"""Do first-use work once so forked workers inherit it"""
+	templates = 0
+	for name in app.jinja_env.list_templates():
+		if name.endswith(".html"):
+			app.jinja_env.get_template(name)
+			templates += 1
+	try:
+		app.url_map.bind("localhost").match("/")
+	except (HTTPException, RequestRedirect):
+		pass
+	with app.app_context():
+		for engine in db.engines.values():
+			engine.dispose()
+	return {"templates": templates}
+
+
+def _serve_worker(app: Flask, sock: socket.socket, host: str, grace: float) -> None:
+	server = make_server(host, sock.getsockname()[1], app, threaded=True, fd=sock.fileno())
+	# Track request threads so shutdown can wait for them
+	server.daemon_threads = False
+	stopping = threading.Event()
+
+	def stop(signum, frame):
+		if not stopping.is_set():
+			stopping.set()
+			threading.Thread(target=server.shutdown, daemon=True).start()
+
+	def watch_master(master: int) -> None:
+		# A master that died without stopping us leaves nobody to replace workers
+		while not stopping.wait(1.0):
+			if os.getppid() != master:
+				stop(None, None)
+
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	signal.signal(signal.SIGHUP, signal.SIG_IGN)
+	threading.Thread(target=watch_master, args=(os.getppid(),), daemon=True).start()
+	server.serve_forever(poll_interval=0.5)
+	# Idle keep-alive connections would block server_close() forever
+	closer = threading.Thread(target=server.server_close, daemon=True)
+	closer.start()
+	closer.join(grace)
+
+
+def _run_worker(app_factory: Callable[[], Flask], app: Optional[Flask], sock: socket.socket,
+		host: str, grace: float, workers: int) -> None:
+	started = time.perf_counter()
+	gc.enable()
+	if app is None:
+		app = app_factory()
+		try:
+			check_worker_state(app, workers)
+		except SystemExit as e:
+			_log(f"Worker {os.getpid()}: {e}", sys.stderr)
+			sys.stdout.flush()
+			os._exit(EX_CONFIG)
+	_log(f"Worker {os.getpid()} ready in {time.perf_counter() - started:.3f}s")
+	code = 0
+	try:
+		_serve_worker(app, sock, host, grace)
+	except BaseException as e:
+		_log(f"Worker {os.getpid()} crashed: {e!r}", sys.stderr)
+		code = 1
+	finally:
+		# os._exit skips atexit: write out the last captured requests
+		recorder = app.extensions.get("traffic_capture")
+		if recorder is not None:
+			recorder.flush()
+		sys.stdout.flush()
+		os._exit(code)
+
+
+def _stop_workers(pids: List[int], grace: float) -> None:
+	for pid in pids:
+		try:
+			os.kill(pid, signal.SIGTERM)
+		except ProcessLookupError:
+			pass
+	deadline = time.monotonic() + grace + 1
+	remaining = set(pids)
+	while remaining and time.monotonic() < deadline:
+		for pid in list(remaining):
+			try:
+				if os.waitpid(pid, os.WNOHANG)[0]:
+					remaining.discard(pid)
+			except ChildProcessError:
+				remaining.discard(pid)
+		time.sleep(0.05)
+	for pid in remaining:
+		try:
+			os.kill(pid, signal.SIGKILL)
+			os.waitpid(pid, 0)
+		except (ProcessLookupError, ChildProcessError):
+			pass
+
+
+def serve(app_factory: Callable[[], Flask], host: str = "127.0.0.1", port: int = 8000,
+		workers: Optional[int] = None, preload: bool = True, grace: float = 30.0) -> None:
+	"""Run the master until SIGTERM/SIGINT (blocks; SIGHUP re-execs it)"""
+	started = time.perf_counter()
+	workers = workers or default_workers()
+	sock = listen(host, port)
+	retire = [int(pid) for pid in os.environ.pop(RETIRE_PIDS_ENV, "").split(",") if pid]
+
+	app = None
+	if preload:
+		# Objects created from here on are never collected in the master, so the
+		# collector won't touch (and un-share) their pages in the workers
+		gc.disable()
+		app = app_factory()
+		check_worker_state(app, workers)
+		warmed = warm(app)
+		gc.freeze()
+		_log(f"Master {os.getpid()} built and warmed the app in {time.perf_counter() - started:.3f}s "
+			f"({warmed['templates']} templates)")
+
+	children: Dict[int, float] = {}
+
+	def spawn() -> None:
+		pid = os.fork()
+		if pid == 0:
+			signal.signal(signal.SIGHUP, signal.SIG_DFL)
+			_run_worker(app_factory, app, sock, host, grace, workers)
+		children[pid] = time.monotonic()
+
+	state = {"stop": False, "reload": False, "failed": False}
+	signal.signal(signal.SIGTERM, lambda signum, frame: state.update(stop=True))
+	signal.signal(signal.SIGINT, lambda signum, frame: state.update(stop=True))
+	signal.signal(signal.SIGHUP, lambda signum, frame: state.update(reload=True))
+
+	for _ in range(workers):
+		spawn()
+	_log(f"Serving on http://{host}:{sock.getsockname()[1]} with {workers} workers "
+		f"({'preloaded' if preload else 'app per worker'})")
+	# A reload's previous generation keeps serving until now
+	_stop_workers(retire, grace)
+
+	try:
+		_supervise(state, children, spawn, sock)
+	finally:
+		_stop_workers(list(children), grace)
+		sock.close()
+	if state["failed"]:
+		sys.exit(EX_CONFIG)
+
+
+def _supervise(state: dict, children: Dict[int, float], spawn: Callable[[], None], sock: socket.socket) -> None:
+	while not state["stop"]:
+		if state["reload"]:
+			_log(f"Master {os.getpid()} reloading")
+			os.set_inheritable(sock.fileno(), True)
+			os.environ[LISTEN_FD_ENV] = str(sock.fileno())
+			os.environ[RETIRE_PIDS_ENV] = ",".join(str(pid) for pid in children)
+			sys.stdout.flush()
+			os.execv(sys.executable, [sys.executable, *sys.orig_argv[1:]])
+		try:
+			pid, status = os.waitpid(-1, os.WNOHANG)
+		except ChildProcessError:
+			pid = 0
+		if not pid:
+			time.sleep(0.2)
+			continue
+		if pid in children:
+			lived = time.monotonic() - children.pop(pid)
+			if os.waitstatus_to_exitcode(status) == EX_CONFIG:
+				_log(f"Worker {pid} can't run with this configuration, stopping", sys.stderr)
+				state["failed"] = True
+				break
+			_log(f"Worker {pid} exited with status {status} after {lived:.1f}s, replacing it", sys.stderr)
+			if lived < 1.0:
+				time.sleep(1.0)  # Don't spin if workers die on startup
+			spawn()
+	_log(f"Master {os.getpid()} stopping {len(children)} workers")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+	parser = argparse.ArgumentParser(description="Run the game with pre-forked workers")
+	parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+	parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+	parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", "0")),
+		help="Worker processes (default: one per available core)")
+	parser.add_argument("--no-preload", dest="preload", action="store_false",
+		help="Build the app in every worker after the fork")
+	parser.add_argument("--grace", type=float, default=30.0, help="Seconds workers get to finish requests on stop")
+	parser.add_argument("--quiet", action="store_true", help="No per-request access log")
+	args = parser.parse_args(argv)
+
+	if args.quiet:
+		import logging
+		logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+	from . import create_app
+	serve(create_app, host=args.host, port=args.port, workers=args.workers or None,
+		preload=args.preload, grace=args.grace)
@@ -0,0 +1,319 @@
+"""
+Horizontal sharding of per-user game state.
+
+users (and auth), daily_rollups and the access-request tables stay in the
+primary database. Everything a user owns (SHARDED_TABLES: pets, their
+activities and stat history, inventories, ledger rows, idempotency keys)
+lives in one shard:
+
+	shard 0    the primary database itself (where all existing data is)
+	shard n    the n-th URL in DATABASE_SHARD_URLS (comma-separated), a bind
+	           named shard<n>: SQLite files, or Postgres schemas through the
+	           search path, e.g. postgresql://host/db?options=-csearch_path%3Dshard_1,public
+
+users.shard is the directory. New users are placed by a hash of their
+username; `flask shard-rebalance` evens shards out afterwards by moving
+users (move_users) in batches:
+
+1. set users.shard_moving; that user's requests get 503 + Retry-After
+2. wait SHARD_MOVE_GRACE_SECONDS for requests already running to finish
+3. copy their rows into the target shard (replacing leftovers of an
+   interrupted move; pet ids already taken there are renumbered)
+4. point users.shard at the target and clear the flag, then delete the
+   rows from the source shard
+
+A request is pinned to the logged-in user's shard in a before_request hook;
+elsewhere (CLI, jobs, admin actions on other users) code pins a shard with
+`with on_shard(n):`, and each_shard() walks them all for fan-out queries.
+With shards configured, a statement on a sharded table without a pinned
+shard raises ShardNotPinned rather than guess; one mixing sharded and
+global tables raises too (they may be in different databases). Raw text()
+statements go to the primary unless given bind_arguments={"mapper": ...}.
+Sharded tables never read from replicas. Startup migrations run on the
+primary; shards get the current schema when first created.
+"""
+from __future__ import annotations
+
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from flask import current_app, has_app_context, jsonify, request
+from flask_login import current_user
+from sqlalchemy import Table, delete, func, inspect as sa_inspect, select, update
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.util import find_tables
+
+from .replicas import RoutingSession
+
+
+BIND_PREFIX = "shard"
+# Per-user tables with the column tying a row to its owner, parents first
+SHARDED_TABLES = {
+	"pets": "owner_id",
+	"pet_activities": "pet_id",
+	"pet_stat_history": "pet_id",
+	"inventories": "owner_id",
+	"ledger_entries": "owner_id",
+	"ledger_snapshots": "owner_id",
+	"idempotency_keys": "user_id",
+}
+# Surrogate keys nothing references; the target shard assigns new ones on a move
+_RENUMBERED = ("inventories", "idempotency_keys")
+_SHARD_KEY = "shard"
+_MOVE_CHUNK = 500
+
+
+class ShardNotPinned(RuntimeError):
+	"""A sharded table was used with no shard pinned on the session"""
+
+
+def _db():
+	return current_app.extensions["sqlalchemy"]
+
+
+def _shard_keys() -> List[Optional[str]]:
+	# Bind key per shard number; [None] when sharding is off
+	return current_app.extensions.get("shards") or [None]
+
+
+def shard_count() -> int:
+	return len(_shard_keys()) if has_app_context() else 1
+
+
+def home_shard(username: str, count: Optional[int] = None) -> int:
+	"""Shard a new user is placed on"""
+	count = count or shard_count()
+	return zlib.crc32(username.encode("utf-8")) % count if count > 1 else 0
+
+
+def new_user_shard(context) -> int:
+	"""Column default for users.shard (ORM and Core inserts alike)"""
+	return home_shard(context.get_current_parameters()["username"])
+
+
+def _tables_of(mapper, clause) -> set:
+	tables = set()
+	if mapper is not None:
+		tables.add(sa_inspect(mapper).local_table.name)
+	if isinstance(clause, UpdateBase):
+		tables.add(clause.table.name)
+	elif clause is not None:
+		tables.update(
+			table.name for table in find_tables(clause, check_columns=True, include_crud=True)
+			if isinstance(table, Table)
+		)
+	return tables
+
+
+class ShardedSession(RoutingSession):
+	"""db.session: sharded tables go to the pinned shard's bind"""
+
+	def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+		if bind is None and len(self._db.engines) > 1:
+			keys = _shard_keys()
+			if len(keys) > 1:
+				tables = _tables_of(mapper, clause)
+				sharded = tables & SHARDED_TABLES.keys()
+				if sharded:
+					if sharded != tables:
+						raise ValueError(f"Statement mixes sharded and global tables: {', '.join(sorted(tables))}")
+					shard = self.info.get(_SHARD_KEY)
+					if shard is None:
+						raise ShardNotPinned(f"No shard pinned for {', '.join(sorted(sharded))}; use on_shard()")
+					return self._db.engines[keys[shard]]
+		return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def on_shard(shard: int) -> Iterator[int]:
+	"""Pin db.session's sharded tables to `shard` inside the block"""
+	info = _db().session.info
+	previous = info.get(_SHARD_KEY)
+	info[_SHARD_KEY] = shard
+	try:
+		yield shard
+	finally:
+		if previous is None:
+			info.pop(_SHARD_KEY, None)
+		else:
+			info[_SHARD_KEY] = previous
+
+
+def each_shard() -> Iterator[int]:
+	"""Yield every shard number with it pinned, for fan-out queries"""
+	for shard in range(shard_count()):
+		with on_shard(shard):
+			yield shard
+
+
+def shards_of(user_ids: Iterable[int]) -> Dict[int, List[int]]:
+	"""{shard: user ids} from the directory"""
+	db = _db()
+	users = db.metadata.tables["users"]
+	ids = sorted({int(user_id) for user_id in user_ids})
+	by_shard: Dict[int, List[int]] = {}
+	for start in range(0, len(ids), _MOVE_CHUNK):
+		chunk = ids[start:start + _MOVE_CHUNK]
+		for user_id, shard in db.session.execute(select(users.c.id, users.c.shard).where(users.c.id.in_(chunk))):
+			by_shard.setdefault(shard, []).append(user_id)
+	return by_shard
+
+
+def _pin_user_shard():
+	if request.endpoint == "static" or not current_user.is_authenticated:
+		return None
+	if current_user.shard_moving:
+		response = jsonify({"error": "Your game is being moved to another server, try again in a moment"})
+		response.headers["Retry-After"] = "2"
+		return response, 503
+	_db().session.info[_SHARD_KEY] = current_user.shard
+	return None
+
+
+def create_shard_tables(app) -> None:
+	"""Create the sharded tables (and their indexes) in every extra shard"""
+	db = app.extensions["sqlalchemy"]
+	tables = [db.metadata.tables[name] for name in SHARDED_TABLES]
+	for key in _shard_keys()[1:]:
+		engine = db.engines[key]
+		db.metadata.create_all(bind=engine, tables=tables)
+		for table in tables:
+			for index in table.indexes:
+				index.create(bind=engine, checkfirst=True)
+
+
+def init_app(app) -> None:
+	"""Register the shard binds and request pinning; call before db.init_app(app)"""
+	urls = app.config.get("SQLALCHEMY_SHARD_URLS") or []
+	if not urls:
+		return
+	binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+	keys: List[Optional[str]] = [None]
+	for n, url in enumerate(urls, start=1):
+		binds[f"{BIND_PREFIX}{n}"] = url
+		keys.append(f"{BIND_PREFIX}{n}")
+	app.config["SQLALCHEMY_BINDS"] = binds
+	app.extensions["shards"] = keys
+	app.before_request(_pin_user_shard)
+
+
+# Moving users between shards
+
+def _owned_rows(conn, name: str, owner_ids: List[int], pet_ids: List[int]):
+	table = _db().metadata.tables[name]
+	column = SHARDED_TABLES[name]
+	values = pet_ids if column == "pet_id" else owner_ids
+	if not values:
+		return []
+	return [dict(row._mapping) for row in conn.execute(select(table).where(table.c[column].in_(values)))]
+
+
+def _delete_owned(conn, owner_ids: List[int]) -> None:
+	tables = _db().metadata.tables
+	pets = tables["pets"]
+	pet_ids = select(pets.c.id).where(pets.c.owner_id.in_(owner_ids)).scalar_subquery()
+	for name in reversed(list(SHARDED_TABLES)):
+		table, column = tables[name], SHARDED_TABLES[name]
+		values = pet_ids if column == "pet_id" else owner_ids
+		conn.execute(delete(table).where(table.c[column].in_(values)))
+
+
+def _copy_owned(source, target, owner_ids: List[int]) -> Dict[str, int]:
+	"""Copy the owners' rows from the source connection into the target one"""
+	tables = _db().metadata.tables
+	pets = _owned_rows(source, "pets", owner_ids, [])
+	pet_ids = [row["id"] for row in pets]
+	taken = set(target.scalars(select(tables["pets"].c.id).where(tables["pets"].c.id.in_(pet_ids)))) if pet_ids else set()
+	renumber: Dict[int, int] = {}
+	if taken:
+		next_id = (target.scalar(select(func.max(tables["pets"].c.id))) or 0) + 1
+		for pet_id in sorted(taken):
+			renumber[pet_id] = next_id
+			next_id += 1
+	copied = {}
+	for name in SHARDED_TABLES:
+		rows = pets if name == "pets" else _owned_rows(source, name, owner_ids, pet_ids)
+		for row in rows:
+			if name == "pets":
+				row["id"] = renumber.get(row["id"], row["id"])
+			elif SHARDED_TABLES[name] == "pet_id":
+				row["pet_id"] = renumber.get(row["pet_id"], row["pet_id"])
+			if name in _RENUMBERED:
+				row.pop("id", None)
+		if rows:
+			target.execute(tables[name].insert(), rows)
+		copied[name] = len(rows)
+	return copied
+
+
+def move_users(user_ids: Iterable[int], target: int, batch: int = 100,
+		grace: Optional[float] = None, log: Callable[[str], None] = print) -> int:
+	"""Move users (and everything they own) to shard `target`; returns users moved"""
+	from .state_cache import state_cache
+
+	db = _db()
+	keys = _shard_keys()
+	if not 0 <= target < len(keys):
+		raise ValueError(f"No shard {target}; shards are 0..{len(keys) - 1}")
+	grace = current_app.config.get("SHARD_MOVE_GRACE_SECONDS", 2.0) if grace is None else grace
+	users = db.metadata.tables["users"]
+	primary = db.engines[None]
+	db.session.commit()
+
+	moved = 0
+	for source, ids in sorted(shards_of(user_ids).items()):
+		if source == target:
+			continue
+		for start in range(0, len(ids), batch):
+			chunk = ids[start:start + batch]
+			with primary.begin() as conn:
+				conn.execute(update(users).where(users.c.id.in_(chunk)).values(shard_moving=True))
+			time.sleep(grace)
+			with db.engines[keys[source]].connect() as src, db.engines[keys[target]].begin() as dst:
+				_delete_owned(dst, chunk)
+				copied = _copy_owned(src, dst, chunk)
+			with primary.begin() as conn:
+				conn.execute(update(users).where(users.c.id.in_(chunk)).values(shard=target, shard_moving=False))
+			# Core writes never reach the session's cache invalidation; cached pets carry the old shard's ids
+			state_cache.invalidate(chunk)
+			with db.engines[keys[source]].begin() as src:
+				_delete_owned(src, chunk)
+			moved += len(chunk)
+			log(f"Moved {len(chunk)} users {source} -> {target} ({copied['pets']} pets, "
+				f"{copied['ledger_entries']} ledger entries); {moved} so far")
+	return moved
+
+
+def shard_sizes() -> Dict[int, int]:
+	"""Users per shard (shards with none included)"""
+	db = _db()
+	users = db.metadata.tables["users"]
+	sizes = {shard: 0 for shard in range(shard_count())}
+	sizes.update(db.session.execute(select(users.c.shard, func.count()).group_by(users.c.shard)).all())
+	return sizes
+
+
+def rebalance_plan(limit: Optional[int] = None) -> Dict[int, List[int]]:
+	"""{target shard: user ids} that evens out users per shard with the fewest moves"""
+	db = _db()
+	users = db.metadata.tables["users"]
+	sizes = shard_sizes()
+	total, count = sum(sizes.values()), len(sizes)
+	goal = {shard: total // count + (1 if shard < total % count else 0) for shard in sizes}
+	spare = []
+	for shard, size in sorted(sizes.items()):
+		if size > goal[shard]:
+			# Newest users first: the least data to copy
+			spare.extend(db.session.scalars(
+				select(users.c.id).where(users.c.shard == shard).order_by(users.c.id.desc()).limit(size - goal[shard])
+			))
+	if limit is not None:
+		spare = spare[:limit]
+	plan: Dict[int, List[int]] = {}
+	for shard, size in sorted(sizes.items()):
+		while size < goal[shard] and spare:
+			plan.setdefault(shard, []).append(spare.pop())
+			size += 1
+	return plan
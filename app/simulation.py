@@ -0,0 +1,260 @@
+"""
+Accelerated-time simulation harness.
+
+Drives virtual players through the real view functions (via Flask's test
+client) against a scratch database, with the app clock either frozen and
+stepped (fully deterministic) or accelerated (e.g. 1000x real time). Reports
+request throughput and how the economy (coins, inventory) evolves.
+"""
+from __future__ import annotations
+
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, insert, select
+from werkzeug.security import generate_password_hash
+
+from .clock import AcceleratedClock, FrozenClock
+from .constants import FOOD_TYPES, PET_TYPES, SHOP_PRICES
+
+
+class VirtualPlayer:
+	"""One logged-in player with its own test client (cookie jar)"""
+
+	def __init__(self, app, user_id: int, rng: random.Random):
+		self.user_id = user_id
+		self.rng = rng
+		self.client = app.test_client()
+		with self.client.session_transaction() as sess:
+			sess["_user_id"] = str(user_id)
+			sess["_fresh"] = True
+		self.state = None
+
+
+class Simulation:
+	def __init__(self, players: int = 1000, hours: float = 24, step_minutes: float = 5,
+			speed: Optional[float] = None, seed: int = 42, database_url: Optional[str] = None,
+			start: Optional[datetime] = None):
+		self.player_count = players
+		self.hours = hours
+		self.step = timedelta(minutes=step_minutes)
+		self.speed = speed
+		self.seed = seed
+		self.start = start or datetime(2025, 1, 1, 8, 0, 0)
+		self.end = self.start + timedelta(hours=hours)
+		self._tmpdir = None
+		if database_url is None:
+			self._tmpdir = tempfile.mkdtemp(prefix="tamagochi-sim-")
+			database_url = f"sqlite:///{os.path.join(self._tmpdir, 'simulation.sqlite')}"
+		self.database_url = database_url
+
+		if speed:
+			self.clock = AcceleratedClock(speed=speed, start=self.start)
+		else:
+			self.clock = FrozenClock(start=self.start)
+
+		from . import create_app
+		self.app = create_app({
+			"SQLALCHEMY_DATABASE_URI": database_url,
+			"CLOCK": self.clock,
+			"TESTING": True,
+			# Virtual players poll far faster than real ones in wall-clock time
+			"RATE_LIMIT_ENABLED": False,
+			# Everything in the scratch database, whatever DATABASE_SHARD_URLS says
+			"SQLALCHEMY_SHARD_URLS": [],
+		})
+		self.rng = random.Random(seed)
+		self.players = []
+		self.status_counts = Counter()
+		self.endpoint_counts = Counter()
+		self.economy = []
+		self.requests = 0
+
+	def close(self) -> None:
+		"""Release the database and remove the scratch directory, if this run made one"""
+		from .extensions import db
+
+		with self.app.app_context():
+			for engine in db.engines.values():
+				engine.dispose()
+		if self._tmpdir is not None:
+			shutil.rmtree(self._tmpdir, ignore_errors=True)
+			self._tmpdir = None
+
+	def __enter__(self) -> "Simulation":
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.close()
+
+	# -- setup -------------------------------------------------------------
+
+	def _create_players(self) -> None:
+		from .extensions import db
+		from .models import User
+
+		password_hash = generate_password_hash("simulation")
+		with self.app.app_context():
+			rows = [
+				{"username": f"sim_{i:06d}", "password_hash": password_hash, "created_at": self.start}
+				for i in range(self.player_count)
+			]
+			db.session.execute(insert(User), rows)
+			db.session.commit()
+			user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+
+		for user_id in user_ids:
+			player = VirtualPlayer(self.app, user_id, random.Random(self.rng.random()))
+			self._request(player, "post", "/select-pet", data={
+				"pet_type": player.rng.choice(PET_TYPES),
+				"pet_name": f"Pet{user_id}"
+			})
+			self.players.append(player)
+
+	# -- requests ----------------------------------------------------------
+
+	def _request(self, player: VirtualPlayer, method: str, url: str, **kwargs):
+		response = getattr(player.client, method)(url, **kwargs)
+		self.requests += 1
+		self.endpoint_counts[f"{method.upper()} {url}"] += 1
+		self.status_counts[response.status_code] += 1
+		return response
+
+	def _choose_action(self, player: VirtualPlayer):
+		"""Pick a plausible next request for the player from its last stats payload"""
+		state = player.state
+		if not state or state.get("is_sleeping"):
+			return None
+		rng = player.rng
+		actions = state["next_events"]["actions"]
+		inventory = state.get("inventory") or {}
+		options = []
+
+		foods = [food for food in FOOD_TYPES if inventory.get(food, 0) > 0]
+		if actions["feed"]["available"] and foods:
+			options.append(("post", "/api/pet/action", {"action": "feed", "food_type": rng.choice(foods)}))
+		if sum(inventory.get(food, 0) for food in FOOD_TYPES) < 8:
+			food = rng.choice(FOOD_TYPES)
+			quantity = rng.randint(1, 5)
+			if inventory.get("coins", 0) >= SHOP_PRICES[food] * quantity:
+				options.append(("post", "/api/shop/purchase", {"food_type": food, "quantity": quantity}))
+		if actions["play"]["available"]:
+			options.append(("post", "/api/pet/action", {"action": "play", "play_type": rng.choice(["play_with_ball", "spin_in_wheel"])}))
+		if actions["wash"]["available"]:
+			options.append(("post", "/api/pet/action", {"action": "wash", "wash_type": rng.choice(["wash_hands", "shower", "bath"])}))
+		if actions["sleep_full"]["available"]:
+			options.append(("post", "/api/pet/action", {"action": "sleep", "sleep_type": "sleep"}))
+		elif actions["sleep_nap"]["available"]:
+			options.append(("post", "/api/pet/action", {"action": "sleep", "sleep_type": "nap"}))
+		if actions["minigame"]["available"]:
+			if rng.random() < 0.5:
+				options.append(("post", "/api/minigame/higher-lower", {"guess": rng.choice(["higher", "lower"])}))
+			else:
+				options.append(("post", "/api/minigame/labyrinth", {"collected": {"blueberry": rng.randint(0, 2), "acorn": rng.randint(1, 2)}}))
+		return rng.choice(options) if options else None
+
+	def _tick(self, poll_probability: float, action_probability: float) -> None:
+		for player in self.players:
+			if player.rng.random() < poll_probability or player.state is None:
+				response = self._request(player, "get", "/api/pet/stats")
+				if response.status_code == 200:
+					player.state = response.get_json()
+			if player.rng.random() < action_probability:
+				choice = self._choose_action(player)
+				if choice:
+					method, url, body = choice
+					self._request(player, method, url, json=body)
+					player.state = None
+
+	def _record_economy(self) -> None:
+		from .extensions import db
+		from .models import Inventory
+
+		with self.app.app_context():
+			columns = [func.sum(Inventory.coins)] + [func.sum(getattr(Inventory, food)) for food in FOOD_TYPES]
+			totals = db.session.execute(select(*columns)).one()
+		players = max(1, len(self.players))
+		snapshot = {
+			"virtual_time": self.clock.now().isoformat(),
+			"total_coins": int(totals[0] or 0),
+			"avg_coins": round((totals[0] or 0) / players, 2),
+		}
+		for food, total in zip(FOOD_TYPES, totals[1:]):
+			snapshot[food] = int(total or 0)
+		self.economy.append(snapshot)
+
+	# -- driver ------------------------------------------------------------
+
+	def run(self, poll_probability: float = 0.8, action_probability: float = 0.3) -> dict:
+		random.seed(self.seed)  # minigame rolls use the module-level RNG
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+			setup_started = time.perf_counter()
+			self._create_players()
+			setup_seconds = time.perf_counter() - setup_started
+			self._record_economy()
+
+			started = time.perf_counter()
+			setup_requests = self.requests
+			next_snapshot = self.start + timedelta(hours=1)
+			ticks = 0
+			while self.clock.now() < self.end:
+				self._tick(poll_probability, action_probability)
+				ticks += 1
+				if isinstance(self.clock, FrozenClock):
+					self.clock.advance(self.step)
+				if self.clock.now() >= next_snapshot:
+					self._record_economy()
+					next_snapshot += timedelta(hours=1)
+			wall_seconds = time.perf_counter() - started
+			if self.economy[-1]["virtual_time"] != self.clock.now().isoformat():
+				self._record_economy()
+
+		requests = self.requests - setup_requests
+		return {
+			"players": self.player_count,
+			"virtual_hours": self.hours,
+			"mode": f"accelerated x{self.speed:g}" if self.speed else f"frozen, {self.step} steps",
+			"seed": self.seed,
+			"ticks": ticks,
+			"setup_seconds": round(setup_seconds, 3),
+			"wall_seconds": round(wall_seconds, 3),
+			"requests": requests,
+			"requests_per_second": round(requests / wall_seconds, 1) if wall_seconds else None,
+			"status_counts": dict(sorted(self.status_counts.items())),
+			"endpoint_counts": dict(self.endpoint_counts.most_common()),
+			"economy": self.economy,
+		}
+
+
+def run_simulation(**kwargs) -> dict:
+	"""Build a scratch app, run the simulation and return its report"""
+	options = {key: kwargs.pop(key) for key in ("poll_probability", "action_probability") if key in kwargs}
+	with Simulation(**kwargs) as simulation:
+		return simulation.run(**options)
+
+
+def format_report(report: dict) -> str:
+	lines = [
+		f"Players: {report['players']}  virtual hours: {report['virtual_hours']}  mode: {report['mode']}  seed: {report['seed']}",
+		f"Setup: {report['setup_seconds']}s  run: {report['wall_seconds']}s  ticks: {report['ticks']}",
+		f"Requests: {report['requests']}  throughput: {report['requests_per_second']} req/s",
+		f"Status codes: {report['status_counts']}",
+		"Endpoints:",
+	]
+	for endpoint, count in report["endpoint_counts"].items():
+		lines.append(f"  {endpoint:<32} {count}")
+	lines.append("Economy:")
+	header = ["virtual_time", "total_coins", "avg_coins"] + FOOD_TYPES
+	lines.append("  " + "  ".join(f"{column:>19}" if column == "virtual_time" else f"{column:>11}" for column in header))
+	for snapshot in report["economy"]:
+		lines.append("  " + "  ".join(
+			f"{snapshot[column]:>19}" if column == "virtual_time" else f"{snapshot[column]:>11}" for column in header
+		))
+	return "\n".join(lines)
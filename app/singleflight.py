@@ -0,0 +1,135 @@
+"""
+Per-user request coalescing.
+
+Players often keep several tabs or devices open, each polling the same
+endpoints for the same pet at nearly the same instant. Two view decorators
+keep that from turning into duplicate work and database lock contention:
+
+	@coalesce_per_user   - concurrent identical GETs from one user share a
+	                       single computation; every caller gets a copy of
+	                       the leader's response
+	@serialize_per_user  - mutating requests from one user run one at a time
+	                       in this process
+
+Both are no-ops when SINGLE_FLIGHT_ENABLED is False.
+"""
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+
+
+class _Call:
+	__slots__ = ("done", "result", "error")
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+
+class SingleFlight:
+	"""Collapse concurrent calls with the same key into one execution"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._calls = {}
+		self.executions = 0
+		self.shared = 0
+
+	def do(self, key, fn):
+		"""Run fn() unless a call for key is in flight; returns (result, shared)"""
+		with self._lock:
+			call = self._calls.get(key)
+			if call is not None:
+				self.shared += 1
+				leader = False
+			else:
+				call = self._calls[key] = _Call()
+				self.executions += 1
+				leader = True
+
+		if not leader:
+			call.done.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result, True
+
+		try:
+			call.result = fn()
+		except BaseException as exc:
+			call.error = exc
+			raise
+		finally:
+			with self._lock:
+				del self._calls[key]
+			call.done.set()
+		return call.result, False
+
+
+class UserLocks:
+	"""Reference-counted per-user locks, dropped once nobody holds or waits"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._locks = {}  # user_id -> [lock, users]
+
+	@contextmanager
+	def hold(self, user_id):
+		with self._lock:
+			entry = self._locks.get(user_id)
+			if entry is None:
+				entry = self._locks[user_id] = [threading.Lock(), 0]
+			entry[1] += 1
+		try:
+			with entry[0]:
+				yield
+		finally:
+			with self._lock:
+				entry[1] -= 1
+				if entry[1] == 0:
+					del self._locks[user_id]
+
+
+flights = SingleFlight()
+user_locks = UserLocks()
+
+
+def _enabled() -> bool:
+	return current_app.config.get("SINGLE_FLIGHT_ENABLED", True) and current_user.is_authenticated
+
+
+def coalesce_per_user(view):
+	"""Share one execution of a read view between concurrent identical requests"""
+	@wraps(view)
+	def wrapper(*args, **kwargs):
+		if not _enabled():
+			return view(*args, **kwargs)
+
+		user_id = current_user.id
+
+		def compute():
+			# Reads that refresh state still must not race the user's own writes
+			with user_locks.hold(user_id):
+				response = current_app.make_response(view(*args, **kwargs))
+			return response.get_data(), response.status_code, list(response.headers.items())
+
+		key = (user_id, request.endpoint, request.query_string)
+		(body, status, headers), _ = flights.do(key, compute)
+		return current_app.response_class(body, status=status, headers=headers)
+	return wrapper
+
+
+def serialize_per_user(view):
+	"""Run a mutating view for one user at a time within this process"""
+	@wraps(view)
+	def wrapper(*args, **kwargs):
+		if not _enabled():
+			return view(*args, **kwargs)
+		with user_locks.hold(current_user.id):
+			return view(*args, **kwargs)
+	return wrapper
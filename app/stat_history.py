@@ -0,0 +1,221 @@
+"""
+Per-pet stat history for charts, in fixed-size packed ring buffers.
+
+Each pet has one pet_stat_history row whose `data` blob holds a ring buffer
+per tier in STAT_HISTORY_TIERS (minute slots for 4 hours, hour slots for 7
+days, day slots for 60 days), back to back. A slot is one unsigned byte per
+stat in STAT_HISTORY_STATS (whole percent, 255 = no sample); slot n of a
+tier covers [n * step, (n + 1) * step) in epoch seconds and lives at index
+n % slots, so the latest slot number per tier (minute_at/hour_at/day_at) is
+all that is needed to tell live slots from stale ones. Every tier keeps the
+last sample taken in its slot. Storage per pet is fixed at BUFFER_BYTES.
+
+Samples are taken after any flush that changes a pet's stats (actions and
+decay updates alike) and written on the flush's connection, so they commit
+with the change that caused them. Samples that would rewrite the same
+minute slot with the same bytes are skipped.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, event, insert, inspect, select, update
+
+from .clock import utcnow
+from .constants import STAT_HISTORY_STATS, STAT_HISTORY_TIERS
+from .extensions import db
+from .models import Pet, PetStatHistory
+
+
+EMPTY = 255
+WIDTH = len(STAT_HISTORY_STATS)
+EMPTY_SLOT = bytes([EMPTY]) * WIDTH
+TIER_NAMES = [name for name, _, _ in STAT_HISTORY_TIERS]
+LATEST_COLUMNS = [f"{name}_at" for name in TIER_NAMES]
+OFFSETS = []
+_offset = 0
+for _, _, _slots in STAT_HISTORY_TIERS:
+	OFFSETS.append(_offset)
+	_offset += _slots * WIDTH
+BUFFER_BYTES = _offset
+
+_EPOCH = datetime(1970, 1, 1)
+_LOOKUP_CHUNK = 500
+_RECENT_KEY = "stat_history_recent"
+_RECENT_MAX = 100000
+_listeners_registered = False
+
+
+def epoch_seconds(when: datetime) -> int:
+	return int((when - _EPOCH).total_seconds())
+
+
+def pack(values: Sequence[float]) -> bytes:
+	return bytes(max(0, min(100, int(round(value)))) for value in values)
+
+
+def write_sample(buffer: bytearray, latest: List[Optional[int]], at: int, sample: bytes) -> None:
+	"""Store `sample` (taken at epoch second `at`) in every tier, in place"""
+	for tier, (_, step, slots) in enumerate(STAT_HISTORY_TIERS):
+		slot, last = at // step, latest[tier]
+		if last is not None and slot < last:
+			continue  # Older than what this tier already holds
+		base = OFFSETS[tier]
+		if last is None or slot - last >= slots:
+			buffer[base:base + slots * WIDTH] = EMPTY_SLOT * slots
+		else:
+			# Slots skipped since the last sample hold stale data from a lap ago
+			for skipped in range(last + 1, slot):
+				position = base + (skipped % slots) * WIDTH
+				buffer[position:position + WIDTH] = EMPTY_SLOT
+		position = base + (slot % slots) * WIDTH
+		buffer[position:position + WIDTH] = sample
+		latest[tier] = slot
+
+
+def read_window(data: bytes, latest: Sequence[Optional[int]], tier: int,
+		start: int, end: int) -> Tuple[int, Dict[str, List[Optional[int]]]]:
+	"""Samples of one tier for epoch seconds [start, end], touching only those slots.
+
+	Returns the first slot number and one list per stat, None where there is
+	no sample.
+	"""
+	_, step, slots = STAT_HISTORY_TIERS[tier]
+	first, final = start // step, end // step
+	last = latest[tier]
+	if last is None:
+		live_from, live_to = final + 1, final
+	else:
+		live_from, live_to = max(first, last - slots + 1), min(final, last)
+	if live_from > live_to:
+		return first, {stat: [None] * (final - first + 1) for stat in STAT_HISTORY_STATS}
+
+	# The live slots are one contiguous run of the ring, or two when it wraps
+	base = OFFSETS[tier]
+	head, tail = live_from % slots, live_to % slots
+	if head <= tail:
+		run = data[base + head * WIDTH:base + (tail + 1) * WIDTH]
+	else:
+		run = data[base + head * WIDTH:base + slots * WIDTH] + data[base:base + (tail + 1) * WIDTH]
+	before, after = [None] * (live_from - first), [None] * (final - live_to)
+	series = {}
+	for index, stat in enumerate(STAT_HISTORY_STATS):
+		series[stat] = before + [None if value == EMPTY else value for value in run[index::WIDTH]] + after
+	return first, series
+
+
+def pick_tier(seconds: float) -> int:
+	"""Finest tier whose buffer covers `seconds` of history"""
+	for tier, (_, step, slots) in enumerate(STAT_HISTORY_TIERS):
+		if step * slots >= seconds:
+			return tier
+	return len(STAT_HISTORY_TIERS) - 1
+
+
+def pet_history(pet_id: int, start: datetime, end: datetime, tier: Optional[int] = None) -> dict:
+	"""Chart data for one pet between start and end (naive UTC)"""
+	start_at, end_at = epoch_seconds(start), epoch_seconds(end)
+	if tier is None:
+		tier = pick_tier(end_at - start_at)
+	name, step, slots = STAT_HISTORY_TIERS[tier]
+	# Never walk more slots than the tier holds
+	start_at = max(start_at, end_at - step * (slots - 1))
+	row = db.session.get(PetStatHistory, pet_id)
+	if row is None:
+		data, latest = b"", [None] * len(STAT_HISTORY_TIERS)
+	else:
+		data, latest = row.data, [getattr(row, column) for column in LATEST_COLUMNS]
+	first, series = read_window(data, latest, tier, start_at, end_at)
+	return {
+		"tier": name,
+		"step_seconds": step,
+		"start": (_EPOCH + timedelta(seconds=first * step)).isoformat(),
+		"series": series,
+	}
+
+
+def _after_flush(session, flush_context) -> None:
+	# new/dirty and attribute history still describe the flush that just ran
+	if not has_app_context() or not current_app.config.get("STAT_HISTORY_ENABLED", True):
+		return
+	samples = {}
+	for obj in (*session.new, *session.dirty):
+		if not isinstance(obj, Pet) or obj.id is None or obj in session.deleted:
+			continue
+		state = inspect(obj)
+		if obj in session.new or any(state.attrs[stat].history.has_changes() for stat in STAT_HISTORY_STATS):
+			samples[obj.id] = pack([getattr(obj, stat) for stat in STAT_HISTORY_STATS])
+	if not samples:
+		return
+
+	at = epoch_seconds(utcnow())
+	minute = at // 60
+	recent = current_app.extensions.get("stat_history_recent", {})
+	samples = {pet_id: sample for pet_id, sample in samples.items() if recent.get(pet_id) != (minute, sample)}
+	if not samples:
+		return
+
+	table = PetStatHistory.__table__
+	# The pets' shard (see app/sharding.py)
+	connection = session.connection(bind_arguments={"mapper": PetStatHistory})
+	pet_ids = sorted(samples)
+	existing = {}
+	for start in range(0, len(pet_ids), _LOOKUP_CHUNK):
+		chunk = pet_ids[start:start + _LOOKUP_CHUNK]
+		for row in connection.execute(select(table).where(table.c.pet_id.in_(chunk))):
+			existing[row.pet_id] = row
+
+	updates, inserts = [], []
+	for pet_id in pet_ids:
+		row = existing.get(pet_id)
+		if row is not None and len(row.data) == BUFFER_BYTES:
+			buffer, latest = bytearray(row.data), [getattr(row, column) for column in LATEST_COLUMNS]
+		else:
+			# New pet, or the tier layout changed since this buffer was written
+			buffer, latest = bytearray(EMPTY_SLOT) * (BUFFER_BYTES // WIDTH), [None] * len(STAT_HISTORY_TIERS)
+		write_sample(buffer, latest, at, samples[pet_id])
+		values = {"data": bytes(buffer), **dict(zip(LATEST_COLUMNS, latest))}
+		if row is None:
+			inserts.append({"pet_id": pet_id, **values})
+		else:
+			updates.append({"b_pet_id": pet_id, **values})
+	if updates:
+		connection.execute(
+			update(table).where(table.c.pet_id == bindparam("b_pet_id"))
+			.values({column: bindparam(column) for column in ["data", *LATEST_COLUMNS]}),
+			updates
+		)
+	if inserts:
+		connection.execute(insert(table), inserts)
+	session.info.setdefault(_RECENT_KEY, {}).update(
+		(pet_id, (minute, sample)) for pet_id, sample in samples.items()
+	)
+
+
+def _after_commit(session) -> None:
+	written = session.info.pop(_RECENT_KEY, None)
+	if not written or not has_app_context():
+		return
+	recent = current_app.extensions.get("stat_history_recent")
+	if recent is not None:
+		if len(recent) > _RECENT_MAX:
+			recent.clear()
+		recent.update(written)
+
+
+def _after_rollback(session) -> None:
+	session.info.pop(_RECENT_KEY, None)
+
+
+def init_app(app) -> None:
+	# pet_id -> (minute slot, sample) last committed by this process
+	app.extensions["stat_history_recent"] = {}
+	global _listeners_registered
+	if _listeners_registered:
+		return
+	event.listen(db.session, "after_flush", _after_flush)
+	event.listen(db.session, "after_commit", _after_commit)
+	event.listen(db.session, "after_rollback", _after_rollback)
+	_listeners_registered = True
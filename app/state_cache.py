@@ -0,0 +1,389 @@
+"""
+Read-through per-user state cache.
+
+Holds an immutable snapshot of a user's pet and inventory keyed by user id,
+so read paths (e.g. repeated /api/pet/stats polls from several tabs) can skip
+the database when nothing has changed. Entries are invalidated whenever a
+commit touches the user's rows (SQLAlchemy after_flush/after_commit events),
+expire after a TTL and are evicted LRU-first above a memory ceiling.
+
+Backends:
+	LocalBackend  - in-process LRU (default, one cache per worker)
+	SharedBackend - client for a cache process on localhost started with
+	                `flask cache-server`, shared by all workers
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from typing import Iterable, Optional, Set
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+
+from .extensions import db
+from .models import ActivityFields, Inventory, Pet, PetActivity, PetStatHistory, User
+
+
+def _column_keys(model) -> list:
+	# From the table rather than the mapper: inspecting the mapper would configure every mapper at import
+	return list(model.__table__.columns.keys())
+
+
+class ActivitySnapshot(namedtuple("ActivitySnapshotBase", ["kind", "activity_type", "start_time", "end_time"])):
+	"""Immutable copy of a PetActivity row"""
+	__slots__ = ()
+
+
+class PetSnapshot(ActivityFields, namedtuple("PetSnapshotBase", _column_keys(Pet) + ["activities"])):
+	"""Immutable copy of a Pet row and its activities; supports the read-only Pet helpers"""
+	__slots__ = ()
+
+	compute_maturity_stage = Pet.compute_maturity_stage
+	compute_next_maturity_change = Pet.compute_next_maturity_change
+
+	def get_activity(self, kind: str) -> Optional[ActivitySnapshot]:
+		for activity in self.activities:
+			if activity.kind == kind:
+				return activity
+		return None
+
+	@classmethod
+	def from_model(cls, pet: Pet) -> "PetSnapshot":
+		activities = tuple(
+			ActivitySnapshot(a.kind, a.activity_type, a.start_time, a.end_time)
+			for a in pet.activities.values()
+		)
+		return cls(*(getattr(pet, key) for key in cls._fields[:-1]), activities)
+
+
+class InventorySnapshot(namedtuple("InventorySnapshotBase", _column_keys(Inventory))):
+	"""Immutable copy of an Inventory row"""
+	__slots__ = ()
+
+	get_food_quantity = Inventory.get_food_quantity
+
+	@classmethod
+	def from_model(cls, inventory: Inventory) -> "InventorySnapshot":
+		return cls(*(getattr(inventory, key) for key in cls._fields))
+
+
+class UserState(namedtuple("UserStateBase", ["user_id", "pet", "inventory", "cached_at"])):
+	"""Cached per-user game state"""
+	__slots__ = ()
+
+	@classmethod
+	def capture(cls, user: User, now: datetime) -> "UserState":
+		return cls(
+			user.id,
+			PetSnapshot.from_model(user.pet) if user.pet else None,
+			InventorySnapshot.from_model(user.inventory) if user.inventory else None,
+			now
+		)
+
+
+def _approx_size(value) -> int:
+	"""Rough deep size of a cached value (namedtuples of scalars)"""
+	size = sys.getsizeof(value)
+	for item in value:
+		if isinstance(item, tuple):
+			size += _approx_size(item)
+		else:
+			size += sys.getsizeof(item)
+	return size
+
+
+class LocalBackend:
+	"""Thread-safe in-process LRU with per-entry TTL and a memory ceiling"""
+
+	def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self._entries: "OrderedDict[object, tuple]" = OrderedDict()  # key -> (value, size, expires)
+		self._invalidated_at = {}  # key -> wall time of last invalidation
+		self._bytes = 0
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self.invalidations = 0
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			value, size, expires = entry
+			if expires < time.monotonic():
+				del self._entries[key]
+				self._bytes -= size
+				self.expirations += 1
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def set(self, key, value, ttl: Optional[float] = None, read_at: Optional[float] = None) -> None:
+		"""Store a value; skipped if the key was invalidated after read_at (a racing write)"""
+		size = _approx_size(value)
+		if size > self.max_bytes:
+			return
+		expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+		with self._lock:
+			if read_at is not None and self._invalidated_at.get(key, 0.0) >= read_at:
+				return
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self._bytes -= old[1]
+			self._entries[key] = (value, size, expires)
+			self._bytes += size
+			while self._bytes > self.max_bytes:
+				_, (_, evicted_size, _) = self._entries.popitem(last=False)
+				self._bytes -= evicted_size
+				self.evictions += 1
+
+	def delete(self, keys: Iterable) -> None:
+		now = time.time()
+		with self._lock:
+			if len(self._invalidated_at) > 10000:
+				# Tombstones only need to outlive in-flight reads
+				cutoff = now - 60
+				self._invalidated_at = {k: t for k, t in self._invalidated_at.items() if t > cutoff}
+			for key in keys:
+				self._invalidated_at[key] = now
+				entry = self._entries.pop(key, None)
+				if entry is not None:
+					self._bytes -= entry[1]
+					self.invalidations += 1
+
+	def clear(self) -> None:
+		with self._lock:
+			self.invalidations += len(self._entries)
+			self._invalidated_at = {key: time.time() for key in self._entries}
+			self._entries.clear()
+			self._bytes = 0
+
+	def stats(self) -> dict:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"entries": len(self._entries),
+				"bytes": self._bytes,
+				"max_bytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+				"evictions": self.evictions,
+				"expirations": self.expirations,
+				"invalidations": self.invalidations,
+			}
+
+
+def manager_class(name: str):
+	"""A fresh BaseManager subclass (its register() calls don't leak between users).
+
+	multiprocessing.managers takes ~10 ms to import and only the shared
+	backends need it, so it is imported here rather than at startup.
+	"""
+	from multiprocessing.managers import BaseManager
+	return type(name, (BaseManager,), {})
+
+
+class SharedBackend:
+	"""Proxy to a LocalBackend living in a cache-server process on localhost"""
+
+	def __init__(self, address=("127.0.0.1", 50055), authkey: bytes = b"tamagochi"):
+		manager = manager_class("CacheManager")
+		manager.register("backend")
+		self._manager = manager(address=address, authkey=authkey)
+		self._connected = False
+		self._connect_lock = threading.Lock()
+		self._local = threading.local()
+
+	@property
+	def _backend(self):
+		# Connect on first use; proxies are not thread-safe so keep one per thread
+		proxy = getattr(self._local, "proxy", None)
+		if proxy is None:
+			with self._connect_lock:
+				if not self._connected:
+					self._manager.connect()
+					self._connected = True
+			proxy = self._local.proxy = self._manager.backend()
+		return proxy
+
+	def get(self, key):
+		return self._backend.get(key)
+
+	def set(self, key, value, ttl: Optional[float] = None, read_at: Optional[float] = None) -> None:
+		self._backend.set(key, value, ttl, read_at)
+
+	def delete(self, keys: Iterable) -> None:
+		self._backend.delete(list(keys))
+
+	def clear(self) -> None:
+		self._backend.clear()
+
+	def stats(self) -> dict:
+		return self._backend.stats()
+
+
+def serve_shared_backend(address=("127.0.0.1", 50055), authkey: bytes = b"tamagochi",
+		max_bytes: int = 256 * 1024 * 1024, ttl: float = 300.0) -> None:
+	"""Run a cache process that SharedBackend clients connect to (blocks)"""
+	backend = LocalBackend(max_bytes=max_bytes, ttl=ttl)
+	manager = manager_class("CacheManager")
+	manager.register("backend", callable=lambda: backend)
+	manager(address=address, authkey=authkey).get_server().serve_forever()
+
+
+class StateCache:
+	"""Per-user state cache; each app gets its own backend in app.extensions"""
+
+	def init_app(self, app) -> None:
+		if app.config.get("STATE_CACHE_BACKEND") == "shared":
+			host, port = app.config.get("STATE_CACHE_ADDRESS", ("127.0.0.1", 50055))
+			backend = SharedBackend((host, int(port)), app.config.get("STATE_CACHE_AUTHKEY", b"tamagochi"))
+		else:
+			backend = LocalBackend(
+				max_bytes=app.config.get("STATE_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+				ttl=app.config.get("STATE_CACHE_TTL", 300.0)
+			)
+		app.extensions["state_cache"] = backend
+		_register_invalidation_listeners()
+
+	@property
+	def backend(self):
+		return current_app.extensions["state_cache"]
+
+	@property
+	def enabled(self) -> bool:
+		return current_app.config.get("STATE_CACHE_ENABLED", True)
+
+	def get(self, user_id: int) -> Optional[UserState]:
+		if not self.enabled:
+			return None
+		return self.backend.get(user_id)
+
+	def put(self, user: User, now: datetime) -> UserState:
+		"""Snapshot the user's committed pet/inventory and cache it"""
+		read_at = time.time()
+		state = UserState.capture(user, now)
+		if self.enabled:
+			self.backend.set(user.id, state, read_at=read_at)
+		return state
+
+	def invalidate(self, user_ids: Iterable[int]) -> None:
+		self.backend.delete(user_ids)
+
+	def clear(self) -> None:
+		self.backend.clear()
+
+	def stats(self) -> dict:
+		return self.backend.stats()
+
+
+state_cache = StateCache()
+
+
+# -- invalidation ----------------------------------------------------------
+
+_DIRTY_KEY = "state_cache_dirty"
+_CLEAR_ALL = object()
+_listeners_registered = False
+# Models whose rows end up in a UserState; the last two are keyed by pet
+_CACHED_MODELS = (Pet, Inventory, User, PetActivity, PetStatHistory)
+_PET_ROWS = (PetActivity, PetStatHistory)
+_LOOKUP_CHUNK = 500
+
+
+def _owner_id(obj) -> Optional[int]:
+	if isinstance(obj, (Pet, Inventory)):
+		return obj.owner_id
+	if isinstance(obj, User):
+		return obj.id
+	return None
+
+
+def _owners_of_pets(session, pet_ids: Iterable[int]) -> Set[int]:
+	"""Owners of these pets, from pets already in the session or else looked up on the pets' shard"""
+	pet_ids = set(pet_ids)
+	owners = set()
+	for obj in list(session.identity_map.values()):
+		# __dict__ only: never load an expired attribute from here
+		if isinstance(obj, Pet) and obj.__dict__.get("id") in pet_ids and "owner_id" in obj.__dict__:
+			owners.add(obj.owner_id)
+			pet_ids.discard(obj.id)
+	if pet_ids:
+		table = Pet.__table__
+		connection = session.connection(bind_arguments={"mapper": Pet})
+		pet_ids = sorted(pet_ids)
+		for start in range(0, len(pet_ids), _LOOKUP_CHUNK):
+			chunk = pet_ids[start:start + _LOOKUP_CHUNK]
+			owners.update(connection.scalars(select(table.c.owner_id).where(table.c.id.in_(chunk))))
+	return owners
+
+
+def mark_users_changed(session, user_ids: Iterable[int]) -> None:
+	"""Invalidate these users' cached state when `session` commits (writes the flush does not see)"""
+	session.info.setdefault(_DIRTY_KEY, set()).update(user_ids)
+
+
+def mark_pets_changed(session, pet_ids: Iterable[int]) -> None:
+	"""Invalidate the cached state of these pets' owners when `session` commits"""
+	mark_users_changed(session, _owners_of_pets(session, pet_ids))
+
+
+def _after_flush(session, flush_context) -> None:
+	dirty = session.info.setdefault(_DIRTY_KEY, set())
+	pet_ids = set()
+	for obj in (*session.new, *session.dirty, *session.deleted):
+		if isinstance(obj, _PET_ROWS):
+			pet_ids.add(obj.pet_id)
+			continue
+		owner_id = _owner_id(obj)
+		if owner_id is not None:
+			dirty.add(owner_id)
+	if pet_ids:
+		dirty.update(_owners_of_pets(session, pet_ids))
+
+
+def _do_orm_execute(orm_execute_state) -> None:
+	# Bulk UPDATE/DELETE statements bypass the flush; drop everything on commit unless the caller
+	# marks the users it changed itself (execution option state_cache_marked=True)
+	if orm_execute_state.is_update or orm_execute_state.is_delete:
+		mapper = orm_execute_state.bind_mapper
+		if mapper is not None and mapper.class_ in _CACHED_MODELS \
+				and not orm_execute_state.execution_options.get("state_cache_marked"):
+			orm_execute_state.session.info.setdefault(_DIRTY_KEY, set()).add(_CLEAR_ALL)
+
+
+def _after_commit(session) -> None:
+	dirty = session.info.pop(_DIRTY_KEY, None)
+	if not dirty or not has_app_context() or "state_cache" not in current_app.extensions:
+		return
+	if _CLEAR_ALL in dirty:
+		state_cache.clear()
+	else:
+		state_cache.invalidate(dirty)
+
+
+def _after_rollback(session) -> None:
+	session.info.pop(_DIRTY_KEY, None)
+
+
+def _register_invalidation_listeners() -> None:
+	global _listeners_registered
+	if _listeners_registered:
+		return
+	event.listen(db.session, "after_flush", _after_flush)
+	event.listen(db.session, "do_orm_execute", _do_orm_execute)
+	event.listen(db.session, "after_commit", _after_commit)
+	event.listen(db.session, "after_rollback", _after_rollback)
+	_listeners_registered = True
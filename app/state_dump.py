@@ -0,0 +1,420 @@
+"""
+Streaming export and bulk import of the whole game state as NDJSON, for
+moving hosts or seeding staging (`flask export-state` / `flask import-state`).
+
+The file is one JSON value per line: a format header, then for each table
+of each database a section header followed by that table's rows as arrays
+in primary-key order:
+
+	{"format": "tamagochi-state", "version": 1, "shards": 1, "tables": ["users", ...]}
+	{"table": "users", "shard": 0, "columns": ["id", "username", ...], "rows": 2}
+	[1, "alice", ...]
+	[2, "bob", ...]
+	{"table": "pets", "shard": 0, "columns": [...], "rows": 2}
+	...
+
+Datetimes are ISO 8601 text ("2024-01-31 12:00:00.000000", as SQLite
+stores them, so loading into SQLite needs no parsing), booleans true/false
+and binary columns base64. Names ending in .gz are gzip-compressed.
+Password hashes are included, so treat a dump like a database backup.
+Idempotency keys (a short-lived replay cache) and maintenance_runs (this
+host's history) are left out.
+
+Export streams each table through a server-side cursor, EXPORT_CHUNK rows at
+a time, inside one read transaction per database: a consistent snapshot of
+each database, but not across shards. With the rollback journal that read
+transaction holds writers off until the export is done; use
+SQLITE_JOURNAL_MODE=wal or a quiet moment.
+
+Import needs empty tables (a freshly created app) and at least as many
+shards as the dump, since rows keep their ids and users.shard; run
+`flask shard-rebalance` afterwards to spread them over more. Secondary
+indexes and the username search index are dropped while loading and built
+once at the end; rows go in with executemany, IMPORT_CHUNK rows per
+transaction. Memory stays flat either way: at most one chunk is in memory.
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import io
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+from itertools import islice
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import Boolean, Date, DateTime, Integer, LargeBinary, func, select, text
+
+from .extensions import db
+from .sharding import SHARDED_TABLES
+from .user_directory import search_index_deferred
+
+
+FORMAT = "tamagochi-state"
+VERSION = 1
+# Parents first, global tables before the per-user ones (see app/sharding.py)
+EXPORT_TABLES = (
+	"users", "daily_rollups", "access_requests", "access_requests_archive",
+	"pets", "pet_activities", "pet_stat_history", "inventories", "ledger_entries", "ledger_snapshots",
+)
+EXPORT_CHUNK = 10000
+IMPORT_CHUNK = 10000
+PROGRESS_SECONDS = 5.0
+_PROBE = datetime(2000, 1, 2, 3, 4, 5, 6)
+
+
+@contextmanager
+def open_dump(path: str, mode: str = "r") -> Iterator[IO[str]]:
+	"""Open a dump file for text reading ("r") or writing ("w"); "-" is stdin/stdout, .gz is gzip"""
+	if path == "-":
+		yield sys.stdout if mode == "w" else sys.stdin
+	elif path.endswith(".gz"):
+		with gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6) as f:
+			yield f
+	else:
+		with open(path, mode, encoding="utf-8", buffering=io.DEFAULT_BUFFER_SIZE * 16) as f:
+			yield f
+
+
+def _engines() -> List[object]:
+	keys = current_app.extensions.get("shards") or [None]
+	return [db.engines[key] for key in keys]
+
+
+def _tables_in(shard: int) -> List[str]:
+	return [name for name in EXPORT_TABLES if shard == 0 or name in SHARDED_TABLES]
+
+
+def _time_text(value) -> str:
+	# SQLite hands back its stored text, other drivers datetime/date objects
+	if isinstance(value, str):
+		return value
+	return value.isoformat(" ") if isinstance(value, datetime) else value.isoformat()
+
+
+def _encoders(table, columns: List[str]) -> List[Optional[Callable]]:
+	"""Per column: raw driver value -> JSON value (None: as it is)"""
+	encoders = []
+	for name in columns:
+		kind = table.c[name].type
+		if isinstance(kind, (DateTime, Date)):
+			encoders.append(_time_text)
+		elif isinstance(kind, LargeBinary):
+			encoders.append(lambda value: base64.b64encode(value).decode("ascii"))
+		elif isinstance(kind, Boolean):
+			encoders.append(bool)
+		else:
+			encoders.append(None)
+	return encoders
+
+
+def _stored_as_text(process: Callable) -> Callable:
+	# The dialect stores datetimes as the same text the dump has (SQLite): only other shapes get parsed
+	def decode(value):
+		if len(value) == 26 and value[10] == " ":
+			return value
+		return process(datetime.fromisoformat(value))
+	return decode
+
+
+def _decoders(table, columns: List[str], dialect) -> List[Optional[Callable]]:
+	"""Per column: JSON value -> Python value, and on to the driver value when given the dialect"""
+	decoders = []
+	for name in columns:
+		kind = table.c[name].type
+		if isinstance(kind, DateTime):
+			parse = datetime.fromisoformat
+		elif isinstance(kind, Date):
+			parse = date.fromisoformat
+		elif isinstance(kind, LargeBinary):
+			parse = base64.b64decode
+		else:
+			parse = None
+		process = kind.dialect_impl(dialect).bind_processor(dialect) if dialect is not None else None
+		if isinstance(kind, DateTime) and process and process(_PROBE) == _time_text(_PROBE):
+			decoders.append(_stored_as_text(process))
+		elif parse and process:
+			decoders.append(lambda value, parse=parse, process=process: process(parse(value)))
+		else:
+			decoders.append(parse or process)
+	return decoders
+
+
+def _convert(row, converters) -> list:
+	return [
+		value if convert is None or value is None else convert(value)
+		for value, convert in zip(row, converters)
+	]
+
+
+class _Progress:
+	"""Logs rows done and rows/s for a section at most every `every` seconds"""
+
+	def __init__(self, log: Callable[[str], None], every: float):
+		self.log, self.every = log, every
+		self.rows = 0
+		self.started = time.perf_counter()
+
+	def section(self, name: str, shard: int, total: int) -> None:
+		self.name, self.total, self.done = f"{name}@{shard}", total, 0
+		self.section_started = self.last = time.perf_counter()
+
+	def advance(self, rows: int, final: bool = False) -> None:
+		self.done += rows
+		self.rows += rows
+		now = time.perf_counter()
+		if final or now - self.last >= self.every:
+			self.last = now
+			rate = self.done / max(now - self.section_started, 1e-9)
+			self.log(f"{self.name}: {self.done}/{self.total} rows ({rate:.0f} rows/s)")
+
+	def summary(self) -> Dict[str, float]:
+		seconds = time.perf_counter() - self.started
+		return {"rows": self.rows, "seconds": round(seconds, 2), "rows_per_second": round(self.rows / max(seconds, 1e-9))}
+
+
+# Export
+
+def _snapshot(conn) -> None:
+	# One read transaction for every table of this database
+	if conn.dialect.name == "sqlite":
+		conn.exec_driver_sql("BEGIN")
+	elif conn.dialect.name == "postgresql":
+		conn.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+
+def export_state(out: IO[str], chunk: int = EXPORT_CHUNK, log: Callable[[str], None] = print,
+		progress_every: float = PROGRESS_SECONDS) -> Dict[str, float]:
+	"""Write every exported table of every database to `out`; returns rows, seconds and rows/s"""
+	db.session.commit()
+	engines = _engines()
+	tables = db.metadata.tables
+	dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+	out.write(dumps({"format": FORMAT, "version": VERSION, "shards": len(engines), "tables": list(EXPORT_TABLES)}) + "\n")
+	progress = _Progress(log, progress_every)
+	for shard, engine in enumerate(engines):
+		with engine.connect() as conn:
+			_snapshot(conn)
+			for name in _tables_in(shard):
+				table = tables[name]
+				columns = [column.name for column in table.columns]
+				total = conn.scalar(select(func.count()).select_from(table))
+				out.write(dumps({"table": name, "shard": shard, "columns": columns, "rows": total}) + "\n")
+				progress.section(name, shard, total)
+				encoders = _encoders(table, columns)
+				plain = not any(encoders)
+				# Driver values as they are: the result type processing would only be undone by the encoders
+				query = select(table).order_by(*table.primary_key.columns).compile(dialect=conn.dialect)
+				result = conn.execution_options(stream_results=True, max_row_buffer=chunk).exec_driver_sql(query.string)
+				for rows in result.partitions(chunk):
+					out.write("".join(
+						dumps(list(row) if plain else _convert(row, encoders)) + "\n" for row in rows
+					))
+					progress.advance(len(rows))
+				progress.advance(0, final=True)
+			conn.rollback()
+	return progress.summary()
+
+
+# Import
+
+def _read_header(lines: Iterator[str]) -> dict:
+	try:
+		header = json.loads(next(lines))
+	except (StopIteration, ValueError):
+		raise ValueError("Not a game state dump (no header line)")
+	if not isinstance(header, dict) or header.get("format") != FORMAT:
+		raise ValueError("Not a game state dump")
+	if header.get("version") != VERSION:
+		raise ValueError(f"Unsupported dump version {header.get('version')} (this app reads {VERSION})")
+	return header
+
+
+def _check_target(engines, names: List[str], shards: int) -> None:
+	if shards > len(engines):
+		raise ValueError(
+			f"The dump has {shards} shards but this app has {len(engines)}; configure at least "
+			f"{shards - 1} DATABASE_SHARD_URLS (and run `flask shard-rebalance` afterwards to use more)"
+		)
+	tables = db.metadata.tables
+	for shard, engine in enumerate(engines):
+		with engine.connect() as conn:
+			for name in names:
+				if name in tables and (shard == 0 or name in SHARDED_TABLES):
+					if conn.execute(select(text("1")).select_from(tables[name]).limit(1)).first():
+						raise ValueError(f"Table {name} in shard {shard} is not empty; import into a fresh database")
+
+
+def _reset_sequence(conn, table) -> None:
+	# Rows came with their ids; Postgres sequences must continue after them
+	pk = list(table.primary_key.columns)
+	if conn.dialect.name != "postgresql" or len(pk) != 1 or not isinstance(pk[0].type, Integer):
+		return
+	if pk[0].autoincrement not in (True, "auto"):
+		return
+	conn.execute(text(
+		f"SELECT setval(pg_get_serial_sequence('{table.name}', '{pk[0].name}'), "
+		f"COALESCE(MAX({pk[0].name}), 1), MAX({pk[0].name}) IS NOT NULL) FROM {table.name}"
+	))
+
+
+@contextmanager
+def _indexes_deferred(engines, names: List[str]) -> Iterator[None]:
+	"""Drop the secondary indexes of the loaded tables; build them once the rows are in"""
+	tables = db.metadata.tables
+	dropped: List[Tuple[object, object]] = []
+	for shard, engine in enumerate(engines):
+		for name in names:
+			if name in tables and (shard == 0 or name in SHARDED_TABLES):
+				for index in tables[name].indexes:
+					index.drop(bind=engine, checkfirst=True)
+					dropped.append((index, engine))
+	try:
+		yield
+	finally:
+		for index, engine in dropped:
+			index.create(bind=engine, checkfirst=True)
+
+
+def _load_section(engine, table, header: dict, rows: Iterable[list], chunk: int, progress: _Progress,
+		driver_values: bool = False) -> None:
+	columns = header["columns"]
+	missing = [name for name in columns if name not in table.c]
+	if missing:
+		raise ValueError(f"Unknown columns in {table.name}: {', '.join(missing)}")
+	progress.section(table.name, header["shard"], header["rows"])
+	# Same columns as this schema: straight to the driver's executemany. Otherwise
+	# through Core, which fills in the defaults of columns the dump predates
+	compiled = table.insert().compile(dialect=engine.dialect, column_keys=columns)
+	raw = compiled.positional and set(columns) == set(table.c.keys())
+	order = None
+	if raw:
+		decoders = _decoders(table, columns, engine.dialect)
+		order = [columns.index(key) for key in compiled.positiontup]
+		if order == list(range(len(order))):
+			order = None
+	else:
+		decoders = _decoders(table, columns, None)
+	# Only the columns that need it
+	decode = [(i, convert) for i, convert in enumerate(decoders) if convert is not None]
+
+	def flush(batch):
+		with engine.begin() as conn:
+			if raw:
+				conn.exec_driver_sql(compiled.string, batch)
+			else:
+				conn.execute(table.insert(), [dict(zip(columns, row)) for row in batch])
+		progress.advance(len(batch))
+
+	loaded = 0
+	if driver_values and raw and order is None:
+		# Tuples the driver takes as they are: no per-row work at all
+		rows = iter(rows)
+		for batch in iter(lambda: list(islice(rows, chunk)), []):
+			flush(batch)
+			loaded += len(batch)
+	else:
+		batch = []
+		for row in rows:
+			if driver_values:
+				row = list(row)
+			for i, convert in decode:
+				if row[i] is not None:
+					row[i] = convert(row[i])
+			if order is not None:
+				row = [row[i] for i in order]
+			batch.append(tuple(row) if raw else row)
+			if len(batch) >= chunk:
+				flush(batch)
+				loaded += len(batch)
+				batch = []
+		if batch:
+			flush(batch)
+			loaded += len(batch)
+	if loaded != header["rows"]:
+		raise ValueError(f"Dump ends early: {table.name}@{header['shard']} has {loaded} of {header['rows']} rows")
+	progress.advance(0, final=True)
+
+
+def load_sections(names: List[str], sections: Iterable[Tuple[dict, Iterable[list]]], chunk: int = IMPORT_CHUNK,
+		log: Callable[[str], None] = print, progress_every: float = PROGRESS_SECONDS,
+		driver_values: bool = False) -> Dict[str, float]:
+	"""Bulk-load (section header, rows) pairs in the dump's layout into tables `names`.
+
+	Rows are lists of dump values (converted in place), or with
+	`driver_values` tuples of dump values the driver also takes as they are
+	(SQLite's datetime text, bools), passed to the driver untouched. The
+	tables' secondary indexes (and the username search index) are rebuilt
+	once at the end; returns rows, seconds and rows/s. Does not check the
+	tables are empty: rows with ids already taken fail their chunk.
+	"""
+	engines = _engines()
+	tables = db.metadata.tables
+	unknown = [name for name in names if name not in tables]
+	if unknown:
+		raise ValueError(f"Unknown tables: {', '.join(unknown)}")
+	db.session.commit()
+	progress = _Progress(log, progress_every)
+	with search_index_deferred() if "users" in names else nullcontext(), _indexes_deferred(engines, names):
+		for header, rows in sections:
+			if not 0 <= header["shard"] < len(engines):
+				raise ValueError(f"No shard {header['shard']} in this app")
+			_load_section(engines[header["shard"]], tables[header["table"]], header, rows, chunk, progress, driver_values)
+	for shard, engine in enumerate(engines):
+		with engine.begin() as conn:
+			for name in names:
+				if shard == 0 or name in SHARDED_TABLES:
+					_reset_sequence(conn, tables[name])
+	return progress.summary()
+
+
+def _parse_sections(lines: Iterator[str]) -> Iterator[Tuple[dict, Iterator[list]]]:
+	# (header, rows) per section of a dump file; each section's rows must be read before the next
+	numbered = enumerate(lines, start=2)
+	pending: List[Optional[dict]] = [None]
+
+	def parse(number, line):
+		try:
+			return json.loads(line)
+		except ValueError as e:
+			raise ValueError(f"Line {number} is not JSON, a truncated dump? ({e})")
+
+	def rows():
+		for number, line in numbered:
+			value = parse(number, line)
+			if isinstance(value, dict):
+				pending[0] = value
+				return
+			yield value
+
+	for number, line in numbered:
+		value = parse(number, line)
+		if not isinstance(value, dict):
+			raise ValueError("Row before any table header")
+		pending[0] = value
+		break
+	while pending[0] is not None:
+		header, pending[0] = pending[0], None
+		yield header, rows()
+
+
+def import_state(lines: IO[str], chunk: int = IMPORT_CHUNK, log: Callable[[str], None] = print,
+		progress_every: float = PROGRESS_SECONDS) -> Dict[str, float]:
+	"""Load a dump into empty tables; returns rows, seconds and rows/s.
+
+	Raises ValueError for a file that is not a dump, one with more shards
+	than this app, non-empty target tables, unknown columns or a truncated
+	section (the chunks before it stay committed).
+	"""
+	lines = iter(lines)
+	header = _read_header(lines)
+	unknown = [name for name in header["tables"] if name not in db.metadata.tables]
+	if unknown:
+		raise ValueError(f"Unknown tables in dump: {', '.join(unknown)}")
+	db.session.commit()
+	_check_target(_engines(), header["tables"], header["shards"])
+	return load_sections(header["tables"], _parse_sections(lines), chunk=chunk, log=log, progress_every=progress_every)
@@ -0,0 +1,248 @@
+"""
+Pet state machine.
+
+Derives the pet's appearance and action availability from its stats and
+predicts when either will next change as the stats decay, so clients can
+schedule a single refresh instead of polling for threshold crossings.
+"""
+from __future__ import annotations
+
+import heapq
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .clock import utcnow
+from .constants import ACTION_THRESHOLDS, PET_APPEARANCE_THRESHOLDS, STAT_DECAY_RATES
+
+
+# Stat -> timestamp column its decay is measured from
+STAT_ANCHORS = {
+	"hunger": "last_fed",
+	"happiness": "last_played",
+	"cleanliness": "last_bathed",
+	"energy": "last_slept",
+}
+
+# Actions that stay available while the pet is asleep
+SLEEP_ACTIONS = ("sleep_nap", "sleep_full")
+
+# A crossing is evaluated slightly after it happens so strict and non-strict
+# comparisons both observe the new state.
+_SETTLE = timedelta(milliseconds=1)
+
+
+def compute_appearance(stats: Dict[str, float], is_sleeping: bool = False) -> str:
+	"""Return the appearance for the given stats (see PET_APPEARANCE_THRESHOLDS)"""
+	sleeping = PET_APPEARANCE_THRESHOLDS['sleeping']
+	hungry = PET_APPEARANCE_THRESHOLDS['hungry']
+	sad = PET_APPEARANCE_THRESHOLDS['sad']
+	happy = PET_APPEARANCE_THRESHOLDS['happy']
+
+	if is_sleeping or stats['energy'] < sleeping['energy']:
+		return "sleeping"
+	if stats['hunger'] < hungry['hunger'] and stats['energy'] >= hungry['energy_min']:
+		return "hungry"
+	if (stats['happiness'] < sad['happiness'] and stats['hunger'] >= sad['hunger_min']
+			and stats['energy'] >= sad['energy_min']):
+		return "sad"
+	if all(stats[stat] >= limit for stat, limit in happy.items()):
+		return "happy"
+	return "idle"
+
+
+def compute_action_availability(stats: Dict[str, float], is_sleeping: bool = False) -> Dict[str, bool]:
+	"""Return which actions are currently allowed (see ACTION_THRESHOLDS)"""
+	availability = {}
+	for action, rule in ACTION_THRESHOLDS.items():
+		value = stats[rule['stat']]
+		allowed = True
+		if 'max' in rule:
+			allowed = value <= rule['max']
+		if 'min' in rule:
+			allowed = allowed and value >= rule['min']
+		if is_sleeping and action not in SLEEP_ACTIONS:
+			allowed = False
+		availability[action] = allowed
+	return availability
+
+
+def _watched_values() -> Dict[str, set]:
+	"""Every stat value at which appearance or an action can flip"""
+	watched = {stat: set() for stat in STAT_ANCHORS}
+	for rule in ACTION_THRESHOLDS.values():
+		for bound in ('max', 'min'):
+			if bound in rule:
+				watched[rule['stat']].add(rule[bound])
+	for rule in PET_APPEARANCE_THRESHOLDS.values():
+		for key, value in rule.items():
+			stat = key[:-len('_min')] if key.endswith('_min') else key
+			if stat in watched:
+				watched[stat].add(value)
+	return watched
+
+
+WATCHED_VALUES = _watched_values()
+
+
+class StatProjection:
+	"""Projects a pet's stats forward in time using the configured decay rates.
+
+	Works on anything exposing the Pet column attributes (a Pet row or a cached
+	snapshot of one). While the pet sleeps its stats decay at the sleeping rate
+	until sleep_end_time, then at the normal rate.
+	"""
+
+	def __init__(self, pet):
+		self.pet = pet
+		self.sleep_end = pet.sleep_end_time if pet.is_sleeping else None
+		self.normal_rate = STAT_DECAY_RATES['normal'] / 3600.0  # points per second
+		self.sleep_rate = STAT_DECAY_RATES['sleeping'] / 3600.0
+
+	def is_sleeping(self, at: datetime) -> bool:
+		if not self.pet.is_sleeping:
+			return False
+		return self.sleep_end is None or at < self.sleep_end
+
+	def _segments(self, anchor: datetime):
+		"""Yield (start, end, rate) decay segments from the anchor onwards"""
+		if self.sleep_end is not None and anchor < self.sleep_end:
+			yield anchor, self.sleep_end, self.sleep_rate
+			yield self.sleep_end, None, self.normal_rate
+		elif self.pet.is_sleeping and self.sleep_end is None:
+			yield anchor, None, self.sleep_rate
+		else:
+			yield anchor, None, self.normal_rate
+
+	def value(self, stat: str, at: datetime) -> float:
+		value = float(getattr(self.pet, stat))
+		anchor = getattr(self.pet, STAT_ANCHORS[stat])
+		for start, end, rate in self._segments(anchor):
+			if at <= start:
+				break
+			until = at if end is None or at < end else end
+			value -= (until - start).total_seconds() * rate
+			if end is None or at < end:
+				break
+		return max(0.0, value)
+
+	def stats(self, at: datetime) -> Dict[str, float]:
+		return {stat: self.value(stat, at) for stat in STAT_ANCHORS}
+
+	def time_at_value(self, stat: str, target: float) -> Optional[datetime]:
+		"""Return when the stat decays down to target, or None if it never does"""
+		value = float(getattr(self.pet, stat))
+		anchor = getattr(self.pet, STAT_ANCHORS[stat])
+		if target < 0 or value <= target:
+			return None
+		for start, end, rate in self._segments(anchor):
+			if rate <= 0:
+				continue
+			reached = start + timedelta(seconds=(value - target) / rate)
+			if end is None or reached <= end:
+				return reached
+			value -= (end - start).total_seconds() * rate
+		return None
+
+
+def _candidate_times(projection: StatProjection, now: datetime) -> List[datetime]:
+	times = set()
+	for stat, values in WATCHED_VALUES.items():
+		for target in values:
+			when = projection.time_at_value(stat, target)
+			if when is not None and when > now:
+				times.add(when)
+	if projection.sleep_end is not None and projection.sleep_end > now:
+		times.add(projection.sleep_end)
+	return sorted(times)
+
+
+def predict_next_events(pet, now: Optional[datetime] = None) -> dict:
+	"""Return current appearance/actions and when each will next change.
+
+	Timestamps are naive UTC like the rest of the stats payload; None means the
+	value will not change without a player action.
+	"""
+	now = now or utcnow()
+	projection = StatProjection(pet)
+
+	stats_now = projection.stats(now)
+	sleeping_now = projection.is_sleeping(now)
+	appearance = compute_appearance(stats_now, sleeping_now)
+	actions = compute_action_availability(stats_now, sleeping_now)
+
+	appearance_change: Optional[Tuple[datetime, str]] = None
+	action_changes: Dict[str, datetime] = {}
+	for when in _candidate_times(projection, now):
+		if appearance_change and len(action_changes) == len(actions):
+			break
+		probe = when + _SETTLE
+		stats_then = projection.stats(probe)
+		sleeping_then = projection.is_sleeping(probe)
+		if appearance_change is None:
+			next_appearance = compute_appearance(stats_then, sleeping_then)
+			if next_appearance != appearance:
+				appearance_change = (when, next_appearance)
+		for action, allowed in compute_action_availability(stats_then, sleeping_then).items():
+			if action not in action_changes and allowed != actions[action]:
+				action_changes[action] = when
+
+	maturity_change = pet.compute_next_maturity_change(now)
+	upcoming = [appearance_change[0]] if appearance_change else []
+	upcoming.extend(action_changes.values())
+	if maturity_change is not None:
+		upcoming.append(maturity_change)
+	next_change = min(upcoming) if upcoming else None
+
+	return {
+		"appearance": {
+			"current": appearance,
+			"next": appearance_change[1] if appearance_change else None,
+			"changes_at": appearance_change[0].isoformat() if appearance_change else None
+		},
+		"actions": {
+			action: {
+				"available": allowed,
+				"changes_at": action_changes[action].isoformat() if action in action_changes else None
+			}
+			for action, allowed in actions.items()
+		},
+		"next_change_time": next_change.isoformat() if next_change else None
+	}
+
+
+def next_change_time(pet, now: Optional[datetime] = None) -> Optional[datetime]:
+	"""Return the earliest upcoming appearance/action/maturity change for a pet"""
+	now = now or utcnow()
+	projection = StatProjection(pet)
+	sleeping_now = projection.is_sleeping(now)
+	stats_now = projection.stats(now)
+	appearance = compute_appearance(stats_now, sleeping_now)
+	actions = compute_action_availability(stats_now, sleeping_now)
+
+	maturity_change = pet.compute_next_maturity_change(now)
+	for when in _candidate_times(projection, now):
+		if maturity_change is not None and when >= maturity_change:
+			break
+		probe = when + _SETTLE
+		stats_then = projection.stats(probe)
+		sleeping_then = projection.is_sleeping(probe)
+		if (compute_appearance(stats_then, sleeping_then) != appearance
+				or compute_action_availability(stats_then, sleeping_then) != actions):
+			return when
+	return maturity_change
+
+
+def predict_batch(pets: Iterable, now: Optional[datetime] = None) -> List[Tuple[datetime, int]]:
+	"""Return (next_change_time, pet_id) pairs as a heap, earliest first.
+
+	Pets with nothing pending are left out. The result can be consumed with
+	heapq.heappop by a scheduler that wakes up once per pet state change.
+	"""
+	now = now or utcnow()
+	schedule = []
+	for pet in pets:
+		when = next_change_time(pet, now)
+		if when is not None:
+			schedule.append((when, pet.id))
+	heapq.heapify(schedule)
+	return schedule
@@ -60,6 +60,14 @@ const PET_COLORS = {
 	squirrel: 0xa0522d  // sienna
 };
 
+// Unique key per user action so the server can replay (not re-run) retried POSTs
+function newIdempotencyKey() {
+	if (window.crypto && window.crypto.randomUUID) {
+		return window.crypto.randomUUID();
+	}
+	return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 // Global inventory state
 let currentInventory = {
 	tree_seed: 0,
@@ -661,6 +669,7 @@ async function handleUnifiedAction(actionType, actionSubType) {
 			method: config.method,
 			headers: {
 				'Content-Type': 'application/json',
+				'Idempotency-Key': newIdempotencyKey(),
 			},
 			body: JSON.stringify(requestBody)
 		});
@@ -951,6 +960,7 @@ function setupAutoUpdates() {
 			if (data.success) {
 				// Use loadCurrentStats logic to handle sleep state properly
 				updateStatsDisplay(data.stats);
+				scheduleStateRefresh(data.next_events);
 				// Maturity info in auto update
 				if (data.maturity) {
 					maturityStage = data.maturity.stage || maturityStage;
@@ -979,16 +989,48 @@ function setupAutoUpdates() {
 	}, 60000); // 60 seconds
 }
 
+// Single wake-up at the next server-predicted appearance/action change
+let stateRefreshTimer = null;
+const MAX_TIMEOUT_MS = 2147483647; // setTimeout limit (~24.8 days)
+
+function scheduleStateRefresh(nextEvents) {
+	if (stateRefreshTimer) {
+		clearTimeout(stateRefreshTimer);
+		stateRefreshTimer = null;
+	}
+	if (!nextEvents || !nextEvents.next_change_time) return;
+	const when = nextEvents.next_change_time;
+	const at = new Date(when + (when.endsWith('Z') ? '' : 'Z'));
+	// Small grace period so the server has crossed the threshold when we ask
+	const delay = Math.min(Math.max(at - new Date(), 0) + 1000, MAX_TIMEOUT_MS);
+	stateRefreshTimer = setTimeout(() => {
+		stateRefreshTimer = null;
+		loadCurrentStats();
+	}, delay);
+}
+
 async function loadCurrentStats() {
 	try {
 		console.log('🔄 loadCurrentStats called - fetching from backend...');
 		const response = await fetch('/api/pet/stats');
+		if (response.status === 429) {
+			// Rate limited: back off until the server says a request will be accepted
+			const retryAfter = parseInt(response.headers.get('Retry-After') || '5', 10);
+			console.log(`⏳ Stats rate limited, retrying in ${retryAfter}s`);
+			if (stateRefreshTimer) clearTimeout(stateRefreshTimer);
+			stateRefreshTimer = setTimeout(() => {
+				stateRefreshTimer = null;
+				loadCurrentStats();
+			}, retryAfter * 1000);
+			return;
+		}
 		const data = await response.json();
 		
 		console.log('📦 Backend response:', data);
 		
 		if (data.success) {
 			updateStatsDisplay(data.stats);
+			scheduleStateRefresh(data.next_events);
 			// Update maturity UI and stage
 			if (data.maturity) {
 				maturityStage = data.maturity.stage || 'adult';
@@ -1935,6 +1977,7 @@ async function autoSleep() {
 			method: 'POST',
 			headers: {
 				'Content-Type': 'application/json',
+				'Idempotency-Key': newIdempotencyKey(),
 			},
 			body: JSON.stringify({ action: 'sleep', sleep_type: 'sleep', auto_sleep: true })
 		});
@@ -2658,6 +2701,7 @@ async function buyFood(foodType, quantity) {
 			method: 'POST',
 			headers: {
 				'Content-Type': 'application/json',
+				'Idempotency-Key': newIdempotencyKey(),
 			},
 			body: JSON.stringify({
 				food_type: foodType,
@@ -2698,6 +2742,33 @@ async function buyFood(foodType, quantity) {
 	}
 }
 
+// Fill the player's values into the shared (server-cached) page markup
+function applyPageBootstrap() {
+	const blob = document.getElementById('page-bootstrap');
+	if (!blob) return;
+	const { pet: petData, inventory } = JSON.parse(blob.textContent);
+
+	['hunger', 'happiness', 'cleanliness', 'energy'].forEach(stat => {
+		const fill = document.querySelector(`.${stat}-fill`);
+		if (!fill) return;
+		fill.setAttribute('data-value', petData[stat]);
+		fill.closest('.stat-bar').querySelector('span').textContent = `${petData[stat]}%`;
+	});
+	const minigameBtn = document.getElementById('minigame-btn');
+	if (minigameBtn) minigameBtn.dataset.joy = petData.happiness;
+
+	Object.keys(inventory).forEach(item => {
+		document.querySelectorAll(`.food-quantity[data-food-type="${item}"]`).forEach(element => {
+			element.textContent = `(${inventory[item]})`;
+		});
+		const storageElement = document.getElementById(`storage-${item}`);
+		if (storageElement) storageElement.textContent = inventory[item];
+	});
+	const shopCoins = document.getElementById('shop-coins');
+	if (shopCoins) shopCoins.textContent = inventory.coins;
+}
+applyPageBootstrap();
+
 // Initialize stat bar widths from data-value attributes
 function initializeStatBars() {
 	const statFills = document.querySelectorAll('.fill[data-value]');
@@ -2877,6 +2948,7 @@ document.addEventListener('DOMContentLoaded', function() {
 			method: 'POST',
 			headers: {
 				'Content-Type': 'application/json',
+				'Idempotency-Key': newIdempotencyKey(),
 			},
 			body: JSON.stringify({ guess: guess })
 		})
@@ -3334,6 +3406,7 @@ document.addEventListener('DOMContentLoaded', function() {
 			method: 'POST',
 			headers: {
 				'Content-Type': 'application/json',
+				'Idempotency-Key': newIdempotencyKey(),
 			},
 			body: JSON.stringify({
 				collected: labyrinthGameState.collected
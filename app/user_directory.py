@@ -0,0 +1,207 @@
+"""
+Admin user directory: keyset pagination, username search and set-based
+bulk deletion.
+
+Pages are ordered newest first on the (created_at, id) index and addressed
+by an opaque cursor instead of OFFSET, so page N costs the same as page 1.
+Substring search uses an SQLite FTS5 trigram index (users_fts) or a Postgres
+pg_trgm index on username; prefix search is a range scan on the username
+index. Other databases fall back to LIKE.
+"""
+from __future__ import annotations
+
+import base64
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, or_, select, text
+
+from .extensions import db
+from .models import IdempotencyRecord, Inventory, LedgerEntry, LedgerSnapshot, Pet, PetActivity, PetStatHistory, User
+from .sharding import on_shard, shards_of
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# SQLite limits bound parameters per statement; delete in chunks
+DELETE_CHUNK = 500
+
+# Rows owned by a user that must go when the user does, children first:
+# (model, column, owner ids -> values of that column or None for the ids themselves)
+USER_OWNED = [
+	(PetActivity, PetActivity.pet_id, lambda ids: select(Pet.id).where(Pet.owner_id.in_(ids))),
+	(PetStatHistory, PetStatHistory.pet_id, lambda ids: select(Pet.id).where(Pet.owner_id.in_(ids))),
+	(Pet, Pet.owner_id, None),
+	(Inventory, Inventory.owner_id, None),
+	(LedgerEntry, LedgerEntry.owner_id, None),
+	(LedgerSnapshot, LedgerSnapshot.owner_id, None),
+	(IdempotencyRecord, IdempotencyRecord.user_id, None),
+]
+
+_SQLITE_FTS_DDL = [
+	"CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+	"username, content='users', content_rowid='id', tokenize='trigram')",
+	"CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+	"INSERT INTO users_fts(rowid, username) VALUES (new.id, new.username); END",
+	"CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+	"INSERT INTO users_fts(users_fts, rowid, username) VALUES ('delete', old.id, old.username); END",
+	"CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username ON users BEGIN "
+	"INSERT INTO users_fts(users_fts, rowid, username) VALUES ('delete', old.id, old.username); "
+	"INSERT INTO users_fts(rowid, username) VALUES (new.id, new.username); END",
+]
+
+
+def ensure_search_index() -> Optional[str]:
+	"""Create the username search index for this database; returns its kind"""
+	dialect = db.engine.dialect.name
+	if dialect == "sqlite":
+		exists = db.session.execute(
+			text("SELECT 1 FROM sqlite_master WHERE type='table' AND name='users_fts'")
+		).first()
+		try:
+			for statement in _SQLITE_FTS_DDL:
+				db.session.execute(text(statement))
+			if not exists:
+				db.session.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+			db.session.commit()
+		except Exception as e:
+			# SQLite built without FTS5 / trigram tokenizer (< 3.34)
+			db.session.rollback()
+			print(f"SEARCH: FTS5 trigram index unavailable, falling back to LIKE ({e})")
+			return None
+		return "fts5"
+	if dialect == "postgresql":
+		db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+		db.session.execute(text(
+			"CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)"
+		))
+		db.session.commit()
+		return "trigram"
+	return None
+
+
+def _has_fts() -> bool:
+	if db.engine.dialect.name != "sqlite":
+		return False
+	return db.session.execute(
+		text("SELECT 1 FROM sqlite_master WHERE type='table' AND name='users_fts'")
+	).first() is not None
+
+
+@contextmanager
+def search_index_deferred() -> Iterator[None]:
+	"""Stop maintaining the username search index inside the block and rebuild it once after (bulk loads)"""
+	dialect = db.engine.dialect.name
+	if dialect == "sqlite" and _has_fts():
+		db.session.execute(text("DROP TRIGGER IF EXISTS users_fts_ai"))
+		db.session.commit()
+		try:
+			yield
+		finally:
+			for statement in _SQLITE_FTS_DDL:
+				db.session.execute(text(statement))
+			db.session.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+			db.session.commit()
+	elif dialect == "postgresql":
+		db.session.execute(text("DROP INDEX IF EXISTS ix_users_username_trgm"))
+		db.session.commit()
+		try:
+			yield
+		finally:
+			ensure_search_index()
+	else:
+		yield
+
+
+def _escape_like(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_clause(q: str, mode: str = "substring"):
+	"""WHERE clause matching usernames by prefix or substring"""
+	if mode == "prefix":
+		# Range scan on the unique username index
+		return and_(User.username >= q, User.username < q + "\U0010ffff")
+	dialect = db.engine.dialect.name
+	if dialect == "sqlite" and len(q) >= 3 and _has_fts():
+		phrase = '"' + q.replace('"', '""') + '"'
+		matches = text("SELECT rowid FROM users_fts WHERE users_fts MATCH :phrase").bindparams(phrase=phrase)
+		return User.id.in_(matches.columns(rowid=db.Integer))
+	pattern = f"%{_escape_like(q)}%"
+	if dialect == "postgresql":
+		return User.username.ilike(pattern, escape="\\")
+	return User.username.like(pattern, escape="\\")
+
+
+def encode_cursor(created_at: datetime, user_id: int) -> str:
+	raw = f"{created_at.isoformat()}|{user_id}".encode()
+	return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+	padded = cursor + "=" * (-len(cursor) % 4)
+	created_at, user_id = base64.urlsafe_b64decode(padded).decode().split("|")
+	return datetime.fromisoformat(created_at), int(user_id)
+
+
+def list_users(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+		q: Optional[str] = None, mode: str = "substring") -> Tuple[List[dict], Optional[str]]:
+	"""Return one page of users (newest first) and the cursor of the next page.
+
+	Raises ValueError for a malformed cursor.
+	"""
+	limit = max(1, min(limit, MAX_PAGE_SIZE))
+	stmt = select(User.id, User.username, User.created_at, User.is_admin)
+	if q:
+		stmt = stmt.where(search_clause(q, mode))
+	if cursor:
+		after_created, after_id = decode_cursor(cursor)
+		stmt = stmt.where(or_(
+			User.created_at < after_created,
+			and_(User.created_at == after_created, User.id < after_id)
+		))
+	stmt = stmt.order_by(User.created_at.desc(), User.id.desc()).limit(limit + 1)
+	rows = db.session.execute(stmt).all()
+
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+	users = [
+		{"id": row.id, "username": row.username, "created_at": row.created_at, "is_admin": row.is_admin}
+		for row in rows
+	]
+	return users, next_cursor
+
+
+def bulk_delete_users(user_ids: Iterable[int]) -> int:
+	"""Delete non-admin users and everything they own with set-based statements.
+
+	Runs in one transaction per database (each shard's rows, then the users);
+	returns the number of users removed.
+	"""
+	requested = sorted({int(user_id) for user_id in user_ids})
+	deletable = []
+	for start in range(0, len(requested), DELETE_CHUNK):
+		chunk = requested[start:start + DELETE_CHUNK]
+		deletable.extend(db.session.scalars(
+			select(User.id).where(User.id.in_(chunk), User.is_admin.is_(False))
+		))
+
+	for shard, owners in shards_of(deletable).items():
+		with on_shard(shard):
+			for start in range(0, len(owners), DELETE_CHUNK):
+				chunk = owners[start:start + DELETE_CHUNK]
+				for model, column, via in USER_OWNED:
+					db.session.execute(
+						delete(model).where(column.in_(via(chunk) if via else chunk))
+						.execution_options(synchronize_session=False)
+					)
+	for start in range(0, len(deletable), DELETE_CHUNK):
+		chunk = deletable[start:start + DELETE_CHUNK]
+		db.session.execute(
+			delete(User).where(User.id.in_(chunk)).execution_options(synchronize_session=False)
+		)
+	db.session.commit()
+	return len(deletable)
@@ -1,13 +1,23 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, session
 from flask_login import login_required, current_user
-from datetime import datetime, timedelta
+import random
+from datetime import timedelta
 
 from .models import Pet, Inventory
 from .extensions import db
+from .clock import utcnow
+from .state_machine import predict_next_events
+from .state_cache import state_cache
+from .singleflight import coalesce_per_user, serialize_per_user
+from .idempotency import idempotent
+from .replicas import replica_ok
+from .rollups import bump, record_action
+from .stat_history import TIER_NAMES, pet_history as load_history
 from .constants import (
     PET_TYPES, FOOD_VALUES, WASH_VALUES, WASH_DURATIONS,
     SLEEP_DURATIONS, PLAY_VALUES, SHOP_PRICES, ACTION_THRESHOLDS,
-    MINIGAME_CONFIG, UPDATE_INTERVALS
+    MINIGAME_CONFIG, UPDATE_INTERVALS, STAT_HISTORY_TIERS,
+    MATURITY_ORDER, MATURITY_DURATIONS_DAYS
 )
 
 
@@ -34,22 +44,18 @@ def handle_feed_action(pet, request_data):
 		return {"success": False, "error": f"No {food_type.replace('_', ' ')} left in inventory"}
 	
 	# Consume the food from inventory
-	if not current_user.inventory.consume_food(food_type, 1):
+	if not current_user.inventory.consume_food(food_type, 1, reason="feed"):
 		return {"success": False, "error": f"Failed to consume {food_type}"}
 	
 	# Apply hunger increase
 	hunger_increase = FOOD_VALUES[food_type]
 	old_hunger = pet.hunger
 	pet.hunger = min(100, pet.hunger + hunger_increase)
-	pet.last_fed = datetime.utcnow()
+	pet.last_fed = utcnow()
 	pet.hunger = round(pet.hunger, 1)
 	
 	# Mark feeding state so frontend can restore animation on refresh
-	from datetime import timedelta
-	pet.is_feeding = True
-	pet.feed_start_time = datetime.utcnow()
-	pet.feed_type = food_type
-	pet.feed_end_time = pet.feed_start_time + timedelta(seconds=5)
+	pet.start_activity("feed", food_type, utcnow(), timedelta(seconds=5))
 	print(f"FEED DEBUG: {food_type} - Hunger: {old_hunger} -> {pet.hunger} (+{hunger_increase}), Inventory: {food_quantity} -> {food_quantity - 1}")
 	
 	return {
@@ -95,15 +101,11 @@ def handle_play_action(pet, request_data):
 	old_happiness = pet.happiness
 	joy_increase = PLAY_VALUES[play_type]
 	pet.happiness = min(100, pet.happiness + joy_increase)
-	pet.last_played = datetime.utcnow()
+	pet.last_played = utcnow()
 	pet.happiness = round(pet.happiness, 1)
 	
 	# Mark playing state so frontend can restore animation on refresh
-	from datetime import timedelta
-	pet.is_playing = True
-	pet.play_start_time = datetime.utcnow()
-	pet.play_type = play_type
-	pet.play_end_time = pet.play_start_time + timedelta(seconds=10)
+	pet.start_activity("play", play_type, utcnow(), timedelta(seconds=10))
 	print(f"PLAY DEBUG: {play_type} - Joy: {old_happiness} -> {pet.happiness} (+{joy_increase})")
 	
 	return {
@@ -140,7 +142,7 @@ def handle_wash_action(pet, request_data):
 	
 	# Apply cleanliness restoration
 	old_cleanliness = pet.cleanliness
-	now = datetime.utcnow()
+	now = utcnow()
 	
 	# Bath always restores to 100, others add their value
 	if wash_type == "bath":
@@ -150,15 +152,12 @@ def handle_wash_action(pet, request_data):
 		cleanliness_increase = WASH_VALUES[wash_type]
 		pet.cleanliness = min(100, pet.cleanliness + cleanliness_increase)
 	
-	pet.last_bathed = datetime.utcnow()
+	pet.last_bathed = utcnow()
 	pet.cleanliness = round(pet.cleanliness, 1)
 	
 	# Set washing state with duration from constants
 	wash_duration_seconds = WASH_DURATIONS[wash_type]
-	pet.is_washing = True
-	pet.wash_start_time = now
-	pet.wash_type = wash_type
-	pet.wash_end_time = now + timedelta(seconds=wash_duration_seconds)
+	pet.start_activity("wash", wash_type, now, timedelta(seconds=wash_duration_seconds))
 	
 	print(f"WASH DEBUG: {wash_type} - Cleanliness: {old_cleanliness} -> {pet.cleanliness} (+{cleanliness_increase})")
 	
@@ -202,7 +201,7 @@ def handle_sleep_action(pet, request_data):
 	
 	# Apply energy restoration using constants
 	old_energy = pet.energy
-	now = datetime.utcnow()
+	now = utcnow()
 	
 	sleep_config = SLEEP_DURATIONS[sleep_type]
 	if sleep_type == 'nap':
@@ -212,12 +211,9 @@ def handle_sleep_action(pet, request_data):
 	
 	# Set sleeping state using duration from constants
 	sleep_duration_minutes = sleep_config['minutes']
-	pet.is_sleeping = True
-	pet.sleep_start_time = now
-	pet.sleep_type = sleep_type
-	pet.sleep_end_time = now + timedelta(minutes=sleep_duration_minutes)
+	pet.start_activity("sleep", sleep_type, now, timedelta(minutes=sleep_duration_minutes))
 	
-	pet.last_slept = datetime.utcnow()
+	pet.last_slept = utcnow()
 	pet.energy = round(pet.energy, 1)
 	
 	print(f"SLEEP DEBUG: {sleep_type} - Energy: {old_energy} -> {pet.energy}")
@@ -239,6 +235,12 @@ def handle_sleep_action(pet, request_data):
 	}
 
 
+@bp.route("/healthz")
+def healthz():
+	"""Liveness probe: no session, database or template work"""
+	return {"status": "ok"}
+
+
 @bp.route("/")
 def index():
 	if not current_user.is_authenticated:
@@ -257,7 +259,17 @@ def index():
 		db.session.add(inventory)
 		db.session.commit()
 	
-	return render_template("game.html", pet=current_user.pet, inventory=current_user.inventory)
+	pet, inventory = current_user.pet, current_user.inventory
+	# Everything below the header comes from the fragment cache; these are
+	# the only per-player values on the page (applied by main.js)
+	bootstrap = {
+		"pet": {"name": pet.name, "pet_type": pet.pet_type},
+		"inventory": {item: getattr(inventory, item) or 0 for item in ("coins", *FOOD_VALUES)},
+	}
+	for stat in ("hunger", "happiness", "cleanliness", "energy"):
+		value = getattr(pet, stat)
+		bootstrap["pet"][stat] = 50 if value is None else value
+	return render_template("game.html", pet=pet, bootstrap=bootstrap)
 
 
 @bp.route("/select-pet", methods=["GET", "POST"])
@@ -300,6 +312,8 @@ def select_pet():
 
 @bp.route("/api/pet/action", methods=["POST"])
 @login_required
+@serialize_per_user
+@idempotent
 def pet_action():
 	if not current_user.pet:
 		return jsonify({"error": "No pet found"}), 404
@@ -347,22 +361,19 @@ def pet_action():
 			return jsonify({"error": f"No {food_type.replace('_', ' ')} left in inventory"}), 400
 		
 		# Consume the food from inventory
-		if not current_user.inventory.consume_food(food_type, 1):
+		if not current_user.inventory.consume_food(food_type, 1, reason="feed"):
 			return jsonify({"error": f"Failed to consume {food_type}"}), 400
 		
 		hunger_increase = food_values[food_type]
 		old_hunger = pet.hunger
 		pet.hunger = min(100, pet.hunger + hunger_increase)
-		pet.last_fed = datetime.utcnow()
+		pet.last_fed = utcnow()
 		pet.hunger = round(pet.hunger, 1)
 		
 		# Persist feeding state for refresh-safe animation (5s)
-		pet.is_feeding = True
-		pet.feed_start_time = datetime.utcnow()
-		pet.feed_type = food_type
-		pet.feed_end_time = pet.feed_start_time + timedelta(seconds=5)
+		pet.start_activity("feed", food_type, utcnow(), timedelta(seconds=5))
 		print(f"FEED DEBUG: {food_type} - Hunger: {old_hunger} -> {pet.hunger} (+{hunger_increase}), Inventory: {food_quantity} -> {food_quantity - 1}")
-		
+		record_action("feed", food_type)
 
 		# Commit the changes immediately for feed action
 		db.session.commit()
@@ -407,15 +418,13 @@ def pet_action():
 		# Apply joy restoration (+25 for both play types)
 		old_happiness = pet.happiness
 		pet.happiness = min(100, pet.happiness + 25)
-		pet.last_played = datetime.utcnow()
+		pet.last_played = utcnow()
 		pet.happiness = round(pet.happiness, 1)
 		
 		print(f"PLAY DEBUG: {play_type} - Joy: {old_happiness} -> {pet.happiness} (+25)")
 		# Mark playing state
-		pet.is_playing = True
-		pet.play_start_time = datetime.utcnow()
-		pet.play_type = play_type
-		pet.play_end_time = pet.play_start_time + timedelta(seconds=10)
+		pet.start_activity("play", play_type, utcnow(), timedelta(seconds=10))
+		record_action("play", play_type)
 
 	elif action == "wash":
 		# Get wash type from request
@@ -433,7 +442,7 @@ def pet_action():
 		
 		# Apply cleanliness restoration
 		old_cleanliness = pet.cleanliness
-		now = datetime.utcnow()
+		now = utcnow()
 		
 		# Define wash types and their cleanliness values
 		wash_values = {
@@ -450,7 +459,7 @@ def pet_action():
 			cleanliness_increase = wash_values[wash_type]
 			pet.cleanliness = min(100, pet.cleanliness + cleanliness_increase)
 		
-		pet.last_bathed = datetime.utcnow()
+		pet.last_bathed = utcnow()
 		pet.cleanliness = round(pet.cleanliness, 1)
 		
 		# Set washing state with different durations
@@ -460,12 +469,10 @@ def pet_action():
 			"bath": 30
 		}
 		
-		pet.is_washing = True
-		pet.wash_start_time = now
-		pet.wash_type = wash_type
-		pet.wash_end_time = now + timedelta(seconds=wash_duration_seconds[wash_type])
+		pet.start_activity("wash", wash_type, now, timedelta(seconds=wash_duration_seconds[wash_type]))
 		
 		print(f"WASH DEBUG: {wash_type} - Cleanliness: {old_cleanliness} -> {pet.cleanliness} (+{cleanliness_increase})")
+		record_action("wash", wash_type)
 		
 		# Commit the changes immediately for wash action
 		db.session.commit()
@@ -510,29 +517,24 @@ def pet_action():
 		
 		# Apply energy restoration
 		old_energy = pet.energy
-		now = datetime.utcnow()
+		now = utcnow()
 		
 		if sleep_type == 'nap':
 			pet.energy = min(100, pet.energy + 25)
 			# Set sleeping state for nap (1 minute for testing, 1 hour in future)
 			sleep_duration_minutes = 1  # TODO: Change to 60 for production
-			pet.is_sleeping = True
-			pet.sleep_start_time = now
-			pet.sleep_type = 'nap'
-			pet.sleep_end_time = now + timedelta(minutes=sleep_duration_minutes)
+			pet.start_activity("sleep", 'nap', now, timedelta(minutes=sleep_duration_minutes))
 		elif sleep_type == 'sleep':
 			pet.energy = 100  # Always restore to 100 for sleep
 			# Set sleeping state for sleep (2 minutes for testing, 8 hours in future)
 			sleep_duration_minutes = 2  # TODO: Change to 480 (8 hours) for production
-			pet.is_sleeping = True
-			pet.sleep_start_time = now
-			pet.sleep_type = 'sleep'
-			pet.sleep_end_time = now + timedelta(minutes=sleep_duration_minutes)
+			pet.start_activity("sleep", 'sleep', now, timedelta(minutes=sleep_duration_minutes))
 		
-		pet.last_slept = datetime.utcnow()
+		pet.last_slept = utcnow()
 		pet.energy = round(pet.energy, 1)
 		
 		print(f"SLEEP DEBUG: {sleep_type} - Energy: {old_energy} -> {pet.energy}")
+		record_action("sleep", sleep_type)
 		
 		# Commit the changes immediately for sleep action
 		db.session.commit()
@@ -576,59 +578,46 @@ def pet_action():
 	})
 
 
-@bp.route("/api/pet/stats", methods=["GET"])
-@login_required
-def get_pet_stats():
-	if not current_user.pet:
-		return jsonify({"error": "No pet found"}), 404
-	
-	pet = current_user.pet
-	
-	# Only update stats if enough time has passed since last action (at least 30 seconds)
-	now = datetime.utcnow()
+def stats_need_update(pet, now) -> bool:
+	"""True if serving stats now would change the pet (a timer ended or decay is due)"""
 	time_since_last_action = min(
 		(now - pet.last_fed).total_seconds(),
 		(now - pet.last_played).total_seconds(),
 		(now - pet.last_bathed).total_seconds(),
 		(now - pet.last_slept).total_seconds()
 	)
-	
-	# Check if pet should wake up from sleep
-	if pet.is_sleeping:
-		pet.check_wake_up()
-		db.session.commit()
-	
-	# Check if pet should finish washing
-	if pet.is_washing:
-		pet.check_wash_finish()
-		db.session.commit()
-
-	# Ensure feed/play states are cleared if ended
-	pet.check_feed_finish()
-	pet.check_play_finish()
-	db.session.commit()
-	
-	# Only update stats if at least 30 seconds have passed since any action
 	if time_since_last_action >= 30:
-		pet.update_stats()
-		db.session.commit()
-	
+		return True
+	timers = (
+		(pet.is_sleeping, pet.sleep_end_time),
+		(pet.is_washing, pet.wash_end_time),
+		(pet.is_feeding, pet.feed_end_time),
+		(pet.is_playing, pet.play_end_time),
+	)
+	return any(active and end_time and now >= end_time for active, end_time in timers)
+
+
+def build_stats_payload(pet, inventory, now) -> dict:
+	"""Stats response body; works on model rows and cached snapshots alike"""
 	# Get inventory data
 	inventory_data = {}
-	if current_user.inventory:
+	if inventory:
 		inventory_data = {
-			"tree_seed": current_user.inventory.tree_seed,
-			"blueberries": current_user.inventory.blueberries,
-			"mushroom": current_user.inventory.mushroom,
-			"acorn": current_user.inventory.acorn,
-			"coins": current_user.inventory.coins
+			"tree_seed": inventory.tree_seed,
+			"blueberries": inventory.blueberries,
+			"mushroom": inventory.mushroom,
+			"acorn": inventory.acorn,
+			"coins": inventory.coins
 		}
 	
 	# Maturity info
-	stage = pet.compute_maturity_stage()
-	next_change_dt = pet.compute_next_maturity_change()
+	stage = pet.compute_maturity_stage(now)
+	next_change_dt = pet.compute_next_maturity_change(now)
 
-	return jsonify({
+	# Upcoming appearance/action changes so the client can schedule its next refresh
+	next_events = predict_next_events(pet, now)
+
+	return {
 		"success": True,
 		"is_sleeping": pet.is_sleeping,
 		"sleep_type": pet.sleep_type,
@@ -652,17 +641,96 @@ def get_pet_stats():
 			"stage": stage,
 			"next_change_time": next_change_dt.isoformat() if next_change_dt else None
 		},
+		"next_events": next_events,
 		"stats": {
 			"hunger": pet.hunger,
 			"happiness": pet.happiness,
 			"cleanliness": pet.cleanliness,
 			"energy": pet.energy
 		}
-	})
+	}
+
+
+@bp.route("/api/pet/stats", methods=["GET"])
+@login_required
+@coalesce_per_user
+def get_pet_stats():
+	now = utcnow()
+
+	# Serve from the per-user cache when this poll would not change anything
+	cached = state_cache.get(current_user.id)
+	if cached is not None and cached.pet is not None and not stats_need_update(cached.pet, now):
+		return jsonify(build_stats_payload(cached.pet, cached.inventory, now))
+
+	if not current_user.pet:
+		return jsonify({"error": "No pet found"}), 404
+	
+	pet = current_user.pet
+	
+	# Only update stats if enough time has passed since last action (at least 30 seconds)
+	time_since_last_action = min(
+		(now - pet.last_fed).total_seconds(),
+		(now - pet.last_played).total_seconds(),
+		(now - pet.last_bathed).total_seconds(),
+		(now - pet.last_slept).total_seconds()
+	)
+	
+	# Check if pet should wake up from sleep
+	if pet.is_sleeping:
+		pet.check_wake_up()
+		db.session.commit()
+	
+	# Check if pet should finish washing
+	if pet.is_washing:
+		pet.check_wash_finish()
+		db.session.commit()
+
+	# Ensure feed/play states are cleared if ended
+	pet.check_feed_finish()
+	pet.check_play_finish()
+	db.session.commit()
+	
+	# Only update stats if at least 30 seconds have passed since any action
+	if time_since_last_action >= 30:
+		pet.update_stats()
+		db.session.commit()
+
+	state = state_cache.put(current_user, now)
+	return jsonify(build_stats_payload(state.pet, state.inventory, now))
+
+
+@bp.route("/api/pet/history", methods=["GET"])
+@replica_ok
+@login_required
+def pet_history():
+	"""Stat chart data: ?hours=168 (default) and optional ?tier=minute|hour|day"""
+	if not current_user.pet:
+		return jsonify({"error": "No pet found"}), 404
+
+	try:
+		hours = float(request.args.get("hours", 168))
+	except ValueError:
+		return jsonify({"error": "hours must be a number"}), 400
+	longest = max(step * slots for _, step, slots in STAT_HISTORY_TIERS) / 3600
+	if not 0 < hours <= longest:
+		return jsonify({"error": f"hours must be between 0 and {longest:g}"}), 400
+
+	tier = request.args.get("tier")
+	if tier is not None and tier not in TIER_NAMES:
+		return jsonify({"error": f"tier must be one of {', '.join(TIER_NAMES)}"}), 400
+
+	now = utcnow()
+	history = load_history(
+		current_user.pet.id, now - timedelta(hours=hours), now,
+		TIER_NAMES.index(tier) if tier is not None else None
+	)
+	return jsonify({"success": True, **history})
 
 
 @bp.route("/api/shop/purchase", methods=["POST"])
 @login_required
+@serialize_per_user
+@idempotent
 def shop_purchase():
 	if not current_user.pet:
 		return jsonify({"error": "No pet found"}), 404
@@ -705,14 +773,17 @@ def shop_purchase():
 		return jsonify({"error": f"Inventory full. Can buy maximum {max_affordable} more"}), 400
 
 	# Process purchase
-	if not current_user.inventory.spend_coins(total_cost):
+	if not current_user.inventory.spend_coins(total_cost, reason="purchase"):
 		return jsonify({"error": "Failed to process payment"}), 500
 
-	if not current_user.inventory.add_food(food_type, quantity):
+	if not current_user.inventory.add_food(food_type, quantity, reason="purchase"):
 		# Refund coins if food addition fails
-		current_user.inventory.add_coins(total_cost)
+		current_user.inventory.add_coins(total_cost, reason="refund")
 		return jsonify({"error": "Failed to add food to inventory"}), 500
 
+	bump("shop_orders", food_type)
+	bump("shop_units", food_type, quantity)
+	bump("shop_revenue", food_type, total_cost)
 	db.session.commit()
 
 	print(f"SHOP: {current_user.username} bought {quantity} {food_type} for {total_cost} coins")
@@ -732,6 +803,7 @@ def shop_purchase():
 
 
 @bp.route("/api/minigame/availability", methods=["GET"])
+@replica_ok
 @login_required
 def minigame_availability():
 	"""Check which minigames are available to play"""
@@ -750,6 +822,8 @@ def minigame_availability():
 
 @bp.route("/api/minigame/higher-lower", methods=["POST"])
 @login_required
+@serialize_per_user
+@idempotent
 def minigame_higher_lower():
 	if not current_user.pet:
 		return jsonify({"error": "No pet found"}), 404
@@ -775,7 +849,6 @@ def minigame_higher_lower():
 		return jsonify({"error": "Invalid guess. Must be 'higher' or 'lower'"}), 400
 	
 	# Generate random number between 0-20, excluding 10
-	import random
 	possible_numbers = list(range(0, 10)) + list(range(11, 21))
 	rolled_number = random.choice(possible_numbers)
 	
@@ -791,7 +864,7 @@ def minigame_higher_lower():
 	# Apply consequences
 	if is_correct:
 		# Grant 20 coins
-		current_user.inventory.add_coins(20)
+		current_user.inventory.add_coins(20, reason="higher_lower")
 		reward_message = f"Correct! You earned 20 coins! 🪙"
 	else:
 		# Reduce joy by 2 points
@@ -801,7 +874,10 @@ def minigame_higher_lower():
 		reward_message = f"Wrong! Pet lost 2 joy points 😢"
 	
 	# Update last played timestamp
-	current_user.last_played_higher_lower = datetime.utcnow()
+	current_user.last_played_higher_lower = utcnow()
+	bump("minigame_plays", "higher_lower")
+	if is_correct:
+		bump("minigame_wins", "higher_lower")
 	
 	# Commit changes
 	db.session.commit()
@@ -825,6 +901,8 @@ def minigame_higher_lower():
 
 @bp.route("/api/minigame/labyrinth", methods=["POST"])
 @login_required
+@serialize_per_user
+@idempotent
 def minigame_labyrinth():
 	if not current_user.pet:
 		return jsonify({"error": "No pet found"}), 404
@@ -862,17 +940,18 @@ def minigame_labyrinth():
 	
 	# Add collected items to inventory
 	if blueberries > 0:
-		current_user.inventory.add_food("blueberries", blueberries)
+		current_user.inventory.add_food("blueberries", blueberries, reason="labyrinth")
 	
 	if acorns > 0:
 		# Add acorns to inventory
-		current_user.inventory.add_food("acorn", acorns)
+		current_user.inventory.add_food("acorn", acorns, reason="labyrinth")
 	
 	# Increase pet happiness slightly for playing
 	old_happiness = current_user.pet.happiness
 	happiness_bonus = min(2, total_collected)  # 1 point per item, max 2
 	current_user.pet.happiness = min(100, current_user.pet.happiness + happiness_bonus)
 	current_user.pet.happiness = round(current_user.pet.happiness, 1)
+	bump("minigame_plays", "labyrinth")
 	
 	# Commit changes
 	db.session.commit()
@@ -908,6 +987,7 @@ def minigame_labyrinth():
 
 @bp.route("/api/pet/test-action", methods=["POST"])
 @login_required
+@serialize_per_user
 def pet_test_action():
 	if not current_user.pet:
 		return jsonify({"error": "No pet found"}), 404
@@ -949,6 +1029,7 @@ def pet_test_action():
 # Debug maturity controls
 @bp.route("/api/pet/maturity", methods=["POST"])
 @login_required
+@serialize_per_user
 def set_maturity_stage():
 	if not current_user.pet:
 		return jsonify({"error": "No pet found"}), 404
@@ -961,9 +1042,7 @@ def set_maturity_stage():
 	pet = current_user.pet
 	current_stage = pet.compute_maturity_stage()
 
-	from datetime import timedelta
 	# Calculate desired stage index
-	from .constants import MATURITY_ORDER, MATURITY_DURATIONS_DAYS
 	idx = MATURITY_ORDER.index(current_stage)
 
 	if action == 'up' and idx < len(MATURITY_ORDER) - 1:
@@ -981,17 +1060,16 @@ def set_maturity_stage():
 	child_days = MATURITY_DURATIONS_DAYS.get("child") or 0
 	teen_days = MATURITY_DURATIONS_DAYS.get("teen") or 0
 	if desired_idx == 0:  # child
-		pet.created_at = datetime.utcnow() - timedelta(hours=1)
+		pet.created_at = utcnow() - timedelta(hours=1)
 	elif desired_idx == 1:  # teen -> just past child duration
-		pet.created_at = datetime.utcnow() - timedelta(days=child_days, hours=1)
+		pet.created_at = utcnow() - timedelta(days=child_days, hours=1)
 	else:  # adult -> past child+teen
-		pet.created_at = datetime.utcnow() - timedelta(days=child_days + teen_days, hours=1)
+		pet.created_at = utcnow() - timedelta(days=child_days + teen_days, hours=1)
 
 	# Return updated maturity info
 	stage = pet.compute_maturity_stage()
 	next_change_dt = pet.compute_next_maturity_change()
 
-	from .extensions import db
 	db.session.commit()
 
 	return jsonify({
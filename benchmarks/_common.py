@@ -0,0 +1,100 @@
+"""
+Shared helpers for the benchmark scripts: scratch apps, seeded players,
+logged-in test clients and latency summaries.
+"""
+import contextlib
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+
+from sqlalchemy import insert, select  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+
+def make_app(database_url=None, **config):
+	"""Create an app on a scratch SQLite database (or the given URL)"""
+	from app import create_app
+	if database_url is None:
+		tmpdir = tempfile.mkdtemp(prefix="tamagochi-bench-")
+		database_url = f"sqlite:///{os.path.join(tmpdir, 'bench.sqlite')}"
+	# Benchmarks hammer endpoints on purpose; bench_ratelimit.py turns limits back on
+	settings = {"SQLALCHEMY_DATABASE_URI": database_url, "TESTING": True, "RATE_LIMIT_ENABLED": False,
+		"JOB_QUEUE_PATH": os.path.join(tempfile.mkdtemp(prefix="tamagochi-jobs-"), "jobs.sqlite")}
+	settings.update(config)
+	return create_app(settings)
+
+
+@contextlib.contextmanager
+def quiet():
+	"""Silence the views' debug prints while measuring"""
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		yield
+
+
+def create_players(app, count, with_pet=True, prefix="bench"):
+	"""Bulk-insert users (plus pet and inventory) and return their ids"""
+	from app.extensions import db
+	from app.models import Inventory, Pet, User
+	from app.sharding import on_shard
+
+	password_hash = generate_password_hash("bench")
+	with app.app_context():
+		first = db.session.scalar(select(db.func.max(User.id))) or 0
+		db.session.execute(insert(User), [
+			{"username": f"{prefix}_{first + i:07d}", "password_hash": password_hash}
+			for i in range(count)
+		])
+		rows = db.session.execute(select(User.id, User.shard).where(User.id > first).order_by(User.id)).all()
+		user_ids = [user_id for user_id, _ in rows]
+		if with_pet:
+			by_shard = {}
+			for user_id, shard in rows:
+				by_shard.setdefault(shard, []).append(user_id)
+			for shard, owner_ids in by_shard.items():
+				with on_shard(shard):
+					db.session.execute(insert(Pet), [
+						{"owner_id": user_id, "pet_type": "squirrel", "name": f"Pet{user_id}"}
+						for user_id in owner_ids
+					])
+					db.session.execute(insert(Inventory), [{"owner_id": user_id} for user_id in owner_ids])
+		db.session.commit()
+	return user_ids
+
+
+def login(app, user_id):
+	"""Return a test client with an authenticated session for user_id"""
+	client = app.test_client()
+	with client.session_transaction() as sess:
+		sess["_user_id"] = str(user_id)
+		sess["_fresh"] = True
+	return client
+
+
+def percentiles(samples_ms):
+	"""p50/p90/p99/max/mean of a list of millisecond samples"""
+	if not samples_ms:
+		return {"n": 0}
+	ordered = sorted(samples_ms)
+
+	def pick(q):
+		return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+	return {
+		"n": len(ordered),
+		"p50": round(pick(0.50), 3),
+		"p90": round(pick(0.90), 3),
+		"p99": round(pick(0.99), 3),
+		"max": round(ordered[-1], 3),
+		"mean": round(sum(ordered) / len(ordered), 3),
+	}
+
+
+def print_table(rows, headers):
+	widths = [max(len(str(h)), *(len(str(row.get(h, ""))) for row in rows)) for h in headers]
+	print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+	for row in rows:
+		print("  ".join(str(row.get(h, "")).ljust(w) for h, w in zip(headers, widths)))
@@ -0,0 +1,137 @@
+"""
+Admin access-request queue latency with a large backlog.
+
+Seeds N requests (10% unprocessed by default), then measures the paginated
+queue (first and deep pages, processed/all tabs), a bulk range update, the
+streaming export and the archival job. --legacy also times the old
+"load every request and render it" page.
+
+	python benchmarks/bench_access_queue.py --requests 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def measure(fn, repeat):
+	samples = []
+	size = 0
+	for _ in range(repeat):
+		started = time.perf_counter()
+		size = fn()
+		samples.append((time.perf_counter() - started) * 1000)
+	return percentiles(samples), size
+
+
+def seed_requests(app, count, unprocessed_ratio, batch=50000):
+	"""Raw executemany inserts spread over the last 180 days"""
+	from sqlalchemy import insert
+	from app.extensions import db
+	from app.models import AccessRequest
+
+	rng = random.Random(7)
+	start = datetime.utcnow() - timedelta(days=180)
+	step = timedelta(days=180) / count
+	with app.app_context():
+		for offset in range(0, count, batch):
+			db.session.execute(insert(AccessRequest), [
+				{
+					"email": f"player{i}@example.com",
+					"message": "Please let me in",
+					"created_at": start + step * i,
+					"processed": rng.random() >= unprocessed_ratio,
+				}
+				for i in range(offset, min(count, offset + batch))
+			])
+			db.session.commit()
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--requests", type=int, default=1000000)
+	parser.add_argument("--unprocessed", type=float, default=0.1, help="Share of requests still new")
+	parser.add_argument("--repeat", type=int, default=20)
+	parser.add_argument("--legacy", action="store_true", help="Also time the old load-everything page (slow)")
+	args = parser.parse_args()
+
+	from flask import render_template
+	from sqlalchemy import func, select
+	from app.access_queue import archive_processed
+	from app.extensions import db
+	from app.models import AccessRequest, User
+	from app.user_directory import encode_cursor
+
+	app = make_app()
+	admin_id = create_players(app, 1, with_pet=False, prefix="admin")[0]
+	with app.app_context():
+		db.session.get(User, admin_id).is_admin = True
+		db.session.commit()
+	started = time.perf_counter()
+	seed_requests(app, args.requests, args.unprocessed)
+	print(f"Seeded {args.requests} access requests in {time.perf_counter() - started:.1f}s")
+
+	client = login(app, admin_id)
+
+	def legacy_page():
+		with app.test_request_context("/auth/admin/access-requests"):
+			requests = AccessRequest.query.order_by(AccessRequest.created_at.desc()).all()
+			return len(render_template("access_requests.html", requests=requests, next_cursor=None, status="all", pending=0))
+
+	def get(url):
+		return lambda: len(client.get(url).data)
+
+	def stream(url):
+		def run():
+			response = client.get(url, buffered=False)
+			size = sum(len(chunk) for chunk in response.response)
+			response.close()
+			return size
+		return run
+
+	def middle_cursor(*criteria):
+		# Cursor of the row halfway down the listing (built once with OFFSET)
+		row = db.session.execute(
+			select(AccessRequest.created_at, AccessRequest.id).where(*criteria)
+			.order_by(AccessRequest.created_at.desc(), AccessRequest.id.desc())
+			.offset(db.session.scalar(select(func.count()).select_from(AccessRequest).where(*criteria)) // 2)
+			.limit(1)
+		).one()
+		return encode_cursor(row.created_at, row.id)
+
+	with app.app_context():
+		deep_new = middle_cursor(AccessRequest.processed.is_(False))
+		deep_all = middle_cursor()
+
+	cases = []
+	if args.legacy:
+		cases.append(("legacy: all requests", legacy_page, 1))
+	cases += [
+		("queue: new, first page", get("/auth/admin/access-requests"), args.repeat),
+		("queue: new, deep page", get(f"/auth/admin/access-requests?cursor={deep_new}"), args.repeat),
+		("queue: all, first page", get("/auth/admin/access-requests?status=all"), args.repeat),
+		("queue: all, deep page", get(f"/auth/admin/access-requests?status=all&cursor={deep_all}"), args.repeat),
+		("export: new, ndjson", stream("/auth/admin/access-requests/export.ndjson?status=new"), 1),
+		("export: all, csv", stream("/auth/admin/access-requests/export.csv"), 1),
+	]
+	rows = []
+	with quiet():
+		for label, fn, repeat in cases:
+			stats, size = measure(fn, repeat)
+			rows.append({"case": label, "n": stats["n"], "p50 ms": stats["p50"], "p99 ms": stats["p99"], "bytes": size})
+
+		started = time.perf_counter()
+		client.post("/auth/admin/access-requests", data={"from_id": 1, "to_id": args.requests // 10})
+		rows.append({"case": "bulk: mark 10% range", "n": 1, "p50 ms": round((time.perf_counter() - started) * 1000, 3), "p99 ms": "", "bytes": ""})
+
+		with app.app_context():
+			started = time.perf_counter()
+			moved = archive_processed(older_than_days=90, chunk_size=5000)
+			rows.append({"case": f"archive: {moved} rows", "n": 1, "p50 ms": round((time.perf_counter() - started) * 1000, 3), "p99 ms": "", "bytes": ""})
+	print_table(rows, ["case", "n", "p50 ms", "p99 ms", "bytes"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,141 @@
+"""
+Expiry sweep time and pet row size: sixteen activity columns on pets versus
+the pet_activities table.
+
+Builds N pets in both layouts in one scratch SQLite file (the legacy layout
+as a standalone pets_legacy table with the old columns), with --active of
+them mid-activity, then times finding and clearing everything that has
+expired: a full scan of pets_legacy versus a range scan on
+pet_activities.end_time. Row sizes come from SQLite's dbstat.
+
+	python benchmarks/bench_activities.py --pets 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import make_app, print_table
+
+LEGACY_DDL = """
+CREATE TABLE pets_legacy (
+	id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL UNIQUE, pet_type VARCHAR(20) NOT NULL,
+	name VARCHAR(50) NOT NULL, hunger INTEGER NOT NULL, happiness INTEGER NOT NULL,
+	cleanliness INTEGER NOT NULL, energy INTEGER NOT NULL, last_fed DATETIME NOT NULL,
+	last_played DATETIME NOT NULL, last_bathed DATETIME NOT NULL, last_slept DATETIME NOT NULL,
+	created_at DATETIME NOT NULL,
+	is_sleeping BOOLEAN NOT NULL, sleep_start_time DATETIME, sleep_type VARCHAR(10), sleep_end_time DATETIME,
+	is_washing BOOLEAN NOT NULL, wash_start_time DATETIME, wash_type VARCHAR(15), wash_end_time DATETIME,
+	is_feeding BOOLEAN NOT NULL, feed_start_time DATETIME, feed_type VARCHAR(30), feed_end_time DATETIME,
+	is_playing BOOLEAN NOT NULL, play_start_time DATETIME, play_type VARCHAR(30), play_end_time DATETIME
+)
+"""
+KINDS = {"sleep": "nap", "wash": "shower", "feed": "acorn", "play": "spin_in_wheel"}
+
+
+def seed(conn, pets, active, now, batch=50000):
+	rng = random.Random(3)
+	stamp = now.isoformat(sep=" ")
+	for offset in range(0, pets, batch):
+		legacy_rows, pet_rows, activity_rows = [], [], []
+		for pet_id in range(offset + 1, min(pets, offset + batch) + 1):
+			base = [pet_id, pet_id, "hamster", f"Pet{pet_id}", 50, 50, 50, 50, stamp, stamp, stamp, stamp, stamp]
+			pet_rows.append(tuple(base))
+			legacy = [0, None, None, None] * 4
+			if rng.random() < active:
+				slot = rng.randrange(4)
+				kind = list(KINDS)[slot]
+				# Ends spread over +-30 minutes around now, so about half have expired
+				end = (now + timedelta(seconds=rng.randint(-1800, 1800))).isoformat(sep=" ")
+				legacy[slot * 4:slot * 4 + 4] = [1, stamp, KINDS[kind], end]
+				activity_rows.append((pet_id, kind, KINDS[kind], stamp, end))
+			legacy_rows.append(tuple(base + legacy))
+		conn.exec_driver_sql(f"INSERT INTO pets_legacy VALUES ({', '.join(['?'] * 29)})", legacy_rows)
+		conn.exec_driver_sql(
+			"INSERT INTO pets (id, owner_id, pet_type, name, hunger, happiness, cleanliness, energy, "
+			"last_fed, last_played, last_bathed, last_slept, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+			pet_rows
+		)
+		if activity_rows:
+			conn.exec_driver_sql(
+				"INSERT INTO pet_activities (pet_id, kind, activity_type, start_time, end_time) VALUES (?, ?, ?, ?, ?)",
+				activity_rows
+			)
+
+
+def table_bytes(conn, name):
+	row = conn.exec_driver_sql(
+		"SELECT SUM(pgsize), SUM(payload) FROM dbstat WHERE name = ?", (name,)
+	).one()
+	return row[0] or 0, row[1] or 0
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--pets", type=int, default=1000000)
+	parser.add_argument("--active", type=float, default=0.05, help="Share of pets mid-activity")
+	args = parser.parse_args()
+
+	from app.activities import LEGACY_COLUMNS, sweep_expired
+	from app.extensions import db
+
+	app = make_app()
+	now = datetime.utcnow()
+	with app.app_context():
+		with db.engine.begin() as conn:
+			conn.exec_driver_sql(LEGACY_DDL)
+			started = time.perf_counter()
+			seed(conn, args.pets, args.active, now)
+			print(f"Seeded {args.pets} pets in both layouts in {time.perf_counter() - started:.1f}s")
+		with db.engine.begin() as conn:
+			conn.exec_driver_sql("ANALYZE")
+
+		rows = []
+		with db.engine.connect() as conn:
+			for name in ("pets_legacy", "pets", "pet_activities"):
+				size, payload = table_bytes(conn, name)
+				count = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {name}").scalar()
+				rows.append({
+					"table": name, "rows": count, "MiB on disk": round(size / 2 ** 20, 1),
+					"payload B/row": round(payload / count, 1) if count else 0,
+				})
+		print_table(rows, ["table", "rows", "MiB on disk", "payload B/row"])
+
+		stamp = now.isoformat(sep=" ")
+		expired = " OR ".join(f"({flag} AND {end} <= :now)" for flag, _, _, end in LEGACY_COLUMNS.values())
+		clear = ", ".join(
+			f"{flag} = CASE WHEN {end} <= :now THEN 0 ELSE {flag} END, "
+			f"{end} = CASE WHEN {end} <= :now THEN NULL ELSE {end} END"
+			for flag, _, _, end in LEGACY_COLUMNS.values()
+		)
+		results = []
+		with db.engine.begin() as conn:
+			plan = conn.execute(db.text(f"EXPLAIN QUERY PLAN SELECT id FROM pets_legacy WHERE {expired}"), {"now": stamp}).all()
+			started = time.perf_counter()
+			found = len(conn.execute(db.text(f"SELECT id FROM pets_legacy WHERE {expired}"), {"now": stamp}).all())
+			find_ms = (time.perf_counter() - started) * 1000
+			started = time.perf_counter()
+			conn.execute(db.text(f"UPDATE pets_legacy SET {clear} WHERE {expired}"), {"now": stamp})
+			results.append({
+				"layout": "legacy columns", "expired": found, "find ms": round(find_ms, 1),
+				"sweep ms": round((time.perf_counter() - started) * 1000, 1), "plan": plan[-1][-1],
+			})
+
+		plan = db.session.execute(
+			db.text("EXPLAIN QUERY PLAN SELECT pet_id FROM pet_activities WHERE end_time <= :now"), {"now": stamp}
+		).all()
+		started = time.perf_counter()
+		found = len(db.session.execute(db.text("SELECT pet_id FROM pet_activities WHERE end_time <= :now"), {"now": stamp}).all())
+		find_ms = (time.perf_counter() - started) * 1000
+		started = time.perf_counter()
+		swept = sweep_expired(now)
+		results.append({
+			"layout": "pet_activities", "expired": swept, "find ms": round(find_ms, 1),
+			"sweep ms": round((time.perf_counter() - started) * 1000, 1), "plan": plan[-1][-1],
+		})
+		assert found == swept
+	print_table(results, ["layout", "expired", "find ms", "sweep ms", "plan"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,78 @@
+"""
+Admin user directory latency at scale.
+
+Compares the old "load every user and render them all" page with keyset
+pages (first and deep), substring search (FTS5 trigram) and prefix search.
+
+	python benchmarks/bench_admin_directory.py --users 100000
+"""
+import argparse
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def measure(fn, repeat):
+	samples = []
+	size = 0
+	for _ in range(repeat):
+		started = time.perf_counter()
+		size = fn()
+		samples.append((time.perf_counter() - started) * 1000)
+	return percentiles(samples), size
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--users", type=int, default=100000)
+	parser.add_argument("--repeat", type=int, default=20)
+	args = parser.parse_args()
+
+	from flask import render_template
+	from app.extensions import db
+	from app.models import User
+
+	app = make_app()
+	started = time.perf_counter()
+	admin_id = create_players(app, 1, with_pet=False, prefix="admin")[0]
+	for done in range(0, args.users, 50000):
+		create_players(app, min(50000, args.users - done), with_pet=False)
+	with app.app_context():
+		db.session.get(User, admin_id).is_admin = True
+		db.session.commit()
+	print(f"Seeded {args.users} users in {time.perf_counter() - started:.1f}s")
+
+	client = login(app, admin_id)
+
+	def legacy_page():
+		# What admin_users() used to do: every row, rendered in one page
+		with app.test_request_context("/auth/admin/users"):
+			users = User.query.order_by(User.created_at.desc()).all()
+			return len(render_template("admin_users.html", users=users, next_cursor=None, q="", mode="substring"))
+
+	def get(url):
+		return lambda: len(client.get(url).data)
+
+	# Cursor roughly in the middle of the directory
+	with app.app_context():
+		from app.user_directory import list_users
+		_, cursor = list_users(limit=args.users // 2)
+
+	cases = [
+		("legacy: all users", legacy_page, max(1, args.repeat // 10)),
+		("keyset: first page", get("/auth/admin/users"), args.repeat),
+		("keyset: middle page", get(f"/auth/admin/users?cursor={cursor}"), args.repeat),
+		("api: first page", get("/auth/admin/api/users"), args.repeat),
+		("search: substring", get("/auth/admin/users?q=12345"), args.repeat),
+		("search: prefix", get("/auth/admin/users?q=bench_00123&mode=prefix"), args.repeat),
+	]
+	rows = []
+	with quiet():
+		for label, fn, repeat in cases:
+			stats, size = measure(fn, repeat)
+			rows.append({"case": label, "n": stats["n"], "p50 ms": stats["p50"], "p99 ms": stats["p99"], "bytes": size})
+	print_table(rows, ["case", "n", "p50 ms", "p99 ms", "bytes"])
+
+
+if __name__ == "__main__":
+	main()
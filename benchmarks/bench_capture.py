@@ -0,0 +1,62 @@
+"""
+Request capture overhead, then a replay of what was captured.
+
+Two apps on scratch SQLite databases, one with TRAFFIC_CAPTURE_PATH set:
+--players players each poll /api/pet/stats and buy food (a JSON body) for
+--rounds rounds, alternating between the apps round by round so drift hits
+both alike. Prints per-request latency with and without capture and the
+bytes per trace record, then replays the trace on a frozen clock
+(replay.run_replay, speed 0) and prints its per-endpoint report.
+
+	python benchmarks/bench_capture.py --players 50 --rounds 40
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--players", type=int, default=50)
+	parser.add_argument("--rounds", type=int, default=40)
+	args = parser.parse_args()
+
+	from app.replay import format_report, run_replay
+
+	tmpdir = tempfile.mkdtemp(prefix="tamagochi-capture-")
+	trace = os.path.join(tmpdir, "trace.ndjson")
+	apps = {
+		"off": make_app(f"sqlite:///{os.path.join(tmpdir, 'off.sqlite')}", JOB_WORKER_THREADS=0),
+		"on": make_app(f"sqlite:///{os.path.join(tmpdir, 'on.sqlite')}", JOB_WORKER_THREADS=0,
+			TRAFFIC_CAPTURE_PATH=trace),
+	}
+	clients = {mode: [login(app, user_id) for user_id in create_players(app, args.players)] for mode, app in apps.items()}
+	samples = {mode: [] for mode in apps}
+	with quiet():
+		for _ in range(args.rounds):
+			for mode in apps:
+				for client in clients[mode]:
+					started = time.perf_counter()
+					client.get("/api/pet/stats")
+					samples[mode].append((time.perf_counter() - started) * 1000)
+					started = time.perf_counter()
+					client.post("/api/shop/purchase", json={"food_type": "acorn", "quantity": 1})
+					samples[mode].append((time.perf_counter() - started) * 1000)
+	recorder = apps["on"].extensions["traffic_capture"]
+	recorder.flush()
+
+	rows = [{"capture": mode, **percentiles(values)} for mode, values in samples.items()]
+	print_table(rows, ["capture", "n", "p50", "p90", "p99", "max", "mean"])
+	overhead = (rows[1]["mean"] - rows[0]["mean"]) * 1000
+	stats = recorder.stats()
+	print(f"Capture overhead {overhead:.0f} us/request (mean); {stats['recorded']} records, "
+		f"{stats['bytes'] / max(stats['recorded'], 1):.0f} bytes each, {stats['dropped']} dropped")
+	print()
+	print(format_report(run_replay(trace, speed=0)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,115 @@
+"""
+Response compression and MessagePack: CPU cost versus bytes saved.
+
+Collects real bodies from a seeded app (stats poll, action, minigame,
+history over several ranges, the game page, admin NDJSON exports), then
+for each one and each codec reports the compressed size, the median time
+to compress it, and the break-even link speed: the bandwidth above which
+sending the raw bytes is quicker than compressing them first. A payload is
+worth compressing when clients sit on links slower than that, which is
+what COMPRESS_MIN_BYTES should follow. MessagePack sizes (and gzip on top)
+are shown for the JSON bodies. Finally the whole GET /api/pet/stats with
+and without Accept-Encoding.
+
+	python benchmarks/bench_compression.py --reps 200
+"""
+import argparse
+import json
+import statistics
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def collect_payloads(export_rows):
+	from app.extensions import db
+	from app.models import AccessRequest, User
+
+	app = make_app(COMPRESS_ENABLED=False, JOB_WORKER_THREADS=0)
+	user_id = create_players(app, 1)[0]
+	with app.app_context():
+		db.session.get(User, user_id).is_admin = True
+		db.session.add_all(AccessRequest(email=f"p{n}@example.com", message="please let me in") for n in range(max(export_rows)))
+		db.session.commit()
+	client = login(app, user_id)
+
+	payloads = {}
+	with quiet():
+		for path in ("/api/minigame/availability", "/api/pet/stats", "/api/pet/history?hours=1", "/api/pet/history?hours=720",
+				"/auth/admin/api/analytics?days=30", "/"):
+			payloads[f"GET {path}"] = client.get(path).data
+		payloads["POST /api/pet/action (feed)"] = client.post("/api/pet/action", json={"action": "feed", "food_type": "acorn"}).data
+		payloads["POST /api/minigame/higher-lower"] = client.post("/api/minigame/higher-lower", json={"guess": "higher"}).data
+		for rows in export_rows:
+			body = client.get("/auth/admin/access-requests/export.ndjson").data
+			payloads[f"export.ndjson ({rows} rows)"] = b"".join(body.splitlines(keepends=True)[:rows])
+	return app, client, payloads
+
+
+def timed(function, reps):
+	samples = []
+	for _ in range(reps):
+		started = time.perf_counter()
+		result = function()
+		samples.append(time.perf_counter() - started)
+	return result, statistics.median(samples)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--reps", type=int, default=200)
+	parser.add_argument("--export-rows", type=int, nargs="+", default=[100, 5000])
+	args = parser.parse_args()
+
+	from app import compression
+
+	app, client, payloads = collect_payloads(args.export_rows)
+	codecs = [("gzip", 1), ("gzip", 6), ("gzip", 9)]
+	if compression.brotli is not None:
+		codecs += [("br", 4), ("br", 5)]
+	else:
+		print("brotli not installed: gzip only")
+
+	rows = []
+	for name, body in sorted(payloads.items(), key=lambda item: len(item[1])):
+		for coding, level in codecs:
+			config = {"COMPRESS_LEVEL": level, "COMPRESS_BROTLI_QUALITY": level}
+			compressed, seconds = timed(lambda: compression.compress(body, coding, config), args.reps)
+			saved = len(body) - len(compressed)
+			rows.append({
+				"payload": name, "bytes": len(body), "codec": f"{coding}-{level}", "out": len(compressed),
+				"ratio": round(len(compressed) / len(body), 2), "us": round(seconds * 1e6, 1),
+				"break-even Mbit/s": round(saved * 8 / seconds / 1e6) if saved > 0 else "never",
+			})
+	print_table(rows, ["payload", "bytes", "codec", "out", "ratio", "us", "break-even Mbit/s"])
+
+	rows = []
+	for name, body in payloads.items():
+		try:
+			data = json.loads(body)
+		except ValueError:  # HTML and NDJSON
+			continue
+		packed, seconds = timed(lambda: compression.packb(data), args.reps)
+		rows.append({
+			"payload": name, "json": len(body), "msgpack": len(packed),
+			"json+gzip": len(compression.compress(body, "gzip", {})),
+			"msgpack+gzip": len(compression.compress(packed, "gzip", {})), "pack us": round(seconds * 1e6, 1),
+		})
+	print_table(rows, ["payload", "json", "msgpack", "json+gzip", "msgpack+gzip", "pack us"])
+
+	app.config["COMPRESS_ENABLED"] = True
+	rows = []
+	with quiet():
+		for label, headers in (("identity", {}), ("gzip", {"Accept-Encoding": "gzip"}), ("br", {"Accept-Encoding": "br"}),
+				("msgpack", {"Accept": "application/msgpack"})):
+			samples = []
+			for _ in range(args.reps):
+				started = time.perf_counter()
+				response = client.get("/api/pet/stats", headers=headers)
+				samples.append((time.perf_counter() - started) * 1000)
+			rows.append({"GET /api/pet/stats": label, "bytes": len(response.data), **percentiles(samples)})
+	print_table(rows, ["GET /api/pet/stats", "bytes", "n", "p50", "p90", "mean"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,73 @@
+"""
+Game page (GET /): render time and bytes with and without the fragment cache.
+
+With FRAGMENT_CACHE_ENABLED=False game_body.html is rendered on every
+request, as the whole page used to be; with the cache it is rendered once
+and only the header, flashes and the per-player JSON bootstrap are
+rendered per request. Reports the template render alone (inside a request
+context for one player) and the whole GET / through the test client, plus
+the page size raw and gzipped.
+
+	python benchmarks/bench_game_page.py --requests 2000
+"""
+import argparse
+import gzip
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def measure(cached, requests, players=20):
+	from flask import render_template
+	from flask_login import login_user
+
+	from app.extensions import db
+	from app.models import User
+
+	app = make_app(FRAGMENT_CACHE_ENABLED=cached)
+	user_ids = create_players(app, players)
+	clients = [login(app, user_id) for user_id in user_ids]
+
+	render = []
+	with app.test_request_context("/"):
+		user = db.session.get(User, user_ids[0])
+		login_user(user)
+		bootstrap = {
+			"pet": {"name": user.pet.name, "pet_type": user.pet.pet_type, "hunger": 50, "happiness": 50,
+				"cleanliness": 50, "energy": 50},
+			"inventory": {"coins": 100, "mushroom": 0, "blueberries": 0, "tree_seed": 0, "acorn": 0},
+		}
+		for _ in range(requests):
+			started = time.perf_counter()
+			render_template("game.html", pet=user.pet, bootstrap=bootstrap)
+			render.append((time.perf_counter() - started) * 1000)
+
+	page, body = [], b""
+	with quiet():
+		for n in range(requests):
+			started = time.perf_counter()
+			response = clients[n % players].get("/")
+			page.append((time.perf_counter() - started) * 1000)
+			assert response.status_code == 200
+			body = response.data
+	return render, page, body
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--requests", type=int, default=2000)
+	args = parser.parse_args()
+
+	rows, sizes = [], []
+	for cached in (False, True):
+		mode = "fragment cache" if cached else "full render"
+		render, page, body = measure(cached, args.requests)
+		rows.append({"case": f"render_template ({mode})", **percentiles(render)})
+		rows.append({"case": f"GET / ({mode})", **percentiles(page)})
+		sizes.append({"mode": mode, "bytes": len(body), "gzip bytes": len(gzip.compress(body))})
+	print_table(rows, ["case", "n", "p50", "p90", "p99", "mean"])
+	print_table(sizes, ["mode", "bytes", "gzip bytes"])
+
+
+if __name__ == "__main__":
+	main()
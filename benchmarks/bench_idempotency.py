@@ -0,0 +1,55 @@
+"""
+Idempotency-Key replay latency versus running the real action.
+
+Buys one tree seed per request with a fresh key (real purchase), then
+re-sends every key (replay served from the in-memory front cache) and
+finally replays again with the front cache cleared (served from the table).
+
+	python benchmarks/bench_idempotency.py --requests 90
+"""
+import argparse
+import time
+import uuid
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def timed(client, keys, body):
+	samples = []
+	statuses = set()
+	for key in keys:
+		started = time.perf_counter()
+		response = client.post("/api/shop/purchase", json=body, headers={"Idempotency-Key": key})
+		samples.append((time.perf_counter() - started) * 1000)
+		statuses.add((response.status_code, response.headers.get("Idempotent-Replayed", "false")))
+	return samples, statuses
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--requests", type=int, default=90, help="At most 95 (inventory limit)")
+	args = parser.parse_args()
+
+	app = make_app()
+	user_id = create_players(app, 1)[0]
+	client = login(app, user_id)
+	keys = [uuid.uuid4().hex for _ in range(args.requests)]
+	body = {"food_type": "tree_seed", "quantity": 1}
+
+	rows = []
+	with quiet():
+		for label, reset_front in (("real purchase", False), ("replay (memory)", False), ("replay (table)", True)):
+			if reset_front:
+				with app.app_context():
+					app.extensions["idempotency_cache"].clear()
+			samples, statuses = timed(client, keys, body)
+			stats = percentiles(samples)
+			rows.append({
+				"path": label, "n": stats["n"], "p50 ms": stats["p50"], "p99 ms": stats["p99"],
+				"mean ms": stats["mean"], "status/replayed": sorted(statuses)
+			})
+	print_table(rows, ["path", "n", "p50 ms", "p99 ms", "mean ms", "status/replayed"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,95 @@
+"""
+Deferred-work queue: cost on the request path and worker throughput.
+
+1. What the request path pays: inserting an access request and committing
+   (the old /auth/request-access) versus defer() writing the job to the
+   local queue, plus the whole POST with the queue in place. In-process
+   workers are off so they don't compete for the CPU.
+2. Jobs/sec drained by WorkerPool for --jobs queued jobs, by thread count
+   and claim batch size: no-op jobs (queue overhead only) and
+   access_request.record jobs (one insert + commit each).
+
+	python benchmarks/bench_jobs.py --requests 2000 --jobs 20000
+"""
+import argparse
+import time
+
+from _common import make_app, percentiles, print_table, quiet
+
+
+def request_path(requests):
+	from app.clock import utcnow
+	from app.extensions import db
+	from app.jobs import defer
+	from app.models import AccessRequest
+
+	app = make_app(JOB_WORKER_THREADS=0)
+	samples = {"insert + commit (inline)": [], "defer() to queue": [], "POST /auth/request-access": []}
+	with app.app_context():
+		for n in range(requests):
+			started = time.perf_counter()
+			db.session.add(AccessRequest(email=f"p{n}@example.com", message="hello"))
+			db.session.commit()
+			samples["insert + commit (inline)"].append((time.perf_counter() - started) * 1000)
+
+			started = time.perf_counter()
+			defer("access_request.record", email=f"q{n}@example.com", message="hello", submitted_at=utcnow().isoformat())
+			samples["defer() to queue"].append((time.perf_counter() - started) * 1000)
+	client = app.test_client()
+	with quiet():
+		for n in range(requests):
+			started = time.perf_counter()
+			response = client.post("/auth/request-access", data={"email": f"r{n}@example.com", "message": "hello"})
+			samples["POST /auth/request-access"].append((time.perf_counter() - started) * 1000)
+			assert response.status_code == 302
+	return samples
+
+
+def drain_rate(kind, jobs, threads, batch):
+	from app.jobs import WorkerPool, job_queue
+
+	app = make_app(JOB_WORKER_THREADS=0)
+	payload = {"email": "x@example.com", "message": "", "submitted_at": "2025-01-01T00:00:00"}
+	with app.app_context():
+		queue = job_queue()
+		for start in range(0, jobs, 1000):
+			queue.put_many([(kind, payload if kind != "bench.noop" else {})] * min(1000, jobs - start))
+		pool = WorkerPool(app, queue, threads=threads, batch=batch, poll_interval=0.01)
+		started = time.perf_counter()
+		pool.start()
+		while sum(pool.stats()["processed"].values()) < jobs:
+			time.sleep(0.005)
+		elapsed = time.perf_counter() - started
+		pool.stop()
+		assert queue.stats()["ready"] == 0
+	return jobs / elapsed
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--requests", type=int, default=2000)
+	parser.add_argument("--jobs", type=int, default=20000)
+	args = parser.parse_args()
+
+	from app.jobs import handler
+
+	@handler("bench.noop")
+	def noop():
+		pass
+
+	samples = request_path(args.requests)
+	print_table(
+		[{"case": name, **percentiles(values)} for name, values in samples.items()],
+		["case", "n", "p50", "p90", "p99", "mean"]
+	)
+
+	rows = []
+	for kind in ("bench.noop", "access_request.record"):
+		for threads, batch in ((1, 1), (1, 50), (2, 50), (4, 50)):
+			rate = drain_rate(kind, args.jobs, threads, batch)
+			rows.append({"jobs": kind, "threads": threads, "batch": batch, "jobs/s": round(rate)})
+	print_table(rows, ["jobs", "threads", "batch", "jobs/s"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,139 @@
+"""
+Ledger overhead and reconciliation speed.
+
+1. POST /api/shop/purchase latency with the ledger on and off (requests
+   alternate between the two apps so drift hits both equally).
+2. A synthetic ledger of --entries entries over --owners owners with
+   consistent inventories and snapshots: time `reconcile()` and
+   `balance_at()` at random points in time.
+
+	python benchmarks/bench_ledger.py --requests 2000 --entries 2000000
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def purchase_latency(requests):
+	per_player = 50  # 5 starting tree seeds + 50 stays under the food cap
+	clients = {}
+	for enabled in (False, True):
+		app = make_app(LEDGER_ENABLED=enabled)
+		clients[enabled] = [login(app, user_id) for user_id in create_players(app, max(1, requests // per_player))]
+	samples = {False: [], True: []}
+	with quiet():
+		for n in range(requests):
+			for enabled, players in clients.items():
+				client = players[(n // per_player) % len(players)]
+				started = time.perf_counter()
+				response = client.post("/api/shop/purchase", json={"food_type": "tree_seed", "quantity": 1})
+				samples[enabled].append((time.perf_counter() - started) * 1000)
+				assert response.status_code == 200, response.get_json()
+	return samples
+
+
+def seed_ledger(app, owners, entries, batch=100000):
+	"""Random purchases/feeds per owner, snapshots every SNAPSHOT_EVERY, matching inventories"""
+	from app.constants import LEDGER_ITEMS
+	from app.extensions import db
+	from app.ledger import REASON_CODES, SNAPSHOT_EVERY
+
+	rng = random.Random(5)
+	user_ids = create_players(app, owners)
+	per_owner = max(len(LEDGER_ITEMS) + 1, entries // owners)
+	start = app.config["CLOCK"].now() - timedelta(days=30)
+	rows, snapshots, inventories = [], [], []
+	with app.app_context():
+		conn = db.session.connection()
+
+		def flush():
+			if not rows:
+				return
+			conn.exec_driver_sql(
+				"INSERT INTO ledger_entries (owner_id, seq, item, delta, reason, created_at) VALUES (?, ?, ?, ?, ?, ?)", rows
+			)
+			rows.clear()
+
+		for owner_id in user_ids:
+			balances = [100, 5, 5, 5, 5]
+			at = start
+			for seq in range(1, per_owner + 1):
+				at += timedelta(seconds=rng.randint(1, 3600))
+				if seq <= len(LEDGER_ITEMS):
+					item, delta, reason = seq - 1, balances[seq - 1], REASON_CODES["open"]
+				else:
+					item = rng.randrange(len(LEDGER_ITEMS))
+					delta = rng.choice((-1, 1, 2, -3))
+					reason = REASON_CODES["purchase"] if delta > 0 else REASON_CODES["feed"]
+					balances[item] += delta
+				rows.append((owner_id, seq, item, delta, reason, at.isoformat(sep=" ")))
+				if seq == len(LEDGER_ITEMS) or seq % SNAPSHOT_EVERY == 0:
+					snapshots.append((owner_id, seq, at.isoformat(sep=" "), *balances))
+			inventories.append((*balances, per_owner, owner_id))
+			if len(rows) >= batch:
+				flush()
+		flush()
+		conn.exec_driver_sql(
+			"INSERT INTO ledger_snapshots (owner_id, seq, created_at, coins, tree_seed, blueberries, mushroom, acorn) "
+			"VALUES (?, ?, ?, ?, ?, ?, ?, ?)", snapshots
+		)
+		conn.exec_driver_sql(
+			"UPDATE inventories SET coins = ?, tree_seed = ?, blueberries = ?, mushroom = ?, acorn = ?, ledger_seq = ? "
+			"WHERE owner_id = ?", inventories
+		)
+		db.session.commit()
+	return user_ids, start
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--requests", type=int, default=2000)
+	parser.add_argument("--entries", type=int, default=2000000)
+	parser.add_argument("--owners", type=int, default=20000)
+	parser.add_argument("--lookups", type=int, default=2000)
+	args = parser.parse_args()
+
+	samples = purchase_latency(args.requests)
+	rows = []
+	for enabled in (False, True):
+		stats = percentiles(samples[enabled])
+		rows.append({"case": f"purchase, ledger {'on' if enabled else 'off'}", **stats})
+	print_table(rows, ["case", "n", "p50", "p90", "p99", "mean"])
+
+	from app.extensions import db
+	from app.ledger import balance_at, reconcile
+
+	app = make_app()
+	started = time.perf_counter()
+	user_ids, start = seed_ledger(app, args.owners, args.entries)
+	print(f"Seeded {args.entries} entries for {args.owners} owners in {time.perf_counter() - started:.1f}s")
+
+	results = []
+	with app.app_context():
+		started = time.perf_counter()
+		report = reconcile()
+		elapsed = time.perf_counter() - started
+		assert report["ok"], report
+		results.append({
+			"case": f"reconcile {report['entries']} entries / {report['snapshots']} snapshots",
+			"ms": round(elapsed * 1000, 1), "rate": f"{report['entries'] / elapsed / 1e6:.2f}M entries/s",
+		})
+
+		rng = random.Random(9)
+		span = (args.entries // args.owners) * 1800
+		started = time.perf_counter()
+		for _ in range(args.lookups):
+			balance_at(rng.choice(user_ids), start + timedelta(seconds=rng.randint(0, span)))
+			db.session.rollback()
+		elapsed = time.perf_counter() - started
+		results.append({
+			"case": "balance_at(owner, random time)", "ms": round(elapsed / args.lookups * 1000, 3), "rate": "per call",
+		})
+	print_table(results, ["case", "ms", "rate"])
+
+
+if __name__ == "__main__":
+	main()
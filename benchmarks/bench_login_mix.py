@@ -0,0 +1,89 @@
+"""
+Login burst mixed with /api/pet/stats polls on a fixed pool of server threads.
+
+Emulates a threaded server (--server-threads workers) receiving a burst of
+requests where every --login-every'th one is a login and the rest are stats
+polls. Latency is measured from arrival (submission) to completion, so it
+includes time spent queued behind other requests.
+
+	inline     - every server thread may run a KDF (the old behaviour)
+	offloaded  - logins verify on the bounded password executor; beyond
+	             --queue waiting logins they get 503 + Retry-After at once
+
+	python benchmarks/bench_login_mix.py --requests 400 --login-every 4
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def run(mode, args):
+	if mode == "inline":
+		config = {"PASSWORD_VERIFY_WORKERS": args.server_threads, "PASSWORD_VERIFY_QUEUE": 10 ** 6}
+	else:
+		config = {"PASSWORD_VERIFY_WORKERS": args.kdf_workers, "PASSWORD_VERIFY_QUEUE": args.queue}
+	app = make_app(SINGLE_FLIGHT_ENABLED=False, **config)
+	players = create_players(app, args.players, prefix="mix")
+
+	from app.extensions import db
+	from app.models import User
+	with app.app_context():
+		usernames = dict(db.session.execute(db.select(User.id, User.username)).all())
+
+	lock = threading.Lock()
+	results = {"login": [], "poll": []}
+	statuses = {}
+
+	def job(kind, user_id, arrived):
+		if kind == "login":
+			client = app.test_client()
+			response = client.post("/auth/login", data={"username": usernames[user_id], "password": "bench"})
+		else:
+			response = login(app, user_id).get("/api/pet/stats")
+		elapsed = (time.perf_counter() - arrived) * 1000
+		with lock:
+			results[kind].append(elapsed)
+			statuses[(kind, response.status_code)] = statuses.get((kind, response.status_code), 0) + 1
+
+	with quiet(), ThreadPoolExecutor(max_workers=args.server_threads) as server:
+		started = time.perf_counter()
+		for i in range(args.requests):
+			kind = "login" if i % args.login_every == 0 else "poll"
+			server.submit(job, kind, players[i % len(players)], time.perf_counter())
+			time.sleep(args.interval_ms / 1000)
+		server.shutdown(wait=True)
+		wall = time.perf_counter() - started
+	app.extensions["password_verifier"].shutdown()
+
+	rows = []
+	for kind in ("poll", "login"):
+		stats = percentiles(results[kind])
+		codes = ", ".join(f"{code}:{count}" for (k, code), count in sorted(statuses.items()) if k == kind)
+		rows.append({
+			"mode": mode, "kind": kind, "n": stats["n"], "p50 ms": stats["p50"],
+			"p99 ms": stats["p99"], "max ms": stats["max"], "statuses": codes, "wall s": round(wall, 2),
+		})
+	return rows
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--requests", type=int, default=400)
+	parser.add_argument("--login-every", type=int, default=4, help="One login per N requests")
+	parser.add_argument("--players", type=int, default=50)
+	parser.add_argument("--server-threads", type=int, default=8)
+	parser.add_argument("--kdf-workers", type=int, default=2)
+	parser.add_argument("--queue", type=int, default=4)
+	parser.add_argument("--interval-ms", type=float, default=5.0, help="Gap between arrivals")
+	args = parser.parse_args()
+
+	rows = run("inline", args) + run("offloaded", args)
+	print(f"{args.requests} requests, 1 login per {args.login_every}, {args.server_threads} server threads")
+	print_table(rows, ["mode", "kind", "n", "p50 ms", "p99 ms", "max ms", "statuses", "wall s"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,161 @@
+"""
+Database maintenance: request latency while a large SQLite file is backed up.
+
+Builds a scratch database padded to --size-mb with access requests (2 KB
+messages), deletes --delete-percent of them to leave free pages, then, for
+each journal mode in --journal-modes, runs --clients threads (players
+alternating GET /api/pet/stats and a POST /api/pet/maturity, which always
+writes) and reports p50/p99/max latency:
+
+	idle       no maintenance running (--seconds)
+	stepped    maintenance.backup() in MAINTENANCE_BACKUP_STEP_PAGES steps
+	one-step   the whole file in a single backup step (a plain copy under lock)
+
+plus each backup's duration, restarts and time writers were held off, and
+the incremental vacuum and ANALYZE times on the file.
+
+	python benchmarks/bench_maintenance.py --size-mb 2048 --clients 4
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def fill(path, size_mb, delete_percent):
+	message = "x" * 2048
+	conn = sqlite3.connect(path, isolation_level=None)
+	conn.execute("PRAGMA synchronous=OFF")
+	rows = 0
+	started = time.perf_counter()
+	while os.path.getsize(path) < size_mb * 1024 * 1024:
+		conn.execute("BEGIN")
+		conn.executemany(
+			"INSERT INTO access_requests (email, message, created_at, processed) VALUES (?, ?, '2024-01-01 00:00:00', 1)",
+			((f"player{n}@example.com", message) for n in range(rows, rows + 20000))
+		)
+		conn.execute("COMMIT")
+		rows += 20000
+	if delete_percent:
+		conn.execute(f"DELETE FROM access_requests WHERE id % 100 < {int(delete_percent)}")
+	conn.close()
+	return rows, time.perf_counter() - started
+
+
+def set_journal_mode(app, path, mode):
+	from app.extensions import db
+
+	# Leaving WAL needs every other connection closed
+	with app.app_context():
+		db.engine.dispose()
+	conn = sqlite3.connect(path, isolation_level=None)
+	conn.execute(f"PRAGMA journal_mode={mode}")
+	conn.close()
+
+
+def under_load(app, user_ids, clients, work):
+	"""Run `work()` while the clients hammer the app; returns (work result, latencies)"""
+	stop = threading.Event()
+	latencies, errors = [], [0]
+	lock = threading.Lock()
+
+	def client_loop(user_id):
+		client = login(app, user_id)
+		local, n = [], 0
+		while not stop.is_set():
+			started = time.perf_counter()
+			if n % 2:
+				response = client.post("/api/pet/maturity", json={"action": "set", "stage": "child"})
+			else:
+				response = client.get("/api/pet/stats")
+			local.append((time.perf_counter() - started) * 1000)
+			if response.status_code != 200:
+				errors[0] += 1
+			n += 1
+		with lock:
+			latencies.extend(local)
+
+	threads = [threading.Thread(target=client_loop, args=(user_id,)) for user_id in user_ids[:clients]]
+	with quiet():
+		for thread in threads:
+			thread.start()
+		try:
+			result = work()
+		finally:
+			stop.set()
+			for thread in threads:
+				thread.join()
+	return result, latencies, errors[0]
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--size-mb", type=int, default=2048)
+	parser.add_argument("--delete-percent", type=int, default=20)
+	parser.add_argument("--clients", type=int, default=4)
+	parser.add_argument("--seconds", type=float, default=5.0)
+	parser.add_argument("--journal-modes", nargs="+", default=["delete", "wal"])
+	args = parser.parse_args()
+
+	from app import maintenance
+
+	tmpdir = tempfile.mkdtemp(prefix="tamagochi-maintenance-")
+	path = os.path.join(tmpdir, "bench.sqlite")
+	app = make_app(f"sqlite:///{path}", JOB_WORKER_THREADS=0, SQLALCHEMY_ENGINE_OPTIONS={"connect_args": {"timeout": 60}})
+	user_ids = create_players(app, args.clients)
+	rows, seconds = fill(path, args.size_mb, args.delete_percent)
+	stats = maintenance.file_stats(path)
+	print(f"Filled {rows} access requests in {seconds:.1f}s: {stats['bytes'] / 1e6:.0f} MB, "
+		f"{stats['free_pages']} free pages ({stats['free_ratio']:.1%}) after deleting {args.delete_percent}%")
+
+	config = app.config
+	rows = []
+	for mode in args.journal_modes:
+		set_journal_mode(app, path, mode)
+		dest = os.path.join(tmpdir, f"backup-{mode}.sqlite")
+		scenarios = [
+			("idle", lambda: time.sleep(args.seconds)),
+			("stepped", lambda: maintenance.backup(
+				path, dest, step_pages=config["MAINTENANCE_BACKUP_STEP_PAGES"],
+				pause=config["MAINTENANCE_STEP_PAUSE_SECONDS"], max_restarts=config["MAINTENANCE_BACKUP_MAX_RESTARTS"])),
+			("one-step", lambda: maintenance.backup(path, dest, step_pages=-1)),
+		]
+		for name, work in scenarios:
+			started = time.perf_counter()
+			result, latencies, errors = under_load(app, user_ids, args.clients, work)
+			summary = percentiles(latencies)
+			rows.append({
+				"journal": mode, "while": name, "seconds": round(time.perf_counter() - started, 2),
+				"requests": summary["n"], "p50": summary.get("p50"), "p99": summary.get("p99"), "max": summary.get("max"),
+				"errors": errors, "restarts": (result or {}).get("restarts", ""),
+				"writers blocked s": (result or {}).get("blocked_seconds", ""),
+			})
+	print_table(rows, ["journal", "while", "seconds", "requests", "p50", "p99", "max", "errors", "restarts", "writers blocked s"])
+
+	set_journal_mode(app, path, "delete")
+	rows = []
+	for name, work in (
+		("incremental_vacuum", lambda: maintenance.incremental_vacuum(
+			path, step_pages=config["MAINTENANCE_VACUUM_STEP_PAGES"], budget=600.0, pause=config["MAINTENANCE_STEP_PAUSE_SECONDS"])),
+		("optimize", lambda: maintenance.optimize(path, config["MAINTENANCE_ANALYSIS_LIMIT"])),
+		("analyze", lambda: maintenance.analyze(path, config["MAINTENANCE_ANALYSIS_LIMIT"])),
+	):
+		started = time.perf_counter()
+		result, latencies, errors = under_load(app, user_ids, args.clients, work)
+		summary = percentiles(latencies)
+		rows.append({
+			"task": name, "seconds": round(time.perf_counter() - started, 2), "p99": summary.get("p99"),
+			"max": summary.get("max"), "errors": errors,
+			"result": " ".join(f"{key}={value}" for key, value in (result or {}).items()),
+		})
+	print_table(rows, ["task", "seconds", "p99", "max", "errors", "result"])
+	stats = maintenance.file_stats(path)
+	print(f"After: {stats['bytes'] / 1e6:.0f} MB, {stats['free_pages']} free pages")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,89 @@
+"""
+N parallel pollers for one user: DB commits and latency with and without
+per-user single-flight coalescing.
+
+Each round advances a frozen clock past the 30 s decay window so every poll
+would refresh the pet, then releases all pollers at once.
+
+	python benchmarks/bench_parallel_polls.py --pollers 16 --rounds 50
+"""
+import argparse
+import threading
+import time
+from datetime import timedelta
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def run(pollers, rounds, single_flight):
+	from sqlalchemy import event
+
+	from app.clock import FrozenClock
+	from app.extensions import db
+
+	clock = FrozenClock()
+	app = make_app(CLOCK=clock, SINGLE_FLIGHT_ENABLED=single_flight)
+	user_id = create_players(app, 1)[0]
+	clients = [login(app, user_id) for _ in range(pollers)]
+
+	commits = [0]
+	lock = threading.Lock()
+
+	def count_commit(session):
+		with lock:
+			commits[0] += 1
+
+	event.listen(db.session, "after_commit", count_commit)
+	latencies = []
+	errors = [0]
+	barrier = threading.Barrier(pollers + 1)
+
+	def poller(client):
+		for _ in range(rounds):
+			barrier.wait()
+			started = time.perf_counter()
+			response = client.get("/api/pet/stats")
+			elapsed = (time.perf_counter() - started) * 1000
+			with lock:
+				latencies.append(elapsed)
+				if response.status_code != 200:
+					errors[0] += 1
+			barrier.wait()
+
+	threads = [threading.Thread(target=poller, args=(client,)) for client in clients]
+	with quiet():
+		for thread in threads:
+			thread.start()
+		for _ in range(rounds):
+			clock.advance(timedelta(seconds=31))
+			barrier.wait()  # release the round
+			barrier.wait()  # wait for it to finish
+		for thread in threads:
+			thread.join()
+	event.remove(db.session, "after_commit", count_commit)
+
+	stats = percentiles(latencies)
+	return {
+		"mode": "single-flight" if single_flight else "baseline",
+		"requests": len(latencies),
+		"errors": errors[0],
+		"commits": commits[0],
+		"commits/round": round(commits[0] / rounds, 2),
+		"p50 ms": stats["p50"],
+		"p99 ms": stats["p99"],
+		"max ms": stats["max"],
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--pollers", type=int, default=16)
+	parser.add_argument("--rounds", type=int, default=50)
+	args = parser.parse_args()
+	rows = [run(args.pollers, args.rounds, flag) for flag in (False, True)]
+	print(f"{args.pollers} pollers x {args.rounds} rounds for one user")
+	print_table(rows, ["mode", "requests", "errors", "commits", "commits/round", "p50 ms", "p99 ms", "max ms"])
+
+
+if __name__ == "__main__":
+	main()
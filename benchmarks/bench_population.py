@@ -0,0 +1,51 @@
+"""
+Synthetic population: rows per second of generate_population.
+
+For each shard count, builds scratch SQLite files (the primary plus
+count - 1 shards) and generates --users players (users, pets, activity
+timers, inventories and access requests) with population.generate_population.
+Prints each section's rate as it finishes, then one row per shard count;
+the totals include rebuilding the indexes and the username search index.
+
+	python benchmarks/bench_population.py --users 1000000 --shards 1 2
+"""
+import argparse
+import os
+import tempfile
+
+from _common import make_app, print_table, quiet
+
+
+def run(shards, args):
+	from app.population import generate_population
+
+	tmpdir = tempfile.mkdtemp(prefix="tamagochi-population-")
+	urls = [f"sqlite:///{os.path.join(tmpdir, f'shard{n}.sqlite')}" for n in range(1, shards)]
+	app = make_app(f"sqlite:///{os.path.join(tmpdir, 'primary.sqlite')}", JOB_WORKER_THREADS=0,
+		SQLALCHEMY_SHARD_URLS=urls)
+	sections = []
+	with app.app_context(), quiet():
+		summary = generate_population(args.users, seed=args.seed, chunk=args.chunk, log=sections.append,
+			progress_every=float("inf"))
+	for line in sections:
+		print(f"  {shards} shard(s) {line}")
+	return {
+		"shards": shards, "users": args.users, "rows": summary["rows"], "seconds": summary["seconds"],
+		"rows/s": summary["rows_per_second"],
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--users", type=int, default=1000000)
+	parser.add_argument("--shards", type=int, nargs="+", default=[1])
+	parser.add_argument("--seed", type=int, default=42)
+	parser.add_argument("--chunk", type=int, default=10000)
+	args = parser.parse_args()
+
+	rows = [run(shards, args) for shards in args.shards]
+	print_table(rows, ["shards", "users", "rows", "seconds", "rows/s"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,106 @@
+"""
+Pre-fork server: cold start and per-worker memory, preloaded versus one
+app per worker.
+
+Starts `serve.py --workers N` twice on a scratch database: with the app
+built once in the master and forked (default), and with --no-preload,
+where every worker imports and builds its own app as separate processes
+did before. Reports the time from launch until every worker is ready and
+a request succeeds, then, after --requests requests, each worker's memory
+from /proc/<pid>/smaps_rollup: RSS, PSS (shared pages split between the
+processes sharing them) and USS (pages private to the worker).
+
+	python benchmarks/bench_prefork.py --workers 4 --requests 400
+"""
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from _common import ROOT, make_app, print_table
+
+
+def memory_kib(pid):
+	fields = {}
+	with open(f"/proc/{pid}/smaps_rollup") as f:
+		for line in f:
+			parts = line.split()
+			if len(parts) == 3 and parts[2] == "kB":
+				fields[parts[0].rstrip(":")] = int(parts[1])
+	return {
+		"rss": fields["Rss"], "pss": fields["Pss"],
+		"uss": fields["Private_Clean"] + fields["Private_Dirty"],
+	}
+
+
+def run(preload, workers, port, requests, env):
+	args = [sys.executable, os.path.join(ROOT, "serve.py"), "--workers", str(workers), "--port", str(port), "--quiet"]
+	if not preload:
+		args.append("--no-preload")
+	started = time.perf_counter()
+	server = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+	worker_pids = []
+	try:
+		while len(worker_pids) < workers:
+			line = server.stdout.readline()
+			if not line:
+				raise RuntimeError("server exited during startup")
+			match = re.match(r"Worker (\d+) ready", line)
+			if match:
+				worker_pids.append(int(match.group(1)))
+		workers_ready = time.perf_counter() - started
+		# Keep draining so the server never blocks on a full pipe
+		threading.Thread(target=server.stdout.read, daemon=True).start()
+		url = f"http://127.0.0.1:{port}/auth/login"
+		while True:
+			try:
+				urllib.request.urlopen(url).read()
+				break
+			except OSError:
+				time.sleep(0.01)
+		first_response = time.perf_counter() - started
+
+		for _ in range(requests):
+			urllib.request.urlopen(url).read()
+		per_worker = [memory_kib(pid) for pid in worker_pids]
+		master = memory_kib(server.pid)
+	finally:
+		server.send_signal(signal.SIGTERM)
+		server.wait(timeout=60)
+
+	def mean(key):
+		return round(sum(m[key] for m in per_worker) / len(per_worker) / 1024, 1)
+
+	return {
+		"mode": "preload + fork" if preload else "app per worker",
+		"workers ready s": round(workers_ready, 3), "first 200 s": round(first_response, 3),
+		"RSS MiB": mean("rss"), "PSS MiB": mean("pss"), "USS MiB": mean("uss"),
+		"total PSS MiB": round((sum(m["pss"] for m in per_worker) + master["pss"]) / 1024, 1),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--workers", type=int, default=4)
+	parser.add_argument("--requests", type=int, default=400)
+	parser.add_argument("--port", type=int, default=18765)
+	args = parser.parse_args()
+
+	# Create the schema up front so neither mode pays for it or races on it
+	app = make_app()
+	env = dict(
+		os.environ, DATABASE_URL=app.config["SQLALCHEMY_DATABASE_URI"],
+		JOB_QUEUE_PATH=app.config["JOB_QUEUE_PATH"], RATE_LIMIT_ENABLED="0", PYTHONPATH=ROOT
+	)
+	rows = [run(preload, args.workers, args.port + n, args.requests, env) for n, preload in enumerate((False, True))]
+	print(f"{args.workers} workers; per-worker memory after {args.requests} requests (master included in total PSS)")
+	print_table(rows, ["mode", "workers ready s", "first 200 s", "RSS MiB", "PSS MiB", "USS MiB", "total PSS MiB"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,61 @@
+"""
+Bulk provisioning throughput versus the one-user-per-POST admin form.
+
+Times N sequential POSTs to /auth/admin/create-user (hash in the request
+thread, one commit each) against provision_users() with 1 and --workers
+hashing processes, and reports users/sec.
+
+	python benchmarks/bench_provisioning.py --users 200 --workers 8
+"""
+import argparse
+import os
+import time
+
+from _common import create_players, login, make_app, print_table, quiet
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--users", type=int, default=200)
+	parser.add_argument("--workers", type=int, default=os.cpu_count())
+	args = parser.parse_args()
+
+	from app.extensions import db
+	from app.models import User
+	from app.provisioning import RosterEntry, provision_users
+
+	app = make_app()
+	admin_id = create_players(app, 1, with_pet=False, prefix="admin")[0]
+	with app.app_context():
+		db.session.get(User, admin_id).is_admin = True
+		db.session.commit()
+	client = login(app, admin_id)
+
+	rows = []
+
+	def record(label, seconds):
+		rows.append({
+			"path": label, "users": args.users, "seconds": round(seconds, 2),
+			"users/sec": round(args.users / seconds, 1),
+		})
+
+	with quiet():
+		started = time.perf_counter()
+		for i in range(args.users):
+			client.post("/auth/admin/create-user", data={"username": f"single_{i:06d}"})
+		record("single-user form", time.perf_counter() - started)
+
+		for workers in sorted({1, args.workers}):
+			roster = [RosterEntry(f"bulk{workers}_{i:06d}", "hamster") for i in range(args.users)]
+			with app.app_context():
+				started = time.perf_counter()
+				credentials, _ = provision_users(roster, with_pet=True, workers=workers)
+				record(f"bulk, {workers} worker(s), with pets", time.perf_counter() - started)
+				assert len(credentials) == args.users
+
+	print(f"CPU cores: {os.cpu_count()}")
+	print_table(rows, ["path", "users", "seconds", "users/sec"])
+
+
+if __name__ == "__main__":
+	main()
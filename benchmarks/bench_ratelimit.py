@@ -0,0 +1,98 @@
+"""
+Rate limiter overhead.
+
+Times LocalLimiter.take() on one hot key and spread over many keys, the full
+before_request hook (policy lookup + identity + take), end-to-end
+/api/pet/stats latency with limiting on and off, and one call through the
+shared (ratelimit-server) backend.
+
+	python benchmarks/bench_ratelimit.py --calls 1000000
+"""
+import argparse
+import multiprocessing
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def per_call_us(fn, calls):
+	started = time.perf_counter()
+	fn(calls)
+	return round((time.perf_counter() - started) / calls * 1e6, 3)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--calls", type=int, default=1000000)
+	parser.add_argument("--keys", type=int, default=100000)
+	parser.add_argument("--requests", type=int, default=2000)
+	args = parser.parse_args()
+
+	from app.ratelimit import LocalLimiter, SharedLimiter, make_hook, serve_shared_limiter
+
+	rows = []
+
+	limiter = LocalLimiter()
+
+	def hot_key(calls):
+		take = limiter.take
+		for _ in range(calls):
+			take(("stats", 1), 1e9, 10)
+
+	def many_keys(calls):
+		take = limiter.take
+		keys = [("stats", i) for i in range(args.keys)]
+		for i in range(calls):
+			take(keys[i % args.keys], 1e9, 10)
+
+	rows.append({"case": "LocalLimiter.take, 1 key", "us/call": per_call_us(hot_key, args.calls)})
+	rows.append({"case": f"LocalLimiter.take, {args.keys} keys", "us/call": per_call_us(many_keys, args.calls)})
+
+	unlimited = {"main.get_pet_stats": ("stats", 1e9, 10 ** 9)}
+	app = make_app(RATE_LIMIT_ENABLED=True, RATE_LIMITS=unlimited)
+	user_id = create_players(app, 1)[0]
+	check_rate_limit = make_hook(app.extensions["rate_limiter"], app.extensions["rate_limit_policies"])
+	with app.test_request_context("/api/pet/stats"):
+		from flask import request, session
+		session["_user_id"] = str(user_id)
+		request.url_rule, request.view_args = app.url_map.bind("localhost").match("/api/pet/stats", return_rule=True)[0], {}
+
+		def hook(calls):
+			for _ in range(calls):
+				check_rate_limit()
+
+		rows.append({"case": "before_request hook (policy + identity + take)", "us/call": per_call_us(hook, args.calls // 10)})
+
+	# Alternate between the two apps so drift/noise hits both equally
+	clients = {}
+	for enabled in (False, True):
+		bench_app = make_app(RATE_LIMIT_ENABLED=enabled, RATE_LIMITS=unlimited)
+		clients[enabled] = login(bench_app, create_players(bench_app, 1)[0])
+	samples = {False: [], True: []}
+	with quiet():
+		for _ in range(args.requests):
+			for enabled, client in clients.items():
+				started = time.perf_counter()
+				client.get("/api/pet/stats")
+				samples[enabled].append((time.perf_counter() - started) * 1e6)
+	for enabled in (False, True):
+		stats = percentiles(samples[enabled])
+		rows.append({"case": f"GET /api/pet/stats, limiter {'on' if enabled else 'off'} (p50)", "us/call": stats["p50"]})
+
+	server = multiprocessing.Process(target=serve_shared_limiter, kwargs={"address": ("127.0.0.1", 50096)}, daemon=True)
+	server.start()
+	time.sleep(0.5)
+	shared = SharedLimiter(("127.0.0.1", 50096))
+
+	def shared_take(calls):
+		for _ in range(calls):
+			shared.take(("stats", 1), 1e9, 10)
+
+	rows.append({"case": "SharedLimiter.take (local IPC)", "us/call": per_call_us(shared_take, min(args.calls, 20000))})
+	server.terminate()
+
+	print_table(rows, ["case", "us/call"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,138 @@
+"""
+Read replicas: GET throughput and latency while the primary takes writes.
+
+Builds a scratch SQLite primary with --players players, copies it as a
+snapshot replica (the stand-in for a streaming replica), then for
+--seconds runs --writers threads committing inventory updates to the
+primary (BEGIN IMMEDIATE ... COMMIT, holding the write lock --hold-ms)
+alongside --readers threads issuing the read-only GETs that get routed:
+/api/minigame/availability, /api/pet/history and the admin analytics
+dashboard. Once with all reads on the primary, once with the replica.
+
+Point --primary-url/--replica-url at a real primary and replica (e.g. two
+Postgres instances with streaming replication, schema already created)
+to measure those instead; the writers then use SQLAlchemy.
+
+	python benchmarks/bench_replicas.py --readers 4 --writers 2 --seconds 5
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+READS = ["/api/minigame/availability", "/api/pet/history?hours=24", "/auth/admin/api/analytics?days=7"]
+
+
+def writer_loop(primary_url, owner_ids, hold_ms, stop, counts):
+	from sqlalchemy import create_engine, text
+
+	n = 0
+	if primary_url.startswith("sqlite:///"):
+		conn = sqlite3.connect(primary_url[len("sqlite:///"):], timeout=30, isolation_level=None)
+		while not stop.is_set():
+			conn.execute("BEGIN IMMEDIATE")
+			conn.execute("UPDATE inventories SET coins = coins + 1 WHERE owner_id = ?", (owner_ids[n % len(owner_ids)],))
+			time.sleep(hold_ms / 1000)
+			conn.execute("COMMIT")
+			n += 1
+		conn.close()
+	else:
+		engine = create_engine(primary_url)
+		with engine.connect() as conn:
+			while not stop.is_set():
+				with conn.begin():
+					conn.execute(text("UPDATE inventories SET coins = coins + 1 WHERE owner_id = :id"), {"id": owner_ids[n % len(owner_ids)]})
+					time.sleep(hold_ms / 1000)
+				n += 1
+		engine.dispose()
+	counts.append(n)
+
+
+def run(primary_url, replica_url, admin_id, reader_ids, writer_ids, args):
+	from app import replicas
+
+	config = {"SQLALCHEMY_REPLICA_URLS": [replica_url]} if replica_url else {}
+	app = make_app(primary_url, JOB_WORKER_THREADS=0, **config)
+	clients = [login(app, admin_id)] + [login(app, user_id) for user_id in reader_ids[1:]]
+
+	stop = threading.Event()
+	latencies, writes, errors = [], [], [0]
+	lock = threading.Lock()
+
+	def reader(client, offset):
+		n = offset
+		local = []
+		while not stop.is_set():
+			path = READS[n % len(READS)] if client is clients[0] else READS[n % 2]
+			started = time.perf_counter()
+			response = client.get(path)
+			local.append((time.perf_counter() - started) * 1000)
+			if response.status_code != 200:
+				errors[0] += 1
+			n += 1
+		with lock:
+			latencies.extend(local)
+
+	threads = [threading.Thread(target=writer_loop, args=(primary_url, writer_ids, args.hold_ms, stop, writes))
+		for _ in range(args.writers)]
+	threads += [threading.Thread(target=reader, args=(client, n)) for n, client in enumerate(clients)]
+	with quiet():
+		started = time.perf_counter()
+		for thread in threads:
+			thread.start()
+		time.sleep(args.seconds)
+		stop.set()
+		for thread in threads:
+			thread.join()
+	elapsed = time.perf_counter() - started
+	with app.app_context():
+		state = replicas.stats()
+	return {
+		"reads": "replica" if replica_url else "primary",
+		"reads/s": round(len(latencies) / elapsed), "writes/s": round(sum(writes) / elapsed),
+		**{f"read {k}": v for k, v in percentiles(latencies).items() if k in ("p50", "p99")},
+		"errors": errors[0], "replica lag s": next((s["lag_seconds"] for s in state.values()), "-"),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--players", type=int, default=200)
+	parser.add_argument("--readers", type=int, default=4)
+	parser.add_argument("--writers", type=int, default=2)
+	parser.add_argument("--hold-ms", type=float, default=2.0)
+	parser.add_argument("--seconds", type=float, default=5.0)
+	parser.add_argument("--primary-url")
+	parser.add_argument("--replica-url")
+	args = parser.parse_args()
+
+	from app.extensions import db
+	from app.models import User
+
+	primary_url, replica_url = args.primary_url, args.replica_url
+	if primary_url is None:
+		tmpdir = tempfile.mkdtemp(prefix="tamagochi-replicas-")
+		primary_url = f"sqlite:///{os.path.join(tmpdir, 'primary.sqlite')}"
+	app = make_app(primary_url)
+	user_ids = create_players(app, args.players)
+	with app.app_context():
+		db.session.get(User, user_ids[0]).is_admin = True
+		db.session.commit()
+	if replica_url is None:
+		replica_path = os.path.join(os.path.dirname(primary_url[len("sqlite:///"):]), "replica.sqlite")
+		shutil.copy(primary_url[len("sqlite:///"):], replica_path)
+		replica_url = f"sqlite:///{replica_path}"
+
+	reader_ids, writer_ids = user_ids[:args.readers], user_ids[args.readers:]
+	rows = [run(primary_url, url, user_ids[0], reader_ids, writer_ids, args) for url in (None, replica_url)]
+	print(f"{args.readers} readers, {args.writers} writers holding the write lock {args.hold_ms} ms, {args.seconds:g}s each")
+	print_table(rows, ["reads", "reads/s", "read p50", "read p99", "writes/s", "errors", "replica lag s"])
+
+
+if __name__ == "__main__":
+	main()
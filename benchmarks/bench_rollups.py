@@ -0,0 +1,153 @@
+"""
+Admin analytics: daily_rollups versus aggregating the raw tables on demand.
+
+Builds --users users with pets (created_at spread over 60 days) and
+--entries ledger entries spread over the last --days days, then writes the
+daily_rollups the views would have produced for the same events. Times:
+
+1. dashboard(): one index range read of daily_rollups.
+2. The ad-hoc equivalent: GROUP BY over ledger_entries for the window
+   (feeds and purchases per food type and day) plus a CASE scan of pets
+   for the maturity buckets. It still can't give minigame plays or win
+   rate, since losses leave no ledger entry.
+3. refresh_gauges() (range counts on pets.created_at) versus that CASE scan.
+
+	python benchmarks/bench_rollups.py --users 1000000 --entries 5000000
+"""
+import argparse
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from _common import make_app, print_table
+
+
+def seed(conn, users, entries, days, now, batch=100000):
+	from app.constants import LEDGER_ITEMS, SHOP_PRICES
+	from app.ledger import ITEM_CODES, REASON_CODES
+
+	rng = random.Random(11)
+	stamp = now.isoformat(sep=" ")
+	for offset in range(0, users, batch):
+		ids = range(offset + 1, min(users, offset + batch) + 1)
+		conn.exec_driver_sql(
+			"INSERT INTO users (id, username, password_hash, is_admin, must_change_password, created_at) VALUES (?, ?, 'x', 0, 0, ?)",
+			[(user_id, f"bench_{user_id:07d}", stamp) for user_id in ids]
+		)
+		conn.exec_driver_sql(
+			"INSERT INTO pets (id, owner_id, pet_type, name, hunger, happiness, cleanliness, energy, "
+			"last_fed, last_played, last_bathed, last_slept, created_at) VALUES (?, ?, 'squirrel', ?, 50, 50, 50, 50, ?, ?, ?, ?, ?)",
+			[
+				(user_id, user_id, f"Pet{user_id}", stamp, stamp, stamp, stamp,
+				(now - timedelta(seconds=rng.randint(0, 60 * 86400))).isoformat(sep=" "))
+				for user_id in ids
+			]
+		)
+
+	foods = LEDGER_ITEMS[1:]
+	seqs = [0] * (users + 1)
+	rollups = Counter()
+	rows = []
+	for _ in range(entries):
+		owner = rng.randint(1, users)
+		at = now - timedelta(seconds=rng.randint(0, days * 86400 - 1))
+		day = at.date()
+		food = rng.choice(foods)
+		if rng.random() < 0.7:
+			delta, reason = -1, "feed"
+			rollups[(day, "action", "feed")] += 1
+			rollups[(day, "feed", food)] += 1
+		else:
+			delta, reason = rng.randint(1, 5), "purchase"
+			rollups[(day, "shop_orders", food)] += 1
+			rollups[(day, "shop_units", food)] += delta
+			rollups[(day, "shop_revenue", food)] += delta * SHOP_PRICES[food]
+		seqs[owner] += 1
+		rows.append((owner, seqs[owner], ITEM_CODES[food], delta, REASON_CODES[reason], at.isoformat(sep=" ")))
+		if len(rows) >= batch:
+			conn.exec_driver_sql("INSERT INTO ledger_entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+			rows.clear()
+	if rows:
+		conn.exec_driver_sql("INSERT INTO ledger_entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+	for day in {day for day, _, _ in rollups}:
+		rollups[(day, "minigame_plays", "higher_lower")] += rng.randint(1000, 5000)
+	conn.exec_driver_sql(
+		"INSERT INTO daily_rollups (day, metric, key, value) VALUES (?, ?, ?, ?)",
+		[(day.isoformat(), metric, key, value) for (day, metric, key), value in rollups.items()]
+	)
+	return len(rollups)
+
+
+def ad_hoc(conn, since, now):
+	"""What the dashboard would have to run without rollups"""
+	from app.constants import MATURITY_DURATIONS_DAYS
+	from app.ledger import REASON_CODES
+
+	conn.exec_driver_sql(
+		"SELECT date(created_at), reason, item, COUNT(*), SUM(delta) FROM ledger_entries "
+		"WHERE created_at >= ? AND reason IN (?, ?) GROUP BY 1, 2, 3",
+		(since.isoformat(sep=" "), REASON_CODES["feed"], REASON_CODES["purchase"])
+	).all()
+	return maturity_scan(conn, now, MATURITY_DURATIONS_DAYS)
+
+
+def maturity_scan(conn, now, durations):
+	child_since = now - timedelta(days=durations["child"])
+	teen_since = child_since - timedelta(days=durations["teen"])
+	return dict(conn.exec_driver_sql(
+		"SELECT CASE WHEN created_at > ? THEN 'child' WHEN created_at > ? THEN 'teen' ELSE 'adult' END, COUNT(*) "
+		"FROM pets GROUP BY 1",
+		(child_since.isoformat(sep=" "), teen_since.isoformat(sep=" "))
+	).all())
+
+
+def timed(fn, repeat):
+	started = time.perf_counter()
+	for _ in range(repeat):
+		result = fn()
+	return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--users", type=int, default=1000000)
+	parser.add_argument("--entries", type=int, default=5000000)
+	parser.add_argument("--days", type=int, default=7)
+	parser.add_argument("--reads", type=int, default=200)
+	args = parser.parse_args()
+
+	from app.constants import MATURITY_DURATIONS_DAYS
+	from app.extensions import db
+	from app.rollups import dashboard, refresh_gauges
+
+	app = make_app()
+	now = datetime.utcnow()
+	since = (now - timedelta(days=args.days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+	with app.app_context():
+		with db.engine.begin() as conn:
+			started = time.perf_counter()
+			rollup_rows = seed(conn, args.users, args.entries, args.days, now)
+			print(f"Seeded {args.users} users, {args.entries} ledger entries and {rollup_rows} rollup rows "
+				f"in {time.perf_counter() - started:.1f}s")
+		with db.engine.begin() as conn:
+			conn.exec_driver_sql("ANALYZE")
+
+		refresh_ms, stages = timed(lambda: refresh_gauges(now), 5)
+		dashboard_ms, report = timed(lambda: dashboard(args.days, today=now.date()), args.reads)
+		assert report["maturity"] == stages and report["pets"] == args.users
+		with db.engine.connect() as conn:
+			ad_hoc_ms, scanned = timed(lambda: ad_hoc(conn, since, now), 3)
+			scan_ms, _ = timed(lambda: maturity_scan(conn, now, MATURITY_DURATIONS_DAYS), 3)
+		assert scanned == stages, (scanned, stages)
+
+	print_table([
+		{"case": f"dashboard({args.days}) from daily_rollups", "ms": round(dashboard_ms, 3)},
+		{"case": "ad-hoc ledger GROUP BY + pets CASE scan", "ms": round(ad_hoc_ms, 1)},
+		{"case": "refresh_gauges (created_at range counts)", "ms": round(refresh_ms, 1)},
+		{"case": "maturity by CASE scan of pets", "ms": round(scan_ms, 1)},
+	], ["case", "ms"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,97 @@
+"""
+Sharding: write throughput with the per-user tables split over 1, 2 and 4
+databases.
+
+For each shard count, builds scratch SQLite files (the primary plus
+count - 1 shards), seeds --players players spread over them by the
+username hash, then for --seconds runs --writers threads, each cycling
+through its own players and POSTing /api/pet/maturity (a pet update
+that always writes, and the commit). SQLite allows one writer per
+database file, so with one shard every commit queues behind the others;
+each added shard is another write lock. --hold-ms keeps every write
+transaction open that much longer (a stand-in for a slower disk or a
+bigger transaction) to show where that queueing starts to dominate.
+
+	python benchmarks/bench_shards.py --players 400 --writers 8 --seconds 5
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def run(shards, args):
+	from sqlalchemy import event
+
+	from app import sharding
+	from app.extensions import db
+
+	tmpdir = tempfile.mkdtemp(prefix="tamagochi-shards-")
+	urls = [f"sqlite:///{os.path.join(tmpdir, f'shard{n}.sqlite')}" for n in range(1, shards)]
+	app = make_app(
+		f"sqlite:///{os.path.join(tmpdir, 'primary.sqlite')}", JOB_WORKER_THREADS=0,
+		SQLALCHEMY_SHARD_URLS=urls, SQLALCHEMY_ENGINE_OPTIONS={"connect_args": {"timeout": 60}},
+	)
+	user_ids = create_players(app, args.players)
+	with app.app_context():
+		sizes = sharding.shard_sizes()
+		if args.hold_ms:
+			def hold(conn):
+				time.sleep(args.hold_ms / 1000)
+			for engine in db.engines.values():
+				event.listen(engine, "commit", hold)
+
+	stop = threading.Event()
+	latencies, errors = [], [0]
+	lock = threading.Lock()
+
+	def writer(offset):
+		clients = [login(app, user_id) for user_id in user_ids[offset::args.writers]]
+		local, n = [], 0
+		while not stop.is_set():
+			started = time.perf_counter()
+			response = clients[n % len(clients)].post("/api/pet/maturity", json={"action": "set", "stage": "child"})
+			local.append((time.perf_counter() - started) * 1000)
+			if response.status_code != 200:
+				errors[0] += 1
+			n += 1
+		with lock:
+			latencies.extend(local)
+
+	threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+	with quiet():
+		started = time.perf_counter()
+		for thread in threads:
+			thread.start()
+		time.sleep(args.seconds)
+		stop.set()
+		for thread in threads:
+			thread.join()
+	elapsed = time.perf_counter() - started
+	summary = percentiles(latencies)
+	return {
+		"shards": shards, "users per shard": "/".join(str(size) for size in sizes.values()),
+		"writes/s": round(len(latencies) / elapsed), "p50": summary.get("p50"), "p99": summary.get("p99"),
+		"errors": errors[0],
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--players", type=int, default=400)
+	parser.add_argument("--writers", type=int, default=8)
+	parser.add_argument("--hold-ms", type=float, default=20.0)
+	parser.add_argument("--seconds", type=float, default=5.0)
+	parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+	args = parser.parse_args()
+
+	rows = [run(shards, args) for shards in args.shards]
+	print(f"{args.writers} writer threads, write transactions held {args.hold_ms:g} ms, {args.seconds:g}s each")
+	print_table(rows, ["shards", "users per shard", "writes/s", "p50", "p99", "errors"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,154 @@
+"""
+Cold start: import-time breakdown and time to first request, with budgets.
+
+Each run starts a fresh interpreter with -X importtime on a scratch
+database (created beforehand, so startup migrations are no-ops) that
+imports the app, calls create_app() and serves GET /healthz, then GET
+/auth/login, through the test client. Reports medians over --runs:
+
+- wall time from spawning the process to the /healthz response
+- phases: framework + package import, create_app(), first requests
+- import self-time by package, and the slowest modules
+
+Exits with status 1 if the median time to /healthz exceeds --budget-ms,
+the app's own modules take more than --app-budget-ms to import, or a
+module that should load on first use (LAZY_MODULES) was imported before
+the first request.
+
+	python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from _common import ROOT, make_app, print_table
+
+# Only admin pages, shared backends or CLI commands need these
+LAZY_MODULES = [
+	"app.provisioning", "app.access_queue", "app.population", "app.state_dump", "app.replay",
+	"app.simulation", "multiprocessing.managers", "concurrent.futures.process",
+]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+client = flask_app.test_client()
+assert client.get("/healthz").status_code == 200
+healthz = time.perf_counter()
+lazy = [name for name in LAZY_MODULES if name in sys.modules]
+assert client.get("/auth/login").status_code == 200
+login = time.perf_counter()
+print(json.dumps({
+	"import": imported - started, "create_app": created - imported,
+	"first /healthz": healthz - created, "first /auth/login": login - healthz,
+	"loaded_early": lazy, "done_at": time.time(),
+}))
+"""
+
+
+def parse_importtime(stderr):
+	"""{module: self microseconds} from -X importtime output"""
+	modules = {}
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		self_us, _, name = line[len("import time:"):].split("|")
+		modules[name.strip()] = int(self_us)
+	return modules
+
+
+def group_of(module):
+	top = module.split(".")[0]
+	if top == "app":
+		return "app"
+	if top in ("flask", "werkzeug", "jinja2", "markupsafe", "itsdangerous", "click", "blinker", "flask_login"):
+		return "flask stack"
+	if top in ("sqlalchemy", "flask_sqlalchemy", "greenlet", "typing_extensions"):
+		return "sqlalchemy"
+	return "stdlib/other"
+
+
+def run_once(env):
+	code = f"LAZY_MODULES = {LAZY_MODULES!r}\n{PROBE}"
+	spawned = time.time()
+	result = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", code],
+		env=env, cwd=ROOT, capture_output=True, text=True, check=True
+	)
+	probe = json.loads(result.stdout.strip().splitlines()[-1])
+	probe["spawn to /healthz"] = probe.pop("done_at") - spawned - probe["first /auth/login"]
+	return probe, parse_importtime(result.stderr)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--runs", type=int, default=5)
+	parser.add_argument("--top", type=int, default=12, help="Slowest modules to list")
+	parser.add_argument("--budget-ms", type=float, default=1500.0, help="Max median spawn-to-/healthz time")
+	parser.add_argument("--app-budget-ms", type=float, default=120.0, help="Max median self-time of app.* imports")
+	args = parser.parse_args()
+
+	app = make_app()
+	env = dict(
+		os.environ, DATABASE_URL=app.config["SQLALCHEMY_DATABASE_URI"],
+		JOB_QUEUE_PATH=app.config["JOB_QUEUE_PATH"], PYTHONPATH=ROOT
+	)
+	# Without cached bytecode every run recompiles each app module; a deployed app has its .pyc files
+	env.pop("PYTHONDONTWRITEBYTECODE", None)
+	run_once(env)  # Warm the OS page cache and .pyc files
+
+	phases, imports = defaultdict(list), defaultdict(list)
+	loaded_early = set()
+	for _ in range(args.runs):
+		probe, modules = run_once(env)
+		loaded_early.update(probe.pop("loaded_early"))
+		for name, seconds in probe.items():
+			phases[name].append(seconds * 1000)
+		for name, self_us in modules.items():
+			imports[name].append(self_us / 1000)
+
+	median = {name: statistics.median(values) for name, values in phases.items()}
+	print_table(
+		[{"phase": name, "median ms": round(value, 1), "max ms": round(max(phases[name]), 1)} for name, value in median.items()],
+		["phase", "median ms", "max ms"]
+	)
+
+	module_ms = {name: statistics.median(values) for name, values in imports.items()}
+	groups = defaultdict(lambda: [0.0, 0])
+	for name, ms in module_ms.items():
+		groups[group_of(name)][0] += ms
+		groups[group_of(name)][1] += 1
+	print_table(
+		[{"package": name, "modules": count, "self ms": round(ms, 1)}
+			for name, (ms, count) in sorted(groups.items(), key=lambda item: -item[1][0])],
+		["package", "modules", "self ms"]
+	)
+	slowest = sorted(module_ms.items(), key=lambda item: -item[1])[:args.top]
+	print_table([{"module": name, "self ms": round(ms, 2)} for name, ms in slowest], ["module", "self ms"])
+
+	failures = []
+	if median["spawn to /healthz"] > args.budget_ms:
+		failures.append(f"spawn to /healthz {median['spawn to /healthz']:.0f} ms > budget {args.budget_ms:.0f} ms")
+	app_ms = groups["app"][0]
+	if app_ms > args.app_budget_ms:
+		failures.append(f"app.* imports {app_ms:.0f} ms > budget {args.app_budget_ms:.0f} ms")
+	if loaded_early:
+		failures.append(f"imported before first use: {', '.join(sorted(loaded_early))}")
+	for failure in failures:
+		print(f"BUDGET EXCEEDED: {failure}")
+	if failures:
+		sys.exit(1)
+	print("Startup within budget")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,119 @@
+"""
+Stat history cost: write overhead, storage per pet, window reads.
+
+1. GET /api/pet/stats on a clock advancing a minute per request (so every
+   poll applies decay and records a sample), history on versus off;
+   requests alternate between the two apps.
+2. --pets pets with fully written buffers: pet_stat_history size from
+   SQLite's dbstat.
+3. Reading a 7-day hourly window: read_window() versus decoding the whole
+   buffer first.
+
+	python benchmarks/bench_stat_history.py --requests 2000 --pets 100000
+"""
+import argparse
+import array
+import random
+import time
+from datetime import timedelta
+
+from _common import create_players, login, make_app, percentiles, print_table, quiet
+
+
+def poll_latency(requests):
+	from app.clock import FrozenClock
+
+	clients = {}
+	for enabled in (False, True):
+		clock = FrozenClock()
+		app = make_app(STAT_HISTORY_ENABLED=enabled, CLOCK=clock)
+		clients[enabled] = (clock, login(app, create_players(app, 1)[0]))
+	samples = {False: [], True: []}
+	with quiet():
+		for _ in range(requests):
+			for enabled, (clock, client) in clients.items():
+				clock.advance(timedelta(minutes=1))
+				started = time.perf_counter()
+				response = client.get("/api/pet/stats")
+				samples[enabled].append((time.perf_counter() - started) * 1000)
+				assert response.status_code == 200
+	return samples
+
+
+def full_buffer(rng):
+	from app.stat_history import BUFFER_BYTES, EMPTY_SLOT, WIDTH, pack, write_sample
+
+	buffer, latest = bytearray(EMPTY_SLOT) * (BUFFER_BYTES // WIDTH), [None, None, None]
+	at = 1_700_000_000
+	# 60 days at one sample per 10 minutes fills every slot of every tier
+	for _ in range(60 * 144):
+		at += 600
+		write_sample(buffer, latest, at, pack([rng.uniform(0, 100) for _ in range(WIDTH)]))
+	return bytes(buffer), latest, at
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--requests", type=int, default=2000)
+	parser.add_argument("--pets", type=int, default=100000)
+	parser.add_argument("--reads", type=int, default=20000)
+	args = parser.parse_args()
+
+	samples = poll_latency(args.requests)
+	rows = [
+		{"case": f"stats poll with decay, history {'on' if enabled else 'off'}", **percentiles(samples[enabled])}
+		for enabled in (False, True)
+	]
+	print_table(rows, ["case", "n", "p50", "p90", "p99", "mean"])
+
+	from app.extensions import db
+	from app.stat_history import BUFFER_BYTES, LATEST_COLUMNS, OFFSETS, STAT_HISTORY_TIERS, WIDTH, read_window
+
+	rng = random.Random(4)
+	data, latest, at = full_buffer(rng)
+	app = make_app()
+	pet_ids = create_players(app, args.pets)
+	with app.app_context():
+		db.session.connection().exec_driver_sql(
+			f"INSERT INTO pet_stat_history (pet_id, data, {', '.join(LATEST_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+			[(pet_id, data, *latest) for pet_id in pet_ids]
+		)
+		db.session.commit()
+		size, payload = db.session.execute(db.text(
+			"SELECT SUM(pgsize), SUM(payload) FROM dbstat WHERE name = 'pet_stat_history'"
+		)).one()
+	storage = [{
+		"pets": args.pets, "buffer bytes": BUFFER_BYTES,
+		"table MiB": round(size / 2 ** 20, 1), "bytes/pet on disk": round(size / args.pets),
+		"payload/pet": round(payload / args.pets),
+	}]
+	print_table(storage, ["pets", "buffer bytes", "table MiB", "bytes/pet on disk", "payload/pet"])
+
+	tier = 1  # hour
+	_, step, slots = STAT_HISTORY_TIERS[tier]
+	start, end = at - 7 * 86400, at
+
+	def windowed():
+		read_window(data, latest, tier, start, end)
+
+	def decode_all():
+		# Same output, but unpack every tier of the buffer first
+		values = array.array("B", data).tolist()
+		series = [[] for _ in range(WIDTH)]
+		for slot in range(start // step, end // step + 1):
+			position = OFFSETS[tier] + (slot % slots) * WIDTH
+			for index in range(WIDTH):
+				value = values[position + index]
+				series[index].append(None if value == 255 else value)
+
+	reads = []
+	for name, fn in (("read_window (168 slots)", windowed), ("decode whole buffer, then slice", decode_all)):
+		started = time.perf_counter()
+		for _ in range(args.reads):
+			fn()
+		reads.append({"case": name, "us/read": round((time.perf_counter() - started) / args.reads * 1e6, 2)})
+	print_table(reads, ["case", "us/read"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,97 @@
+"""
+Game state export/import: rows per second and memory with --users players.
+
+Seeds a scratch SQLite database with --users players (each with a pet and
+an inventory), exports it with state_dump.export_state to an NDJSON file
+(.gz with --gzip), imports that into a fresh database, and re-exports the
+copy to check it matches. Resident memory is sampled every second while
+each side runs; flat means the peak stays near the starting RSS however
+many rows go through.
+
+	python benchmarks/bench_state_dump.py --users 1000000
+"""
+import argparse
+import os
+import resource
+import tempfile
+import threading
+import time
+
+from _common import create_players, make_app, print_table, quiet
+
+
+def rss_mb():
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+	except OSError:
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(work):
+	"""Run work() sampling RSS every second; returns (result, samples in MB)"""
+	samples, stop = [rss_mb()], threading.Event()
+
+	def sample():
+		while not stop.wait(1.0):
+			samples.append(rss_mb())
+
+	sampler = threading.Thread(target=sample, daemon=True)
+	sampler.start()
+	try:
+		result = work()
+	finally:
+		stop.set()
+		sampler.join()
+	samples.append(rss_mb())
+	return result, samples
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--users", type=int, default=1000000)
+	parser.add_argument("--chunk", type=int, default=10000)
+	parser.add_argument("--gzip", action="store_true")
+	args = parser.parse_args()
+
+	from app.state_dump import export_state, import_state, open_dump
+
+	tmpdir = tempfile.mkdtemp(prefix="tamagochi-dump-")
+	source = make_app(f"sqlite:///{os.path.join(tmpdir, 'source.sqlite')}", JOB_WORKER_THREADS=0)
+	target = make_app(f"sqlite:///{os.path.join(tmpdir, 'target.sqlite')}", JOB_WORKER_THREADS=0)
+	started = time.perf_counter()
+	with quiet():
+		for start in range(0, args.users, 100000):
+			create_players(source, min(100000, args.users - start))
+	print(f"Seeded {args.users} players in {time.perf_counter() - started:.1f}s")
+
+	dump = os.path.join(tmpdir, "state.ndjson" + (".gz" if args.gzip else ""))
+	copy = os.path.join(tmpdir, "copy.ndjson" + (".gz" if args.gzip else ""))
+
+	def export(app, path):
+		def work():
+			with app.app_context(), open_dump(path, "w") as out:
+				return export_state(out, chunk=args.chunk, log=lambda message: None)
+		return work
+
+	def load():
+		with target.app_context(), open_dump(dump) as lines:
+			return import_state(lines, chunk=args.chunk, log=lambda message: None)
+
+	rows = []
+	for name, work in (("export", export(source, dump)), ("import", load), ("re-export", export(target, copy))):
+		with quiet():
+			summary, samples = measure(work)
+		rows.append({
+			"step": name, "rows": summary["rows"], "seconds": summary["seconds"],
+			"rows/s": summary["rows_per_second"], "RSS start MB": round(samples[0]),
+			"RSS peak MB": round(max(samples)), "RSS end MB": round(samples[-1]),
+		})
+	print_table(rows, ["step", "rows", "seconds", "rows/s", "RSS start MB", "RSS peak MB", "RSS end MB"])
+	with open_dump(dump) as a, open_dump(copy) as b:
+		same = all(x == y for x, y in zip(a, b))
+	print(f"Dump {os.path.getsize(dump) / 1e6:.0f} MB; re-export {'matches' if same else 'DIFFERS'}")
+
+
+if __name__ == "__main__":
+	main()
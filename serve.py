@@ -0,0 +1,6 @@
+from app.server import main
+
+
+# Production entry point: python serve.py --workers 4 (see app/server.py)
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,76 @@
+from flask import jsonify
+from flask_login import login_required
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from app.extensions import db
+from app.idempotency import idempotent
+from app.models import IdempotencyRecord, User
+
+
+def _app(tmp_path):
+	app = create_app({
+		"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/app.sqlite",
+		"JOB_QUEUE_PATH": f"{tmp_path}/jobs.sqlite",
+		"JOB_WORKER_THREADS": 0,
+		"RATE_LIMIT_ENABLED": False,
+		"TESTING": True,
+	})
+	calls = []
+
+	@app.post("/test/flaky")
+	@login_required
+	@idempotent
+	def flaky():
+		# The claim commits with this write; the failure comes after it
+		calls.append(1)
+		user = db.session.get(User, int(app.config["TEST_USER_ID"]))
+		user.username = f"flaky{len(calls)}"
+		db.session.commit()
+		if len(calls) == 1:
+			raise RuntimeError("view failed after its commit")
+		if len(calls) == 2:
+			return jsonify({"error": "still failing"}), 503
+		return jsonify({"calls": len(calls)})
+
+	with app.app_context():
+		user = User(username="flaky", password_hash=generate_password_hash("pw", "pbkdf2:sha256:1000"))
+		db.session.add(user)
+		db.session.commit()
+		app.config["TEST_USER_ID"] = user.id
+	return app, calls
+
+
+def _client(app):
+	client = app.test_client()
+	with client.session_transaction() as session:
+		session["_user_id"] = str(app.config["TEST_USER_ID"])
+		session["_fresh"] = True
+	return client
+
+
+def _records(app):
+	with app.app_context():
+		return db.session.execute(db.select(IdempotencyRecord.key, IdempotencyRecord.status_code)).all()
+
+
+def test_retry_runs_again_after_the_view_raises(tmp_path):
+	app, calls = _app(tmp_path)
+	app.config["PROPAGATE_EXCEPTIONS"] = False
+	client = _client(app)
+	headers = {"Idempotency-Key": "retry-me"}
+
+	assert client.post("/test/flaky", headers=headers).status_code == 500
+	assert _records(app) == []
+
+	assert client.post("/test/flaky", headers=headers).status_code == 503
+	assert _records(app) == []
+
+	response = client.post("/test/flaky", headers=headers)
+	assert response.status_code == 200
+	assert response.get_json() == {"calls": 3}
+	assert _records(app) == [("retry-me", 200)]
+
+	replay = client.post("/test/flaky", headers=headers)
+	assert replay.headers.get("Idempotent-Replayed") == "true"
+	assert len(calls) == 3
@@ -0,0 +1,59 @@
+import sqlite3
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app, jobs
+from app.extensions import db
+from app.models import User
+
+
+@jobs.handler("test.noop")
+def _noop(**payload):
+	pass
+
+
+def _refuse_inserts(path):
+	conn = sqlite3.connect(path)
+	conn.execute(
+		"CREATE TRIGGER refuse BEFORE INSERT ON jobs BEGIN SELECT RAISE(ABORT, 'queue refused'); END"
+	)
+	conn.commit()
+	conn.close()
+
+
+def test_failed_put_leaves_the_connection_usable(tmp_path):
+	queue = jobs.JobQueue(str(tmp_path / "jobs.sqlite"))
+	queue.put("test.noop", {})
+	_refuse_inserts(queue.path)
+
+	try:
+		queue.put("test.noop", {})
+	except sqlite3.IntegrityError:
+		pass
+	else:
+		raise AssertionError("insert should have been refused")
+	assert not queue._connect().in_transaction
+
+	queue._connect().execute("DROP TRIGGER refuse")
+	queue.put("test.noop", {})
+	assert queue.stats()["ready"] == 2
+
+
+def test_commit_succeeds_when_the_queue_cannot_be_written(tmp_path):
+	app = create_app({
+		"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/app.sqlite",
+		"JOB_QUEUE_PATH": f"{tmp_path}/jobs.sqlite",
+		"JOB_WORKER_THREADS": 0,
+		"TESTING": True,
+	})
+	with app.app_context():
+		queue = jobs.job_queue()
+		queue.stats()
+		_refuse_inserts(queue.path)
+		db.session.add(User(username="queued", password_hash=generate_password_hash("pw", "pbkdf2:sha256:1000")))
+		jobs.defer("test.noop", value=1)
+		db.session.commit()
+
+		assert db.session.scalar(db.select(User.id).where(User.username == "queued")) is not None
+		assert queue.counters["dropped"] == 1
+		assert "jobs_pending" not in db.session.info
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import threading
+
+from app.maintenance import backup
+
+
+def _make_database(path, rows=20000):
+	conn = sqlite3.connect(path)
+	conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v BLOB)")
+	conn.executemany("INSERT INTO t (v) VALUES (?)", [(os.urandom(400),) for _ in range(rows)])
+	conn.commit()
+	conn.close()
+
+
+def test_backup_finishes_while_a_writer_commits_in_a_loop(tmp_path):
+	source = str(tmp_path / "source.sqlite")
+	_make_database(source)
+	stop, started, commits = threading.Event(), threading.Event(), []
+
+	def writer():
+		conn = sqlite3.connect(source, timeout=30)
+		while not stop.is_set():
+			conn.execute("UPDATE t SET v = ? WHERE id = ?", (os.urandom(400), len(commits) % 20000 + 1))
+			conn.commit()
+			commits.append(1)
+			started.set()
+		conn.close()
+
+	thread = threading.Thread(target=writer, daemon=True)
+	thread.start()
+	try:
+		started.wait(10)
+		# Default rollback journal: every write restarts the stepped copy
+		result = backup(source, str(tmp_path / "backup.sqlite"), step_pages=64, pause=0.0, verify=True)
+	finally:
+		stop.set()
+		thread.join()
+
+	assert result["restarts"] > 0
+	assert result["blocked_seconds"] > 0
+	copy = sqlite3.connect(result["dest"])
+	assert copy.execute("SELECT count(*) FROM t").fetchone()[0] == 20000
+	copy.close()
+
+
+def test_backup_without_writers_copies_in_steps(tmp_path):
+	source = str(tmp_path / "source.sqlite")
+	_make_database(source, rows=2000)
+	result = backup(source, str(tmp_path / "backup.sqlite"), step_pages=16, pause=0.0)
+	assert result["restarts"] == 0
+	assert result["steps"] > 1
+	assert result["blocked_seconds"] == 0.0